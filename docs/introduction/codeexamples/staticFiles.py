@@ -1,14 +1,10 @@
-from twisted.web.static import File
-
 from klein import Klein
+from klein.static import mount
 
 
 app = Klein()
 
-
-@app.route("/", branch=True)
-def pg_index(request):
-    return File("./")
+mount(app, "/", "./")
 
 
 app.run("localhost", 8080)
@@ -41,7 +41,7 @@ if __name__ == "__main__":
         keywords="twisted flask werkzeug web",
         license="MIT",
         name="klein",
-        packages=["klein", "klein.storage", "klein.test"],
+        packages=["klein", "klein.bench", "klein.storage", "klein.test"],
         package_dir={"": "src"},
         package_data=dict(
             klein=["py.typed"],
@@ -12,11 +12,16 @@ from ._app import (
     url_for,
     urlFor,
 )
+from ._compression import CompressionPolicy
 from ._dihttp import RequestComponent, RequestURL, Response
 from ._form import Field, FieldValues, Form, RenderableForm
+from ._multipart import UploadedFile
 from ._plating import Plating
+from ._processes import HandlerProcessPool, cpuBound
 from ._requirer import Requirer
+from ._responsecache import CachePolicy
 from ._session import Authorization, SessionProcurer
+from ._threads import HandlerThreadPool, blocking
 from ._version import __version__ as _incremental_version
 
 
@@ -29,6 +34,8 @@ else:
     from . import resource
 
 __all__ = (
+    "CachePolicy",
+    "CompressionPolicy",
     "Klein",
     "KleinErrorHandler",
     "KleinRenderable",
@@ -37,17 +44,22 @@ __all__ = (
     "Field",
     "FieldValues",
     "Form",
+    "HandlerProcessPool",
+    "HandlerThreadPool",
     "RequestComponent",
     "RequestURL",
     "Response",
     "RenderableForm",
     "SessionProcurer",
+    "UploadedFile",
     "Authorization",
     "Requirer",
     "__author__",
     "__copyright__",
     "__license__",
     "__version__",
+    "blocking",
+    "cpuBound",
     "handle_errors",
     "resource",
     "route",
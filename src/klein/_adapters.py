@@ -0,0 +1,114 @@
+# -*- test-case-name: klein.test.test_adapters -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Pooling of bound Werkzeug L{MapAdapter}s.
+
+Almost every request to a given server shares the same server name, script
+name and URL scheme, so rather than calling L{Map.bind} (and re-doing its host
+name normalization) for every request, L{AdapterPool} keeps a bounded LRU of
+adapters bound to each such triple and hands out cheap copies of them with
+only the path and method replaced.
+"""
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from werkzeug.routing import Map, MapAdapter
+
+from ._dispatch import CacheStats, mapVersion
+
+
+__all__ = ()
+
+
+_AdapterKey = Tuple[str, Optional[str], str]
+
+
+class AdapterPool:
+    """
+    A bounded LRU of L{MapAdapter}s, keyed by server name, script name and URL
+    scheme, for a single L{Map}.
+
+    The pool is emptied whenever it is used with a different map, or rules
+    have been added to its map since the adapters were bound.
+
+    @ivar maxsize: The maximum number of adapters to keep.
+    """
+
+    def __init__(self, maxsize: int = 128) -> None:
+        self.maxsize = maxsize
+        self._adapters: "OrderedDict[_AdapterKey, MapAdapter]" = OrderedDict()
+        self._map: Optional[Map] = None
+        self._version = -1
+        self._hits = 0
+        self._misses = 0
+
+    def stats(self) -> CacheStats:
+        """
+        Report how effective this pool has been.
+        """
+        return CacheStats(self._hits, self._misses, len(self._adapters))
+
+    def invalidate(self) -> None:
+        """
+        Discard all pooled adapters.
+        """
+        self._adapters.clear()
+
+    def adapterFor(
+        self,
+        urlMap: Map,
+        serverName: str,
+        scriptName: Optional[str] = None,
+        urlScheme: str = "http",
+    ) -> MapAdapter:
+        """
+        Get the pooled adapter for C{urlMap} bound to the given server name,
+        script name and URL scheme.
+
+        The returned adapter is shared, and must not be modified; it is
+        suitable for building URLs.
+        """
+        version = mapVersion(urlMap)
+        if urlMap is not self._map or version != self._version:
+            self.invalidate()
+            self._map = urlMap
+            self._version = version
+
+        key = (serverName, scriptName, urlScheme)
+        adapter = self._adapters.get(key)
+        if adapter is not None:
+            self._hits += 1
+            self._adapters.move_to_end(key)
+            return adapter
+
+        self._misses += 1
+        adapter = urlMap.bind(serverName, scriptName, url_scheme=urlScheme)
+        self._adapters[key] = adapter
+        while len(self._adapters) > self.maxsize:
+            self._adapters.popitem(last=False)
+        return adapter
+
+    def bind(
+        self,
+        urlMap: Map,
+        serverName: str,
+        scriptName: str,
+        urlScheme: str,
+        pathInfo: str,
+        method: str,
+    ) -> MapAdapter:
+        """
+        Get a new adapter equivalent to C{urlMap.bind(serverName, scriptName,
+        path_info=pathInfo, default_method=method, url_scheme=urlScheme)}.
+
+        Unlike the adapters returned by L{AdapterPool.adapterFor}, the result
+        belongs to the caller.
+        """
+        template = self.adapterFor(urlMap, serverName, scriptName, urlScheme)
+        adapter = type(template).__new__(type(template))
+        adapter.__dict__.update(template.__dict__)
+        adapter.path_info = pathInfo
+        adapter.default_method = method
+        return adapter
@@ -11,6 +11,7 @@ from inspect import iscoroutine
 from typing import (
     IO,
     Any,
+    AsyncIterator,
     Awaitable,
     Callable,
     Dict,
@@ -26,8 +27,9 @@ from typing import (
     cast,
     overload,
 )
-from weakref import ref
 
+import attr
+from tubes.itube import IFount
 from werkzeug.routing import Map, MapAdapter, Rule, Submount
 from zope.interface import implementer
 
@@ -42,9 +44,31 @@ from twisted.web.resource import IResource
 from twisted.web.server import Request, Site
 from twisted.web.template import Tag
 
+from ._adapters import AdapterPool
+from ._compression import CompressionPolicy, CompressionSetting, resolvePolicy
 from ._decorators import modified, named
+from ._dispatch import (
+    LazyRule,
+    MatchCache,
+    RouteDispatcher,
+    RouteMatch,
+    RouteTimings,
+    VersionedMap,
+)
+from ._drain import Drainer, InFlight
+from ._errorhandlers import ErrorHandlerTable
+from ._instrumentation import RequestTimings, TimingObserver
 from ._interfaces import IKleinRequest, KleinQueryValue
+from ._jsoncodec import STDLIB_JSON, JSONCodec, lookupCodec
+from ._limits import ConcurrencyLimit
+from ._multipart import FormRequest, canSkipFormParsing
+from ._profiling import RequestProfiler
+from ._requestbody import StreamingRequest
 from ._resource import KleinResource, route_metadata
+from ._responsecache import CachePolicy, ResponseCache
+from ._serve import Supervisor, isWorker, serveWorkers
+from ._shedding import NORMAL, AdmissionController, checkPriority
+from ._threads import HandlerThreadPool, blocking, defaultPool
 from ._typing_compat import Concatenate, ParamSpec, Protocol
 
 
@@ -52,7 +76,9 @@ _KleinSynchronousRenderable = Union[
     str, bytes, IResource, IRenderable, Tag, None
 ]
 KleinSynchronousRenderable = Union[
-    _KleinSynchronousRenderable, Iterable[_KleinSynchronousRenderable]
+    _KleinSynchronousRenderable,
+    Iterable[_KleinSynchronousRenderable],
+    AsyncIterator[Union[str, bytes]],
 ]
 KleinRenderable = Union[
     KleinSynchronousRenderable, Awaitable[KleinSynchronousRenderable]
@@ -96,6 +122,7 @@ list will have to be handled at runtime.
 """
 
 KleinRouteHandlerT = TypeVar("KleinRouteHandlerT", bound=KleinRouteHandler)
+TimingObserverT = TypeVar("TimingObserverT", bound=TimingObserver)
 """
 Let's make sure that we don't modify klein handlers' arg lists as we pass them
 through though.
@@ -115,6 +142,12 @@ class RouteMetadata(Protocol):
 
     __name__: str
     segment_count: int
+    cache_policy: Optional[CachePolicy]
+    compression: Optional[CompressionPolicy]
+    concurrency_limit: Optional[ConcurrencyLimit]
+    priority: str
+    stream_body: bool
+    max_body_size: Optional[int]
 
 
 def _call(
@@ -163,6 +196,9 @@ class KleinRequest:
 
     def __init__(self, request: Request) -> None:
         self.branch_segments = [""]
+        self.timings: Optional[RequestTimings] = None
+        self.body_fount: Optional[IFount] = None
+        self.json_codec: JSONCodec = STDLIB_JSON
 
     def url_for(
         self,
@@ -202,6 +238,15 @@ class _PartialRouteSignature(Protocol[R]):
         url: str,
         *args: Any,
         branch: bool = False,
+        cache: Optional[CachePolicy] = None,
+        compress: CompressionSetting = None,
+        threaded: Union[bool, HandlerThreadPool] = False,
+        max_concurrency: Optional[int] = None,
+        max_queue: int = 0,
+        queue_timeout: float = 5.0,
+        priority: str = NORMAL,
+        stream_body: bool = False,
+        max_body_size: Optional[int] = None,
         **kwargs: Any,
     ) -> R:
         """
@@ -216,6 +261,15 @@ class _FullRouteSignature(Protocol[P, R]):
         url: str,
         *args: P.args,
         branch: bool = False,
+        cache: Optional[CachePolicy] = None,
+        compress: CompressionSetting = None,
+        threaded: Union[bool, HandlerThreadPool] = False,
+        max_concurrency: Optional[int] = None,
+        max_queue: int = 0,
+        queue_timeout: float = 5.0,
+        priority: str = NORMAL,
+        stream_body: bool = False,
+        max_body_size: Optional[int] = None,
         **kwargs: P.kwargs,
     ) -> R:
         """
@@ -256,22 +310,121 @@ def _normalFunction(arg: Callable[P, R]) -> Callable[P, R]:
 # end argument-processing hack
 
 
+@attr.s(auto_attribs=True, eq=False)
+class _RoutingState:
+    """
+    The routing configuration of a L{Klein} application, shared by all of the
+    views of it that are bound to instances.
+
+    @ivar url_map: A C{werkzeug.routing.Map} object which will be used for
+        routing resolution.
+    @ivar compiled_routes: Whether requests are matched with a
+        L{RouteDispatcher} compiled from C{url_map} before falling back to
+        Werkzeug.
+    @ivar match_cache: The L{MatchCache} of routing outcomes, if enabled.
+    @ivar endpoints: A C{dict} mapping endpoint names to handler functions.
+    @ivar error_handlers: The registered error handlers, in order.
+    @ivar dispatcher: The most recently compiled L{RouteDispatcher}, if any.
+    @ivar adapters: The L{AdapterPool} used to bind C{url_map} for matching
+        requests and building URLs.
+    @ivar error_table: The L{ErrorHandlerTable} indexing C{error_handlers}.
+    @ivar response_cache: The L{ResponseCache} of the responses of routes
+        with a L{CachePolicy}.
+    @ivar compression: The L{CompressionPolicy} of routes which don't set
+        their own, if any.
+    @ivar in_flight: The requests being handled by the application's
+        resources.
+    @ivar observers: The observers of the L{RequestTimings} of each request.
+    @ivar profiler: The L{RequestProfiler} choosing which requests to
+        profile, if any.
+    @ivar thread_pool: The L{HandlerThreadPool} running the handlers of
+        threaded routes, if not the default one.
+    @ivar admission: The L{AdmissionController} deciding which requests to
+        shed, if any.
+    @ivar json_codec: The L{JSONCodec} Klein encodes and decodes JSON with.
+    """
+
+    url_map: Map
+    compiled_routes: bool
+    match_cache: Optional[MatchCache]
+    endpoints: Dict[str, KleinRouteHandler] = attr.Factory(dict)
+    error_handlers: ErrorMethods = attr.Factory(list)
+    dispatcher: Optional[RouteDispatcher] = None
+    adapters: AdapterPool = attr.Factory(AdapterPool)
+    error_table: ErrorHandlerTable = attr.Factory(ErrorHandlerTable)
+    response_cache: ResponseCache = attr.Factory(ResponseCache)
+    compression: Optional[CompressionPolicy] = None
+    in_flight: InFlight = attr.Factory(InFlight)
+    observers: List[TimingObserver] = attr.Factory(list)
+    profiler: Optional[RequestProfiler] = None
+    thread_pool: Optional[HandlerThreadPool] = None
+    admission: Optional[AdmissionController] = None
+    json_codec: JSONCodec = STDLIB_JSON
+
+
 class Klein:
     """
     L{Klein} is an object which is responsible for maintaining the routing
     configuration of our application.
 
-    @ivar _url_map: A C{werkzeug.routing.Map} object which will be used for
-        routing resolution.
-    @ivar _endpoints: A C{dict} mapping endpoint names to handler functions.
+    When a L{Klein} is an attribute of a class, accessing it on an instance
+    gives a view of it bound to that instance, sharing its L{_RoutingState}.
+
+    @ivar _state: The L{_RoutingState} of the application.
+    @ivar _instance: The instance this view is bound to, if any.
+    @ivar _boundAs: The name of the class attribute this L{Klein} was found
+        as, if known.
     """
 
     _subroute_segments = 0
 
-    def __init__(self) -> None:
-        self._url_map = Map()
-        self._endpoints: Dict[str, KleinRouteHandler] = {}
-        self._error_handlers: ErrorMethods = []
+    def __init__(
+        self,
+        compiled_routes: bool = False,
+        match_cache_size: int = 0,
+        defer_routes: bool = False,
+        response_cache_bytes: int = 16 * 1024 * 1024,
+        compression: Optional[CompressionPolicy] = None,
+        thread_pool: Optional[HandlerThreadPool] = None,
+    ) -> None:
+        """
+        @param compiled_routes: If C{True}, match requests using a radix tree
+            compiled from this application's routes, consulting Werkzeug only
+            for rules (or outcomes, such as 404s) that the compiled dispatcher
+            cannot decide by itself.  Matching results are identical either
+            way.
+
+        @param match_cache_size: If non-zero, remember the outcomes of matching
+            up to this many distinct method, host and path combinations,
+            including those that resulted in a 404 or 405.
+
+        @param defer_routes: If C{True}, collect the rules for routes as they
+            are added, and only build the route table from them once, when
+            L{Klein.freeze} is called or the first request is routed.
+
+        @param response_cache_bytes: The maximum total size of the responses
+            kept for routes with a L{CachePolicy}.
+
+        @param compression: If given, the L{CompressionPolicy} with which to
+            compress the responses of routes that don't specify their own.
+
+        @param thread_pool: If given, the L{HandlerThreadPool} in which to run
+            the handlers of routes with C{threaded=True}, rather than the one
+            shared by all applications.
+        """
+        urlMap = VersionedMap()
+        if defer_routes:
+            urlMap.deferRules()
+        self._state = _RoutingState(
+            url_map=urlMap,
+            compiled_routes=compiled_routes,
+            match_cache=(
+                MatchCache(match_cache_size) if match_cache_size else None
+            ),
+            response_cache=ResponseCache(response_cache_bytes),
+            compression=compression,
+            thread_pool=thread_pool,
+        )
         self._instance: Optional[Klein] = None
         self._boundAs: Optional[str] = None
 
@@ -289,16 +442,225 @@ class Klein:
     @property
     def url_map(self) -> Map:
         """
-        Read only property exposing L{Klein._url_map}.
+        Read only property exposing the application's
+        C{werkzeug.routing.Map}.
         """
-        return self._url_map
+        return self._state.url_map
 
     @property
     def endpoints(self) -> Dict[str, KleinRouteHandler]:
         """
-        Read only property exposing L{Klein._endpoints}.
+        Read only property exposing the application's C{dict} mapping
+        endpoint names to handler functions.
+        """
+        return self._state.endpoints
+
+    @property
+    def route_timings(self) -> RouteTimings:
+        """
+        Read only property reporting how long adding routes and building the
+        route table has taken so far.
+        """
+        urlMap = self._state.url_map
+        if isinstance(urlMap, VersionedMap):
+            return urlMap.timings()
+        return RouteTimings(0, 0.0, 0.0)
+
+    def freeze(self) -> None:
+        """
+        Build the route table now, rather than when the first request is
+        routed.
+
+        This binds any routes deferred with C{defer_routes=True}, sorts the
+        route table and, with C{compiled_routes=True}, compiles it.  Routes can
+        still be added afterwards, at the cost of rebuilding.
+        """
+        urlMap = self._state.url_map
+        if isinstance(urlMap, VersionedMap):
+            urlMap.finalize()
+        if self._state.compiled_routes:
+            dispatcher = self._state.dispatcher
+            if dispatcher is None or not dispatcher.isCurrentFor(urlMap):
+                self._state.dispatcher = RouteDispatcher(urlMap)
+
+    @property
+    def adapter_pool(self) -> AdapterPool:
+        """
+        Read only property exposing the L{AdapterPool} of bound
+        C{werkzeug.routing.MapAdapter}s; see L{AdapterPool.stats}.
         """
-        return self._endpoints
+        return self._state.adapters
+
+    @property
+    def match_cache(self) -> Optional[MatchCache]:
+        """
+        Read only property exposing the L{MatchCache} of routing outcomes, or
+        L{None} if this application does not cache them.
+        """
+        return self._state.match_cache
+
+    @property
+    def response_cache(self) -> ResponseCache:
+        """
+        Read only property exposing the L{ResponseCache} of the responses of
+        routes with a L{CachePolicy}.
+        """
+        return self._state.response_cache
+
+    @property
+    def in_flight(self) -> InFlight:
+        """
+        Read only property exposing the L{InFlight} count of requests being
+        handled by this application's resources.
+        """
+        return self._state.in_flight
+
+    @property
+    def timing_observers(self) -> List[TimingObserver]:
+        """
+        Read only property exposing the observers added with
+        L{Klein.instrument}.
+        """
+        return self._state.observers
+
+    def instrument(self, observer: TimingObserverT) -> TimingObserverT:
+        """
+        Time each stage of handling every request to this application, and
+        call C{observer} with the L{RequestTimings} of each request once it
+        is finished.
+
+        Observers are called synchronously as requests finish, so they should
+        be quick; L{StageHistograms} aggregates the timings into histograms
+        with bounded memory.
+
+        May be used as a decorator.
+
+        @return: C{observer}
+        """
+        self._state.observers.append(observer)
+        return observer
+
+    @property
+    def profiler(self) -> Optional[RequestProfiler]:
+        """
+        Read only property exposing the L{RequestProfiler} given to
+        L{Klein.profile}, if any.
+        """
+        return self._state.profiler
+
+    def profile(self, profiler: RequestProfiler) -> RequestProfiler:
+        """
+        Profile the requests to this application which C{profiler} chooses,
+        keeping the profiles of the slow ones in it.
+
+        Use L{klein.profiling.exposeProfiles} to serve them.
+
+        @return: C{profiler}
+        """
+        self._state.profiler = profiler
+        return profiler
+
+    @property
+    def admission_controller(self) -> Optional[AdmissionController]:
+        """
+        Read only property exposing the L{AdmissionController} given to
+        L{Klein.shed_load}, if any.
+        """
+        return self._state.admission
+
+    def shed_load(self, controller: AdmissionController) -> AdmissionController:
+        """
+        Answer a growing fraction of the requests to this application with a
+        503 as the reactor's lag, measured by C{controller}'s L{LagMonitor},
+        rises; the monitor is started, if it isn't already.
+
+        Requests to routes with C{priority=CRITICAL} are never shed.
+
+        @return: C{controller}
+        """
+        self._state.admission = controller
+        controller.monitor.start()
+        return controller
+
+    @property
+    def json_codec(self) -> JSONCodec:
+        """
+        Read only property exposing the L{JSONCodec} chosen with
+        L{Klein.use_json_codec}, or the standard library's by default.
+        """
+        return self._state.json_codec
+
+    def use_json_codec(self, codec: Union[str, JSONCodec]) -> JSONCodec:
+        """
+        Encode and decode JSON with C{codec} throughout this application: in
+        L{Plating}, L{Response} bodies and L{Form}s.
+
+        @param codec: A L{JSONCodec}, or the name of a registered one, such
+            as C{"orjson"} if it's installed.
+
+        @return: The codec.
+
+        @raise ValueError: If no codec is registered by the given name.
+        """
+        self._state.json_codec = lookupCodec(codec)
+        return self._state.json_codec
+
+    @property
+    def concurrency_limits(self) -> Dict[str, ConcurrencyLimit]:
+        """
+        Read only property mapping the endpoints of routes with a
+        C{max_concurrency} to their L{ConcurrencyLimit}s; see
+        L{ConcurrencyLimit.stats}.
+        """
+        limits = {}
+        for endpoint, handler in self._state.endpoints.items():
+            limit = getattr(handler, "concurrency_limit", None)
+            if limit is not None:
+                limits[endpoint] = limit
+        return limits
+
+    @property
+    def thread_pool(self) -> HandlerThreadPool:
+        """
+        Read only property exposing the L{HandlerThreadPool} which runs the
+        handlers of routes with C{threaded=True}; see
+        L{HandlerThreadPool.stats}.
+        """
+        pool = self._state.thread_pool
+        return defaultPool() if pool is None else pool
+
+    def match(self, mapper: MapAdapter) -> RouteMatch:
+        """
+        Match the request that C{mapper} is bound to against this
+        application's routes.
+
+        @return: The matched C{werkzeug.routing.Rule} and its arguments, as
+            returned by C{MapAdapter.match(return_rule=True)}.
+
+        @raise werkzeug.exceptions.HTTPException: If no route matches, or the
+            match is a redirect.
+        """
+        cache = self._state.match_cache
+        if cache is not None:
+            return cache.match(mapper, self._matchUncached)
+        return self._matchUncached(mapper)
+
+    def _matchUncached(self, mapper: MapAdapter) -> RouteMatch:
+        """
+        Implementation of L{Klein.match} that does not consult the
+        L{MatchCache}.
+        """
+        state = self._state
+        if state.compiled_routes:
+            dispatcher = state.dispatcher
+            if dispatcher is None or not dispatcher.isCurrentFor(state.url_map):
+                dispatcher = state.dispatcher = RouteDispatcher(state.url_map)
+            found = dispatcher.match(mapper.path_info, mapper.default_method)
+            if found is not None:
+                return found
+        rule, arguments = mapper.match(return_rule=True)
+        # Werkzeug is only annotated as returning a Mapping; it's a dict.
+        return rule, cast(Dict[str, Any], arguments)
 
     def execute_endpoint(
         self, endpoint: str, request: IRequest, *args: Any, **kwargs: Any
@@ -307,12 +669,27 @@ class Klein:
         Execute the named endpoint with all arguments and possibly a bound
         instance.
         """
-        endpoint_f: Callable[..., KleinRenderable] = self._endpoints[endpoint]
+        endpoint_f: Callable[..., KleinRenderable] = self._state.endpoints[
+            endpoint
+        ]
         # typing note: endpoint_f is a KleinRouteHandler, which is not defined
         # as taking *args, **kwargs (because they aren't required), but we're
         # going to pass them along here anyway.
         return endpoint_f(self._instance, request, *args, **kwargs)
 
+    def next_error_handler(
+        self, failure: Failure, after: int = -1
+    ) -> Optional[Tuple[int, KleinErrorMethod]]:
+        """
+        Find the first error handler registered after the one at index
+        C{after} which handles C{failure}.
+
+        @return: The index and the handler, or L{None} if there is none.
+        """
+        return self._state.error_table.nextHandler(
+            self._state.error_handlers, failure, after
+        )
+
     def execute_error_handler(
         self,
         handler: KleinErrorMethod,
@@ -333,9 +710,20 @@ class Klein:
 
         return KleinResource(self)
 
+    def __set_name__(self, owner: object, name: str) -> None:
+        """
+        Remember the name of the class attribute this L{Klein} was assigned
+        to, so that L{Klein.__get__} does not have to look for it.
+        """
+        if self._boundAs is None:
+            self._boundAs = name
+
     def __get__(self, instance: Any, owner: object) -> Klein:
         """
         Get an instance of L{Klein} bound to C{instance}.
+
+        This is a lightweight view sharing this L{Klein}'s routing state, which
+        is cached on C{instance} if it allows it.
         """
         if instance is None:
             return self
@@ -353,19 +741,18 @@ class Klein:
                 self._boundAs = "unknown_" + str(id(self))
 
         boundName = f"__klein_bound_{self._boundAs}__"
-        k = cast(
-            Optional["Klein"], getattr(instance, boundName, lambda: None)()
-        )
+        k = getattr(instance, boundName, None)
 
-        if k is None:
-            k = self.__class__()
-            k._url_map = self._url_map
-            k._endpoints = self._endpoints
-            k._error_handlers = self._error_handlers
+        if (
+            not isinstance(k, Klein)
+            or k._state is not self._state
+            or k._instance is not instance
+        ):
+            k = self.__class__.__new__(self.__class__)
+            k.__dict__.update(self.__dict__)
             k._instance = instance
-            kref = ref(k)
             try:
-                setattr(instance, boundName, kref)
+                setattr(instance, boundName, k)
             except AttributeError:
                 pass
 
@@ -385,6 +772,15 @@ class Klein:
         url: str,
         *args: Any,
         branch: bool = False,
+        cache: Optional[CachePolicy] = None,
+        compress: CompressionSetting = None,
+        threaded: Union[bool, HandlerThreadPool] = False,
+        max_concurrency: Optional[int] = None,
+        max_queue: int = 0,
+        queue_timeout: float = 5.0,
+        priority: str = NORMAL,
+        stream_body: bool = False,
+        max_body_size: Optional[int] = None,
         **kwargs: Any,
     ) -> Callable[[KleinRouteHandlerT], KleinRouteHandlerT]:
         """
@@ -402,10 +798,47 @@ class Klein:
         @param branch: A bool indiciated if a branch endpoint should
             be added that allows all child path segments that don't
             match some other route to be consumed.  Default C{False}.
+        @param cache: If given, the L{CachePolicy} with which to cache the
+            responses of this route.
+        @param compress: A L{CompressionPolicy} with which to compress the
+            responses of this route, C{True} for the application's policy or
+            the default one, C{False} for none, or L{None} (the default) for
+            the application's policy, if it has one.
+        @param threaded: C{True} to call the handler in a thread of the
+            application's L{HandlerThreadPool}, as if decorated with
+            L{blocking}, or the L{HandlerThreadPool} to call it in.
+        @param max_concurrency: If given, the most requests to this route
+            handled at once; see L{Klein.concurrency_limits}.
+        @param max_queue: The most requests to this route which may wait for
+            others to finish, when C{max_concurrency} is given; any more are
+            answered with a 503.
+        @param queue_timeout: The most seconds a request may wait before it
+            is answered with a 503.
+        @param priority: L{CRITICAL} if requests to this route, such as
+            health checks, must never be shed by L{Klein.shed_load}; L{LOW}
+            if they should be shed before others; or L{NORMAL}.
+        @param stream_body: If C{True}, the handler is called as soon as
+            the request's headers have arrived, and reads its body from the
+            C{IFount} that is the C{body_fount} of L{IKleinRequest}; see
+            L{klein._requestbody}.
+        @param max_body_size: If given, the largest request body, in bytes,
+            this route accepts; larger ones are refused with a 413, as soon
+            as they're known to be too large.  Either this or C{stream_body}
+            makes L{Klein.run} serve the application with
+            L{StreamingRequest}s.
 
         @returns: decorated handler function.
         """
         segment_count = self._segments_in_url(url) + self._subroute_segments
+        compression = resolvePolicy(compress, self._state.compression)
+        checkPriority(priority)
+        limit = None
+        if max_concurrency is not None:
+            limit = ConcurrencyLimit(max_concurrency, max_queue, queue_timeout)
+        threads = threaded
+        if threaded is True:
+            # Leave the default pool to be made when first needed.
+            threads = self._state.thread_pool or True
 
         @named("router for '" + url + "'")
         def deco(f: KleinRouteHandlerT) -> KleinRouteHandlerT:
@@ -414,6 +847,11 @@ class Klein:
                 "endpoint",
                 metadata.__name__,
             )
+            handler: KleinRouteHandler = f
+            if isinstance(threads, HandlerThreadPool):
+                handler = blocking(pool=threads)(f)
+            elif threads:
+                handler = blocking(f)
             if branch:
                 branchKwargs = kwargs.copy()
                 branchKwargs["endpoint"] = branchKwargs["endpoint"] + "_branch"
@@ -428,14 +866,20 @@ class Klein:
                     IKleinRequest(request).branch_segments = kw.pop(
                         "__rest__", ""
                     ).split("/")
-                    return _call(instance, f, request, *a, **kw)
+                    return _call(instance, handler, request, *a, **kw)
 
                 branch_metadata = route_metadata(branch_f)
                 branch_metadata.segment_count = segment_count
-
-                self._endpoints[branchKwargs["endpoint"]] = branch_f
-                self._url_map.add(
-                    Rule(
+                branch_metadata.cache_policy = cache
+                branch_metadata.compression = compression
+                branch_metadata.concurrency_limit = limit
+                branch_metadata.priority = priority
+                branch_metadata.stream_body = stream_body
+                branch_metadata.max_body_size = max_body_size
+
+                self._state.endpoints[branchKwargs["endpoint"]] = branch_f
+                self._state.url_map.add(
+                    LazyRule(
                         url.rstrip("/") + "/" + "<path:__rest__>",
                         *args,
                         **branchKwargs,
@@ -449,13 +893,19 @@ class Klein:
                 *a: Any,
                 **kw: Any,
             ) -> KleinRenderable:
-                return _call(instance, f, request, *a, **kw)
+                return _call(instance, handler, request, *a, **kw)
 
             exec_metadata = route_metadata(_f)
             exec_metadata.segment_count = segment_count
-
-            self._endpoints[kwargs["endpoint"]] = _f
-            self._url_map.add(Rule(url, *args, **kwargs))
+            exec_metadata.cache_policy = cache
+            exec_metadata.compression = compression
+            exec_metadata.concurrency_limit = limit
+            exec_metadata.priority = priority
+            exec_metadata.stream_body = stream_body
+            exec_metadata.max_body_size = max_body_size
+
+            self._state.endpoints[kwargs["endpoint"]] = _f
+            self._state.url_map.add(LazyRule(url, *args, **kwargs))
             return f
 
         return deco
@@ -466,7 +916,7 @@ class Klein:
         Within this block, C{@route} adds rules to a
         C{werkzeug.routing.Submount}.
 
-        This is implemented by tinkering with the instance's C{_url_map}
+        This is implemented by tinkering with the application's C{url_map}
         variable. A context manager allows us to gracefully use the pattern of
         "change a variable, do some things with the new value, then put it back
         to how it was before.
@@ -485,7 +935,7 @@ class Klein:
                        routes established during the with-block.
         """
 
-        _map_before_submount = self._url_map
+        _map_before_submount = self._state.url_map
 
         segments = self._segments_in_url(prefix)
 
@@ -499,12 +949,12 @@ class Klein:
         submount_map = SubmountMap()
 
         try:
-            self._url_map = cast(Map, submount_map)
+            self._state.url_map = cast(Map, submount_map)
             self._subroute_segments += segments
             yield self
             _map_before_submount.add(Submount(prefix, submount_map.rules))
         finally:
-            self._url_map = _map_before_submount
+            self._state.url_map = _map_before_submount
             self._subroute_segments -= segments
 
     @overload
@@ -598,7 +1048,7 @@ class Klein:
             ) -> KleinRenderable:
                 return _call(instance, f, request, failure)
 
-            self._error_handlers.append((exceptions, _f))
+            self._state.error_handlers.append((exceptions, _f))
 
             return cast(Callable, _f)
 
@@ -622,7 +1072,7 @@ class Klein:
                 )
             host = ""
         return buildURL(
-            self.url_map.bind(host),
+            self._state.adapters.adapterFor(self.url_map, host),
             endpoint,
             values,
             method,
@@ -632,6 +1082,18 @@ class Klein:
 
     url_for = urlFor
 
+    def _streamsBodies(self) -> bool:
+        """
+        Do any of this application's routes set C{stream_body} or
+        C{max_body_size}, so that requests must be routed before their bodies
+        arrive?
+        """
+        for handler in self._state.endpoints.values():
+            metadata = route_metadata(handler)
+            if metadata.stream_body or metadata.max_body_size is not None:
+                return True
+        return False
+
     def run(
         self,
         host: Optional[str] = None,
@@ -639,6 +1101,11 @@ class Klein:
         logFile: Optional[IO] = None,
         endpoint_description: Optional[str] = None,
         displayTracebacks: bool = True,
+        workers: int = 1,
+        reuse_port: bool = False,
+        max_requests: Optional[int] = None,
+        max_rss: Optional[int] = None,
+        drain_timeout: float = 30.0,
     ) -> None:
         """
         Run a minimal twisted.web server on the specified C{port}, bound to the
@@ -663,21 +1130,75 @@ class Klein:
 
         @param displayTracebacks: Weather a processing error will result in
             a page displaying the traceback with debugging information or not.
+
+        @param workers: The number of processes to serve requests from.  With
+            more than one, this process binds C{host} and C{port} and then
+            supervises that many workers, each running this program again and
+            accepting connections on the same socket; workers which exit are
+            restarted.  Not supported with C{endpoint_description}.
+
+        @param reuse_port: If C{True}, each worker binds its own socket with
+            C{SO_REUSEPORT} instead of sharing one, so that the kernel
+            balances connections between them.  Needs a C{port}.
+
+        @param max_requests: If given, stop serving once this many requests
+            have been handled, so that the worker is replaced by a fresh one.
+
+        @param max_rss: If given, stop serving once this process's resident
+            memory exceeds this many bytes, so that the worker is replaced by
+            a fresh one.
+
+        @param drain_timeout: When stopping, whether on C{SIGTERM} or because
+            of C{max_requests} or C{max_rss}, the server stops accepting
+            connections and waits up to this many seconds for the requests in
+            flight to finish before exiting.
         """
+        if endpoint_description and (workers > 1 or reuse_port):
+            raise ValueError(
+                "Multiple workers need a host and port, not an endpoint"
+            )
+
         if logFile is None:
             logFile = sys.stdout
 
         log.startLogging(logFile)
 
-        if not endpoint_description:
-            endpoint_description = f"tcp:port={port}:interface={host}"
-
-        endpoint = serverFromString(reactor, endpoint_description)
-
-        site = Site(self.resource())
+        requestFactory: Type[Request] = Request
+        siteOptions: Dict[str, Any] = {}
+        if self._streamsBodies():
+            requestFactory = StreamingRequest
+        elif canSkipFormParsing:
+            requestFactory = FormRequest
+        if canSkipFormParsing:
+            # Forms parse multipart bodies incrementally; don't have Twisted
+            # parse them into memory first.
+            siteOptions["parsePOSTFormSubmission"] = False
+        site = Site(
+            self.resource(), requestFactory=requestFactory, **siteOptions
+        )
         site.displayTracebacks = displayTracebacks
 
-        endpoint.listen(site)
+        drainer = Drainer(
+            reactor,
+            self._state.in_flight,
+            drain_timeout,
+            max_requests,
+            max_rss,
+        )
+        if workers > 1 or reuse_port or isWorker():
+            served = serveWorkers(
+                reactor, site, host or "", port or 0, workers, reuse_port
+            )
+            if not isinstance(served, Supervisor):
+                drainer.listening(served)
+                drainer.start()
+        else:
+            if not endpoint_description:
+                endpoint_description = f"tcp:port={port}:interface={host}"
+
+            endpoint = serverFromString(reactor, endpoint_description)
+            endpoint.listen(site).addCallback(drainer.listening)
+            drainer.start()
         reactor.run()  # type: ignore[attr-defined]
 
 
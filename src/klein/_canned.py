@@ -0,0 +1,126 @@
+# -*- test-case-name: klein.test.test_canned -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Pre-encoded responses for Werkzeug's L{HTTPException}s.
+
+When no error handler deals with an L{HTTPException}, such as the
+L{NotFound} or L{MethodNotAllowed} raised by routing, L{KleinResource} sends
+the exception's own response.  Building that with Werkzeug means
+constructing a response object and re-encoding its headers and body every
+time, although for the stock exceptions they only vary with the status code
+and description.  L{CannedResponses} does that once per status code and
+description and keeps the encoded result.
+"""
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from ._dispatch import CacheStats
+
+
+__all__ = ()
+
+
+Headers = Tuple[Tuple[bytes, bytes], ...]
+CannedResponse = Tuple[int, Headers, bytes]
+
+_CannedKey = Tuple[int, Optional[str]]
+
+
+def _cannable(exception: HTTPException) -> bool:
+    """
+    Is C{exception}'s response fully determined by its code, description and
+    (for L{MethodNotAllowed}) its valid methods?
+    """
+    cls = type(exception)
+    return (
+        exception.response is None
+        and cls.get_response is HTTPException.get_response
+        and cls.get_body is HTTPException.get_body
+        and cls.get_description is HTTPException.get_description
+        and (
+            cls.get_headers is HTTPException.get_headers
+            or cls.get_headers is MethodNotAllowed.get_headers
+        )
+        and (
+            exception.description is None or type(exception.description) is str
+        )
+    )
+
+
+class CannedResponses:
+    """
+    A bounded LRU of the encoded responses for L{HTTPException}s, keyed by
+    status code and description.
+
+    @ivar maxsize: The maximum number of responses to keep.
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self.maxsize = maxsize
+        self._responses: "OrderedDict[_CannedKey, Tuple[Headers, bytes]]" = (
+            OrderedDict()
+        )
+        self._hits = 0
+        self._misses = 0
+
+    def stats(self) -> CacheStats:
+        """
+        Report how effective this cache has been.
+        """
+        return CacheStats(self._hits, self._misses, len(self._responses))
+
+    def responseFor(self, exception: HTTPException) -> Optional[CannedResponse]:
+        """
+        Get the status code, headers and body that Werkzeug would send for
+        C{exception}.
+
+        @return: The response, or L{None} if C{exception} customizes its
+            response in a way that cannot be cached, in which case the caller
+            must ask it for its response itself.
+        """
+        if not _cannable(exception):
+            return None
+
+        code = exception.code
+        assert code is not None
+        key = (code, exception.description)
+        found = self._responses.get(key)
+        if found is not None:
+            self._hits += 1
+            self._responses.move_to_end(key)
+        else:
+            self._misses += 1
+            found = self._responses[key] = self._encode(exception)
+            while len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+
+        headers, body = found
+        if isinstance(exception, MethodNotAllowed) and exception.valid_methods:
+            allow = ", ".join(exception.valid_methods).encode("utf-8")
+            headers = headers + ((b"Allow", allow),)
+        return code, headers, body
+
+    @staticmethod
+    def _encode(exception: HTTPException) -> Tuple[Headers, bytes]:
+        """
+        Have Werkzeug build C{exception}'s response, minus any C{Allow} header,
+        and encode it.
+        """
+        response = WerkzeugResponse(
+            exception.get_body(),
+            exception.code,
+            HTTPException.get_headers(exception),
+        )
+        headers = tuple(
+            (name.encode("utf-8"), value.encode("utf-8"))
+            for name, value in response.headers
+        )
+        return headers, b"".join(response.iter_encoded())
+
+
+cannedResponses = CannedResponses()
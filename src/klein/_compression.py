@@ -0,0 +1,329 @@
+# -*- test-case-name: klein.test.test_compression -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Compression of response bodies with C{gzip} or C{deflate}, negotiated on
+C{Accept-Encoding}.
+
+Compression is enabled for a whole application with
+C{Klein(compression=CompressionPolicy())}, or for a route with
+C{@app.route(..., compress=CompressionPolicy())}.  L{KleinResource} then
+installs a L{ResponseEncoder} on each request for such a route, which
+decides, once the response's headers are known, whether to compress it.
+"""
+
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple, Union, cast
+
+import attr
+from zope.interface import implementer
+
+from twisted.web.http import NO_BODY_CODES, PARTIAL_CONTENT
+from twisted.web.iweb import IRequest, _IRequestEncoder
+from twisted.web.server import Request
+
+
+__all__ = ()
+
+
+# Media types, or prefixes of media types ending with "/", whose content is
+# already compressed.
+_alreadyCompressed = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "font/woff2",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zip",
+    "application/x-bzip2",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/zstd",
+    "application/octet-stream",
+)
+
+# Media types matched by the prefixes above which do compress well.
+_compressible = frozenset(["image/svg+xml", "image/x-icon", "image/bmp"])
+
+
+def _normalizeTypes(types: Sequence[str]) -> Tuple[str, ...]:
+    return tuple(each.lower() for each in types)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class CompressionPolicy:
+    """
+    How to compress the responses of a route.
+
+    @ivar minimum_size: Bodies smaller than this many bytes, when their size
+        is known up front, are sent uncompressed.
+    @ivar level: The C{zlib} compression level, from 1 to 9.
+    @ivar excluded_types: Media types that are never compressed, because
+        they already are; entries ending with C{"/"} match every subtype.
+    """
+
+    minimum_size: int = 1024
+    level: int = 6
+    excluded_types: Sequence[str] = attr.ib(
+        default=_alreadyCompressed, converter=_normalizeTypes
+    )
+
+    def compresses(self, contentType: Optional[bytes]) -> bool:
+        """
+        Should content of the given type be compressed?
+        """
+        if contentType is None:
+            return True
+        mediaType = (
+            contentType.split(b";", 1)[0].strip().lower().decode("latin-1")
+        )
+        if mediaType in _compressible:
+            return True
+        for excluded in self.excluded_types:
+            if excluded.endswith("/"):
+                if mediaType.startswith(excluded):
+                    return False
+            elif mediaType == excluded:
+                return False
+        return True
+
+
+CompressionSetting = Union[CompressionPolicy, bool, None]
+
+
+def resolvePolicy(
+    route: CompressionSetting, default: Optional[CompressionPolicy]
+) -> Optional[CompressionPolicy]:
+    """
+    Combine a route's C{compress} setting with its application's default.
+    """
+    if route is None:
+        return default
+    if route is True:
+        return default if default is not None else CompressionPolicy()
+    if route is False:
+        return None
+    return route
+
+
+def acceptedEncodings(header: Optional[bytes]) -> Dict[str, float]:
+    """
+    Parse an C{Accept-Encoding} header into a mapping of lowercase content
+    codings to their quality values.
+    """
+    accepted: Dict[str, float] = {}
+    if header is None:
+        return accepted
+    for element in header.decode("latin-1").split(","):
+        coding, *params = element.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+# Window bits for each content coding we produce, in order of preference.
+_wbits = {b"gzip": 16 + zlib.MAX_WBITS, b"deflate": zlib.MAX_WBITS}
+
+
+def negotiate(request: IRequest) -> Optional[bytes]:
+    """
+    Pick the content coding to compress the response to C{request} with, if
+    any.
+    """
+    accepted = acceptedEncodings(request.getHeader(b"accept-encoding"))
+    best, bestQuality = None, 0.0
+    for coding in _wbits:
+        quality = accepted.get(coding.decode("ascii"), accepted.get("*", 0.0))
+        if quality > bestQuality:
+            best, bestQuality = coding, quality
+    return best
+
+
+def compress(body: bytes, coding: bytes, level: int) -> bytes:
+    """
+    Compress a whole body.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _wbits[coding])
+    return compressor.compress(body) + compressor.flush()
+
+
+_BodyKey = Tuple[int, bytes, int]
+
+
+class CompressedBodies:
+    """
+    An LRU of compressed bodies, keyed by the identity of the uncompressed
+    body, so that bodies which are sent repeatedly, such as those of cached
+    responses or of constant L{klein.Response}s, are only compressed once.
+
+    @ivar maxBytes: The maximum total size of the bodies held, compressed
+        and uncompressed.
+    """
+
+    def __init__(self, maxBytes: int = 4 * 1024 * 1024) -> None:
+        self.maxBytes = maxBytes
+        self._bodies: "OrderedDict[_BodyKey, Tuple[bytes, bytes]]"
+        self._bodies = OrderedDict()
+        self._bytes = 0
+
+    def compress(self, body: bytes, coding: bytes, level: int) -> bytes:
+        """
+        Compress C{body}, or get its compressed form from the last time it
+        was compressed the same way.
+        """
+        key = (id(body), coding, level)
+        entry = self._bodies.get(key)
+        # The entry keeps the body alive, so its id can't have been reused.
+        if entry is not None and entry[0] is body:
+            self._bodies.move_to_end(key)
+            return entry[1]
+        compressed = compress(body, coding, level)
+        size = len(body) + len(compressed)
+        if size <= self.maxBytes // 8:
+            self._bodies[key] = (body, compressed)
+            self._bytes += size
+            while self._bytes > self.maxBytes:
+                _, (old, oldCompressed) = self._bodies.popitem(last=False)
+                self._bytes -= len(old) + len(oldCompressed)
+        return compressed
+
+
+compressedBodies = CompressedBodies()
+
+
+@implementer(_IRequestEncoder)
+class ResponseEncoder:
+    """
+    Compress the response to a request, if its headers allow it, as it is
+    written.
+
+    Installed as the request's encoder, so that everything written with
+    C{request.write} goes through L{ResponseEncoder.encode}.  Bodies whose
+    size is known before they are written are compressed in one go with
+    L{ResponseEncoder.encodeBody} instead, so that they can still be sent
+    with a C{Content-Length}.
+
+    @ivar request: The request.
+    @ivar policy: The L{CompressionPolicy} of the route.
+    @ivar coding: The content coding negotiated with the client, if any.
+    @ivar cacheable: Whether the whole body is one which will be sent again,
+        such as that of a cached response or of a constant
+        L{klein.Response}, so that its compressed form is worth keeping in
+        L{compressedBodies}.
+    """
+
+    def __init__(
+        self,
+        request: IRequest,
+        policy: CompressionPolicy,
+        coding: Optional[bytes],
+    ) -> None:
+        self.request = request
+        self.policy = policy
+        self.coding = coding
+        self.cacheable = False
+        self._decided = False
+        self._compressor: Optional["zlib._Compress"] = None
+
+    def _decide(self, size: Optional[int]) -> bool:
+        """
+        Decide whether to compress the response, now that its headers are
+        final, and set the headers accordingly.
+
+        @param size: The size of the body, if known.
+        """
+        self._decided = True
+        request = self.request
+        headers = request.responseHeaders
+        code = cast(Request, request).code
+        if (
+            code in NO_BODY_CODES
+            or code == PARTIAL_CONTENT
+            or headers.hasHeader(b"content-encoding")
+            or headers.hasHeader(b"content-range")
+        ):
+            return False
+        contentType = headers.getRawHeaders(b"content-type", [None])[0]
+        if not self.policy.compresses(contentType):
+            return False
+        for value in headers.getRawHeaders(b"cache-control", []):
+            if b"no-transform" in value.lower():
+                return False
+        vary = headers.getRawHeaders(b"vary", [])
+        if not any(
+            name.strip().lower() in (b"accept-encoding", b"*")
+            for value in vary
+            for name in value.split(b",")
+        ):
+            headers.addRawHeader(b"vary", b"accept-encoding")
+        if self.coding is None:
+            return False
+        if size is not None and size < self.policy.minimum_size:
+            return False
+        headers.setRawHeaders(b"content-encoding", [self.coding])
+        etag = headers.getRawHeaders(b"etag", [None])[0]
+        if etag is not None and not etag.startswith(b"W/"):
+            # The compressed body is not byte-for-byte the one the strong
+            # entity tag was computed for.
+            headers.setRawHeaders(b"etag", [b"W/" + etag])
+        return True
+
+    def encodeBody(self, body: bytes) -> bytes:
+        """
+        Compress a whole body, if the response should be compressed, before
+        anything has been written.  Only L{ResponseEncoder.cacheable} bodies
+        are kept in L{compressedBodies}.
+        """
+        if self._decided or not self._decide(len(body)):
+            return body
+        assert self.coding is not None
+        if self.cacheable:
+            return compressedBodies.compress(
+                body, self.coding, self.policy.level
+            )
+        return compress(body, self.coding, self.policy.level)
+
+    def encode(self, data: bytes) -> bytes:
+        """
+        Compress data written to the request, if the response should be
+        compressed.  Each write is flushed, so that streamed chunks reach the
+        client as they are produced.
+        """
+        if not self._decided:
+            headers = self.request.responseHeaders
+            if not getattr(
+                self.request, "startedWriting", True
+            ) and not headers.hasHeader(b"content-length"):
+                if self._decide(None):
+                    assert self.coding is not None
+                    self._compressor = zlib.compressobj(
+                        self.policy.level, zlib.DEFLATED, _wbits[self.coding]
+                    )
+            self._decided = True
+        compressor = self._compressor
+        if compressor is None or not data:
+            return data
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """
+        Finish compressing the response.
+        """
+        self._decided = True
+        compressor, self._compressor = self._compressor, None
+        if compressor is None:
+            return b""
+        return compressor.flush()
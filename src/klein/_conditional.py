@@ -0,0 +1,141 @@
+# -*- test-case-name: klein.test.test_conditional -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Conditional C{GET} support: C{ETag} and C{Last-Modified} validators, and
+answering C{If-None-Match} and C{If-Modified-Since} with C{304 Not
+Modified}.
+"""
+
+from base64 import urlsafe_b64encode
+from datetime import datetime
+from hashlib import blake2b
+from math import ceil
+from typing import Optional, Tuple, Union, cast
+
+from twisted.web.http import NOT_MODIFIED, datetimeToString, stringToDatetime
+from twisted.web.iweb import IRequest
+from twisted.web.server import Request
+
+
+__all__ = ()
+
+
+ETag = Union[str, bytes]
+Timestamp = Union[float, datetime]
+Validators = Tuple[Optional[ETag], Optional[Timestamp]]
+
+_conditionalMethods = frozenset([b"GET", b"HEAD"])
+
+
+def formatETag(etag: ETag) -> bytes:
+    """
+    Format C{etag} as the value of an C{ETag} header, quoting it unless it
+    is already a quoted (possibly weak) entity tag.
+    """
+    if isinstance(etag, str):
+        etag = etag.encode("ascii")
+    if etag.startswith((b'"', b'W/"')) and etag.endswith(b'"'):
+        return etag
+    return b'"' + etag + b'"'
+
+
+def bodyETag(body: bytes) -> bytes:
+    """
+    Compute a strong entity tag for a response body.
+    """
+    digest = blake2b(body, digest_size=12).digest()
+    return b'"' + urlsafe_b64encode(digest) + b'"'
+
+
+def wholeSeconds(when: float) -> int:
+    """
+    C{when}, in seconds since the epoch, as the whole second an HTTP date
+    stands for.  HTTP dates only have whole seconds, so this rounds up, as
+    Twisted does.
+    """
+    return int(ceil(when))
+
+
+def formatTimestamp(when: Timestamp) -> bytes:
+    """
+    Format C{when}, in seconds since the epoch or as an aware L{datetime}, as
+    the value of a C{Last-Modified} header.
+    """
+    if isinstance(when, datetime):
+        when = when.timestamp()
+    return cast(bytes, datetimeToString(wholeSeconds(when)))
+
+
+def setValidators(
+    request: IRequest, etag: Optional[ETag], lastModified: Optional[Timestamp]
+) -> None:
+    """
+    Set the C{ETag} and C{Last-Modified} headers of the response to
+    C{request}, for those validators that are given.
+    """
+    if etag is not None:
+        request.setHeader(b"etag", formatETag(etag))
+    if lastModified is not None:
+        request.setHeader(b"last-modified", formatTimestamp(lastModified))
+
+
+def _opaque(etag: bytes) -> bytes:
+    """
+    The opaque part of an entity tag, for weak comparison.
+    """
+    return etag[2:] if etag.startswith(b"W/") else etag
+
+
+def _matches(ifNoneMatch: bytes, etag: bytes) -> bool:
+    if ifNoneMatch.strip() == b"*":
+        return True
+    opaque = _opaque(etag.strip())
+    return any(
+        _opaque(candidate.strip()) == opaque
+        for candidate in ifNoneMatch.split(b",")
+    )
+
+
+def notModified(request: IRequest) -> bool:
+    """
+    Is the response to C{request}, as it is now, unchanged from the version
+    the client has?
+
+    Only C{200} responses to C{GET} and C{HEAD} requests are considered.
+    C{If-None-Match} is compared with the response's C{ETag} header, and
+    takes precedence over C{If-Modified-Since}, which is compared with its
+    C{Last-Modified} header.
+    """
+    code = cast(Request, request).code
+    if code != 200 or request.method not in _conditionalMethods:
+        return False
+    ifNoneMatch = request.getHeader(b"if-none-match")
+    if ifNoneMatch is not None:
+        etag = request.responseHeaders.getRawHeaders(b"etag", [None])[0]
+        return etag is not None and _matches(ifNoneMatch, etag)
+    ifModifiedSince = request.getHeader(b"if-modified-since")
+    lastModified = request.responseHeaders.getRawHeaders(
+        b"last-modified", [None]
+    )[0]
+    if ifModifiedSince is None or lastModified is None:
+        return False
+    try:
+        since = stringToDatetime(ifModifiedSince.split(b";", 1)[0])
+        modified = stringToDatetime(lastModified)
+    except (ValueError, IndexError):
+        return False
+    return cast(bool, modified <= since)
+
+
+def answerNotModified(request: IRequest) -> bool:
+    """
+    If L{notModified} says so, turn the response to C{request} into a C{304
+    Not Modified} response.
+
+    @return: Whether it did; if so, no body should be written.
+    """
+    if notModified(request):
+        request.setResponseCode(NOT_MODIFIED)
+        return True
+    return False
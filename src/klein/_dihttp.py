@@ -2,7 +2,17 @@
 Dependency-Injected HTTP metadata.
 """
 
-from typing import Any, Dict, Mapping, Sequence, Type, Union, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Mapping,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+    cast,
+)
 
 import attr
 from hyperlink import DecodedURL
@@ -11,6 +21,15 @@ from zope.interface import Interface, implementer, provider
 from twisted.python.components import Componentized
 from twisted.web.iweb import IRequest
 
+from ._conditional import (
+    ETag,
+    Timestamp,
+    Validators,
+    answerNotModified,
+    bodyETag,
+    setValidators,
+)
+from ._jsoncodec import requestCodec
 from .interfaces import (
     IDependencyInjector,
     IRequestLifecycle,
@@ -118,7 +137,20 @@ class Response:
         - some HTTP headers
 
         - a body object, which can be anything else Klein understands; for
-          example, an IResource, an IRenderable, str, bytes, etc.
+          example, an IResource, an IRenderable, str, bytes, etc.  A list or
+          dict is encoded as JSON with the application's L{JSONCodec}, and
+          sent as C{application/json} unless a C{Content-Type} is given.
+
+        - optionally, validators for conditional requests: an C{etag}, a
+          C{last_modified} time (in seconds since the epoch, or an aware
+          L{datetime.datetime}), or a C{validator} callable returning both,
+          which is only called when the response is applied.
+
+    When the request's C{If-None-Match} or C{If-Modified-Since} header
+    matches the validators of a C{200} response, Klein answers with C{304 Not
+    Modified} instead, without rendering the body.  If no C{etag} is given
+    and the body is C{str} or C{bytes}, one is computed from the body, unless
+    C{auto_etag} is false.
 
     @since: Klein 23.12.0
     """
@@ -128,11 +160,16 @@ class Response:
         Union[str, bytes], Union[str, bytes, Sequence[Union[str, bytes]]]
     ] = attr.ib(factory=dict)
     body: Any = ""
+    etag: Optional[ETag] = None
+    last_modified: Optional[Timestamp] = None
+    validator: Optional[Callable[[], Validators]] = None
+    auto_etag: bool = True
 
     def _applyToRequest(self, request: IRequest) -> Any:
         """
         Apply this L{Response} to the given L{IRequest}, setting its response
-        code and headers.
+        code and headers, and return its body, or L{None} if the request is
+        answered with C{304 Not Modified} instead.
 
         Private because:
 
@@ -148,4 +185,26 @@ class Response:
             else:
                 headerValues = [headerValueOrValues]
             request.responseHeaders.setRawHeaders(headerName, headerValues)
-        return self.body
+
+        body = self.body
+        if isinstance(body, (list, dict)):
+            body = requestCodec(request).dumps(body)
+            if not request.responseHeaders.hasHeader(b"content-type"):
+                request.setHeader(b"content-type", b"application/json")
+        etag, lastModified = self.etag, self.last_modified
+        if self.validator is not None:
+            etag, lastModified = self.validator()
+        if (
+            etag is None
+            and self.code == 200
+            and isinstance(body, (str, bytes))
+            and self.auto_etag
+            and not request.responseHeaders.hasHeader(b"etag")
+        ):
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            etag = bodyETag(body)
+        setValidators(request, etag, lastModified)
+        if answerNotModified(request):
+            return None
+        return body
@@ -0,0 +1,596 @@
+# -*- test-case-name: klein.test.test_dispatch -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Compiled route dispatch.
+
+Werkzeug's L{MapAdapter.match} walks a generic state machine, re-deriving a
+good deal of per-request state along the way.  L{RouteDispatcher} compiles the
+rules of a L{Map} into a radix tree once, so that fully static paths are
+resolved with a single C{dict} lookup and parametric paths are resolved with a
+walk over pre-compiled segment matchers.
+
+The dispatcher only ever answers when it is I{certain} that its answer is the
+one Werkzeug would give.  Anything it does not understand (custom converters,
+aliases, redirects, defaults, host matching, mixed static/dynamic segments) as
+well as every non-match (404, 405, slash redirects) is left to Werkzeug, by
+returning L{None} from L{RouteDispatcher.match}.
+
+L{MatchCache} memoizes the outcomes of matching, including 404s and 405s,
+for applications whose traffic is concentrated on few URLs.
+
+L{VersionedMap} and L{LazyRule} keep building large route tables cheap.
+"""
+
+import gc
+import re
+from collections import OrderedDict
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import attr
+from werkzeug.exceptions import HTTPException, MethodNotAllowed, NotFound
+from werkzeug.routing import (
+    IntegerConverter,
+    Map,
+    MapAdapter,
+    PathConverter,
+    Rule,
+    RuleFactory,
+    UnicodeConverter,
+    UUIDConverter,
+    ValidationError,
+)
+
+
+__all__ = ()
+
+
+_variableSegment = re.compile(
+    r"^<(?:[a-zA-Z_][a-zA-Z0-9_]*(?:\(.*\))?:)?"
+    r"(?P<name>[a-zA-Z_][a-zA-Z0-9_]*)>$"
+)
+
+_repeatedSlashes = re.compile("//+")
+
+_compilableConverters = (
+    IntegerConverter,
+    PathConverter,
+    UnicodeConverter,
+    UUIDConverter,
+)
+
+RouteMatch = Tuple[Rule, Dict[str, Any]]
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class RouteTimings:
+    """
+    How long building a route table has taken.
+
+    @ivar additions: The number of rules and rule factories added.
+    @ivar adding: Seconds spent adding them.
+    @ivar finalizing: Seconds spent binding deferred rules and sorting the
+        table for matching and building.
+    """
+
+    additions: int
+    adding: float
+    finalizing: float
+
+
+class VersionedMap(Map):
+    """
+    A L{Map} that counts the rules added to it, and can defer binding them
+    until they are first needed.
+
+    Werkzeug calls L{Map.update} before matching or building URLs with a map,
+    so deferred rules are bound then, in one go, if not explicitly by
+    L{VersionedMap.finalize} before.
+
+    @ivar version: The number of times L{Map.add} has been called.
+    """
+
+    version = 0
+    _pending: Optional[List[RuleFactory]] = None
+    _adding = 0.0
+    _finalizing = 0.0
+
+    def deferRules(self) -> None:
+        """
+        Collect the rules added from now on without binding them until
+        L{VersionedMap.finalize} is called.
+        """
+        if self._pending is None:
+            self._pending = []
+
+    def add(self, rulefactory: RuleFactory) -> None:
+        start = perf_counter()
+        if self._pending is not None:
+            self._pending.append(rulefactory)
+        else:
+            super().add(rulefactory)
+        self.version += 1
+        self._adding += perf_counter() - start
+
+    def finalize(self) -> None:
+        """
+        Bind any deferred rules, stop deferring, and sort the rules for
+        matching and building.
+        """
+        start = perf_counter()
+        pending, self._pending = self._pending, None
+        if pending:
+            # Binding allocates a lot of long-lived objects, which would
+            # otherwise trigger many pointless garbage collection passes.
+            collecting = gc.isenabled()
+            gc.disable()
+            try:
+                for rulefactory in pending:
+                    super().add(rulefactory)
+            finally:
+                if collecting:
+                    gc.enable()
+        super().update()
+        self._finalizing += perf_counter() - start
+
+    def update(self) -> None:
+        if self._pending is not None or self._remap:
+            self.finalize()
+
+    def iter_rules(self, endpoint: Optional[str] = None) -> Iterator[Rule]:
+        if self._pending is not None:
+            self.finalize()
+        return super().iter_rules(endpoint)
+
+    def is_endpoint_expecting(self, endpoint: str, *arguments: str) -> bool:
+        if self._pending is not None:
+            self.finalize()
+        return super().is_endpoint_expecting(endpoint, *arguments)
+
+    def timings(self) -> RouteTimings:
+        """
+        Report how long building this map has taken so far.
+        """
+        return RouteTimings(self.version, self._adding, self._finalizing)
+
+
+class LazyRule(Rule):
+    """
+    A L{Rule} that compiles its URL builders the first time it builds a URL,
+    rather than when it is bound to a map.
+
+    Generating and compiling the builders' code is by far the most expensive
+    part of adding a rule, and most rules are never used to build URLs.
+    """
+
+    def _compile_builder(
+        self, append_unknown: bool = True
+    ) -> Callable[..., Tuple[str, str]]:
+        name = "_build_unknown" if append_unknown else "_build"
+
+        def build(rule: Rule, **values: Any) -> Tuple[str, str]:
+            builder = Rule._compile_builder(rule, append_unknown)
+            bound = builder.__get__(rule, None)
+            setattr(rule, name, bound)
+            return bound(**values)  # type: ignore[no-any-return]
+
+        return build
+
+
+def mapVersion(urlMap: Map) -> int:
+    """
+    Return a number that changes whenever rules are added to C{urlMap}.
+
+    This is constant-time for a L{VersionedMap}.  Rules can only ever be
+    added to a L{Map}, so for any other map the number of rules is
+    sufficient, but recent versions of Werkzeug have to collect them all to
+    count them.
+    """
+    if isinstance(urlMap, VersionedMap):
+        return urlMap.version
+    return len(urlMap._rules)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class CacheStats:
+    """
+    A snapshot of a routing cache's counters.
+
+    @ivar hits: The number of lookups served from the cache.
+    @ivar misses: The number of lookups that had to be computed.
+    @ivar size: The number of entries currently cached.
+    """
+
+    hits: int
+    misses: int
+    size: int
+
+
+class _Indeterminate(Exception):
+    """
+    Raised while walking the tree to indicate that only Werkzeug can decide
+    the outcome of this match.
+    """
+
+
+@attr.s(auto_attribs=True, slots=True, eq=False)
+class _DynamicSegment:
+    """
+    A transition out of a L{_Node} that consumes one path segment (or, if
+    C{final}, all remaining path segments) matching a converter's regex.
+    """
+
+    pattern: Pattern[str]
+    final: bool
+    weight: int
+
+
+@attr.s(auto_attribs=True, slots=True, eq=False)
+class _Node:
+    """
+    A state in the dispatch tree; mirrors Werkzeug's matcher C{State}.
+
+    @ivar opaque: Whether a rule the dispatcher cannot compile passes through
+        this node, in which case any match visiting it is indeterminate.
+    """
+
+    static: Dict[str, "_Node"] = attr.ib(factory=dict)
+    dynamic: List[Tuple[_DynamicSegment, "_Node"]] = attr.ib(factory=list)
+    rules: List[Rule] = attr.ib(factory=list)
+    opaque: bool = False
+
+
+def _pathPart(pathInfo: str) -> str:
+    """
+    Normalize C{PATH_INFO} the same way L{MapAdapter.match} does.
+    """
+    return f"/{pathInfo.lstrip('/')}" if pathInfo else ""
+
+
+def _ruleParts(rule: Rule) -> List[str]:
+    """
+    Split a rule's path into segments the way Werkzeug matches it, which by
+    default is with repeated slashes merged into one.
+    """
+    path = rule.rule
+    if rule.merge_slashes is not False:
+        path = _repeatedSlashes.sub("/", path)
+    return path.split("/")
+
+
+def _methodAllowed(rule: Rule, method: str) -> bool:
+    return rule.methods is None or method in rule.methods
+
+
+class RouteDispatcher:
+    """
+    A compiled, read-only view of the rules in a L{Map}.
+
+    @ivar ruleCount: The number of rules in the map at compilation time; used
+        by L{RouteDispatcher.isCurrentFor} to detect that the map has grown.
+    """
+
+    def __init__(self, urlMap: Map) -> None:
+        self.ruleCount = mapVersion(urlMap)
+        self._root = _Node()
+        self._static: Dict[str, _Node] = {}
+        # Werkzeug < 2.2 matches with a sorted list of regexes, whose priority
+        # rules we do not emulate; in that case everything is indeterminate.
+        self._enabled = hasattr(urlMap, "_matcher") and not (
+            urlMap.host_matching or urlMap.default_subdomain
+        )
+        if not self._enabled:
+            return
+
+        rules = [rule for rule in urlMap.iter_rules() if not rule.build_only]
+        endpointsWithDefaults = {
+            rule.endpoint for rule in rules if rule.defaults
+        }
+        for rule in rules:
+            self._add(rule, rule.endpoint not in endpointsWithDefaults)
+        self._sort(self._root)
+        self._indexStatic(self._root, [])
+
+    def isCurrentFor(self, urlMap: Map) -> bool:
+        """
+        Is this dispatcher still an accurate compilation of C{urlMap}?
+        """
+        return self.ruleCount == mapVersion(urlMap)
+
+    def _segmentsFor(self, rule: Rule) -> Optional[List[Any]]:
+        """
+        Split a rule into a list of static strings and L{_DynamicSegment}s, or
+        return L{None} if it is not compilable.
+        """
+        if (
+            rule.alias
+            or rule.redirect_to is not None
+            or rule.websocket
+            or rule.subdomain
+            or rule.host
+            or not rule.rule.startswith("/")
+            or "//" in rule.rule
+        ):
+            return None
+        converters = rule._converters
+        segments: List[Any] = []
+        rawSegments = rule.rule.split("/")
+        for index, raw in enumerate(rawSegments):
+            if "<" not in raw and ">" not in raw:
+                segments.append(raw)
+                continue
+            variable = _variableSegment.match(raw)
+            if variable is None:
+                return None
+            converter = converters[variable.group("name")]
+            if type(converter) not in _compilableConverters:
+                return None
+            final = not converter.part_isolating
+            if final and index != len(rawSegments) - 1:
+                return None
+            segments.append(
+                _DynamicSegment(
+                    pattern=re.compile(f"(?:{converter.regex})\\Z"),
+                    final=final,
+                    weight=converter.weight,
+                )
+            )
+        return segments
+
+    def _add(self, rule: Rule, compilable: bool) -> None:
+        segments = self._segmentsFor(rule) if compilable else None
+        node = self._root
+        if segments is None:
+            # Mark the deepest node reachable through the rule's leading
+            # static segments; nothing can be decided once a walk gets there.
+            if rule.rule.startswith("/") and not (rule.subdomain or rule.host):
+                for raw in _ruleParts(rule):
+                    if "<" in raw or ">" in raw:
+                        break
+                    node = node.static.setdefault(raw, _Node())
+            node.opaque = True
+            return
+
+        for segment in segments:
+            if isinstance(segment, str):
+                node = node.static.setdefault(segment, _Node())
+                continue
+            for existing, child in node.dynamic:
+                if (
+                    existing.pattern.pattern == segment.pattern.pattern
+                    and existing.final == segment.final
+                    and existing.weight == segment.weight
+                ):
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.dynamic.append((segment, child))
+                node = child
+        node.rules.append(rule)
+
+    def _sort(self, node: _Node) -> None:
+        # Stable, like Werkzeug's, so equal weights keep registration order.
+        node.dynamic.sort(key=lambda entry: entry[0].weight)
+        for child in node.static.values():
+            self._sort(child)
+        for _, child in node.dynamic:
+            self._sort(child)
+
+    def _indexStatic(self, node: _Node, segments: List[str]) -> None:
+        """
+        Record every node reachable through static segments only, keyed by
+        its full path, stopping at opaque nodes.
+        """
+        if node.opaque:
+            return
+        if node.rules:
+            self._static["/".join(segments)] = node
+        for segment, child in node.static.items():
+            self._indexStatic(child, segments + [segment])
+
+    def match(self, pathInfo: str, method: str) -> Optional[RouteMatch]:
+        """
+        Match C{pathInfo} and C{method}.
+
+        @return: The same C{(rule, arguments)} tuple that
+            C{MapAdapter.match(return_rule=True)} would return, or L{None} if
+            the dispatcher cannot be certain of the outcome.
+        """
+        if not self._enabled:
+            return None
+        method = method.upper()
+        path = _pathPart(pathInfo)
+
+        node = self._static.get(path)
+        if node is not None:
+            for rule in node.rules:
+                if _methodAllowed(rule, method):
+                    return rule, {}
+
+        try:
+            found = self._walk(self._root, path.split("/"), 0, [], method)
+        except _Indeterminate:
+            return None
+        if found is None:
+            return None
+
+        rule, values = found
+        arguments = {}
+        for name, value in zip(rule._converters.keys(), values):
+            try:
+                arguments[str(name)] = rule._converters[name].to_python(value)
+            except ValidationError:
+                return None
+        return rule, arguments
+
+    def _walk(
+        self,
+        node: _Node,
+        parts: List[str],
+        index: int,
+        values: List[str],
+        method: str,
+    ) -> Optional[Tuple[Rule, List[str]]]:
+        if node.opaque:
+            raise _Indeterminate()
+
+        if index == len(parts):
+            for rule in node.rules:
+                if _methodAllowed(rule, method):
+                    return rule, values
+            slashed = node.static.get("")
+            if slashed is not None:
+                if slashed.opaque:
+                    raise _Indeterminate()
+                for rule in slashed.rules:
+                    if _methodAllowed(rule, method):
+                        if rule.strict_slashes:
+                            # Werkzeug redirects to the slashed URL.
+                            raise _Indeterminate()
+                        return rule, values
+            return None
+
+        part = parts[index]
+        child = node.static.get(part)
+        if child is not None:
+            found = self._walk(child, parts, index + 1, values, method)
+            if found is not None:
+                return found
+
+        for segment, child in node.dynamic:
+            if segment.final:
+                target = "/".join(parts[index:])
+                after = len(parts)
+            else:
+                target = part
+                after = index + 1
+            if segment.pattern.match(target) is not None:
+                found = self._walk(
+                    child, parts, after, values + [target], method
+                )
+                if found is not None:
+                    return found
+
+        if part == "" and index == len(parts) - 1:
+            for rule in node.rules:
+                if not rule.strict_slashes and _methodAllowed(rule, method):
+                    return rule, values
+
+        return None
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class _NegativeMatch:
+    """
+    A cached routing failure.
+
+    @ivar validMethods: L{None} for a 404, or the methods to report in a 405.
+    """
+
+    validMethods: Optional[Sequence[str]]
+
+    def exception(self) -> HTTPException:
+        if self.validMethods is None:
+            return NotFound()
+        return MethodNotAllowed(valid_methods=list(self.validMethods))
+
+
+_MatchKey = Tuple[str, str, str]
+_MatchOutcome = Union[RouteMatch, _NegativeMatch]
+
+
+class MatchCache:
+    """
+    A bounded LRU of routing outcomes, keyed by method, server name and path.
+
+    Both successful matches and the two routing failures that depend only on
+    those keys, L{NotFound} and L{MethodNotAllowed}, are cached.  Redirects
+    are not, since their target also depends on the script name, scheme and
+    query string.
+
+    The cache is emptied whenever rules are added to the map being matched.
+
+    @ivar maxsize: The maximum number of outcomes to keep.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._outcomes: "OrderedDict[_MatchKey, _MatchOutcome]" = OrderedDict()
+        self._map: Optional[Map] = None
+        self._version = -1
+        self._hits = 0
+        self._misses = 0
+
+    def stats(self) -> CacheStats:
+        """
+        Report how effective this cache has been.
+        """
+        return CacheStats(self._hits, self._misses, len(self._outcomes))
+
+    def invalidate(self) -> None:
+        """
+        Discard all cached outcomes.
+        """
+        self._outcomes.clear()
+
+    def match(
+        self, mapper: MapAdapter, matcher: Callable[[MapAdapter], RouteMatch]
+    ) -> RouteMatch:
+        """
+        Return the cached outcome of matching C{mapper}, or compute it with
+        C{matcher} and cache it.
+
+        @raise NotFound: If no route matches.
+        @raise MethodNotAllowed: If no route matches the request's method.
+        """
+        urlMap = mapper.map
+        version = mapVersion(urlMap)
+        if urlMap is not self._map or version != self._version:
+            self.invalidate()
+            self._map = urlMap
+            self._version = version
+
+        key = (mapper.default_method, mapper.server_name, mapper.path_info)
+        outcome = self._outcomes.get(key)
+        if outcome is not None:
+            self._hits += 1
+            self._outcomes.move_to_end(key)
+            if isinstance(outcome, _NegativeMatch):
+                raise outcome.exception()
+            rule, arguments = outcome
+            return rule, dict(arguments)
+
+        self._misses += 1
+        try:
+            rule, arguments = matcher(mapper)
+        except NotFound as e:
+            if type(e) is not NotFound:
+                raise
+            self._remember(key, _NegativeMatch(None))
+            raise
+        except MethodNotAllowed as e:
+            methods = e.valid_methods
+            self._remember(
+                key, _NegativeMatch(None if methods is None else list(methods))
+            )
+            raise
+        self._remember(key, (rule, dict(arguments)))
+        return rule, arguments
+
+    def _remember(self, key: _MatchKey, outcome: _MatchOutcome) -> None:
+        self._outcomes[key] = outcome
+        while len(self._outcomes) > self.maxsize:
+            self._outcomes.popitem(last=False)
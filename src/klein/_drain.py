@@ -0,0 +1,309 @@
+# -*- test-case-name: klein.test.test_drain -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Draining a server gracefully: when the reactor is asked to stop, whether by
+C{SIGTERM} or because a worker has handled enough requests or grown too
+large, stop accepting connections, let the requests in flight finish, and
+only then exit.
+"""
+
+import os
+import sys
+from typing import Any, Callable, List, Optional
+from weakref import WeakSet
+
+from twisted.internet.defer import (
+    Deferred,
+    DeferredList,
+    TimeoutError,
+    maybeDeferred,
+    succeed,
+)
+from twisted.internet.interfaces import IListeningPort
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web.iweb import IRequest
+
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:  # pragma: no cover
+    # Windows
+    haveRUsage = False
+else:
+    haveRUsage = True
+
+
+__all__ = ()
+
+
+# How often to check whether the connections closing after the last responses
+# have finished writing them, in seconds.
+_flushInterval = 0.05
+
+
+def currentRSS() -> int:
+    """
+    The resident set size of this process, in bytes, or 0 if it can't be
+    measured.
+
+    Where C{/proc} isn't available, this is the peak resident set size
+    instead.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):  # pragma: no cover
+        if not haveRUsage:
+            return 0
+        maxrss = getrusage(RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _closeAfterResponse(request: IRequest) -> None:
+    """
+    Close the connection of C{request} once it has been answered, rather
+    than keeping it alive for further requests.
+    """
+    request.setHeader(b"connection", b"close")
+    channel = getattr(request, "channel", None)
+    if channel is not None:
+        channel.persistent = False
+
+
+def _isClosing(transport: Any) -> bool:
+    """
+    Is C{transport} still connected, but closing once it has written what is
+    buffered for it?
+    """
+    return bool(
+        getattr(transport, "disconnecting", False)
+        and getattr(transport, "connected", False)
+    )
+
+
+class InFlight:
+    """
+    The requests being handled by the L{KleinResource}s of an application.
+
+    @ivar active: The number of requests which haven't finished yet.
+    @ivar handled: The number of requests which have finished.
+    @ivar draining: Whether the server is shutting down, so that new
+        requests on existing connections should close them once they're
+        answered.
+    """
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.handled = 0
+        self.draining = False
+        self._idle: List[Deferred[None]] = []
+        self._observers: List[Callable[["InFlight"], object]] = []
+        self._requests: "WeakSet[IRequest]" = WeakSet()
+        self._channels: "WeakSet[Any]" = WeakSet()
+
+    def started(self, request: IRequest) -> None:
+        """
+        Count C{request} as in flight, until L{InFlight.finished} is called
+        for it.
+        """
+        self.active += 1
+        self._requests.add(request)
+        channel = getattr(request, "channel", None)
+        if channel is not None:
+            self._channels.add(channel)
+        if self.draining:
+            _closeAfterResponse(request)
+
+    def drain(self) -> None:
+        """
+        Start draining: close the connection of each request in flight, and
+        of each request which starts from now on, once it's answered.
+        """
+        self.draining = True
+        for request in list(self._requests):
+            if not getattr(request, "finished", False):
+                _closeAfterResponse(request)
+
+    def closing(self) -> int:
+        """
+        The number of connections requests were made on which are closing,
+        but haven't finished writing what is buffered for them yet.
+        """
+        return sum(
+            1
+            for channel in list(self._channels)
+            if _isClosing(getattr(channel, "transport", None))
+        )
+
+    def finishedWith(self, request: IRequest) -> None:
+        """
+        Call L{InFlight.finished} for C{request} once it is finished, or its
+        connection is lost.
+        """
+        request.notifyFinish().addBoth(  # type: ignore[attr-defined]
+            self.finished
+        )
+
+    def finished(self, result: object = None) -> None:
+        """
+        Stop counting a request as in flight.
+        """
+        self.active -= 1
+        self.handled += 1
+        for observer in self._observers:
+            observer(self)
+        if not self.active:
+            idle, self._idle = self._idle, []
+            for waiting in idle:
+                waiting.callback(None)
+
+    def observe(self, observer: Callable[["InFlight"], object]) -> None:
+        """
+        Call C{observer} with this L{InFlight} whenever a request finishes.
+        """
+        self._observers.append(observer)
+
+    def idle(self) -> "Deferred[None]":
+        """
+        Wait for every request in flight to finish.
+        """
+        if not self.active:
+            return succeed(None)
+        waiting: Deferred[None] = Deferred(
+            lambda d: self._idle.remove(d)
+        )
+        self._idle.append(waiting)
+        return waiting
+
+
+class Drainer:
+    """
+    Drain a server before the reactor stops, and stop the reactor once the
+    server has handled C{maxRequests} requests or grown beyond C{maxRSS}
+    bytes, so that whatever supervises it can start a fresh one.
+
+    @ivar timeout: How long to wait for the requests in flight to finish, in
+        seconds, before shutting down regardless.
+    """
+
+    def __init__(
+        self,
+        reactor: Any,
+        inFlight: InFlight,
+        timeout: float = 30.0,
+        maxRequests: Optional[int] = None,
+        maxRSS: Optional[int] = None,
+        checkInterval: float = 5.0,
+        rss: Callable[[], int] = currentRSS,
+    ) -> None:
+        self._reactor = reactor
+        self._inFlight = inFlight
+        self.timeout = timeout
+        self._maxRequests = maxRequests
+        self._maxRSS = maxRSS
+        self._checkInterval = checkInterval
+        self._rss = rss
+        self._ports: List[IListeningPort] = []
+        self._checking: Optional[LoopingCall] = None
+        self._recycling = False
+
+    def listening(self, port: IListeningPort) -> IListeningPort:
+        """
+        Stop C{port} from accepting connections when draining.
+        """
+        self._ports.append(port)
+        return port
+
+    def start(self) -> None:
+        """
+        Drain before the reactor shuts down, and start watching the
+        thresholds.
+        """
+        self._reactor.addSystemEventTrigger("before", "shutdown", self.drain)
+        if self._maxRequests is not None:
+            self._inFlight.observe(self._checkRequests)
+        if self._maxRSS is not None:
+            self._checking = LoopingCall(self._checkRSS)
+            self._checking.clock = self._reactor
+            self._checking.start(self._checkInterval, now=False)
+
+    def _checkRequests(self, inFlight: InFlight) -> None:
+        assert self._maxRequests is not None
+        if inFlight.handled >= self._maxRequests:
+            self._recycle(f"handled {inFlight.handled} requests")
+
+    def _checkRSS(self) -> None:
+        assert self._maxRSS is not None
+        rss = self._rss()
+        if rss > self._maxRSS:
+            self._recycle(f"resident set size is {rss} bytes")
+
+    def _recycle(self, why: str) -> None:
+        if self._recycling:
+            return
+        self._recycling = True
+        log.msg(f"Recycling this server: {why}")
+        self._reactor.stop()
+
+    def drain(self) -> "Deferred[None]":
+        """
+        Stop accepting connections, wait for the requests in flight to
+        finish and for their connections to finish writing the responses, or
+        for L{Drainer.timeout} seconds to pass.
+        """
+        inFlight = self._inFlight
+        inFlight.drain()
+        deadline = self._reactor.seconds() + self.timeout
+        if self._checking is not None and self._checking.running:
+            self._checking.stop()
+        stopped = DeferredList(
+            [maybeDeferred(port.stopListening) for port in self._ports]
+        )
+
+        def waitForRequests(_: object) -> "Deferred[None]":
+            if inFlight.active:
+                log.msg(f"Waiting for {inFlight.active} requests to finish")
+            idle = inFlight.idle()
+            idle.addTimeout(self.timeout, self._reactor)
+            return idle
+
+        def timedOut(failure: Failure) -> None:
+            failure.trap(TimeoutError)
+            log.msg(
+                f"{inFlight.active} requests still in flight after "
+                f"{self.timeout} seconds; shutting down regardless"
+            )
+
+        def flush(_: object) -> "Deferred[None]":
+            # The last responses may still be in their transports' buffers, so
+            # let the reactor write them before it disconnects everything.
+            return self._flushed(deadline)
+
+        stopped.addCallback(waitForRequests).addErrback(timedOut)
+        return stopped.addCallback(flush)
+
+    def _flushed(self, deadline: float) -> "Deferred[None]":
+        """
+        Wait for the connections which are closing to finish writing, giving
+        the reactor at least one turn, until C{deadline}.
+        """
+        flushed: Deferred[None] = Deferred()
+
+        def check() -> None:
+            closing = self._inFlight.closing()
+            if not closing:
+                flushed.callback(None)
+            elif self._reactor.seconds() >= deadline:
+                log.msg(
+                    f"{closing} connections still writing after "
+                    f"{self.timeout} seconds; shutting down regardless"
+                )
+                flushed.callback(None)
+            else:
+                self._reactor.callLater(_flushInterval, check)
+
+        self._reactor.callLater(0, check)
+        return flushed
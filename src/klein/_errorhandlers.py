@@ -0,0 +1,119 @@
+# -*- test-case-name: klein.test.test_errorhandlers -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Lookup of the error handlers registered with L{Klein.handle_errors}.
+
+Handlers are tried in registration order, each one only if the failure it
+would be given matches one of the exception types it was registered for, as
+determined by L{Failure.check}.  Rather than asking every handler in turn,
+L{ErrorHandlerTable} indexes the handlers by the exceptions they handle and,
+for each exception type it sees, computes the ordered indexes of the handlers
+that apply to it by walking the type's MRO.
+"""
+
+from bisect import bisect_right
+from collections import defaultdict
+from inspect import isclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from twisted.python.failure import Failure
+from twisted.python.reflect import qual
+
+
+if TYPE_CHECKING:
+    # NB: circular import, must not be imported at runtime.
+    from ._app import ErrorMethods, KleinErrorMethod
+
+
+__all__ = ()
+
+
+def _checkKey(exception: Any) -> Hashable:
+    """
+    Compute the value that L{Failure.check} looks for among a failure's
+    C{parents} when asked about C{exception}.
+    """
+    if isclass(exception) and issubclass(exception, Exception):
+        return qual(exception)
+    return exception  # type: ignore[no-any-return]
+
+
+class ErrorHandlerTable:
+    """
+    An index of a list of error handlers by the exception types they handle.
+
+    The table is rebuilt whenever it is used with a different list of
+    handlers, or handlers have been added to its list since it was built.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: Optional["ErrorMethods"] = None
+        self._count = -1
+        self._byKey: Dict[Hashable, List[int]] = {}
+        self._byType: Dict[type, Tuple[int, ...]] = {}
+
+    def _compile(self, handlers: "ErrorMethods") -> None:
+        byKey: Dict[Hashable, List[int]] = defaultdict(list)
+        for index, (exceptions, handler) in enumerate(handlers):
+            for exception in exceptions:
+                indexes = byKey[_checkKey(exception)]
+                if not indexes or indexes[-1] != index:
+                    indexes.append(index)
+        self._handlers = handlers
+        self._count = len(handlers)
+        self._byKey = dict(byKey)
+        self._byType = {}
+
+    def candidates(
+        self, handlers: "ErrorMethods", exceptionType: type
+    ) -> Tuple[int, ...]:
+        """
+        Get the indexes, in ascending order, of the handlers in C{handlers}
+        that apply to failures of type C{exceptionType}.
+        """
+        if handlers is not self._handlers or len(handlers) != self._count:
+            self._compile(handlers)
+
+        found = self._byType.get(exceptionType)
+        if found is None:
+            merged: Set[int] = set()
+            for parent in exceptionType.__mro__:
+                merged.update(self._byKey.get(qual(parent), ()))
+            found = self._byType[exceptionType] = tuple(sorted(merged))
+        return found
+
+    def nextHandler(
+        self, handlers: "ErrorMethods", failure: Failure, after: int = -1
+    ) -> Optional[Tuple[int, "KleinErrorMethod"]]:
+        """
+        Find the first handler after index C{after} in C{handlers} that applies
+        to C{failure}.
+
+        @return: The handler's index and the handler, or L{None} if no
+            remaining handler applies.
+        """
+        exceptionType = failure.type
+        if not isinstance(exceptionType, type):
+            # Not something we can index; ask each handler the slow way.
+            for index in range(after + 1, len(handlers)):
+                exceptions, handler = handlers[index]
+                if failure.check(*exceptions):
+                    return index, handler
+            return None
+
+        indexes = self.candidates(handlers, exceptionType)
+        position = bisect_right(indexes, after)
+        if position == len(indexes):
+            return None
+        index = indexes[position]
+        return index, handlers[index][1]
@@ -1,6 +1,5 @@
 # -*- test-case-name: klein.test.test_form -*-
 
-import json
 from typing import (
     Any,
     AnyStr,
@@ -30,6 +29,13 @@ from twisted.web.template import Element, Tag, TagLoader, tags
 
 from ._app import KleinRenderable, _call
 from ._decorators import bindable
+from ._jsoncodec import parsedJSONBody
+from ._multipart import (
+    IMultipartForm,
+    MultipartLimits,
+    UploadedFile,
+    parseMultipart,
+)
 from ._typing_compat import Protocol
 from .interfaces import (
     EarlyExit,
@@ -90,13 +96,28 @@ def textConverter(value: AnyStr) -> str:
         return value
 
 
-class IParsedJSONBody(Interface):
+def fileConverter(value: Any) -> UploadedFile:
     """
-    Marker interface for the dict parsed from the request body's JSON contents.
+    Converter for uploaded files, which are passed on as they are.
     """
+    return cast(UploadedFile, value)
+
 
-    # TODO: how to allow applications to pass options to loads, such as
-    # parse_float?
+def _formValue(request: IRequest, name: str) -> Optional[str]:
+    """
+    The first value of the key/value form field called C{name}, whether
+    Twisted parsed it into C{request.args} or it's in a multipart body
+    parsed by L{parseMultipart}.
+    """
+    allValues = request.args.get(name.encode("utf-8"))
+    if allValues:
+        return cast(str, allValues[0].decode("utf-8"))
+    multipart = cast(Componentized, request).getComponent(IMultipartForm)
+    if multipart is not None:
+        part = multipart.get(name)
+        if part is not None:
+            return cast(str, part.text())
+    return None
 
 
 @implementer(IRequiredParameter)
@@ -106,6 +127,8 @@ class Field:
     A L{Field} is a static part of a L{Form}.
 
     @ivar converter: The converter.
+    @ivar maxSize: The largest value, in bytes, that this field accepts in a
+        multipart body, if not the default of L{MultipartLimits}.
     """
 
     converter: Callable[[str], Any]
@@ -118,6 +141,7 @@ class Field:
     noLabel: bool = False
     value: str = ""
     error: Optional[ValidationError] = None
+    maxSize: Optional[int] = None
 
     # IRequiredParameter
     def registerInjector(
@@ -197,33 +221,30 @@ class Field:
         In the case of key/value form posts, this attempts to reliably make the
         value into str.  In the case of a JSON post, however, it will simply
         extract the value from the top-level dictionary, which means it could
-        be any arrangement of JSON-serializiable objects.
+        be any arrangement of JSON-serializiable objects.  The body is parsed
+        only once per request, with the application's L{JSONCodec}.
+
+        File fields extract an L{UploadedFile} from a multipart body.
         """
         fieldName = self.formFieldName
         if fieldName is None:
             raise ValueError("Cannot extract unnamed form field.")
+        if self.formInputType == "file":
+            multipart = cast(Componentized, request).getComponent(
+                IMultipartForm
+            )
+            if multipart is None:
+                return None
+            return multipart.get(fieldName)
         contentType = request.getHeader(b"content-type")
         if contentType is not None and contentType.startswith(
             b"application/json"
         ):
-            # TODO: parse only once, please.
-            parsed = cast(Componentized, request).getComponent(IParsedJSONBody)
-            if parsed is None:
-                request.content.seek(0)
-                octets = request.content.read()
-                characters = octets.decode("utf-8")
-                parsed = json.loads(characters)
-                cast(Componentized, request).setComponent(
-                    IParsedJSONBody, parsed
-                )
-            if fieldName not in parsed:
+            parsed = parsedJSONBody(request)
+            if not isinstance(parsed, dict) or fieldName not in parsed:
                 return None
             return parsed[fieldName]
-        allValues = request.args.get(fieldName.encode("utf-8"))
-        if allValues:
-            return allValues[0].decode("utf-8")
-        else:
-            return None
+        return _formValue(request, fieldName)
 
     def validateValue(self, value: Any) -> Any:
         """
@@ -334,6 +355,22 @@ class Field:
 
         return cls(converter=bounded_number, formInputType="number", **kw)
 
+    @classmethod
+    def file(cls, maxSize: int = 16 * 1024 * 1024, **kw: Any) -> "Field":
+        """
+        A field for an uploaded file, no larger than C{maxSize} bytes, which
+        is passed to the handler as an L{UploadedFile}.
+
+        Uploads are parsed from C{multipart/form-data} bodies, and larger
+        ones are kept in temporary files rather than in memory; see
+        L{klein._multipart}.  The body is parsed only once it has been
+        buffered, so C{maxSize} applies after all of it has been received;
+        set C{max_body_size} on the route to refuse larger bodies sooner.
+        """
+        return cls(
+            converter=fileConverter, formInputType="file", maxSize=maxSize, **kw
+        )
+
     @classmethod
     def submit(cls, value: str) -> "Field":
         """
@@ -395,9 +432,13 @@ class RenderableForm:
         """
         anySubmit = False
         for field in self._form.fields:
+            value = field.value
+            if field.formInputType != "file":
+                # Browsers don't let pages fill in file inputs.
+                value = self.prevalidationValues.get(field, value)
             yield attr.evolve(
                 field,
-                value=self.prevalidationValues.get(field, field.value),
+                value=value,
                 error=self.validationErrors.get(field, None),
             )
             if field.formInputType == "submit":
@@ -696,9 +737,7 @@ def checkCSRF(request: IRequest) -> None:
             return
         # We have a session, we weren't authenticated by a header... time to
         # check that token.
-        token = request.args.get(CSRF_PROTECTION.encode("ascii"), [b""])[
-            0
-        ].decode("ascii")
+        token = _formValue(request, CSRF_PROTECTION) or ""
         if token == session.identifier:
             # The token matches.  We're OK.
             return
@@ -716,6 +755,25 @@ class Form:
 
     fields: Sequence[Field]
 
+    def multipartLimits(self) -> MultipartLimits:
+        """
+        The limits on multipart bodies submitted to this form: each field's
+        own C{maxSize}, and a total large enough for all of them.
+        """
+        partSizes = {
+            field.formFieldName: field.maxSize
+            for field in self.fields
+            if field.formFieldName is not None and field.maxSize is not None
+        }
+        defaults = MultipartLimits()
+        return MultipartLimits(
+            maxTotalSize=max(
+                defaults.maxTotalSize,
+                sum(partSizes.values()) + defaults.maxPartSize,
+            ),
+            partSizes=partSizes,
+        )
+
     @staticmethod
     def onValidationFailureFor(
         handler: _requirerFunctionWithForm,
@@ -773,6 +831,7 @@ class Form:
         prevalidationValues = {}
         arguments = {}
 
+        parseMultipart(request, self.multipartLimits())
         checkCSRF(request)
 
         for field in self.fields:
@@ -0,0 +1,283 @@
+# -*- test-case-name: klein.test.test_instrumentation -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Per-stage timing of requests.
+
+Once an observer has been added with L{klein.Klein.instrument}, each request
+to the application gets a L{RequestTimings}, to which L{KleinResource},
+L{klein.Requirer} and L{klein.Plating} add a timestamp as they finish each
+stage of handling it.  Once the request is finished, every observer is
+called with its L{RequestTimings}.
+
+L{StageHistograms} is an observer which aggregates the timings into
+histograms per route and stage, and can present them in Prometheus' text
+format.
+"""
+
+from bisect import bisect_left
+from time import perf_counter, thread_time
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+from twisted.python import log
+from twisted.web.iweb import IRequest
+from twisted.web.server import Request
+
+from ._interfaces import IKleinRequest
+
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ._app import Klein, KleinRenderable
+
+
+__all__ = ()
+
+
+# The stages of handling a request, each named for the timestamp which ends
+# it, in the order they happen.
+URL = "url"  # Extracting and decoding the parts of the URL.
+MATCH = "match"  # Matching the URL to a route.
+PREPARE = "prepare"  # Running a Requirer's prerequisites.
+INJECT = "inject"  # Injecting a Requirer's required parameters.
+DATA = "data"  # Running a Plating route's method.
+PLATING = "plating"  # Serializing JSON, or setting up a template.
+HANDLER = "handler"  # The rest of the route handler, until its result.
+RENDER = "render"  # Rendering a resource, stream or Element, if unfinished.
+FINISH = "finish"  # Writing the response, until the request is finished.
+
+TOTAL = "total"
+"""
+The pseudo-stage which L{StageHistograms} uses for whole requests.
+"""
+
+UNMATCHED = "<unmatched>"
+"""
+The route name used for requests which didn't match a route.
+"""
+
+
+class RequestTimings:
+    """
+    When each stage of handling a request ended.
+
+    @ivar endpoint: The endpoint of the matched route, if any.
+    @ivar method: The request method.
+    @ivar code: The response code, once the request is finished.
+    @ivar marks: The name of each stage, with the wall clock time
+        (L{time.perf_counter}) and thread CPU time (L{time.thread_time}) at
+        which it ended, starting with C{"start"}.
+    """
+
+    __slots__ = ("endpoint", "method", "code", "marks")
+
+    def __init__(self, method: bytes) -> None:
+        self.endpoint: Optional[str] = None
+        self.method = method
+        self.code: Optional[int] = None
+        self.marks: List[Tuple[str, float, float]] = [
+            ("start", perf_counter(), thread_time())
+        ]
+
+    def mark(self, stage: str) -> None:
+        """
+        Record the end of C{stage}.
+        """
+        self.marks.append((stage, perf_counter(), thread_time()))
+
+    def stages(self) -> Iterator[Tuple[str, float, float]]:
+        """
+        The name, wall clock duration and thread CPU duration, in seconds,
+        of each stage.
+        """
+        marks = self.marks
+        for (_, wall, cpu), (stage, endWall, endCPU) in zip(marks, marks[1:]):
+            yield stage, endWall - wall, endCPU - cpu
+
+    def total(self) -> Tuple[float, float]:
+        """
+        The wall clock and thread CPU durations of the whole request, so far.
+        """
+        _, startWall, startCPU = self.marks[0]
+        _, endWall, endCPU = self.marks[-1]
+        return endWall - startWall, endCPU - startCPU
+
+
+TimingObserver = Callable[[RequestTimings], object]
+
+
+def requestTimings(request: IRequest) -> Optional[RequestTimings]:
+    """
+    The L{RequestTimings} of C{request}, if its application is instrumented.
+    """
+    return getattr(IKleinRequest(request, None), "timings", None)
+
+
+def deliverTimings(
+    timings: RequestTimings,
+    request: IRequest,
+    observers: Sequence[TimingObserver],
+) -> None:
+    """
+    Record the end of a finished request, and give its timings to
+    C{observers}.
+    """
+    timings.mark(FINISH)
+    timings.code = cast(Request, request).code
+    for observer in observers:
+        try:
+            observer(timings)
+        except Exception:
+            log.err(None, "Error in request timing observer")
+
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+"""
+The default upper bounds of the buckets of L{StageHistograms}, in seconds.
+"""
+
+
+class _Histogram:
+    __slots__ = ("counts", "wall", "cpu")
+
+    def __init__(self, size: int) -> None:
+        self.counts = [0] * size
+        self.wall = 0.0
+        self.cpu = 0.0
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class StageHistograms:
+    """
+    A L{TimingObserver} which counts the wall clock durations of each stage
+    of the requests to each route in fixed buckets, and adds up their wall
+    clock and CPU durations.
+
+    Memory is bounded: there is one histogram per route and stage, and once
+    there are C{maxSeries} of them, further routes are counted together
+    under the route name C{"<other>"}.
+
+    @ivar buckets: The upper bounds of the buckets, in seconds, in
+        ascending order; a last bucket counts everything slower.
+    """
+
+    def __init__(
+        self,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        maxSeries: int = 1000,
+    ) -> None:
+        self.buckets = tuple(buckets)
+        self._maxSeries = maxSeries
+        self._histograms: Dict[Tuple[str, str], _Histogram] = {}
+
+    def __call__(self, timings: RequestTimings) -> None:
+        route = timings.endpoint or UNMATCHED
+        for stage, wall, cpu in timings.stages():
+            self._observe(route, stage, wall, cpu)
+        self._observe(route, TOTAL, *timings.total())
+
+    def _observe(self, route: str, stage: str, wall: float, cpu: float) -> None:
+        histograms = self._histograms
+        histogram = histograms.get((route, stage))
+        if histogram is None:
+            if len(histograms) >= self._maxSeries:
+                route = "<other>"
+            histogram = histograms.get((route, stage))
+            if histogram is None:
+                histogram = histograms[route, stage] = _Histogram(
+                    len(self.buckets) + 1
+                )
+        histogram.counts[bisect_left(self.buckets, wall)] += 1
+        histogram.wall += wall
+        histogram.cpu += cpu
+
+    def snapshot(self) -> Dict[Tuple[str, str], Tuple[List[int], float, float]]:
+        """
+        The bucket counts, total wall clock time and total CPU time of each
+        route and stage.
+        """
+        return {
+            key: (list(histogram.counts), histogram.wall, histogram.cpu)
+            for key, histogram in self._histograms.items()
+        }
+
+    def exposition(self) -> bytes:
+        """
+        The histograms in the Prometheus text exposition format.
+        """
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        lines = [
+            "# HELP klein_request_stage_seconds Wall clock time spent in "
+            "each stage of handling requests.",
+            "# TYPE klein_request_stage_seconds histogram",
+        ]
+        cpuLines = [
+            "# HELP klein_request_stage_cpu_seconds_total Thread CPU time "
+            "spent in each stage of handling requests.",
+            "# TYPE klein_request_stage_cpu_seconds_total counter",
+        ]
+        for (route, stage), histogram in sorted(self._histograms.items()):
+            labels = f'route="{_label(route)}",stage="{_label(stage)}"'
+            cumulative = 0
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(
+                    "klein_request_stage_seconds_bucket"
+                    f'{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f"klein_request_stage_seconds_sum{{{labels}}} "
+                f"{histogram.wall!r}"
+            )
+            lines.append(
+                f"klein_request_stage_seconds_count{{{labels}}} {cumulative}"
+            )
+            cpuLines.append(
+                f"klein_request_stage_cpu_seconds_total{{{labels}}} "
+                f"{histogram.cpu!r}"
+            )
+        return "\n".join(lines + cpuLines + [""]).encode("utf-8")
+
+
+def exposeMetrics(
+    app: "Klein", histograms: StageHistograms, url: str = "/metrics"
+) -> None:
+    """
+    Add a route to C{app} at C{url} which presents C{histograms} in the
+    Prometheus text exposition format.
+    """
+
+    def metrics(request: IRequest) -> "KleinRenderable":
+        request.setHeader(
+            b"content-type", b"text/plain; version=0.0.4; charset=utf-8"
+        )
+        return histograms.exposition()
+
+    app.route(url, endpoint=f"metrics:{url}")(metrics)
@@ -18,6 +18,18 @@ KleinQueryValue = Union[str, int, float]
 class IKleinRequest(Interface):
     branch_segments = Attribute("Segments consumed by a branch route.")
     mapper = Attribute("L{werkzeug.routing.MapAdapter}")
+    timings = Attribute(
+        "The L{klein.instrumentation.RequestTimings} of the request, if its "
+        "application is instrumented."
+    )
+    body_fount = Attribute(
+        "The C{IFount} of the request body, if its route has "
+        "C{stream_body=True}."
+    )
+    json_codec = Attribute(
+        "The L{klein._jsoncodec.JSONCodec} of the application routing the "
+        "request."
+    )
 
     def url_for(
         endpoint: str,
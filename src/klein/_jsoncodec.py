@@ -0,0 +1,176 @@
+# -*- test-case-name: klein.test.test_jsoncodec -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Encoding and decoding JSON with a codec chosen by the application.
+
+Klein encodes JSON for L{klein.Plating}, for L{klein.Response} bodies which
+are lists or dicts, and for the profiler's listing, and decodes JSON request
+bodies for L{klein.Form}s.  It does all of that with the L{JSONCodec} of the
+application the request is routed by, which is the standard library's
+L{json} module unless L{klein.Klein.use_json_codec} chooses another one.
+
+Codecs for C{orjson} and C{ujson} are registered if they can be imported;
+L{fastestCodec} is the fastest of them that is.
+"""
+
+import json
+from typing import Any, Callable, Dict, Optional, Union, cast
+
+import attr
+from werkzeug.exceptions import BadRequest
+from zope.interface import Interface
+
+from twisted.python.components import Componentized
+from twisted.web.iweb import IRequest
+
+from ._interfaces import IKleinRequest
+
+
+__all__ = ()
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class JSONCodec:
+    """
+    A way of encoding values as JSON and decoding them again.
+
+    @ivar name: The name the codec is registered under.
+    @ivar dumps: Encode a JSON-serializable value as UTF-8 bytes.
+    @ivar loads: Decode UTF-8 bytes, raising L{ValueError} if they aren't
+        valid JSON.
+    """
+
+    name: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+def _stdlibDumps(value: Any) -> bytes:
+    return json.dumps(value).encode("utf-8")
+
+
+STDLIB_JSON = JSONCodec("json", _stdlibDumps, json.loads)
+
+_codecs: Dict[str, JSONCodec] = {}
+
+# The names of the codecs fastestCodec prefers, fastest first.
+_fastest = ["orjson", "ujson", "json"]
+
+
+def registerCodec(codec: JSONCodec) -> JSONCodec:
+    """
+    Make C{codec} available by name to L{Klein.use_json_codec}, replacing
+    any codec registered under the same name.
+
+    @return: C{codec}
+    """
+    _codecs[codec.name] = codec
+    return codec
+
+
+def availableCodecs() -> Dict[str, JSONCodec]:
+    """
+    The registered codecs, by name.
+    """
+    return dict(_codecs)
+
+
+def fastestCodec() -> JSONCodec:
+    """
+    The fastest of the codecs which could be imported.
+    """
+    for name in _fastest:
+        if name in _codecs:
+            return _codecs[name]
+    return STDLIB_JSON
+
+
+def lookupCodec(codec: Union[str, JSONCodec]) -> JSONCodec:
+    """
+    The codec C{codec} names, or C{codec} itself.
+
+    @raise ValueError: If no codec is registered by that name.
+    """
+    if isinstance(codec, JSONCodec):
+        return codec
+    try:
+        return _codecs[codec]
+    except KeyError:
+        raise ValueError(f"No JSON codec named {codec!r} is available")
+
+
+registerCodec(STDLIB_JSON)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    pass
+else:
+    registerCodec(JSONCodec("orjson", orjson.dumps, orjson.loads))
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    pass
+else:  # pragma: no cover
+
+    def _ujsonDumps(value: Any) -> bytes:
+        return cast(bytes, ujson.dumps(value, ensure_ascii=False).encode())
+
+    registerCodec(JSONCodec("ujson", _ujsonDumps, ujson.loads))
+
+
+def requestCodec(request: IRequest) -> JSONCodec:
+    """
+    The codec of the application routing C{request}, or L{STDLIB_JSON} if
+    it isn't being routed by one.
+    """
+    kleinRequest = IKleinRequest(request, None)
+    return cast(JSONCodec, getattr(kleinRequest, "json_codec", STDLIB_JSON))
+
+
+class IParsedJSONBody(Interface):
+    """
+    Marker interface for the L{ParsedBody} of a request's JSON contents.
+    """
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ParsedBody:
+    """
+    The outcome of parsing a request's body as JSON.
+
+    @ivar value: The value, if it was parsed.
+    @ivar error: Why it couldn't be, if it couldn't.
+    """
+
+    value: Any = None
+    error: Optional[str] = None
+
+
+def parsedJSONBody(request: IRequest) -> Any:
+    """
+    The value of C{request}'s JSON body, decoded with L{requestCodec} the
+    first time it's asked for; later calls return the same value.
+
+    @raise BadRequest: If the body isn't valid JSON.
+    """
+    componentized = cast(Componentized, request)
+    parsed: Optional[ParsedBody] = componentized.getComponent(IParsedJSONBody)
+    if parsed is None:
+        content = request.content
+        if content is None:
+            octets = b""
+        else:
+            content.seek(0)
+            octets = content.read()
+            content.seek(0)
+        try:
+            parsed = ParsedBody(value=requestCodec(request).loads(octets))
+        except ValueError as e:
+            parsed = ParsedBody(error=f"The request body isn't JSON: {e}")
+        componentized.setComponent(IParsedJSONBody, parsed)
+    if parsed.error is not None:
+        raise BadRequest(parsed.error)
+    return parsed.value
@@ -0,0 +1,170 @@
+# -*- test-case-name: klein.test.test_limits -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Limiting how many requests to a route are handled at once.
+
+A route given C{max_concurrency} gets a L{ConcurrencyLimit}, which
+L{KleinResource} consults before running its handler.  Requests beyond the
+limit wait, in the order they arrived, for one of those being handled to
+finish; those which would make the queue longer than C{max_queue}, or which
+wait longer than C{queue_timeout} seconds, are answered at once with a 503
+and a C{Retry-After} header, without running the handler.  This stops one
+slow route from holding every connection the server can handle.
+"""
+
+from collections import deque
+from math import ceil
+from typing import Any, Deque, Optional
+
+import attr
+from werkzeug.exceptions import ServiceUnavailable
+
+from twisted.internet.defer import Deferred
+
+
+__all__ = ()
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class LimitStats:
+    """
+    A snapshot of the activity of a L{ConcurrencyLimit}.
+
+    @ivar maxConcurrency: The most requests handled at once.
+    @ivar active: The number of requests being handled now.
+    @ivar queued: The number of requests waiting now.
+    @ivar admitted: The number of requests which have been handled, or are
+        being handled.
+    @ivar rejected: The number of requests refused because the queue was
+        full.
+    @ivar timedOut: The number of requests refused because they waited too
+        long.
+    @ivar cancelled: The number of requests whose clients went away while
+        they waited.
+    """
+
+    maxConcurrency: int
+    active: int
+    queued: int
+    admitted: int
+    rejected: int
+    timedOut: int
+    cancelled: int
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _Waiter:
+    admitted: "Deferred[None]"
+    timeout: Any = None
+
+
+class ConcurrencyLimit:
+    """
+    The limit on the number of requests to a route handled at once.
+
+    @ivar maxConcurrency: The most requests handled at once.
+    @ivar maxQueue: The most requests which may wait.
+    @ivar queueTimeout: The most seconds a request may wait.
+    @ivar clock: The L{IReactorTime} timing out waiting requests; the global
+        reactor, unless another is given.
+    """
+
+    def __init__(
+        self,
+        maxConcurrency: int,
+        maxQueue: int = 0,
+        queueTimeout: float = 5.0,
+        clock: Any = None,
+    ) -> None:
+        if maxConcurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.maxConcurrency = maxConcurrency
+        self.maxQueue = maxQueue
+        self.queueTimeout = queueTimeout
+        self.clock = clock
+        self._waiting: Deque[_Waiter] = deque()
+        self._active = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._timedOut = 0
+        self._cancelled = 0
+
+    def stats(self) -> LimitStats:
+        """
+        Report how busy the route is, and has been.
+        """
+        return LimitStats(
+            self.maxConcurrency,
+            self._active,
+            len(self._waiting),
+            self._admitted,
+            self._rejected,
+            self._timedOut,
+            self._cancelled,
+        )
+
+    def acquire(self) -> "Optional[Deferred[None]]":
+        """
+        Admit a request, if there's room for it.
+
+        @return: L{None} if the request may be handled now, or a L{Deferred}
+            firing when it may be, or failing with L{ServiceUnavailable} if
+            it may not.  Cancelling the L{Deferred} gives up its place in the
+            queue.  Each admitted request must be L{released
+            <ConcurrencyLimit.release>} once it's finished.
+
+        @raise ServiceUnavailable: If the queue is full.
+        """
+        if self._active < self.maxConcurrency:
+            self._active += 1
+            self._admitted += 1
+            return None
+        if len(self._waiting) >= self.maxQueue:
+            self._rejected += 1
+            raise self._unavailable("Too many requests are waiting")
+
+        def cancel(admitted: "Deferred[None]") -> None:
+            self._waiting.remove(waiter)
+            waiter.timeout.cancel()
+            self._cancelled += 1
+
+        waiter = _Waiter(Deferred(cancel))
+        clock = self.clock
+        if clock is None:
+            from twisted.internet import reactor as clock
+        waiter.timeout = clock.callLater(
+            self.queueTimeout, self._timedOutWaiting, waiter
+        )
+        self._waiting.append(waiter)
+        return waiter.admitted
+
+    def release(self) -> None:
+        """
+        An admitted request has finished: admit the next one waiting, if any.
+        """
+        if self._waiting:
+            waiter = self._waiting.popleft()
+            waiter.timeout.cancel()
+            self._admitted += 1
+            waiter.admitted.callback(None)
+        else:
+            self._active -= 1
+
+    def _timedOutWaiting(self, waiter: _Waiter) -> None:
+        """
+        C{waiter} has waited too long.
+        """
+        self._waiting.remove(waiter)
+        self._timedOut += 1
+        waiter.admitted.errback(
+            self._unavailable("Timed out waiting for earlier requests")
+        )
+
+    def _unavailable(self, description: str) -> ServiceUnavailable:
+        """
+        The error with which requests are refused.
+        """
+        return ServiceUnavailable(
+            description, retry_after=max(1, ceil(self.queueTimeout))
+        )
@@ -0,0 +1,524 @@
+# -*- test-case-name: klein.test.test_multipart -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Parsing C{multipart/form-data} request bodies incrementally.
+
+Twisted parses uploads into C{request.args}, holding every file in memory as
+C{bytes}.  L{MultipartParser} instead parses a body as it's fed to it, a
+chunk at a time, writing each part to an L{UploadedFile} which is kept in
+memory only until it grows larger than C{spoolThreshold}, and enforcing
+L{MultipartLimits} as it goes rather than once it has the whole body.
+
+L{klein.Form}s parse multipart bodies with L{parseMultipart}, which feeds a
+parser from C{request.content}.  Where Twisted supports it, L{klein.Klein.run}
+keeps Twisted from parsing them too, by constructing its
+L{twisted.web.server.Site} with C{parsePOSTFormSubmission=False} and
+L{FormRequest}, which parses them once instead, and still puts their text
+fields and URL-encoded bodies into C{request.args}.
+
+Either way, the parser is fed from C{request.content}, which Twisted has
+already buffered, so L{MultipartLimits} are applied to the body only after
+all of it has been received: they bound what is parsed, not what is read.
+To refuse large bodies before they're read, give the route a
+C{max_body_size}.
+"""
+
+import mmap
+import sys
+from email.message import Message
+from email.parser import HeaderParser
+from email.utils import collapse_rfc2231_value
+from inspect import signature
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, Dict, Iterator, List, Mapping, Optional, cast
+
+import attr
+from werkzeug.exceptions import (
+    BadRequest,
+    HTTPException,
+    RequestEntityTooLarge,
+)
+from zope.interface import Interface
+
+from twisted.python.components import Componentized
+from twisted.web.http import parse_qs
+from twisted.web.iweb import IRequest
+from twisted.web.server import Request, Site
+
+
+__all__ = ()
+
+
+_CRLF = b"\r\n"
+_chunkSize = 64 * 1024
+_spoolThreshold = 512 * 1024
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class MultipartLimits:
+    """
+    Limits on what a L{MultipartParser} accepts.
+
+    @ivar spoolThreshold: The size, in bytes, beyond which a part is written
+        to a temporary file rather than kept in memory.
+    @ivar maxPartSize: The largest part, in bytes, for fields not in
+        C{partSizes}.
+    @ivar maxTotalSize: The largest body, in bytes.
+    @ivar maxHeaderSize: The largest block of headers of a part, in bytes.
+    @ivar maxParts: The most parts in a body.
+    @ivar partSizes: The largest part, in bytes, for particular fields.
+    """
+
+    spoolThreshold: int = _spoolThreshold
+    maxPartSize: int = 1024 * 1024
+    maxTotalSize: int = 64 * 1024 * 1024
+    maxHeaderSize: int = 16 * 1024
+    maxParts: int = 1000
+    partSizes: Mapping[str, int] = attr.ib(factory=dict, hash=False)
+
+    def sizeFor(self, name: str) -> int:
+        """
+        The largest part, in bytes, for the field called C{name}.
+        """
+        return self.partSizes.get(name, self.maxPartSize)
+
+
+class UploadedFile:
+    """
+    A part of a C{multipart/form-data} body, such as an uploaded file.
+
+    It's a readable file, which is positioned at the start once the body
+    has been parsed.
+
+    @ivar name: The name of the form field.
+    @ivar filename: The name of the uploaded file, if the client gave one.
+    @ivar contentType: The media type of the part.
+    @ivar size: The size of the part, in bytes.
+    @ivar file: The L{SpooledTemporaryFile} holding the part.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        filename: Optional[str] = None,
+        contentType: str = "text/plain",
+        spoolThreshold: int = _spoolThreshold,
+    ) -> None:
+        self.name = name
+        self.filename = filename
+        self.contentType = contentType
+        self.size = 0
+        self.file: IO[bytes] = cast(
+            IO[bytes], SpooledTemporaryFile(spoolThreshold)
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"<UploadedFile {self.name!r} filename={self.filename!r} "
+            f"size={self.size}>"
+        )
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.file.readline(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.file)
+
+    @property
+    def closed(self) -> bool:
+        return self.file.closed
+
+    def close(self) -> None:
+        self.file.close()
+
+    def text(self, encoding: str = "utf-8") -> str:
+        """
+        The whole of the part, decoded.
+        """
+        self.file.seek(0)
+        try:
+            return self.file.read().decode(encoding)
+        finally:
+            self.file.seek(0)
+
+    def mmap(self) -> mmap.mmap:
+        """
+        Map the part into memory read-only, writing it to its temporary file
+        first if it's still held in memory, so that large files may be
+        processed without reading them.
+
+        @raise ValueError: If the part is empty, since empty files can't be
+            mapped.
+        """
+        file = cast(Any, self.file)
+        file.rollover()
+        file.flush()
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_PREAMBLE = "preamble"
+_DELIMITED = "delimited"
+_HEADERS = "headers"
+_BODY = "body"
+_DONE = "done"
+
+
+class MultipartParser:
+    """
+    A parser of C{multipart/form-data} bodies, fed a chunk at a time.
+
+    @ivar parts: The parts parsed so far.
+    """
+
+    def __init__(
+        self, boundary: bytes, limits: MultipartLimits = MultipartLimits()
+    ) -> None:
+        self._limits = limits
+        self._delimiter = _CRLF + b"--" + boundary
+        # The first delimiter needn't follow a line break, so pretend that
+        # one came first.
+        self._buffer = bytearray(_CRLF)
+        self._state = _PREAMBLE
+        self._received = 0
+        self._part: Optional[UploadedFile] = None
+        self.parts: List[UploadedFile] = []
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the closing delimiter has been parsed.
+        """
+        return self._state == _DONE
+
+    def feed(self, data: bytes) -> None:
+        """
+        Parse the next chunk of the body.
+
+        @raise BadRequest: If the body is malformed.
+        @raise RequestEntityTooLarge: If the body, a part, or a part's headers
+            are too large.
+        """
+        self._received += len(data)
+        if self._received > self._limits.maxTotalSize:
+            raise RequestEntityTooLarge("The form is too large")
+        if self._state == _DONE:
+            # Ignore the epilogue.
+            return
+        self._buffer += data
+        while self._step():
+            pass
+
+    def close(self) -> List[UploadedFile]:
+        """
+        The body is complete.
+
+        @return: Its parts, each positioned at its start.
+
+        @raise BadRequest: If the body was cut short.
+        """
+        if self._state != _DONE:
+            raise BadRequest("The form was truncated")
+        for part in self.parts:
+            part.seek(0)
+        return self.parts
+
+    def abort(self) -> None:
+        """
+        Discard the parts parsed so far.
+        """
+        for part in self.parts:
+            part.close()
+        self._state = _DONE
+
+    def _step(self) -> bool:
+        """
+        Parse as much of the buffer as the current state can.
+
+        @return: Whether to continue, in a new state.
+        """
+        buffer = self._buffer
+        if self._state == _PREAMBLE or self._state == _BODY:
+            found = buffer.find(self._delimiter)
+            if found < 0:
+                # Keep anything which could be the start of a delimiter.
+                keep = len(self._delimiter) - 1
+                if len(buffer) > keep:
+                    self._consume(len(buffer) - keep)
+                return False
+            self._consume(found)
+            del buffer[: len(self._delimiter)]
+            self._part = None
+            self._state = _DELIMITED
+            return True
+        if self._state == _DELIMITED:
+            if len(buffer) < 2:
+                return False
+            if buffer.startswith(b"--"):
+                self._state = _DONE
+                buffer.clear()
+                return False
+            end = buffer.find(_CRLF)
+            if end < 0:
+                self._checkHeaderSize(len(buffer))
+                return False
+            if buffer[:end].strip(b" \t"):
+                raise BadRequest("Malformed multipart delimiter")
+            del buffer[: end + 2]
+            self._state = _HEADERS
+            return True
+        if self._state == _HEADERS:
+            if buffer.startswith(_CRLF):
+                end, headers = 0, b""
+            else:
+                end = buffer.find(_CRLF + _CRLF)
+                if end < 0:
+                    self._checkHeaderSize(len(buffer))
+                    return False
+                self._checkHeaderSize(end)
+                headers = bytes(buffer[:end])
+                end += 2
+            del buffer[: end + 2]
+            self._startPart(headers)
+            self._state = _BODY
+            return True
+        return False
+
+    def _consume(self, length: int) -> None:
+        """
+        Remove C{length} bytes from the start of the buffer, writing them to
+        the current part, unless they're the preamble.
+        """
+        part = self._part
+        if part is not None and length:
+            part.size += length
+            if part.size > self._limits.sizeFor(part.name):
+                raise RequestEntityTooLarge(
+                    f"The {part.name!r} field is too large"
+                )
+            with memoryview(self._buffer) as view, view[:length] as data:
+                part.file.write(data)
+        del self._buffer[:length]
+
+    def _checkHeaderSize(self, size: int) -> None:
+        if size > self._limits.maxHeaderSize:
+            raise RequestEntityTooLarge("A form field's headers are too large")
+
+    def _startPart(self, headers: bytes) -> None:
+        """
+        Start a part with the given headers.
+        """
+        if len(self.parts) >= self._limits.maxParts:
+            raise RequestEntityTooLarge("The form has too many fields")
+        message = HeaderParser().parsestr(headers.decode("utf-8", "replace"))
+        if message.get_content_disposition() != "form-data":
+            raise BadRequest("A form field isn't form-data")
+        name = message.get_param("name", header="content-disposition")
+        if name is None:
+            raise BadRequest("A form field has no name")
+        self._part = UploadedFile(
+            collapse_rfc2231_value(name),
+            message.get_filename(),
+            message.get_content_type(),
+            self._limits.spoolThreshold,
+        )
+        self.parts.append(self._part)
+
+
+def multipartBoundary(request: IRequest) -> Optional[bytes]:
+    """
+    The boundary of C{request}'s body, if it's C{multipart/form-data}.
+
+    @raise BadRequest: If it's multipart, but has no valid boundary.
+    """
+    contentType = request.getHeader(b"content-type")
+    if contentType is None:
+        return None
+    message = Message()
+    message["content-type"] = contentType.decode("latin-1")
+    if message.get_content_type() != "multipart/form-data":
+        return None
+    boundary = message.get_boundary()
+    if not boundary or len(boundary) > 70:
+        raise BadRequest("The form has no valid boundary")
+    return boundary.encode("latin-1")
+
+
+class IMultipartForm(Interface):
+    """
+    Marker interface for the L{MultipartForm} parsed from a request's body.
+    """
+
+
+@attr.s(auto_attribs=True)
+class MultipartForm:
+    """
+    The parts of a C{multipart/form-data} body, by field name.
+    """
+
+    fields: Dict[str, List[UploadedFile]] = attr.ib(factory=dict)
+
+    @classmethod
+    def fromParts(cls, parts: List[UploadedFile]) -> "MultipartForm":
+        form = cls()
+        for part in parts:
+            form.fields.setdefault(part.name, []).append(part)
+        return form
+
+    def get(self, name: str) -> Optional[UploadedFile]:
+        """
+        The first part for the field called C{name}, if any.
+        """
+        parts = self.fields.get(name)
+        return parts[0] if parts else None
+
+    def check(self, limits: MultipartLimits) -> None:
+        """
+        Enforce C{limits} on a form which was parsed without them, by
+        L{FormRequest}.  Only the sizes of the parts, not of their headers,
+        count towards C{limits.maxTotalSize}.
+
+        @raise RequestEntityTooLarge: If the form, or a part, is too large.
+        """
+        parts = [part for parts in self.fields.values() for part in parts]
+        if len(parts) > limits.maxParts:
+            raise RequestEntityTooLarge("The form has too many fields")
+        if sum(part.size for part in parts) > limits.maxTotalSize:
+            raise RequestEntityTooLarge("The form is too large")
+        for part in parts:
+            if part.size > limits.sizeFor(part.name):
+                raise RequestEntityTooLarge(
+                    f"The {part.name!r} field is too large"
+                )
+
+    def close(self) -> None:
+        """
+        Discard every part.
+        """
+        for parts in self.fields.values():
+            for part in parts:
+                part.close()
+
+
+def parseMultipart(
+    request: IRequest, limits: MultipartLimits = MultipartLimits()
+) -> Optional[MultipartForm]:
+    """
+    Parse C{request}'s body, if it's C{multipart/form-data}, or check the
+    form which L{FormRequest} already parsed from it against C{limits}.
+
+    The body has been buffered by the time it's parsed, so C{limits} only
+    apply once all of it has been received.
+
+    The parts are discarded once the request is finished.
+
+    @return: The L{MultipartForm}, or L{None} if the body isn't multipart.
+    """
+    componentized = cast(Componentized, request)
+    form: Optional[MultipartForm] = componentized.getComponent(IMultipartForm)
+    if form is not None:
+        form.check(limits)
+        return form
+    boundary = multipartBoundary(request)
+    if boundary is None:
+        return None
+    return _parseContent(request, boundary, limits)
+
+
+def _parseContent(
+    request: IRequest, boundary: bytes, limits: MultipartLimits
+) -> MultipartForm:
+    """
+    Feed C{request.content} to a L{MultipartParser}, and remember the form
+    it parses as C{request}'s L{IMultipartForm} until it's finished.
+    """
+    parser = MultipartParser(boundary, limits)
+    content = request.content
+    content.seek(0)
+    try:
+        while True:
+            chunk = content.read(_chunkSize)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        form = MultipartForm.fromParts(parser.close())
+    except BaseException:
+        parser.abort()
+        raise
+    finally:
+        content.seek(0)
+    cast(Componentized, request).setComponent(IMultipartForm, form)
+    request.notifyFinish().addBoth(  # type: ignore[attr-defined]
+        lambda _, parts=form: parts.close()
+    )
+    return form
+
+
+canSkipFormParsing = "parsePOSTFormSubmission" in signature(Site).parameters
+"""
+Can a L{Site} be told not to parse form submissions into C{request.args}?
+"""
+
+
+# The body has already been read by the time L{FormRequest} parses it, so
+# there's nothing to gain by limiting it then; L{parseMultipart} checks each
+# form's own limits later.
+_unlimited = MultipartLimits(
+    maxPartSize=sys.maxsize,
+    maxTotalSize=sys.maxsize,
+    maxHeaderSize=sys.maxsize,
+    maxParts=sys.maxsize,
+)
+
+
+class FormRequest(Request):
+    """
+    A request which parses C{application/x-www-form-urlencoded} bodies into
+    C{request.args}, as Twisted does, and parses C{multipart/form-data}
+    bodies into an L{IMultipartForm}.  The text fields of a multipart body
+    are copied into C{request.args} too, as Twisted would, but uploaded
+    files are left in temporary files rather than read into memory.
+
+    Use it as the C{requestFactory} of a L{Site} constructed with
+    C{parsePOSTFormSubmission=False}.
+    """
+
+    def process(self) -> None:
+        contentType = self.getHeader(b"content-type") or b""
+        mediaType = contentType.split(b";", 1)[0].strip().lower()
+        if self.method == b"POST" and self.content is not None:
+            if mediaType == b"application/x-www-form-urlencoded":
+                self.content.seek(0)
+                self.args.update(parse_qs(self.content.read(), 1))
+                self.content.seek(0)
+            elif mediaType == b"multipart/form-data":
+                self._parseMultipart()
+        super().process()
+
+    def _parseMultipart(self) -> None:
+        """
+        Parse a multipart body, copying its text fields into C{self.args}.
+        A malformed body is left for L{parseMultipart} to reject.
+        """
+        try:
+            boundary = multipartBoundary(self)
+            if boundary is None:
+                return
+            form = _parseContent(self, boundary, _unlimited)
+        except HTTPException:
+            return
+        for name, parts in form.fields.items():
+            for part in parts:
+                if part.filename is None:
+                    values = self.args.setdefault(name.encode("utf-8"), [])
+                    values.append(part.read())
+                    part.seek(0)
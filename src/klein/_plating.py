@@ -6,7 +6,6 @@ Templating wrapper support for Klein.
 from __future__ import annotations
 
 from functools import partial
-from json import dumps
 from operator import setitem
 from typing import Any, Callable, Generator, List, Tuple, cast
 
@@ -19,6 +18,8 @@ from twisted.web.template import Element, Tag, TagLoader
 
 from ._app import _call
 from ._decorators import bindable, modified, originalName
+from ._instrumentation import DATA, PLATING, requestTimings
+from ._jsoncodec import requestCodec
 
 
 StackType = List[Tuple[Any, Callable[[Any], None]]]
@@ -232,7 +233,10 @@ class Plating:
             def mymethod(
                 instance: Any, request: IRequest, *args: Any, **kw: Any
             ) -> Any:
+                timings = requestTimings(request)
                 data = yield _call(instance, method, request, *args, **kw)
+                if timings is not None:
+                    timings.mark(DATA)
                 if _should_return_json(request):
                     json_data = self._defaults.copy()
                     json_data.update(data)
@@ -240,13 +244,15 @@ class Plating:
                         json_data.pop(ignored, None)
                     request.setHeader(b"content-type", b"application/json")
                     ready = yield resolveDeferredObjects(json_data)
-                    result = dumps(ready)
+                    result = requestCodec(request).dumps(ready)
                 else:
                     data[self.CONTENT] = loader.load()
                     request.setHeader(
                         b"content-type", b"text/html; charset=utf-8"
                     )
                     result = self._elementify(instance, data)
+                if timings is not None:
+                    timings.mark(PLATING)
                 return result
 
             return method
@@ -0,0 +1,247 @@
+# -*- test-case-name: klein.test.test_threads,klein.test.test_processes -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Bounded pools of workers for running route handlers off the reactor thread.
+
+A L{BoundedPool} runs a bounded number of calls at once, and holds a bounded
+number more in a queue on the reactor thread; when that is full, calls are
+refused with L{ServiceUnavailable}, so that their requests are answered with
+a 503.  Calls still waiting in the queue when they're cancelled, as
+L{klein.resource.KleinResource} does when a client disconnects, are never
+run.  Subclasses decide where the calls run.
+"""
+
+from abc import ABC, abstractmethod
+from collections import deque
+from time import perf_counter
+from typing import Any, Callable, Deque, Optional
+
+import attr
+from werkzeug.exceptions import ServiceUnavailable
+
+from twisted.internet.defer import Deferred, fail
+from twisted.python.failure import Failure
+
+
+__all__ = ()
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class PoolStats:
+    """
+    A snapshot of the activity of a L{BoundedPool}.
+
+    @ivar size: The most calls the pool runs at once.
+    @ivar running: The number of calls running now.
+    @ivar queued: The number of calls waiting for a worker now.
+    @ivar completed: The number of calls which have finished running.
+    @ivar rejected: The number of calls refused because the queue was full.
+    @ivar cancelled: The number of calls removed from the queue because
+        their request went away.
+    @ivar totalWait: The total time, in seconds, that the calls started so
+        far waited in the queue.
+    @ivar maxWait: The longest time, in seconds, that a call waited in the
+        queue.
+    """
+
+    size: int
+    running: int
+    queued: int
+    completed: int
+    rejected: int
+    cancelled: int
+    totalWait: float
+    maxWait: float
+
+    def meanWait(self) -> float:
+        """
+        The mean time, in seconds, that the calls started so far waited in
+        the queue.
+        """
+        started = self.running + self.completed
+        return self.totalWait / started if started else 0.0
+
+
+@attr.s(auto_attribs=True, eq=False)
+class PoolJob:
+    """
+    A call to be run by a L{BoundedPool}.
+
+    @ivar result: The L{Deferred} given to the caller.
+    @ivar queued: When the call was made, according to the pool's clock.
+    @ivar worker: Whatever the pool needs to remember about the call while
+        it runs.
+    """
+
+    result: "Deferred[Any]"
+    f: Callable[..., Any]
+    args: Any
+    kwargs: Any
+    queued: float
+    worker: Any = None
+
+
+class BoundedPool(ABC):
+    """
+    A bounded pool of workers, started when the first call is run and
+    stopped when the reactor (the global one, unless another is given)
+    shuts down.
+
+    @ivar size: The most calls run at once.
+    @ivar maxQueue: The most calls which may wait for a worker; further ones
+        are refused with a 503.
+    @ivar retryAfter: The number of seconds that clients whose requests are
+        refused are told to wait before retrying, if any.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        maxQueue: int,
+        retryAfter: Optional[int],
+        reactor: Any,
+        now: Callable[[], float] = perf_counter,
+    ) -> None:
+        if size < 1:
+            raise ValueError("A pool needs at least one worker")
+        self.size = size
+        self.maxQueue = maxQueue
+        self.retryAfter = retryAfter
+        self._reactor = reactor
+        self._now = now
+        self._started = False
+        self._stopsOnShutdown = False
+        self._queue: Deque[PoolJob] = deque()
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._totalWait = 0.0
+        self._maxWait = 0.0
+
+    def stats(self) -> PoolStats:
+        """
+        Report how busy this pool is, and has been.
+        """
+        return PoolStats(
+            self.size,
+            self._running,
+            len(self._queue),
+            self._completed,
+            self._rejected,
+            self._cancelled,
+            self._totalWait,
+            self._maxWait,
+        )
+
+    def run(
+        self, f: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> "Deferred[Any]":
+        """
+        Call C{f} with C{args} and C{kwargs} in one of this pool's workers
+        once one is free.
+
+        @return: A L{Deferred} firing with the result of C{f}, or failing
+            with L{ServiceUnavailable} if the queue is full.  Cancelling it
+            before C{f} starts means C{f} is never called.
+        """
+        if self._running >= self.size and len(self._queue) >= self.maxQueue:
+            self._rejected += 1
+            return fail(self._unavailable())
+
+        def cancel(result: "Deferred[Any]") -> None:
+            if job in self._queue:
+                self._queue.remove(job)
+                self._cancelled += 1
+            else:
+                self._cancelRunning(job)
+
+        job = PoolJob(Deferred(cancel), f, args, kwargs, self._now())
+        if self._running < self.size:
+            self._start(job)
+        else:
+            self._queue.append(job)
+        return job.result
+
+    def _unavailable(self) -> ServiceUnavailable:
+        """
+        The error with which calls are refused when the queue is full.
+        """
+        return ServiceUnavailable(
+            "Too many requests are waiting", retry_after=self.retryAfter
+        )
+
+    def _start(self, job: PoolJob) -> None:
+        """
+        Run C{job} in a worker, starting the workers if need be.
+        """
+        if not self._started:
+            self._started = True
+            self._startWorkers()
+            if self._reactor is None:
+                from twisted.internet import reactor
+
+                self._reactor = reactor
+            if not self._stopsOnShutdown:
+                self._stopsOnShutdown = True
+                self._reactor.addSystemEventTrigger(
+                    "during", "shutdown", self.stop
+                )
+        waited = self._now() - job.queued
+        self._totalWait += waited
+        self._maxWait = max(self._maxWait, waited)
+        self._running += 1
+        self._dispatch(job).addBoth(self._finished, job)
+
+    def _finished(self, result: object, job: PoolJob) -> None:
+        """
+        C{job} has finished running: deliver its result, unless it was
+        cancelled, and start the next one waiting.
+        """
+        self._running -= 1
+        self._completed += 1
+        if self._queue:
+            self._start(self._queue.popleft())
+        if job.result.called:
+            # It was cancelled while it ran.
+            return
+        if isinstance(result, Failure):
+            job.result.errback(result)
+        else:
+            job.result.callback(result)
+
+    def stop(self) -> None:
+        """
+        Stop this pool's workers.
+        """
+        if self._started:
+            self._started = False
+            self._stopWorkers()
+
+    @abstractmethod
+    def _startWorkers(self) -> None:
+        """
+        Get ready to run calls.
+        """
+
+    @abstractmethod
+    def _stopWorkers(self) -> None:
+        """
+        Stop running calls.
+        """
+
+    @abstractmethod
+    def _dispatch(self, job: PoolJob) -> "Deferred[Any]":
+        """
+        Run C{job}'s call in a worker.
+
+        @return: A L{Deferred} firing with the result of the call once the
+            worker is free for another.
+        """
+
+    def _cancelRunning(self, job: PoolJob) -> None:
+        """
+        C{job}'s caller has cancelled it while it runs; by default, it's
+        left to finish, and its result discarded.
+        """
@@ -0,0 +1,309 @@
+# -*- test-case-name: klein.test.test_processes -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Running CPU-bound functions in a pool of worker processes.
+
+Threads don't help handlers which spend their time computing rather than
+waiting, because of the GIL.  A function decorated with L{cpuBound} is
+instead called in a worker process of a L{HandlerProcessPool}: its arguments
+and result are pickled, and calling it returns a L{Deferred}.
+
+Route handlers need the request, which can't be sent to another process,
+so rather than decorating a handler itself, decorate a function beneath
+L{klein.Requirer.require}, which calls it with only the values it injects
+and those from the URL, or a helper which a handler calls::
+
+    @requirer.require(app.route("/thumbnail/<int:size>"), image=ImageField)
+    @cpuBound
+    def thumbnail(size, image):
+        ...
+
+Each worker process runs one call at a time.  A worker which crashes, runs
+a call for longer than the pool's timeout, or is running a call when it's
+cancelled (as L{klein.resource.KleinResource} does when a client
+disconnects) is killed, and replaced by a new one when next needed.
+"""
+
+import multiprocessing
+import sys
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+from time import perf_counter
+from typing import Any, Callable, List, Optional, Union, cast, overload
+
+import attr
+from werkzeug.exceptions import GatewayTimeout
+
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.python.failure import Failure
+
+from ._decorators import modified
+from ._pools import BoundedPool, PoolJob
+
+
+__all__ = ()
+
+
+def _singleProcessExecutor() -> Executor:
+    """
+    Make an executor with a single worker process.
+
+    Workers are spawned rather than forked, so that they don't inherit the
+    reactor, its threads or its connections.
+    """
+    return ProcessPoolExecutor(1, multiprocessing.get_context("spawn"))
+
+
+def _kill(executor: Executor) -> None:
+    """
+    Kill the worker processes of C{executor}, abandoning whatever they're
+    running.
+    """
+    terminate = getattr(executor, "terminate_workers", None)
+    if terminate is not None:
+        terminate()
+    else:
+        # Before Python 3.14, ProcessPoolExecutor can't do this itself.
+        processes = getattr(executor, "_processes", None) or {}
+        for process in list(processes.values()):
+            process.terminate()
+        if sys.version_info >= (3, 9):
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:  # pragma: no cover
+            # Before Python 3.9, shutdown() can't cancel the calls which
+            # haven't started yet.
+            pending = getattr(executor, "_pending_work_items", None) or {}
+            for item in list(pending.values()):
+                item.future.cancel()
+            executor.shutdown(wait=False)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class _Running:
+    """
+    A call running in a worker process.
+
+    @ivar executor: The executor of the worker process.
+    @ivar done: The L{Deferred} given to L{BoundedPool}, which fires once
+        the call is over.
+    @ivar timeout: The delayed call timing it out, if any.
+    """
+
+    executor: Executor
+    done: "Deferred[Any]"
+    timeout: Any = None
+
+
+class HandlerProcessPool(BoundedPool):
+    """
+    A bounded pool of worker processes for running CPU-bound functions.
+
+    @ivar timeout: The number of seconds a call may run before it fails with
+        L{GatewayTimeout} and its worker is killed, if any.
+    @ivar restarts: The number of workers killed because they crashed, timed
+        out, or were running a cancelled call.
+
+    @see: L{BoundedPool}
+    """
+
+    def __init__(
+        self,
+        size: Optional[int] = None,
+        maxQueue: int = 100,
+        timeout: Optional[float] = None,
+        retryAfter: Optional[int] = None,
+        reactor: Any = None,
+        executorFactory: Callable[[], Executor] = _singleProcessExecutor,
+        now: Callable[[], float] = perf_counter,
+    ) -> None:
+        if size is None:
+            size = multiprocessing.cpu_count()
+        super().__init__(size, maxQueue, retryAfter, reactor, now)
+        self.timeout = timeout
+        self._executorFactory = executorFactory
+        self._idle: List[Executor] = []
+        self._busy: List[Executor] = []
+        self.restarts = 0
+
+    def _startWorkers(self) -> None:
+        # Worker processes are started as calls need them.
+        pass
+
+    def _stopWorkers(self) -> None:
+        """
+        Kill this pool's worker processes.
+        """
+        for executor in self._idle + self._busy:
+            _kill(executor)
+        self._idle = []
+        self._busy = []
+
+    def _dispatch(self, job: PoolJob) -> "Deferred[Any]":
+        executor = self._idle.pop() if self._idle else self._executorFactory()
+        self._busy.append(executor)
+        running = job.worker = _Running(executor, Deferred())
+        if self.timeout is not None:
+            running.timeout = self._reactor.callLater(
+                self.timeout, self._timedOut, running
+            )
+        try:
+            future = executor.submit(job.f, *job.args, **job.kwargs)
+        except BaseException:
+            self._done(running, Failure(), broken=True)
+        else:
+            future.add_done_callback(
+                lambda future: self._reactor.callFromThread(
+                    self._settled, running, future
+                )
+            )
+        return running.done
+
+    def _settled(self, running: _Running, future: "Future[Any]") -> None:
+        """
+        The call C{running} has completed in its worker, unless that worker
+        has been killed.
+        """
+        if running.done.called:
+            return
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            self._done(running, Failure(), broken=True)
+        except BaseException:
+            self._done(running, Failure())
+        else:
+            self._done(running, result)
+
+    def _timedOut(self, running: _Running) -> None:
+        """
+        The call C{running} has taken too long.
+        """
+        running.timeout = None
+        error = GatewayTimeout("The worker took too long to respond")
+        self._done(running, Failure(error), broken=True)
+
+    def _cancelRunning(self, job: PoolJob) -> None:
+        """
+        Kill the worker running C{job}, which is no longer wanted.
+        """
+        running = job.worker
+        if running is not None and not running.done.called:
+            self._done(running, Failure(CancelledError()), broken=True)
+
+    def _done(
+        self, running: _Running, result: object, broken: bool = False
+    ) -> None:
+        """
+        The call C{running} is over, with C{result}; C{broken} if its
+        worker should be replaced.
+        """
+        if running.timeout is not None:
+            running.timeout.cancel()
+            running.timeout = None
+        executor = running.executor
+        if executor in self._busy:
+            self._busy.remove(executor)
+            if broken:
+                self.restarts += 1
+                _kill(executor)
+            elif self._started:
+                self._idle.append(executor)
+            else:
+                _kill(executor)
+        if isinstance(result, Failure):
+            running.done.errback(result)
+        else:
+            running.done.callback(result)
+
+
+_defaultPool: Optional[HandlerProcessPool] = None
+
+
+def defaultProcessPool() -> HandlerProcessPool:
+    """
+    The L{HandlerProcessPool} used by L{cpuBound} functions which aren't
+    given one.
+    """
+    global _defaultPool
+    if _defaultPool is None:
+        _defaultPool = HandlerProcessPool()
+    return _defaultPool
+
+
+def _callByName(
+    module: str, qualname: str, args: Any, kwargs: Any
+) -> Any:
+    """
+    Call the function named C{qualname} in C{module}, before it was
+    decorated with L{cpuBound}.
+
+    Decorated functions can't be pickled themselves, because their names
+    refer to the decorated versions, so worker processes find them by name.
+    """
+    found: Any = import_module(module)
+    for name in qualname.split("."):
+        found = getattr(found, name)
+    while True:
+        target = getattr(found, "__klein_cpu_bound__", None)
+        if target is not None:
+            found = target
+            break
+        wrapped = getattr(found, "__wrapped__", None)
+        if wrapped is None:
+            break
+        found = wrapped
+    return found(*args, **kwargs)
+
+
+Offloaded = Callable[..., "Deferred[Any]"]
+
+
+@overload
+def cpuBound(f: Callable[..., Any]) -> Offloaded:
+    ...  # pragma: no cover
+
+
+@overload
+def cpuBound(
+    *, pool: Optional[HandlerProcessPool] = None
+) -> Callable[[Callable[..., Any]], Offloaded]:
+    ...  # pragma: no cover
+
+
+def cpuBound(
+    f: Optional[Callable[..., Any]] = None,
+    *,
+    pool: Optional[HandlerProcessPool] = None,
+) -> Union[Offloaded, Callable[[Callable[..., Any]], Offloaded]]:
+    """
+    Decorate a module-level function or method, so that it is called in a
+    worker process of C{pool}, or of L{defaultProcessPool} if none is given.
+
+    Its arguments, and its result, must be picklable; so must the instance
+    of a method.
+
+    @return: A function taking the same arguments as C{f}, and returning a
+        L{Deferred} which fires with its result.
+    """
+
+    def decorator(f: Callable[..., Any]) -> Offloaded:
+        if "<locals>" in f.__qualname__:
+            raise ValueError(
+                f"{f.__qualname__} can't be found by worker processes; "
+                "define it at module or class level"
+            )
+        module, qualname = f.__module__, f.__qualname__
+
+        @modified("cpu-bound", f)
+        def inProcess(*args: Any, **kwargs: Any) -> "Deferred[Any]":
+            processes = defaultProcessPool() if pool is None else pool
+            return processes.run(_callByName, module, qualname, args, kwargs)
+
+        inProcess.__klein_cpu_bound__ = f
+        return cast(Offloaded, inProcess)
+
+    if f is None:
+        return decorator
+    return decorator(f)
@@ -0,0 +1,398 @@
+# -*- test-case-name: klein.test.test_profiling -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Profiling a sample of requests with C{cProfile}, and keeping the profiles of
+the slow ones.
+
+Once a L{RequestProfiler} has been given to L{klein.Klein.profile},
+L{KleinResource} profiles a fraction of the requests to the application, and
+every request to chosen endpoints, while it runs
+L{klein.Klein.execute_endpoint} and renders the result.  The profiles of
+those which take longer than a threshold to finish are kept, with the route
+they went to, in a ring buffer of bounded size, which L{exposeProfiles} can
+serve from a route protected by a token.
+
+Only the code which runs synchronously in those steps is profiled: while a
+handler waits for a L{Deferred}, the reactor is serving other requests, and
+those shouldn't be charged to it.
+"""
+
+import marshal
+from collections import deque
+from cProfile import Profile
+from hmac import compare_digest
+from io import StringIO
+from itertools import count
+from os.path import basename
+from pstats import Stats
+from random import random
+from time import perf_counter, time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+import attr
+
+from twisted.web.iweb import IRequest
+
+from ._jsoncodec import requestCodec
+
+
+if TYPE_CHECKING:  # pragma: no cover
+    from ._app import Klein, KleinRenderable
+
+
+__all__ = ()
+
+
+T = TypeVar("T")
+
+# The statistics gathered by cProfile: for each function, its primitive call
+# count, call count, time spent in itself, cumulative time, and the same for
+# the calls from each of its callers.
+FunctionKey = Tuple[str, int, str]
+ProfileStats = Dict[FunctionKey, Tuple[int, int, float, float, Dict[Any, Any]]]
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class SlowRequest:
+    """
+    The profile of a request which took longer than a L{RequestProfiler}'s
+    threshold to finish.
+
+    @ivar identifier: A number identifying this request among those kept by
+        its L{RequestProfiler}.
+    @ivar endpoint: The endpoint of the route the request went to.
+    @ivar method: The request method.
+    @ivar uri: The request URI.
+    @ivar duration: How long the request took to finish, in seconds.
+    @ivar started: When the request started, in seconds since the epoch.
+    @ivar stats: The statistics gathered by C{cProfile}.
+    """
+
+    identifier: int
+    endpoint: str
+    method: bytes
+    uri: bytes
+    duration: float
+    started: float
+    stats: ProfileStats = attr.ib(repr=False)
+
+    def summary(self) -> Dict[str, object]:
+        """
+        Everything but the statistics, as JSON-serializable values.
+        """
+        return {
+            "id": self.identifier,
+            "endpoint": self.endpoint,
+            "method": self.method.decode("latin-1"),
+            "uri": self.uri.decode("latin-1"),
+            "duration": self.duration,
+            "started": self.started,
+        }
+
+
+# There can only be one profiler active at a time, so a request rendered
+# while another is being profiled (by a nested KleinResource, say) isn't.
+_running: List["RequestProfile"] = []
+
+
+class RequestProfile:
+    """
+    The profile of a single request, gathered while running each of the
+    functions given to L{RequestProfile.run}.
+    """
+
+    def __init__(
+        self,
+        profiler: "RequestProfiler",
+        endpoint: str,
+        request: IRequest,
+    ) -> None:
+        self._profiler = profiler
+        self._endpoint = endpoint
+        self._request = request
+        self._profile = Profile()
+        self._started = time()
+        self._start = profiler.now()
+        self._done = False
+
+    def run(self, f: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call C{f} with C{args} and C{kwargs}, profiling it.
+        """
+        if _running or self._done:
+            return f(*args, **kwargs)
+        _running.append(self)
+        self._profile.enable()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self._profile.disable()
+            _running.pop()
+
+    def finished(self, result: object = None) -> None:
+        """
+        The request has finished, or its connection was lost: keep its
+        profile if it was slow.
+        """
+        if self._done:
+            return
+        self._done = True
+        duration = self._profiler.now() - self._start
+        if duration >= self._profiler.threshold:
+            self._profile.create_stats()
+            request = self._request
+            self._profiler.keep(
+                self._endpoint,
+                request.method,
+                request.uri,
+                duration,
+                self._started,
+                # typeshed has the times as ints; they're floats.
+                cast(ProfileStats, self._profile.stats),
+            )
+
+
+class RequestProfiler:
+    """
+    Choose which requests to profile, and keep the profiles of the slow ones.
+
+    @ivar sampleRate: The fraction of requests to profile, from 0 to 1.
+    @ivar endpoints: Endpoints every request to which is profiled.
+    @ivar threshold: How long, in seconds, a profiled request must take to
+        finish for its profile to be kept.
+    @ivar slow: The profiles kept, oldest first; once there are C{capacity}
+        of them, the oldest is discarded to make room for each new one.
+    """
+
+    def __init__(
+        self,
+        sampleRate: float = 0.01,
+        endpoints: Iterable[str] = (),
+        threshold: float = 1.0,
+        capacity: int = 50,
+        sample: Callable[[], float] = random,
+        now: Callable[[], float] = perf_counter,
+    ) -> None:
+        self.sampleRate = sampleRate
+        self.endpoints = frozenset(endpoints)
+        self.threshold = threshold
+        self.slow: Deque[SlowRequest] = deque(maxlen=capacity)
+        self._sample = sample
+        self.now = now
+        self._identifiers = count(1)
+
+    def start(
+        self, request: IRequest, endpoint: str
+    ) -> Optional[RequestProfile]:
+        """
+        Decide whether to profile C{request} to C{endpoint}.
+
+        @return: A L{RequestProfile} for it, or L{None} if it isn't to be
+            profiled.
+        """
+        if endpoint in self.endpoints or self._sample() < self.sampleRate:
+            return RequestProfile(self, endpoint, request)
+        return None
+
+    def keep(
+        self,
+        endpoint: str,
+        method: bytes,
+        uri: bytes,
+        duration: float,
+        started: float,
+        stats: ProfileStats,
+    ) -> SlowRequest:
+        """
+        Add the profile of a slow request to L{RequestProfiler.slow}.
+        """
+        slow = SlowRequest(
+            next(self._identifiers),
+            endpoint,
+            method,
+            uri,
+            duration,
+            started,
+            stats,
+        )
+        self.slow.append(slow)
+        return slow
+
+    def find(self, identifier: int) -> Optional[SlowRequest]:
+        """
+        The kept profile with the given identifier, if it's still kept.
+        """
+        for slow in self.slow:
+            if slow.identifier == identifier:
+                return slow
+        return None
+
+
+class _LoadedStats:
+    """
+    Enough of a profiler to give L{pstats.Stats} statistics gathered
+    earlier.
+    """
+
+    def __init__(self, stats: ProfileStats) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def pstatsDump(stats: ProfileStats) -> bytes:
+    """
+    C{stats} in the format written by L{pstats.Stats.dump_stats}, which
+    L{pstats.Stats} and tools like C{snakeviz} can load.
+    """
+    return marshal.dumps(stats)
+
+
+def pstatsText(stats: ProfileStats, limit: int = 50) -> str:
+    """
+    The C{limit} functions with the most cumulative time in C{stats}, as
+    printed by L{pstats.Stats.print_stats}.
+    """
+    stream = StringIO()
+    loaded: Any = _LoadedStats(stats)
+    printer = Stats(loaded, stream=stream)
+    printer.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
+
+
+def _frame(key: FunctionKey) -> str:
+    filename, line, name = key
+    if filename == "~":
+        frame = name
+    else:
+        frame = f"{name} ({basename(filename)}:{line})"
+    return frame.replace(";", ":")
+
+
+def collapsedStacks(stats: ProfileStats, maxDepth: int = 100) -> Iterator[str]:
+    """
+    C{stats} as collapsed stacks, for C{flamegraph.pl}, C{speedscope} and
+    similar tools: one line per stack, with the frames separated by
+    semicolons, followed by the microseconds spent in its innermost frame.
+
+    C{cProfile} only records which function called which, not whole stacks,
+    so the time spent in a function called from several places is divided
+    between them in proportion to their share of its cumulative time.
+    """
+    callees: Dict[FunctionKey, List[Tuple[FunctionKey, float]]] = {}
+    roots = []
+    for key, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            roots.append(key)
+        for caller, (_, _, _, callerTime) in callers.items():
+            callees.setdefault(caller, []).append((key, callerTime))
+
+    totals: Dict[Tuple[str, ...], float] = {}
+
+    def visit(key: FunctionKey, stack: Tuple[str, ...], share: float) -> None:
+        _, _, inline, cumulative, _ = stats[key]
+        stack += (_frame(key),)
+        totals[stack] = totals.get(stack, 0.0) + inline * share
+        if len(stack) >= maxDepth:
+            return
+        for callee, callTime in callees.get(key, []):
+            if callee == key or _frame(callee) in stack:
+                # Recursion; its time is already counted.
+                continue
+            calleeCumulative = stats[callee][3]
+            if calleeCumulative and callTime:
+                visit(
+                    callee,
+                    stack,
+                    share * min(callTime / calleeCumulative, 1.0),
+                )
+
+    for root in sorted(roots):
+        visit(root, (), 1.0)
+    for stack, seconds in sorted(totals.items()):
+        microseconds = round(seconds * 1_000_000)
+        if microseconds:
+            yield f"{';'.join(stack)} {microseconds}"
+
+
+def _authorized(request: IRequest, token: str) -> bool:
+    authorization = request.getHeader(b"authorization") or b""
+    scheme, _, credentials = authorization.partition(b" ")
+    return scheme.lower() == b"bearer" and compare_digest(
+        credentials.strip(), token.encode("utf-8")
+    )
+
+
+def _refuse(request: IRequest) -> bytes:
+    request.setResponseCode(401)
+    request.setHeader(b"www-authenticate", b'Bearer realm="klein-profiles"')
+    return b"Unauthorized"
+
+
+def exposeProfiles(
+    app: "Klein",
+    profiler: RequestProfiler,
+    token: str,
+    url: str = "/debug/profiles",
+) -> None:
+    """
+    Add routes to C{app} which serve the slow requests kept by C{profiler}
+    to clients presenting C{token} as a bearer token in their
+    C{Authorization} header.
+
+    C{url} lists the slow requests as JSON, newest first, and
+    C{url/<id>?format=<format>} serves the profile of one, where the format
+    is C{text} (the default) for a L{pstats} report, C{pstats} for a file
+    which L{pstats.Stats} can load, or C{collapsed} for collapsed stacks.
+    """
+    if not token:
+        raise ValueError("A token is required to protect profiles")
+
+    def profiles(request: IRequest) -> "KleinRenderable":
+        if not _authorized(request, token):
+            return _refuse(request)
+        request.setHeader(b"content-type", b"application/json")
+        summaries = [slow.summary() for slow in reversed(profiler.slow)]
+        return requestCodec(request).dumps(summaries)
+
+    def profile(request: IRequest, profile_id: int) -> "KleinRenderable":
+        if not _authorized(request, token):
+            return _refuse(request)
+        slow = profiler.find(profile_id)
+        if slow is None:
+            request.setResponseCode(404)
+            return b"No such profile"
+        format = request.args.get(b"format", [b"text"])[0]
+        if format == b"pstats":
+            request.setHeader(b"content-type", b"application/octet-stream")
+            request.setHeader(
+                b"content-disposition",
+                b'attachment; filename="%d.pstats"' % (slow.identifier,),
+            )
+            return pstatsDump(slow.stats)
+        request.setHeader(b"content-type", b"text/plain; charset=utf-8")
+        if format == b"collapsed":
+            lines = collapsedStacks(slow.stats)
+            return "".join(line + "\n" for line in lines).encode("utf-8")
+        if format == b"text":
+            return pstatsText(slow.stats).encode("utf-8")
+        request.setResponseCode(400)
+        return b"Unknown format; use text, pstats or collapsed"
+
+    app.route(url, endpoint=f"profiles:{url}")(profiles)
+    app.route(f"{url}/<int:profile_id>", endpoint=f"profile:{url}")(profile)
@@ -5,7 +5,6 @@
 Support for interoperability with L{twisted.web.iweb.IRequest}.
 """
 
-from io import BytesIO
 from typing import cast
 
 from attr import Factory, attrib, attrs
@@ -19,17 +18,15 @@ from twisted.web.iweb import IRequest
 from ._attrs_zope import provides
 from ._headers import IHTTPHeaders
 from ._headers_compat import HTTPHeadersWrappingHeaders
-from ._message import FountAlreadyAccessedError, MessageState
+from ._message import MessageState
 from ._request import IHTTPRequest
-from ._tubes import IOFount, fountToBytes
+from ._requestbody import bodyFount
+from ._tubes import fountToBytes
 
 
 __all__ = ()
 
 
-noneIO = BytesIO()
-
-
 @implementer(IHTTPRequest)
 @attrs(frozen=True)
 class HTTPRequestWrappingIRequest:
@@ -79,15 +76,7 @@ class HTTPRequestWrappingIRequest:
         return HTTPHeadersWrappingHeaders(headers=self._request.requestHeaders)
 
     def bodyAsFount(self) -> IFount:
-        source = self._request.content
-        if source is noneIO:
-            raise FountAlreadyAccessedError()
-
-        fount = IOFount(source=source)
-
-        self._request.content = noneIO
-
-        return fount
+        return bodyFount(self._request)
 
     async def bodyAsBytes(self) -> bytes:
         if self._state.cachedBody is not None:
@@ -0,0 +1,389 @@
+# -*- test-case-name: klein.test.test_requestbody -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Streaming request bodies to handlers as they arrive.
+
+Twisted's L{Request} buffers the whole body into C{request.content} before
+the resource renders it, so an upload costs memory (or disk) equal to its
+size, and a route can't refuse one that's too large until it's all been
+received.  L{StreamingRequest}, which L{klein.Klein.run} serves with when
+any route sets C{stream_body} or C{max_body_size}, routes each request with
+a body as soon as its headers arrive:
+
+    - requests to routes with C{max_body_size} whose C{Content-Length} is
+      too large are refused at once with a 413, and so are those whose body
+      grows too large as it arrives;
+
+    - requests to routes with C{stream_body=True} are rendered at once, and
+      their bodies are delivered by a L{BodyFount} as they're received,
+      pausing the transport while the handler's drain is paused.
+
+Handlers of routes with C{stream_body=True} get the body as the
+C{body_fount} of L{IKleinRequest}.  If the body was buffered anyway, as it
+is when the application isn't served with L{StreamingRequest}, the fount
+delivers it as a single C{memoryview} of the buffer, or of a memory map of
+the file Twisted wrote it to, rather than a copy.
+"""
+
+import mmap
+import os
+from collections import deque
+from io import BytesIO, UnsupportedOperation
+from typing import IO, Any, Deque, Optional, Tuple, cast
+
+from tubes.itube import IDrain, IFount, ISegment
+from tubes.kit import Pauser, beginFlowingTo
+from werkzeug.exceptions import RequestEntityTooLarge
+from zope.interface import implementer
+
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web.http import parse_qs, unquote
+from twisted.web.iweb import IRequest
+
+from ._imessage import FountAlreadyAccessedError
+from ._multipart import FormRequest
+
+
+__all__ = ()
+
+
+noneIO = BytesIO()
+
+BodyPolicy = Tuple[bool, Optional[int]]
+"""
+Whether a route streams request bodies, and the largest body it accepts.
+"""
+
+
+@implementer(IFount)
+class BodyFount:
+    """
+    A fount of the chunks of a request body, fed to it as they arrive.
+
+    Chunks received before a drain is attached, or while it's paused, are
+    buffered; once more than C{highWater} bytes are, the producer (the
+    transport, for L{StreamingRequest}) is paused until they're delivered.
+
+    @ivar drain: The drain the body flows to, if any.
+    @ivar claimed: Whether the fount has been given to a handler.
+    """
+
+    outputType = ISegment
+
+    def __init__(
+        self, producer: Any = None, highWater: int = 64 * 1024
+    ) -> None:
+        self.drain: Optional[IDrain] = None
+        self.claimed = False
+        self._producer = producer
+        self._highWater = highWater
+        self._buffer: Deque[Any] = deque()
+        self._buffered = 0
+        self._pauser = Pauser(self._pause, self._resume)
+        self._paused = False
+        self._producerPaused = False
+        self._stopped = False
+        self._reason: Optional[Failure] = None
+        self._ended = False
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether the whole body, or the reason it won't come, has been
+        received.
+        """
+        return self._reason is not None
+
+    def receive(self, data: Any) -> None:
+        """
+        The next chunk of the body has arrived.
+        """
+        if self._stopped or self._reason is not None:
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._deliver()
+
+    def finish(self, reason: Optional[Failure] = None) -> None:
+        """
+        The body is over: complete, unless a reason it's incomplete is
+        given.
+        """
+        if self._reason is None:
+            if reason is None:
+                reason = Failure(StopIteration())
+            self._reason = reason
+            self._deliver()
+
+    def flowTo(self, drain: IDrain) -> IFount:
+        result = beginFlowingTo(self, drain)
+        self._deliver()
+        return cast(IFount, result)
+
+    def pauseFlow(self) -> Any:
+        return self._pauser.pause()
+
+    def stopFlow(self) -> None:
+        """
+        The drain wants no more of the body: discard the rest as it arrives.
+        """
+        self._stopped = True
+        self._buffer.clear()
+        self._buffered = 0
+        self._resumeProducer()
+
+    def _pause(self) -> None:
+        self._paused = True
+        self._pauseProducer()
+
+    def _resume(self) -> None:
+        self._paused = False
+        self._deliver()
+
+    def _deliver(self) -> None:
+        """
+        Deliver what's buffered to the drain, for as long as it's willing.
+        """
+        while self._buffer and self.drain is not None and not self._paused:
+            data = self._buffer.popleft()
+            self._buffered -= len(data)
+            self.drain.receive(data)
+        if self._buffered > self._highWater or self._paused:
+            self._pauseProducer()
+        else:
+            self._resumeProducer()
+        if (
+            not self._buffer
+            and self._reason is not None
+            and self.drain is not None
+            and not self._paused
+            and not self._ended
+        ):
+            self._ended = True
+            self.drain.flowStopped(self._reason)
+
+    def _pauseProducer(self) -> None:
+        if self._producer is not None and not self._producerPaused:
+            self._producerPaused = True
+            self._producer.pauseProducing()
+
+    def _resumeProducer(self) -> None:
+        if self._producer is not None and self._producerPaused:
+            self._producerPaused = False
+            self._producer.resumeProducing()
+
+
+def bufferedLength(request: IRequest) -> int:
+    """
+    The length of the body that Twisted buffered for C{request}.
+    """
+    content = request.content
+    if content is None or content is noneIO:
+        return 0
+    position = content.tell()
+    length = content.seek(0, os.SEEK_END)
+    content.seek(position)
+    return cast(int, length)
+
+
+def bufferedBody(content: IO[bytes]) -> memoryview:
+    """
+    A view of a buffered body, without copying it: of the buffer of a
+    L{BytesIO}, or of a memory map of a file.
+    """
+    if isinstance(content, BytesIO):
+        return content.getbuffer()
+    try:
+        content.flush()
+        fileno = content.fileno()
+    except (AttributeError, OSError, UnsupportedOperation):
+        content.seek(0)
+        return memoryview(content.read())
+    if os.fstat(fileno).st_size == 0:
+        return memoryview(b"")
+    return memoryview(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ))
+
+
+def bodyFount(request: IRequest) -> IFount:
+    """
+    Claim the body of C{request} as a fount: the L{BodyFount} it's arriving
+    through, if it's being streamed, or one delivering a view of the buffered
+    body.
+
+    @raise FountAlreadyAccessedError: If the body has already been claimed.
+    """
+    stream: Optional[BodyFount] = getattr(request, "bodyStream", None)
+    if stream is not None:
+        if stream.claimed:
+            raise FountAlreadyAccessedError()
+        stream.claimed = True
+        return stream
+    content = request.content
+    if content is noneIO:
+        raise FountAlreadyAccessedError()
+    request.content = noneIO
+    fount = BodyFount()
+    fount.claimed = True
+    if content is not None:
+        view = bufferedBody(content)
+        if view:
+            fount.receive(view)
+        if not isinstance(content, BytesIO):
+            # The map outlives the file; Twisted no longer knows to close it.
+            request.notifyFinish().addBoth(  # type: ignore[attr-defined]
+                lambda _: content.close()
+            )
+    fount.finish()
+    return fount
+
+
+_continue = b"HTTP/1.1 100 Continue\r\n\r\n"
+_tooLarge = (
+    b"HTTP/1.1 413 Request Entity Too Large\r\n"
+    b"Connection: close\r\n"
+    b"Content-Length: 0\r\n"
+    b"\r\n"
+)
+
+
+class StreamingRequest(FormRequest):
+    """
+    A request which is routed once its headers have arrived, so that its
+    body may be refused, or streamed to its handler, as it arrives.
+
+    Use it as the C{requestFactory} of a L{twisted.web.server.Site} serving
+    a L{KleinResource}.
+
+    @ivar bodyStream: The L{BodyFount} the body is streamed through, if its
+        route has C{stream_body=True}.
+    """
+
+    bodyStream: Optional[BodyFount] = None
+    _maxBodySize: Optional[int] = None
+    _received = 0
+    _refused = False
+    _bodyReceived = False
+    _cleanupPending = False
+
+    def gotLength(self, length: Optional[int]) -> None:
+        super().gotLength(length)
+        if length == 0:
+            return
+        stream, self._maxBodySize = self._bodyPolicy()
+        if self._maxBodySize is not None and (length or 0) > self._maxBodySize:
+            # Refuse to read the body, rather than invite the client to send
+            # it.
+            self._takeExpectation()
+            self._refuse()
+        elif stream:
+            # The channel would send the interim response after the handler
+            # has started, and perhaps finished, the real one.
+            transport: Any = self.channel.transport
+            if self._takeExpectation():
+                transport.write(_continue)
+            self.content = BytesIO()
+            self.bodyStream = BodyFount(transport)
+            self.process()
+
+    def _takeExpectation(self) -> bool:
+        """
+        Remove any C{Expect: 100-continue} header, so that the channel
+        doesn't respond to it.
+
+        @return: Whether the client expects an interim response.
+        """
+        expect = self.requestHeaders.getRawHeaders(b"expect")
+        if not expect or expect[0].lower() != b"100-continue":
+            return False
+        self.requestHeaders.removeHeader(b"expect")
+        return self.clientproto == b"HTTP/1.1"
+
+    def _bodyPolicy(self) -> BodyPolicy:
+        """
+        Route this request, before its body has arrived, to find out how its
+        body is to be handled.
+
+        This depends on the request line, which
+        L{twisted.web.http.HTTPChannel} keeps in private attributes until the
+        body has arrived; requests on other channels, such as HTTP/2 ones,
+        have their bodies buffered.  C{prepath} and C{postpath} are only set
+        for the lookup, and are set again when the request is processed.
+        """
+        channel: Any = self.channel
+        command = getattr(channel, "_command", None)
+        path = getattr(channel, "_path", None)
+        version = getattr(channel, "_version", None)
+        if command is None or path is None or version is None:
+            return False, None
+        self.method = command
+        self.uri = path
+        self.clientproto = version
+        self.path, _, query = self.uri.partition(b"?")
+        self.args = parse_qs(query, 1)
+        self.site = channel.site
+        self.prepath = []
+        self.postpath = list(map(unquote, self.path[1:].split(b"/")))
+        try:
+            resource = self.site.getResourceFor(self)
+            policy = getattr(resource, "bodyPolicy", None)
+            if policy is None:
+                return False, None
+            return cast(BodyPolicy, policy(self))
+        except BaseException:
+            log.err(None, "Unhandled error routing request before its body")
+            return False, None
+        finally:
+            self.prepath = self.postpath = None
+
+    def handleContentChunk(self, data: bytes) -> None:
+        if self._refused:
+            return
+        self._received += len(data)
+        if self._maxBodySize is not None and self._received > self._maxBodySize:
+            self._refuse()
+        elif self.bodyStream is not None:
+            self.bodyStream.receive(data)
+        else:
+            super().handleContentChunk(data)
+
+    def requestReceived(
+        self, command: bytes, path: bytes, version: bytes
+    ) -> None:
+        if self._refused:
+            return
+        if self.bodyStream is None:
+            super().requestReceived(command, path, version)
+            return
+        self._bodyReceived = True
+        self.bodyStream.finish()
+        if self._cleanupPending:
+            super()._cleanup()
+
+    def _cleanup(self) -> None:
+        if self.bodyStream is not None and not self._bodyReceived:
+            # The response is over before the body is: the channel can't
+            # move on to the next request until the rest of it has arrived.
+            self._cleanupPending = True
+            self.bodyStream.stopFlow()
+            return
+        super()._cleanup()
+
+    def connectionLost(self, reason: Failure) -> None:
+        if self.bodyStream is not None:
+            self.bodyStream.finish(reason)
+        super().connectionLost(reason)
+
+    def _refuse(self) -> None:
+        """
+        The body is too large: answer with a 413 if nothing has been written
+        yet, and close the connection rather than read the rest.
+        """
+        self._refused = True
+        if self.bodyStream is not None:
+            self.bodyStream.finish(Failure(RequestEntityTooLarge()))
+        transport: Any = self.channel.transport
+        if not self.startedWriting:
+            transport.write(_tooLarge)
+        transport.loseConnection()
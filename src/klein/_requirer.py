@@ -9,6 +9,7 @@ from twisted.web.iweb import IRequest
 
 from ._app import _call
 from ._decorators import bindable, modified
+from ._instrumentation import INJECT, PREPARE, requestTimings
 from .interfaces import (
     EarlyExit,
     IDependencyInjector,
@@ -132,12 +133,17 @@ class Requirer:
                 instance: Any, request: IRequest, *args: Any, **routeParams: Any
             ) -> Any:
                 injected = routeParams.copy()
+                timings = requestTimings(request)
                 try:
                     yield lifecycle.runPrepareHooks(instance, request)
+                    if timings is not None:
+                        timings.mark(PREPARE)
                     for k, injector in injectors.items():
                         injected[k] = yield injector.injectValue(
                             instance, request, routeParams
                         )
+                    if timings is not None:
+                        timings.mark(INJECT)
                 except EarlyExit as ee:
                     result = ee.alternateReturnValue
                 else:
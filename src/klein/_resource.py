@@ -1,27 +1,63 @@
 # -*- test-case-name: klein.test.test_resource -*-
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Any, Optional, Sequence, Tuple, Union, cast
-
-from werkzeug.exceptions import HTTPException
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.routing import Rule
 
 from twisted.internet import defer
 from twisted.internet.defer import Deferred, maybeDeferred, succeed
 from twisted.python import log
 from twisted.python.failure import Failure
 from twisted.web import server
+from twisted.web.http import NO_BODY_CODES
 from twisted.web.iweb import IRenderable, IRequest
 from twisted.web.resource import IResource, Resource, getChildForRequest
 from twisted.web.template import renderElement
 
+from ._canned import cannedResponses
+from ._compression import ResponseEncoder, negotiate
+from ._conditional import answerNotModified
 from ._dihttp import Response
+from ._instrumentation import (
+    HANDLER,
+    MATCH,
+    RENDER,
+    URL,
+    RequestTimings,
+    deliverTimings,
+)
 from ._interfaces import IKleinRequest
+from ._limits import ConcurrencyLimit
+from ._profiling import RequestProfile
+from ._requestbody import BodyPolicy, bodyFount, bufferedLength
+from ._responsecache import (
+    CachedResponse,
+    CacheKey,
+    CachePolicy,
+    ResponseCache,
+    cacheKey,
+    mayServeFromCache,
+    mayStore,
+)
+from ._streaming import Stream, StreamProducer, isStream
 
 
 if TYPE_CHECKING:
     # NB: circular import, must not be imported at runtime.
     from ._app import (
-        ErrorMethods,
         Klein,
         KleinRenderable,
         KleinRouteHandler,
@@ -43,6 +79,44 @@ def ensure_utf8_bytes(v: Union[str, bytes]) -> bytes:
     return v
 
 
+def _requestFinished(request: IRequest) -> bool:
+    """
+    Has C{request} been finished, or has its connection gone away?
+    """
+    return bool(
+        getattr(request, "finished", False)
+        or getattr(request, "_disconnected", False)
+    )
+
+
+def _constantBody(request: IRequest) -> None:
+    """
+    The whole body of the response to C{request} will be sent again, so its
+    compressed form is worth keeping.  A L{Response} body of L{bytes} is
+    written as it is, and so counts as constant.
+    """
+    encoder = getattr(request, "_encoder", None)
+    if isinstance(encoder, ResponseEncoder):
+        encoder.cacheable = True
+
+
+def _marking(
+    result: object, request: IRequest, timings: RequestTimings, stage: str
+) -> object:
+    """
+    Record the end of C{stage} in C{timings}, unless C{request} has already
+    been finished, and pass C{result} on.
+    """
+    if not _requestFinished(request):
+        timings.mark(stage)
+    return result
+
+
+_cacheableMethods = frozenset([b"GET", b"HEAD"])
+
+_Store = Tuple[ResponseCache, CacheKey, CachePolicy]
+
+
 class _StandInResource:
     """
     A standin for a Resource.
@@ -158,6 +232,9 @@ class KleinResource(Resource):
         return not result
 
     def render(self, request: IRequest) -> KleinRenderable:
+        observers = self._app.timing_observers
+        timings = RequestTimings(request.method) if observers else None
+
         # Stuff we need to know for the mapper.
         try:
             (
@@ -174,152 +251,364 @@ class KleinResource(Resource):
             return b"Non-UTF-8 encoding in URL."
 
         # Bind our mapper.
-        mapper = self._app.url_map.bind(
+        mapper = self._app.adapter_pool.bind(
+            self._app.url_map,
             server_name,
             script_name,
-            path_info=path_info,
-            default_method=request.method.decode("utf-8"),
-            url_scheme=url_scheme,
+            url_scheme,
+            path_info,
+            request.method.decode("utf-8"),
         )
         # Make the mapper available to the view.
         kleinRequest = IKleinRequest(request)
         kleinRequest.mapper = mapper
+        kleinRequest.json_codec = self._app.json_codec
+        if timings is not None:
+            timings.mark(URL)
+            kleinRequest.timings = timings
+
+        inFlight = self._app.in_flight
+        inFlight.started(request)
+
+        store: Optional[_Store] = None
+        profile: Optional[RequestProfile] = None
+        # The limit this request has been admitted under, if any.
+        admitted: Optional[ConcurrencyLimit] = None
+        try:
+            (rule, kwargs) = self._app.match(mapper)
+            if timings is not None:
+                timings.endpoint = rule.endpoint
+                timings.mark(MATCH)
+            metadata = route_metadata(self._app.endpoints[rule.endpoint])
+            maxBodySize = metadata.max_body_size
+            if (
+                maxBodySize is not None
+                and bufferedLength(request) > maxBodySize
+            ):
+                raise RequestEntityTooLarge()
+            if metadata.stream_body:
+                kleinRequest.body_fount = bodyFount(request)
+            compression = metadata.compression
+            if (
+                compression is not None
+                and getattr(request, "_encoder", False) is None
+            ):
+                request._encoder = (  # type: ignore[attr-defined]
+                    ResponseEncoder(request, compression, negotiate(request))
+                )
+            policy = metadata.cache_policy
+            if policy is not None and request.method in _cacheableMethods:
+                cache = self._app.response_cache
+                key = cacheKey(rule.endpoint, server_name, request, policy)
+                if mayServeFromCache(request):
+                    cached = cache.get(key)
+                    if cached is not None:
+                        self._writeCached(cached, request)
+                        inFlight.finished()
+                        if timings is not None:
+                            deliverTimings(timings, request, observers)
+                        return server.NOT_DONE_YET  # type: ignore[return-value]
+                store = (cache, key, policy)
+            admission = self._app.admission_controller
+            if admission is not None:
+                admission.admit(metadata.priority)
+            limit = metadata.concurrency_limit
+            waiting = None
+            if limit is not None:
+                waiting = limit.acquire()
+                if waiting is None:
+                    admitted = limit
+                else:
+                    waiting.addCallback(self._admitted, request, limit)
+            profiler = self._app.profiler
+            if profiler is not None:
+                profile = profiler.start(request, rule.endpoint)
+            execute: Callable[..., object] = self._execute
+            if profile is not None:
+                execute = partial(profile.run, execute)
+            if waiting is None:
+                result = execute(request, rule, kwargs)
+            else:
+                result = waiting.addCallback(
+                    lambda _: execute(request, rule, kwargs)
+                )
+            if timings is not None and not isinstance(result, Deferred):
+                timings.mark(HANDLER)
+        except BaseException:
+            d = defer.fail()
+        else:
+            if isinstance(result, Response):
+                body = result.body
+                if body is None or isinstance(body, (str, bytes)):
+                    if isinstance(body, bytes):
+                        _constantBody(request)
+                    result = result._applyToRequest(request)
+            if result is None or isinstance(result, (str, bytes)):
+                # Synchronous fast path: nothing to wait for, so we don't need
+                # any of the Deferred machinery below.
+                try:
+                    if store is not None:
+                        self._remember(result, request, *store)
+                    if profile is None:
+                        self._writeResponse(result, request)
+                    else:
+                        profile.run(self._writeResponse, result, request)
+                except BaseException:
+                    log.err(None, "Unhandled Error writing response")
+                inFlight.finished()
+                if admitted is not None:
+                    admitted.release()
+                if profile is not None:
+                    profile.finished()
+                if timings is not None:
+                    deliverTimings(timings, request, observers)
+                return server.NOT_DONE_YET  # type: ignore[return-value]
+
+            if isinstance(result, Deferred):
+                d = result
+            else:
+                d = succeed(result)
 
-        # Make sure we'll notice when the connection goes away unambiguously.
-        request_finished = [False]
-
-        def _finish(result: object) -> None:
-            request_finished[0] = True
-
-        def _execute() -> Deferred:
-            # Actually doing the match right here. This can cause an exception
-            # to percolate up. If that happens it will be handled below in
-            # processing_failed, either by a user-registered error handler or
-            # one of our defaults.
-            (rule, kwargs) = mapper.match(return_rule=True)
-            endpoint = rule.endpoint
-
-            # Try pretty hard to fix up prepath and postpath.
-            segment_count = route_metadata(
-                self._app.endpoints[endpoint]
-            ).segment_count
-            request.prepath.extend(request.postpath[:segment_count])
-            request.postpath = request.postpath[segment_count:]
+            request.notifyFinish().addErrback(  # type: ignore[attr-defined]
+                lambda _: d.cancel(),
+            )
 
+        inFlight.finishedWith(request)
+        if admitted is not None:
+            release = admitted.release
             request.notifyFinish().addBoth(  # type: ignore[attr-defined]
-                _finish,
+                lambda _: release()
             )
-
-            # Standard Twisted Web stuff. Defer the method action, giving us
-            # something renderable or printable. Return NOT_DONE_YET and set up
-            # the incremental renderer.
-            d = maybeDeferred(
-                self._app.execute_endpoint, endpoint, request, **kwargs
+        if timings is not None:
+            request.notifyFinish().addBoth(  # type: ignore[attr-defined]
+                lambda _: deliverTimings(timings, request, observers)
             )
-
-            request.notifyFinish().addErrback(  # type: ignore[attr-defined]
-                lambda _: d.cancel(),
+            d.addCallback(_marking, request, timings, HANDLER)
+        process, write = self._process, self._writeResponse
+        if profile is not None:
+            request.notifyFinish().addBoth(  # type: ignore[attr-defined]
+                profile.finished
             )
+            process = partial(profile.run, process)
+            write = partial(profile.run, write)
+        d.addCallback(process, request)
+        if timings is not None:
+            d.addCallback(_marking, request, timings, RENDER)
+        if store is not None:
+            d.addCallback(self._remember, request, *store)
+        d.addErrback(self._processingFailed, request)
+        d.addCallback(write, request)
+        d.addErrback(log.err, _why="Unhandled Error writing response")
 
-            return d
-
-        d = maybeDeferred(_execute)
-
-        # typing note: returns Any because Response._applyToRequest returns Any
-        def process(r: object) -> Any:
-            """
-            Recursively go through r and any child Resources until something
-            returns an IRenderable, then render it and let the result of that
-            bubble back up.
-            """
-            if isinstance(r, Response):
-                r = r._applyToRequest(request)
-
-            if IResource.providedBy(r):
-                request.render(  # type: ignore[attr-defined]
-                    getChildForRequest(r, request)
-                )
-                return StandInResource
-
-            if IRenderable.providedBy(r):
-                renderElement(request, r)
-                return StandInResource
-
-            return r
-
-        d.addCallback(process)
-
-        def processing_failed(
-            failure: Failure, error_handlers: ErrorMethods
-        ) -> Optional[Deferred]:
-            # The failure processor writes to the request.  If the
-            # request is already finished we should suppress failure
-            # processing.  We don't return failure here because there
-            # is no way to surface this failure to the user if the
-            # request is finished.
-            if request_finished[0]:
-                if not failure.check(defer.CancelledError):
-                    log.err(failure, "Unhandled Error Processing Request.")
-                return None
-
-            # If there are no more registered handlers, apply some defaults
-            if len(error_handlers) == 0:
-                if failure.check(HTTPException):
-                    he = failure.value
-                    assert isinstance(he, HTTPException)
-                    request.setResponseCode(he.code)
-                    resp = he.get_response({})
-
-                    for header, value in resp.headers:
-                        request.setHeader(
-                            ensure_utf8_bytes(header), ensure_utf8_bytes(value)
-                        )
-
-                    encoded = resp.iter_encoded()  # type: ignore[attr-defined]
-                    return succeed(ensure_utf8_bytes(b"".join(encoded)))
-                else:
-                    request.processingFailed(  # type: ignore[attr-defined]
-                        failure,
-                    )
-                    return None
-
-            error_handler = error_handlers[0]
-
-            # Each error handler is a tuple of
-            # (list_of_exception_types, handler_fn)
-            if failure.check(*error_handler[0]):
-                handler_func = error_handler[1]
-                d = maybeDeferred(
-                    self._app.execute_error_handler,
-                    handler_func,
-                    request,
-                    failure,
-                )
+        return server.NOT_DONE_YET  # type: ignore[return-value]
 
-                d.addCallback(process)
+    def bodyPolicy(self, request: IRequest) -> BodyPolicy:
+        """
+        How the body of C{request}, whose headers have arrived but whose body
+        hasn't, is to be handled by the route it would match, for
+        L{StreamingRequest}.
 
-                return d.addErrback(processing_failed, error_handlers[1:])
+        @return: Whether the route has C{stream_body}, and its
+            C{max_body_size}; or C{(False, None)} if no route matches.
+        """
+        try:
+            (
+                url_scheme,
+                server_name,
+                server_port,
+                path_info,
+                script_name,
+            ) = extractURLparts(request)
+            mapper = self._app.adapter_pool.bind(
+                self._app.url_map,
+                server_name,
+                script_name,
+                url_scheme,
+                path_info,
+                request.method.decode("utf-8"),
+            )
+            (rule, kwargs) = self._app.match(mapper)
+        except (URLDecodeError, HTTPException, UnicodeDecodeError):
+            return False, None
+        metadata = route_metadata(self._app.endpoints[rule.endpoint])
+        return metadata.stream_body, metadata.max_body_size
+
+    def _execute(
+        self, request: IRequest, rule: Rule, kwargs: Dict[str, Any]
+    ) -> object:
+        """
+        Execute the endpoint of the matched C{rule}.
 
-            return processing_failed(failure, error_handlers[1:])
+        This can cause an exception to percolate up.  If that happens it will
+        be handled by L{KleinResource._processingFailed}, either by a
+        user-registered error handler or one of our defaults.
+        """
+        endpoint = rule.endpoint
 
-        d.addErrback(processing_failed, self._app._error_handlers)
+        # Try pretty hard to fix up prepath and postpath.
+        segment_count = route_metadata(
+            self._app.endpoints[endpoint]
+        ).segment_count
+        request.prepath.extend(request.postpath[:segment_count])
+        request.postpath = request.postpath[segment_count:]
 
-        def write_response(
-            r: Union[_StandInResource, str, bytes, int, None]
-        ) -> None:
-            if r is StandInResource:
-                return
+        return self._app.execute_endpoint(endpoint, request, **kwargs)
 
-            if isinstance(r, str):
-                r = r.encode("utf-8")
+    def _admitted(
+        self, _: None, request: IRequest, limit: ConcurrencyLimit
+    ) -> None:
+        """
+        C{request} has waited its turn under C{limit}: let the next request
+        in once it's finished.
+        """
+        request.notifyFinish().addBoth(  # type: ignore[attr-defined]
+            lambda _: limit.release()
+        )
 
-            if isinstance(r, bytes):
-                request.write(r)
+    def _remember(
+        self,
+        r: object,
+        request: IRequest,
+        cache: ResponseCache,
+        key: CacheKey,
+        policy: CachePolicy,
+    ) -> object:
+        """
+        Store the response C{r} to C{request} in C{cache}, if it is a complete
+        response body that may be cached, then pass it on.
+        """
+        if isinstance(r, str):
+            r = r.encode("utf-8")
+        if isinstance(r, bytes) and mayStore(request):
+            cache.store(key, policy, request, r)
+        return r
 
-            if not request_finished[0]:
-                request.finish()
+    def _writeCached(self, cached: CachedResponse, request: IRequest) -> None:
+        """
+        Answer C{request} with a response from a L{ResponseCache}.
+        """
+        request.setResponseCode(cached.code)
+        for name, values in cached.headers:
+            request.responseHeaders.setRawHeaders(name, values)
+        age = self._app.response_cache.now() - cached.stored
+        request.setHeader(b"age", b"%d" % (age,))
+        if answerNotModified(request):
+            self._writeResponse(None, request)
+        else:
+            _constantBody(request)
+            self._writeResponse(cached.body, request)
+
+    # typing note: returns Any because Response._applyToRequest returns Any
+    def _process(self, r: object, request: IRequest) -> Any:
+        """
+        Recursively go through r and any child Resources until something
+        returns an IRenderable, then render it and let the result of that
+        bubble back up.
+        """
+        if isinstance(r, Response):
+            if isinstance(r.body, bytes):
+                _constantBody(request)
+            r = r._applyToRequest(request)
+
+        if IResource.providedBy(r):
+            request.render(  # type: ignore[attr-defined]
+                getChildForRequest(r, request)
+            )
+            return StandInResource
+
+        if IRenderable.providedBy(r):
+            renderElement(request, r)
+            return StandInResource
+
+        if isStream(r):
+            producer = StreamProducer(request, cast(Stream, r))
+            return producer.start().addCallback(lambda _: StandInResource)
+
+        return r
+
+    def _processingFailed(
+        self,
+        failure: Failure,
+        request: IRequest,
+        after: int = -1,
+    ) -> Optional[Deferred]:
+        # The failure processor writes to the request.  If the
+        # request is already finished we should suppress failure
+        # processing.  We don't return failure here because there
+        # is no way to surface this failure to the user if the
+        # request is finished.
+        if _requestFinished(request):
+            if not failure.check(defer.CancelledError):
+                log.err(failure, "Unhandled Error Processing Request.")
+            return None
+
+        # If there are no more registered handlers, apply some defaults
+        found = self._app.next_error_handler(failure, after)
+        if found is None:
+            if failure.check(HTTPException):
+                he = failure.value
+                assert isinstance(he, HTTPException)
+                canned = cannedResponses.responseFor(he)
+                if canned is not None:
+                    code, headers, body = canned
+                    _constantBody(request)
+                    request.setResponseCode(code)
+                    for name, raw in headers:
+                        request.setHeader(name, raw)
+                    return succeed(body)
+
+                request.setResponseCode(he.code)
+                resp = he.get_response({})
+
+                for header, value in resp.headers:
+                    request.setHeader(
+                        ensure_utf8_bytes(header), ensure_utf8_bytes(value)
+                    )
 
-        d.addCallback(write_response)
-        d.addErrback(log.err, _why="Unhandled Error writing response")
+                encoded = resp.iter_encoded()  # type: ignore[attr-defined]
+                return succeed(ensure_utf8_bytes(b"".join(encoded)))
+            else:
+                request.processingFailed(  # type: ignore[attr-defined]
+                    failure,
+                )
+                return None
 
-        return server.NOT_DONE_YET  # type: ignore[return-value]
+        # Each failed handler falls back to the next registered handler that
+        # can handle its failure.
+        index, handler_func = found
+        d = maybeDeferred(
+            self._app.execute_error_handler,
+            handler_func,
+            request,
+            failure,
+        )
+        d.addCallback(self._process, request)
+        return d.addErrback(self._processingFailed, request, index)
+
+    def _writeResponse(
+        self,
+        r: Union[_StandInResource, str, bytes, int, None],
+        request: IRequest,
+    ) -> None:
+        if r is StandInResource:
+            return
+
+        if isinstance(r, str):
+            r = r.encode("utf-8")
+
+        if isinstance(r, bytes):
+            if (
+                not getattr(request, "startedWriting", True)
+                and cast(server.Request, request).code not in NO_BODY_CODES
+                and not request.responseHeaders.hasHeader(b"content-length")
+            ):
+                # We know the whole body, so don't make Twisted fall back to
+                # chunked encoding.
+                encoder = getattr(request, "_encoder", None)
+                if isinstance(encoder, ResponseEncoder):
+                    r = encoder.encodeBody(r)
+                request.setHeader(b"content-length", b"%d" % (len(r),))
+            request.write(r)
+
+        if not _requestFinished(request):
+            request.finish()
@@ -0,0 +1,259 @@
+# -*- test-case-name: klein.test.test_responsecache -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Caching of the responses of routes.
+
+A route opts in with C{@app.route(..., cache=CachePolicy(ttl=5))}.
+L{KleinResource} then stores the status, headers and body of successful
+responses to C{GET} and C{HEAD} requests for it in the application's
+L{ResponseCache}, and answers the same request from there until the entry
+expires, without calling the route's handler.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+from typing import (
+    Callable,
+    Iterable,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
+
+import attr
+
+from twisted.web.iweb import IRequest
+from twisted.web.server import Request
+
+from ._dispatch import CacheStats
+
+
+__all__ = ()
+
+
+def _normalizeVary(vary: Iterable[Union[str, bytes]]) -> Tuple[bytes, ...]:
+    return tuple(
+        (name.encode("ascii") if isinstance(name, str) else name).lower()
+        for name in vary
+    )
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class CachePolicy:
+    """
+    How to cache the responses of a route.
+
+    @ivar ttl: How many seconds a response is served from the cache for.
+    @ivar vary: The names of the request headers the response depends on,
+        besides the host name and the URI; requests with different values for
+        any of them are cached separately.
+    """
+
+    ttl: float
+    vary: Sequence[bytes] = attr.ib(default=(), converter=_normalizeVary)
+
+
+Headers = Tuple[Tuple[bytes, Tuple[bytes, ...]], ...]
+CacheKey = Tuple[str, str, bytes, Tuple[Optional[bytes], ...]]
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class CachedResponse:
+    """
+    A response stored in a L{ResponseCache}.
+
+    @ivar code: The response code.
+    @ivar headers: The response headers, excluding those that describe the
+        connection or a particular transmission of the response.
+    @ivar body: The response body.
+    @ivar stored: When the response was stored.
+    @ivar expires: When the response stops being served.
+    """
+
+    code: int
+    headers: Headers
+    body: bytes
+    stored: float
+    expires: float
+
+    @property
+    def size(self) -> int:
+        """
+        An estimate of the memory used by this response, in bytes.
+        """
+        return (
+            len(self.body)
+            + sum(
+                len(name) + sum(len(value) for value in values)
+                for name, values in self.headers
+            )
+            + 256
+        )
+
+
+# Headers which are never stored, because they're about this particular
+# transmission of the response rather than its content.
+_unstoredHeaders = frozenset(
+    [
+        b"age",
+        b"connection",
+        b"content-length",
+        b"date",
+        b"keep-alive",
+        b"server",
+        b"set-cookie",
+        b"transfer-encoding",
+    ]
+)
+
+
+def _directives(
+    request: IRequest, headerName: bytes, response: bool
+) -> Set[bytes]:
+    headers = request.responseHeaders if response else request.requestHeaders
+    return {
+        directive.strip().split(b"=", 1)[0].lower()
+        for value in headers.getRawHeaders(headerName, [])
+        for directive in value.split(b",")
+    }
+
+
+def mayServeFromCache(request: IRequest) -> bool:
+    """
+    May C{request} be answered with a cached response?
+
+    Clients can demand a fresh response with C{Cache-Control: no-cache} (or
+    C{Pragma: no-cache}), or forbid storing it with C{Cache-Control:
+    no-store}.
+    """
+    directives = _directives(request, b"cache-control", False)
+    directives |= _directives(request, b"pragma", False)
+    return not directives & {b"no-cache", b"no-store"}
+
+
+def mayStore(request: IRequest) -> bool:
+    """
+    May the response to C{request}, as it is now, be stored in a
+    L{ResponseCache}?
+
+    Only complete C{200} responses that are not setting cookies and do not
+    forbid it with their own C{Cache-Control} header can be stored.
+    """
+    code = cast(Request, request).code
+    if code != 200 or getattr(request, "startedWriting", True):
+        return False
+    if getattr(request, "cookies", None):
+        return False
+    if b"no-store" in _directives(request, b"cache-control", False):
+        return False
+    directives = _directives(request, b"cache-control", True)
+    return not directives & {b"no-store", b"private", b"no-cache"}
+
+
+def cacheKey(
+    endpoint: str, serverName: str, request: IRequest, policy: CachePolicy
+) -> CacheKey:
+    """
+    Compute the key of the response to C{request} for the route named
+    C{endpoint}.
+    """
+    return (
+        endpoint,
+        serverName,
+        request.uri,
+        tuple(request.getHeader(name) for name in policy.vary),
+    )
+
+
+class ResponseCache:
+    """
+    An LRU of the responses of routes, bounded by their total size.
+
+    @ivar maxBytes: The maximum total size of the cached responses; the least
+        recently used responses are evicted to stay below it.
+    @ivar now: A callable returning the current time, in seconds.
+    """
+
+    def __init__(
+        self,
+        maxBytes: int = 16 * 1024 * 1024,
+        now: Callable[[], float] = monotonic,
+    ) -> None:
+        self.maxBytes = maxBytes
+        self.now = now
+        self._responses: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def totalBytes(self) -> int:
+        """
+        The total size of the cached responses.
+        """
+        return self._bytes
+
+    def stats(self) -> CacheStats:
+        """
+        Report how effective this cache has been.
+        """
+        return CacheStats(self._hits, self._misses, len(self._responses))
+
+    def invalidate(self) -> None:
+        """
+        Discard all cached responses.
+        """
+        self._responses.clear()
+        self._bytes = 0
+
+    def _discard(self, key: CacheKey) -> None:
+        self._bytes -= self._responses.pop(key).size
+
+    def get(self, key: CacheKey) -> Optional[CachedResponse]:
+        """
+        Get the unexpired response stored as C{key}, if any.
+        """
+        response = self._responses.get(key)
+        if response is not None:
+            if response.expires > self.now():
+                self._hits += 1
+                self._responses.move_to_end(key)
+                return response
+            self._discard(key)
+        self._misses += 1
+        return None
+
+    def store(
+        self, key: CacheKey, policy: CachePolicy, request: IRequest, body: bytes
+    ) -> None:
+        """
+        Store the response to C{request}, with the given C{body}, as C{key},
+        according to C{policy}.
+        """
+        if policy.ttl <= 0:
+            return
+        now = self.now()
+        response = CachedResponse(
+            code=cast(Request, request).code,
+            headers=tuple(
+                (name, tuple(values))
+                for name, values in request.responseHeaders.getAllRawHeaders()
+                if name.lower() not in _unstoredHeaders
+            ),
+            body=body,
+            stored=now,
+            expires=now + policy.ttl,
+        )
+        size = response.size
+        if size > self.maxBytes:
+            return
+        if key in self._responses:
+            self._discard(key)
+        self._responses[key] = response
+        self._bytes += size
+        while self._bytes > self.maxBytes:
+            self._discard(next(iter(self._responses)))
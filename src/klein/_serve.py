@@ -0,0 +1,396 @@
+# -*- test-case-name: klein.test.test_serve -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Serving an application from several worker processes, and the
+C{python -m klein serve} command.
+
+The supervising process binds the listening socket once and starts each
+worker by running its own command line again, with the socket's file
+descriptor and L{WORKER_ENV} in the environment; when the worker gets to
+L{klein.Klein.run} in turn, it adopts the socket with
+C{IReactorSocket.adoptStreamPort} instead of starting workers of its own.
+With C{reuse_port=True}, each worker instead binds a socket of its own with
+C{SO_REUSEPORT}, and the kernel balances connections between them.
+
+Workers are started by running a new interpreter rather than by forking,
+because Twisted's reactor is created as soon as it is imported and can't be
+shared with, or safely reinitialized in, a forked child.
+"""
+
+import gc
+import os
+import socket
+import sys
+from argparse import ArgumentParser
+from importlib import import_module
+from time import monotonic
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Union,
+    cast,
+)
+
+from twisted.internet.defer import Deferred, DeferredList, succeed
+from twisted.internet.error import ProcessDone, ProcessExitedAlready
+from twisted.internet.interfaces import (
+    IDelayedCall,
+    IListeningPort,
+    IProtocolFactory,
+)
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
+from twisted.python.failure import Failure
+
+
+__all__ = ()
+
+
+WORKER_ENV = "KLEIN_WORKER"
+"""
+Set in the environment of worker processes, to the worker's index.
+"""
+
+LISTEN_FD_ENV = "KLEIN_LISTEN_FD"
+"""
+Set in the environment of worker processes to the file descriptor of the
+listening socket they share, unless they bind their own.
+"""
+
+
+def isWorker() -> bool:
+    """
+    Is this process a worker started by a L{Supervisor}?
+    """
+    return WORKER_ENV in os.environ
+
+
+def listeningSocket(
+    interface: str, port: int, reusePort: bool = False, backlog: int = 50
+) -> socket.socket:
+    """
+    Bind and listen on a non-blocking TCP socket.
+
+    @param interface: The address to bind to; C{""} for every IPv4
+        interface.
+    @param port: The port to bind to.
+    @param reusePort: Whether to set C{SO_REUSEPORT}, so that other
+        processes may bind the same address.
+    @param backlog: The size of the queue of connections waiting to be
+        accepted.
+    """
+    family = socket.AF_INET6 if ":" in interface else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reusePort:
+            reuseport = getattr(socket, "SO_REUSEPORT", None)
+            if reuseport is None:
+                raise ValueError("SO_REUSEPORT is not supported here")
+            sock.setsockopt(socket.SOL_SOCKET, reuseport, 1)
+        sock.bind((interface, port))
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def inheritedSocket(fd: str) -> socket.socket:
+    """
+    The listening socket a worker inherited from its L{Supervisor}.
+
+    @param fd: The value of L{LISTEN_FD_ENV}.
+
+    @raise ValueError: If C{fd} isn't a file descriptor.
+    """
+    try:
+        fileno = int(fd)
+    except ValueError:
+        fileno = -1
+    if fileno < 0:
+        raise ValueError(f"{LISTEN_FD_ENV} is not a file descriptor: {fd!r}")
+    return socket.socket(fileno=fileno)
+
+
+def workerCommand() -> List[str]:
+    """
+    The command line which started this process, to start workers with.
+    """
+    origArgv: Optional[List[str]] = getattr(sys, "orig_argv", None)
+    if origArgv:
+        return list(origArgv)
+    spec = getattr(sys.modules["__main__"], "__spec__", None)
+    if spec is not None:  # pragma: no cover
+        # Python < 3.10, run with -m
+        return [sys.executable, "-m", spec.name] + sys.argv[1:]
+    return [sys.executable] + sys.argv  # pragma: no cover
+
+
+class _WorkerProtocol(ProcessProtocol):
+    """
+    Tell a L{Supervisor} when one of its workers exits.
+    """
+
+    def __init__(self, ended: Callable[[Failure], None]) -> None:
+        self._ended = ended
+
+    def processEnded(self, reason: Failure) -> None:
+        self._ended(reason)
+
+
+class Supervisor:
+    """
+    Start a number of worker processes, and restart them when they exit
+    until told to stop.
+
+    A worker which exits within C{minUptime} seconds of being started is
+    restarted after a delay, which doubles for each successive early exit up
+    to C{maxDelay} seconds, so that a worker which can't start doesn't spin.
+
+    @ivar workers: The process transports of the running workers, by index.
+    """
+
+    def __init__(
+        self,
+        reactor: Any,
+        count: int,
+        command: Sequence[str],
+        env: Dict[str, str],
+        childFDs: Dict[int, Any],
+        minUptime: float = 1.0,
+        maxDelay: float = 30.0,
+        now: Callable[[], float] = monotonic,
+    ) -> None:
+        self._reactor = reactor
+        self._count = count
+        self._command = list(command)
+        self._env = env
+        self._childFDs = childFDs
+        self._minUptime = minUptime
+        self._maxDelay = maxDelay
+        self._now = now
+        self._stopping = False
+        self.workers: Dict[int, Any] = {}
+        self._started: Dict[int, float] = {}
+        self._delays: Dict[int, float] = {}
+        self._restarts: Dict[int, IDelayedCall] = {}
+        self._exited: Dict[int, List[Deferred[None]]] = {}
+
+    def start(self) -> None:
+        """
+        Start every worker.
+        """
+        for index in range(self._count):
+            self._spawn(index)
+
+    def _spawn(self, index: int) -> None:
+        self._restarts.pop(index, None)
+        env = dict(self._env)
+        env[WORKER_ENV] = str(index)
+        self.workers[index] = self._reactor.spawnProcess(
+            _WorkerProtocol(lambda reason: self._ended(index, reason)),
+            self._command[0],
+            self._command,
+            env=env,
+            childFDs=self._childFDs,
+        )
+        self._started[index] = self._now()
+
+    def _ended(self, index: int, reason: Failure) -> None:
+        del self.workers[index]
+        for waiting in self._exited.pop(index, []):
+            waiting.callback(None)
+        if self._stopping:
+            return
+        if reason.check(ProcessDone):
+            log.msg(f"Worker {index} exited; restarting it")
+        else:
+            log.msg(f"Worker {index} died ({reason.value}); restarting it")
+        if self._now() - self._started[index] < self._minUptime:
+            delay = min(
+                max(self._delays.get(index, 0.0) * 2, 1.0), self._maxDelay
+            )
+        else:
+            delay = 0.0
+        self._delays[index] = delay
+        self._restarts[index] = self._reactor.callLater(
+            delay, self._spawn, index
+        )
+
+    def stop(self, signal: str = "TERM") -> "Deferred[object]":
+        """
+        Stop restarting workers, and send each running worker C{signal}.
+
+        @return: A L{Deferred} which fires once every worker has exited.
+        """
+        self._stopping = True
+        for restart in self._restarts.values():
+            restart.cancel()
+        self._restarts.clear()
+        if not self.workers:
+            return succeed(None)
+        waiting = []
+        for index, process in list(self.workers.items()):
+            exited: Deferred[None] = Deferred()
+            self._exited.setdefault(index, []).append(exited)
+            waiting.append(exited)
+            try:
+                process.signalProcess(signal)
+            except ProcessExitedAlready:
+                pass
+        return DeferredList(waiting).addCallback(lambda _: None)
+
+
+def serveWorkers(
+    reactor: Any,
+    factory: IProtocolFactory,
+    interface: str,
+    port: int,
+    workers: int,
+    reusePort: bool = False,
+) -> Union[Supervisor, IListeningPort]:
+    """
+    Arrange for C{factory} to be served on C{interface} and C{port} by
+    C{workers} worker processes once C{reactor} runs.
+
+    In a worker, this listens with C{factory}; otherwise it starts a
+    L{Supervisor} of workers, running this process's command line again.
+
+    @return: The L{Supervisor}, or the listening port in a worker.
+
+    @raise ValueError: If C{reusePort} is given without a C{port}, since each
+        worker would then bind a different one.
+    """
+    if reusePort and not port:
+        raise ValueError("reusePort needs a port for the workers to share")
+    if isWorker():
+        inherited = os.environ.get(LISTEN_FD_ENV)
+        if inherited is not None:
+            sock = inheritedSocket(inherited)
+        else:
+            sock = listeningSocket(interface, port, reusePort=True)
+        listeningPort = reactor.adoptStreamPort(
+            sock.fileno(), sock.family, factory
+        )
+        sock.close()
+        # Everything imported so far lives as long as the process does, so
+        # keep the collector from scanning it again and again.
+        gc.freeze()
+        return cast(IListeningPort, listeningPort)
+
+    env = dict(os.environ)
+    childFDs: Dict[int, Any] = {0: 0, 1: 1, 2: 2}
+    if not reusePort:
+        sock = listeningSocket(interface, port)
+        fd = sock.fileno()
+        # Keep the socket open, and inherited by the workers, for as long as
+        # this process runs.
+        os.set_inheritable(fd, True)
+        reactor.addSystemEventTrigger("after", "shutdown", sock.close)
+        env[LISTEN_FD_ENV] = str(fd)
+        childFDs[fd] = fd
+    supervisor = Supervisor(reactor, workers, workerCommand(), env, childFDs)
+    reactor.callWhenRunning(supervisor.start)
+    reactor.addSystemEventTrigger("before", "shutdown", supervisor.stop)
+    return supervisor
+
+
+def loadApp(name: str) -> Any:
+    """
+    Import an application given as C{"package.module:attribute"}, where the
+    attribute defaults to C{app}.
+    """
+    moduleName, _, attribute = name.partition(":")
+    obj: Any = import_module(moduleName)
+    for part in (attribute or "app").split("."):
+        obj = getattr(obj, part)
+    return obj
+
+
+_sizeSuffixes = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parseSize(size: str) -> int:
+    """
+    Parse a number of bytes, optionally with a C{K}, C{M} or C{G} suffix.
+    """
+    multiplier = _sizeSuffixes.get(size[-1:].upper())
+    if multiplier is None:
+        return int(size)
+    return int(float(size[:-1]) * multiplier)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """
+    Entry point for C{python -m klein}.
+    """
+    parser = ArgumentParser(prog="python -m klein")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Serve a Klein application.")
+    serve.add_argument(
+        "app", help="The application, as package.module:attribute."
+    )
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument(
+        "--endpoint",
+        help="A Twisted server endpoint description to listen on instead "
+        "of --host and --port; only with a single worker.",
+    )
+    serve.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of worker processes.",
+    )
+    serve.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="Have each worker bind its own socket with SO_REUSEPORT, rather "
+        "than sharing one.",
+    )
+    serve.add_argument(
+        "--max-requests",
+        type=int,
+        help="Recycle each worker after it has handled this many requests.",
+    )
+    serve.add_argument(
+        "--max-rss",
+        type=parseSize,
+        help="Recycle each worker once its resident memory exceeds this "
+        "many bytes; K, M and G suffixes are accepted.",
+    )
+    serve.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=30.0,
+        help="How long to let requests in flight finish when shutting down "
+        "or recycling a worker, in seconds.",
+    )
+    serve.add_argument(
+        "--no-tracebacks",
+        action="store_true",
+        help="Don't show tracebacks on error pages.",
+    )
+    options = parser.parse_args(argv)
+
+    app = loadApp(options.app)
+    app.run(
+        options.host,
+        options.port,
+        endpoint_description=options.endpoint,
+        displayTracebacks=not options.no_tracebacks,
+        workers=options.workers,
+        reuse_port=options.reuse_port,
+        max_requests=options.max_requests,
+        max_rss=options.max_rss,
+        drain_timeout=options.drain_timeout,
+    )
+    return 0
@@ -0,0 +1,201 @@
+# -*- test-case-name: klein.test.test_shedding -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Shedding load when the reactor falls behind.
+
+A L{LagMonitor} schedules a heartbeat with the reactor, and measures how late
+each one runs: when the reactor is overloaded, everything it does is
+delayed, including the heartbeat.  Once a L{AdmissionController} has been
+given to L{klein.Klein.shed_load}, L{KleinResource} asks it whether to
+handle each request; as the lag rises from C{lowLag} to C{highLag}, it
+answers a growing fraction of them with a 503 at once, rather than letting
+every request get slower.
+
+Routes have a priority: those with L{CRITICAL} priority, such as health
+checks, are never shed, and those with L{LOW} priority are shed twice as
+readily as those with the default, L{NORMAL}.
+"""
+
+from random import random
+from typing import Any, Callable, Optional
+
+import attr
+from werkzeug.exceptions import ServiceUnavailable
+
+
+__all__ = ()
+
+
+CRITICAL = "critical"
+NORMAL = "normal"
+LOW = "low"
+
+_priorities = {CRITICAL: 0.0, NORMAL: 1.0, LOW: 2.0}
+
+
+def checkPriority(priority: str) -> str:
+    """
+    Check that C{priority} is a known route priority.
+
+    @raise ValueError: If it isn't.
+    """
+    if priority not in _priorities:
+        raise ValueError(
+            f"Unknown priority {priority!r}; "
+            f"use one of {', '.join(sorted(_priorities))}"
+        )
+    return priority
+
+
+class LagMonitor:
+    """
+    Measure how late the reactor runs a heartbeat scheduled every
+    C{interval} seconds.
+
+    @ivar interval: The number of seconds between heartbeats.
+    @ivar smoothing: How much weight each heartbeat's lag has in L{lag},
+        from 0 to 1.
+    @ivar lag: A moving average of the lag, in seconds.
+    @ivar maxLag: The longest lag seen, in seconds.
+    @ivar clock: The L{IReactorTime} to measure; the global reactor, unless
+        another is given.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        smoothing: float = 0.3,
+        clock: Any = None,
+    ) -> None:
+        self.interval = interval
+        self.smoothing = smoothing
+        self.clock = clock
+        self.lag = 0.0
+        self.maxLag = 0.0
+        self._expected = 0.0
+        self._heartbeat: Any = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether heartbeats are being scheduled.
+        """
+        return self._heartbeat is not None
+
+    def start(self) -> None:
+        """
+        Start scheduling heartbeats.
+        """
+        if self._heartbeat is not None:
+            return
+        if self.clock is None:
+            from twisted.internet import reactor
+
+            self.clock = reactor
+        self._schedule()
+
+    def stop(self) -> None:
+        """
+        Stop scheduling heartbeats.
+        """
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+
+    def _schedule(self) -> None:
+        self._expected = self.clock.seconds() + self.interval
+        self._heartbeat = self.clock.callLater(self.interval, self._beat)
+
+    def _beat(self) -> None:
+        """
+        Record how late this heartbeat is, and schedule the next one.
+        """
+        lag = max(0.0, self.clock.seconds() - self._expected)
+        self.lag += self.smoothing * (lag - self.lag)
+        self.maxLag = max(self.maxLag, lag)
+        self._schedule()
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class SheddingStats:
+    """
+    A snapshot of the activity of an L{AdmissionController}.
+
+    @ivar lag: The reactor's lag, in seconds.
+    @ivar fraction: The fraction of L{NORMAL} requests being shed.
+    @ivar admitted: The number of requests admitted.
+    @ivar shed: The number of requests shed.
+    """
+
+    lag: float
+    fraction: float
+    admitted: int
+    shed: int
+
+
+class AdmissionController:
+    """
+    Decide which requests to shed, according to the lag measured by a
+    L{LagMonitor}.
+
+    @ivar monitor: The L{LagMonitor}.
+    @ivar lowLag: The lag, in seconds, above which requests start to be
+        shed.
+    @ivar highLag: The lag, in seconds, at which every request not of
+        L{CRITICAL} priority is shed.
+    @ivar retryAfter: The number of seconds that clients whose requests are
+        shed are told to wait before retrying.
+    """
+
+    def __init__(
+        self,
+        monitor: Optional[LagMonitor] = None,
+        lowLag: float = 0.05,
+        highLag: float = 0.5,
+        retryAfter: int = 1,
+        sample: Callable[[], float] = random,
+    ) -> None:
+        if highLag <= lowLag:
+            raise ValueError("highLag must be greater than lowLag")
+        self.monitor = LagMonitor() if monitor is None else monitor
+        self.lowLag = lowLag
+        self.highLag = highLag
+        self.retryAfter = retryAfter
+        self._sample = sample
+        self._admitted = 0
+        self._shed = 0
+
+    def stats(self) -> SheddingStats:
+        """
+        Report how much load is being shed, and has been.
+        """
+        return SheddingStats(
+            self.monitor.lag,
+            self.fraction(NORMAL),
+            self._admitted,
+            self._shed,
+        )
+
+    def fraction(self, priority: str) -> float:
+        """
+        The fraction of requests with the given priority to shed now.
+        """
+        excess = (self.monitor.lag - self.lowLag) / (self.highLag - self.lowLag)
+        return min(1.0, max(0.0, excess * _priorities[priority]))
+
+    def admit(self, priority: str) -> None:
+        """
+        Decide whether to handle a request to a route with the given
+        priority.
+
+        @raise ServiceUnavailable: If it's to be shed.
+        """
+        if priority != CRITICAL:
+            fraction = self.fraction(priority)
+            if fraction and self._sample() < fraction:
+                self._shed += 1
+                raise ServiceUnavailable(
+                    "The server is overloaded", retry_after=self.retryAfter
+                )
+        self._admitted += 1
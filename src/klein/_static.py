@@ -0,0 +1,639 @@
+# -*- test-case-name: klein.test.test_static -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Serving a directory of static files.
+
+Compared to L{twisted.web.static.File}, L{StaticFiles}:
+
+    - caches what it learns from C{stat()}ing files, re-checking each file's
+      modification time at most every C{recheck} seconds;
+
+    - sends file contents with C{os.sendfile} when the connection is a plain
+      TCP connection;
+
+    - supports single and multiple byte ranges;
+
+    - serves precompressed C{.br} and C{.gz} siblings of files to clients
+      which accept those encodings;
+
+    - emits strong C{ETag}s, and answers conditional requests with C{304 Not
+      Modified}.
+"""
+
+import os
+from collections import OrderedDict
+from mimetypes import guess_type
+from secrets import token_hex
+from stat import S_ISREG
+from time import monotonic
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+
+import attr
+from zope.interface import implementer
+
+from twisted.internet.interfaces import IPushProducer, ISSLTransport
+from twisted.internet.tcp import Connection
+from twisted.python import log
+from twisted.web.http import (
+    FORBIDDEN,
+    MOVED_PERMANENTLY,
+    NOT_FOUND,
+    PARTIAL_CONTENT,
+    REQUESTED_RANGE_NOT_SATISFIABLE,
+    stringToDatetime,
+)
+from twisted.web.iweb import IRequest
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+from ._app import Klein
+from ._compression import acceptedEncodings
+from ._conditional import answerNotModified, setValidators, wholeSeconds
+
+
+__all__ = ()
+
+
+# The file name suffix of the precompressed variant of a file, for each
+# content coding, in order of preference.
+_suffixes: Dict[str, str] = {"br": ".br", "gzip": ".gz"}
+
+# Requests for more ranges than this get the whole file instead.
+_maxRanges = 16
+
+# How much of a file is read and written at a time, when not using
+# sendfile.  It's more than the transport's buffer size, so that each write
+# pauses the producer until the transport has caught up, which is when the
+# buffer is known to be empty and sendfile can be used instead.
+_chunkSize = 128 * 1024
+
+# Files smaller than this are always written normally.
+_sendfileThreshold = 64 * 1024
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class _Representation:
+    """
+    A file, or a precompressed variant of it, as it was last C{stat()}ed.
+    """
+
+    path: str
+    size: int
+    etag: bytes
+    encoding: Optional[bytes] = None
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class _FileInfo:
+    """
+    Everything needed to serve a file, without touching the file system
+    until its contents are sent.
+
+    @ivar identity: The file itself.
+    @ivar variants: Its precompressed variants, in order of preference.
+    @ivar mtimeNs: Its modification time, in nanoseconds.
+    @ivar contentType: Its content type.
+    """
+
+    identity: _Representation
+    variants: Tuple[_Representation, ...]
+    mtimeNs: int
+    contentType: bytes
+
+    @property
+    def lastModified(self) -> float:
+        return self.mtimeNs / 1e9
+
+
+def _etag(size: int, mtimeNs: int, encoding: Optional[bytes] = None) -> bytes:
+    tag = b"%x-%x" % (mtimeNs, size)
+    if encoding is not None:
+        tag += b"-" + encoding
+    return b'"' + tag + b'"'
+
+
+def _segmentsToPath(root: str, segments: Sequence[bytes]) -> Optional[str]:
+    """
+    Map the segments of a request path to a file system path under C{root},
+    or L{None} if they would escape it.
+    """
+    names = []
+    for segment in segments:
+        if (
+            segment in (b"", b".", b"..")
+            or b"/" in segment
+            or b"\\" in segment
+            or b"\x00" in segment
+        ):
+            return None
+        names.append(os.fsdecode(segment))
+    return os.path.join(root, *names)
+
+
+def parseRanges(header: bytes, size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a C{Range} header for a representation of C{size} bytes.
+
+    @return: The satisfiable ranges, as inclusive C{(first, last)} byte
+        positions, which is empty if none of them are; or L{None} if the
+        header is invalid, uses another unit, or asks for too many ranges, in
+        which case it is ignored.
+    """
+    unit, _, specs = header.partition(b"=")
+    if unit.strip().lower() != b"bytes":
+        return None
+    ranges = []
+    elements = [spec.strip() for spec in specs.split(b",") if spec.strip()]
+    if not elements or len(elements) > _maxRanges:
+        return None
+    for spec in elements:
+        first, dash, last = spec.partition(b"-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                if suffix == 0 or size == 0:
+                    continue
+                ranges.append((max(0, size - suffix), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges
+
+
+Segment = Union[bytes, Tuple[int, int]]
+
+
+def _sendfileSocket(request: IRequest) -> Optional[int]:
+    """
+    The file descriptor of the socket to C{os.sendfile} the response to
+    C{request} to, if that is possible.
+    """
+    if not hasattr(os, "sendfile"):
+        return None
+    transport = getattr(getattr(request, "channel", None), "transport", None)
+    if not isinstance(transport, Connection):
+        return None
+    if ISSLTransport.providedBy(transport):
+        return None
+    return cast(int, transport.fileno())
+
+
+@implementer(IPushProducer)
+class FileProducer:
+    """
+    Write the segments of a response body, some literal C{bytes} and some
+    C{(offset, length)} ranges of a file, to a request.
+
+    Whenever this producer is resumed after having been paused, the
+    transport's buffer has just been emptied, so file ranges are sent
+    directly from the file to the socket with C{sendfile} if there is one,
+    until the socket's buffer is full too.
+
+    @ivar request: The request to write to.
+    @ivar file: The file to read from.
+    @ivar segments: What's left to write.
+    @ivar socket: The file descriptor of the socket to C{sendfile} to, if
+        any.
+    """
+
+    def __init__(
+        self,
+        request: IRequest,
+        file: IO[bytes],
+        segments: List[Segment],
+        socket: Optional[int] = None,
+        sendfile: Optional[Callable[[int, int, int, int], int]] = getattr(
+            os, "sendfile", None
+        ),
+    ) -> None:
+        self.request = request
+        self.file = file
+        self.segments = segments
+        self.socket = socket
+        self._sendfile = sendfile
+        self._paused = False
+        self._producing = False
+        self._done = False
+
+    def start(self) -> None:
+        """
+        Register with the request and start writing.
+        """
+        self.request.registerProducer(self, True)  # type: ignore[attr-defined]
+        self.request.notifyFinish().addErrback(  # type: ignore[attr-defined]
+            lambda _: self.stopProducing()
+        )
+        self._produce(drained=False)
+
+    def pauseProducing(self) -> None:
+        self._paused = True
+
+    def resumeProducing(self) -> None:
+        drained = self._paused
+        self._paused = False
+        self._produce(drained)
+
+    def stopProducing(self) -> None:
+        self._close()
+
+    def _close(self) -> None:
+        if not self._done:
+            self._done = True
+            self.file.close()
+
+    def _produce(self, drained: bool) -> None:
+        if self._producing or self._done:
+            return
+        self._producing = True
+        try:
+            self._write(drained)
+        except BaseException:
+            log.err(None, "Error sending static file")
+            self._close()
+            self.request.unregisterProducer()  # type: ignore[attr-defined]
+            self.request.loseConnection()  # type: ignore[attr-defined]
+        finally:
+            self._producing = False
+
+    def _write(self, drained: bool) -> None:
+        request = self.request
+        segments = self.segments
+        while not self._paused and not self._done:
+            if not segments:
+                self._close()
+                request.unregisterProducer()  # type: ignore[attr-defined]
+                request.finish()
+                return
+            segment = segments[0]
+            if isinstance(segment, bytes):
+                del segments[0]
+                request.write(segment)
+                drained = False
+                continue
+            offset, length = segment
+            if (
+                drained
+                and self.socket is not None
+                and self._sendfile is not None
+                and length >= _sendfileThreshold
+            ):
+                try:
+                    sent = self._sendfile(
+                        self.socket, self.file.fileno(), offset, length
+                    )
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    # Not supported for this file or socket after all.
+                    self.socket = None
+                    sent = 0
+                # Anything short of everything means the socket is full.
+                drained = sent == length
+            else:
+                self.file.seek(offset)
+                data = self.file.read(min(length, _chunkSize))
+                if not data:
+                    raise OSError(f"{self.file.name} was truncated")
+                sent = len(data)
+                request.write(data)
+                drained = False
+            if sent == length:
+                del segments[0]
+            else:
+                segments[0] = (offset + sent, length - sent)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class _Served:
+    """
+    What L{StaticFiles._lookup} found for a request path.
+    """
+
+    info: Optional[_FileInfo] = None
+    redirect: bool = False
+    forbidden: bool = False
+
+
+class StaticFiles(Resource):
+    """
+    A resource serving the files in a directory, for use on a branch route.
+
+    @ivar path: The directory to serve.
+    @ivar index: The names of the files to serve for a directory, in order
+        of preference.  Directories without one are not found; their
+        contents are never listed.
+    @ivar encodings: The content codings of the precompressed variants to
+        look for, in order of preference, among C{"br"} and C{"gzip"}.
+    @ivar recheck: How many seconds to trust what is known about a file
+        before checking its modification time again.
+    @ivar maxEntries: How many files to remember information about.
+    @ivar now: A callable returning the current time, in seconds.
+    """
+
+    isLeaf = True
+
+    def __init__(
+        self,
+        path: Union[str, "os.PathLike[str]"],
+        index: Sequence[str] = ("index.html",),
+        encodings: Sequence[str] = ("br", "gzip"),
+        recheck: float = 1.0,
+        maxEntries: int = 1024,
+        now: Callable[[], float] = monotonic,
+    ) -> None:
+        super().__init__()
+        for encoding in encodings:
+            if encoding not in _suffixes:
+                raise ValueError(f"Unsupported content coding {encoding!r}")
+        self.path = os.path.abspath(path)
+        self.index = tuple(index)
+        self.encodings = tuple(encodings)
+        self.recheck = recheck
+        self.maxEntries = maxEntries
+        self.now = now
+        self._entries: "OrderedDict[str, Tuple[float, _FileInfo]]" = (
+            OrderedDict()
+        )
+
+    def _stat(self, path: str) -> Optional[_FileInfo]:
+        """
+        Find out what is needed to serve the regular file at C{path}.
+        """
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not S_ISREG(st.st_mode):
+            return None
+        variants = []
+        for encoding in self.encodings:
+            variantPath = path + _suffixes[encoding]
+            try:
+                vst = os.stat(variantPath)
+            except OSError:
+                continue
+            # A variant older than its file is stale.
+            if S_ISREG(vst.st_mode) and vst.st_mtime_ns >= st.st_mtime_ns:
+                coding = encoding.encode("ascii")
+                variants.append(
+                    _Representation(
+                        variantPath,
+                        vst.st_size,
+                        _etag(vst.st_size, st.st_mtime_ns, coding),
+                        coding,
+                    )
+                )
+        contentType, _ = guess_type(path, strict=False)
+        return _FileInfo(
+            identity=_Representation(
+                path, st.st_size, _etag(st.st_size, st.st_mtime_ns)
+            ),
+            variants=tuple(variants),
+            mtimeNs=st.st_mtime_ns,
+            contentType=(contentType or "application/octet-stream").encode(
+                "ascii"
+            ),
+        )
+
+    def _info(self, path: str) -> Optional[_FileInfo]:
+        """
+        Get the cached information about the file at C{path}, re-checking its
+        modification time if it was last checked too long ago.
+        """
+        now = self.now()
+        entry = self._entries.get(path)
+        if entry is not None:
+            checked, info = entry
+            if now - checked < self.recheck:
+                self._entries.move_to_end(path)
+                return info
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._entries[path]
+                return None
+            if (
+                st.st_mtime_ns == info.mtimeNs
+                and st.st_size == info.identity.size
+            ):
+                self._entries[path] = (now, info)
+                self._entries.move_to_end(path)
+                return info
+        fresh = self._stat(path)
+        if fresh is None:
+            self._entries.pop(path, None)
+            return None
+        self._entries[path] = (now, fresh)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+        return fresh
+
+    def _lookup(self, segments: Sequence[bytes]) -> _Served:
+        """
+        Find the file to serve for the given path segments.
+        """
+        directory = False
+        if segments and segments[-1] == b"":
+            directory = True
+            segments = segments[:-1]
+        path = _segmentsToPath(self.path, segments)
+        if path is None:
+            return _Served()
+        if not directory:
+            try:
+                info = self._info(path)
+            except PermissionError:
+                return _Served(forbidden=True)
+            if info is not None:
+                return _Served(info)
+            if not os.path.isdir(path):
+                return _Served()
+            return _Served(redirect=True)
+        for name in self.index:
+            try:
+                info = self._info(os.path.join(path, name))
+            except PermissionError:
+                return _Served(forbidden=True)
+            if info is not None:
+                return _Served(info)
+        return _Served()
+
+    def _negotiate(self, request: IRequest, info: _FileInfo) -> _Representation:
+        """
+        Pick the representation of a file to send in response to
+        C{request}.
+        """
+        if not info.variants:
+            return info.identity
+        accepted = acceptedEncodings(request.getHeader(b"accept-encoding"))
+        best, bestQuality = info.identity, 0.0
+        for variant in info.variants:
+            coding = variant.encoding.decode("ascii")  # type: ignore
+            quality = accepted.get(coding, accepted.get("*", 0.0))
+            if quality > bestQuality:
+                best, bestQuality = variant, quality
+        return best
+
+    def _rangesApply(
+        self, request: IRequest, info: _FileInfo, chosen: _Representation
+    ) -> bool:
+        """
+        Does the C{If-Range} header of C{request}, if any, allow its C{Range}
+        header to be honoured?
+        """
+        ifRange: Optional[bytes] = request.getHeader(b"if-range")
+        if ifRange is None:
+            return True
+        ifRange = ifRange.strip()
+        if ifRange.startswith(b'"'):
+            return ifRange == chosen.etag
+        if ifRange.startswith(b"W/"):
+            return False
+        try:
+            since: int = stringToDatetime(ifRange)
+        except (ValueError, IndexError):
+            return False
+        return since == wholeSeconds(info.lastModified)
+
+    def render_GET(self, request: IRequest) -> Union[bytes, int]:
+        served = self._lookup(request.postpath)
+        if served.redirect:
+            path, _, query = request.uri.partition(b"?")
+            location = path + b"/" + (b"?" + query if query else b"")
+            request.setResponseCode(MOVED_PERMANENTLY)
+            request.setHeader(b"location", location)
+            return b""
+        if served.forbidden:
+            request.setResponseCode(FORBIDDEN)
+            return b"Forbidden"
+        info = served.info
+        if info is None:
+            request.setResponseCode(NOT_FOUND)
+            return b"Not Found"
+
+        chosen = self._negotiate(request, info)
+        request.setHeader(b"content-type", info.contentType)
+        request.setHeader(b"accept-ranges", b"bytes")
+        if info.variants:
+            request.setHeader(b"vary", b"accept-encoding")
+        if chosen.encoding is not None:
+            request.setHeader(b"content-encoding", chosen.encoding)
+        setValidators(request, chosen.etag, info.lastModified)
+        if answerNotModified(request):
+            return b""
+
+        size = chosen.size
+        segments: List[Segment] = [(0, size)] if size else []
+        rangeHeader = request.getHeader(b"range")
+        if rangeHeader is not None and self._rangesApply(request, info, chosen):
+            ranges = parseRanges(rangeHeader, size)
+            if ranges == []:
+                request.setResponseCode(REQUESTED_RANGE_NOT_SATISFIABLE)
+                request.setHeader(b"content-range", b"bytes */%d" % (size,))
+                return b""
+            if ranges is not None:
+                request.setResponseCode(PARTIAL_CONTENT)
+                segments = self._rangeSegments(
+                    request, info.contentType, ranges, size
+                )
+
+        length = sum(
+            len(segment) if isinstance(segment, bytes) else segment[1]
+            for segment in segments
+        )
+        request.setHeader(b"content-length", b"%d" % (length,))
+        if request.method == b"HEAD" or not segments:
+            return b""
+
+        try:
+            file = open(chosen.path, "rb")
+        except OSError:
+            # It went away since we last looked.
+            self._entries.pop(info.identity.path, None)
+            request.setResponseCode(NOT_FOUND)
+            request.responseHeaders.removeHeader(b"content-length")
+            return b"Not Found"
+        FileProducer(request, file, segments, _sendfileSocket(request)).start()
+        return NOT_DONE_YET
+
+    render_HEAD = render_GET
+
+    @staticmethod
+    def _rangeSegments(
+        request: IRequest,
+        contentType: bytes,
+        ranges: List[Tuple[int, int]],
+        size: int,
+    ) -> List[Segment]:
+        """
+        Set the headers of a C{206 Partial Content} response to C{request}
+        for the given C{ranges}, and return the segments of its body.
+        """
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            request.setHeader(
+                b"content-range", b"bytes %d-%d/%d" % (first, last, size)
+            )
+            return [(first, last - first + 1)]
+        boundary = token_hex(16).encode("ascii")
+        request.setHeader(
+            b"content-type", b"multipart/byteranges; boundary=" + boundary
+        )
+        segments: List[Segment] = []
+        for first, last in ranges:
+            segments.append(
+                b"\r\n--%s\r\ncontent-type: %s\r\n"
+                b"content-range: bytes %d-%d/%d\r\n\r\n"
+                % (boundary, contentType, first, last, size)
+            )
+            segments.append((first, last - first + 1))
+        segments.append(b"\r\n--%s--\r\n" % (boundary,))
+        return segments
+
+
+def mount(
+    app: Klein,
+    url: str,
+    path: Union[str, "os.PathLike[str]"],
+    **kwargs: object,
+) -> StaticFiles:
+    """
+    Serve the files in the directory at C{path} under C{url}, on a branch
+    route of C{app}.
+
+    @param kwargs: Passed on to L{StaticFiles}.
+
+    @return: The L{StaticFiles} resource.
+    """
+    files = StaticFiles(path, **kwargs)  # type: ignore[arg-type]
+
+    def static(request: IRequest) -> StaticFiles:
+        return files
+
+    app.route(url.rstrip("/") + "/", branch=True, endpoint=f"static:{url}")(
+        static
+    )
+    return files
@@ -0,0 +1,140 @@
+# -*- test-case-name: klein.test.test_streaming -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Streaming response bodies from iterators and asynchronous iterators.
+
+A route may return (or wrap in a L{klein.Response}) an iterator or an
+asynchronous iterator of C{bytes} or C{str} chunks, such as a generator; the
+chunks are then written as they are produced, rather than the whole body
+being materialized first.
+"""
+
+from typing import AsyncIterator, Iterator, Optional, Union
+
+from zope.interface import implementer
+
+from twisted.internet.defer import Deferred, ensureDeferred
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+from twisted.web.iweb import IRequest
+
+
+__all__ = ()
+
+
+Chunk = Union[str, bytes]
+Stream = Union[Iterator[Chunk], AsyncIterator[Chunk]]
+
+
+def isStream(body: object) -> bool:
+    """
+    Is C{body} an iterator or asynchronous iterator to stream?
+    """
+    return isinstance(body, (Iterator, AsyncIterator))
+
+
+def _gone(request: IRequest) -> bool:
+    return bool(
+        getattr(request, "_disconnected", False)
+        or getattr(request, "finished", False)
+    )
+
+
+@implementer(IPushProducer)
+class StreamProducer:
+    """
+    Write the chunks of a L{Stream} to a request, as a streaming producer,
+    so that iteration pauses while the transport's buffer is full.
+
+    @ivar request: The request to write the chunks to.
+    @ivar stream: The iterator or asynchronous iterator of chunks.
+    """
+
+    def __init__(self, request: IRequest, stream: Stream) -> None:
+        self.request = request
+        self.stream = stream
+        self._paused = False
+        self._resumed: Optional[Deferred[None]] = None
+        self._driving: Optional[Deferred[None]] = None
+
+    def start(self) -> "Deferred[None]":
+        """
+        Register with the request and start writing chunks.
+
+        @return: A L{Deferred} which fires with L{None} once every chunk has
+            been written and the request finished, or fails with the
+            iterator's exception if that is raised before any chunk has been
+            written.  If it is raised after that, it is logged and the
+            connection is closed instead, since the response can no longer be
+            changed.
+        """
+        self.request.registerProducer(self, True)  # type: ignore[attr-defined]
+        self.request.notifyFinish().addErrback(  # type: ignore[attr-defined]
+            lambda _: self.stopProducing()
+        )
+        self._driving = ensureDeferred(self._drive())
+        return self._driving
+
+    async def _drive(self) -> None:
+        request = self.request
+        stream = self.stream
+        try:
+            while True:
+                if self._paused:
+                    self._resumed = Deferred()
+                    await self._resumed
+                if isinstance(stream, AsyncIterator):
+                    try:
+                        chunk = await stream.__anext__()
+                    except StopAsyncIteration:
+                        break
+                else:
+                    try:
+                        chunk = next(stream)
+                    except StopIteration:
+                        break
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                elif not isinstance(chunk, bytes):
+                    raise TypeError(
+                        f"Streamed chunks must be str or bytes, not {chunk!r}"
+                    )
+                request.write(chunk)
+        except BaseException:
+            if _gone(request):
+                raise
+            request.unregisterProducer()  # type: ignore[attr-defined]
+            if not getattr(request, "startedWriting", False):
+                raise
+            log.err(None, "Error streaming response body")
+            request.loseConnection()  # type: ignore[attr-defined]
+        else:
+            request.unregisterProducer()  # type: ignore[attr-defined]
+            request.finish()
+        finally:
+            await self._close()
+
+    async def _close(self) -> None:
+        stream = self.stream
+        if isinstance(stream, AsyncIterator):
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        else:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    def pauseProducing(self) -> None:
+        self._paused = True
+
+    def resumeProducing(self) -> None:
+        self._paused = False
+        resumed, self._resumed = self._resumed, None
+        if resumed is not None:
+            resumed.callback(None)
+
+    def stopProducing(self) -> None:
+        if self._driving is not None:
+            self._driving.cancel()
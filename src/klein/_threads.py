@@ -0,0 +1,151 @@
+# -*- test-case-name: klein.test.test_threads -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Running blocking route handlers in a pool of threads.
+
+A handler decorated with L{blocking}, or routed with C{threaded=True}, is
+called in a thread of a L{HandlerThreadPool} rather than on the reactor
+thread, so that it can call blocking libraries without stalling every other
+connection.  Like every L{BoundedPool}, it runs a bounded number of handlers
+at once, and holds a bounded number more in a queue; when that is full,
+requests are answered with a 503.  Handlers still waiting in the queue when
+their client disconnects are never run.
+
+Handlers run in a thread must not use the request, or anything else
+belonging to the reactor, other than through
+L{twisted.internet.interfaces.IReactorFromThreads.callFromThread}.
+"""
+
+from inspect import iscoroutine
+from time import perf_counter
+from typing import Any, Callable, Optional, TypeVar, Union, cast, overload
+
+from twisted.internet.defer import Deferred, ensureDeferred
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from ._decorators import bindable, modified
+from ._pools import BoundedPool, PoolJob
+
+
+__all__ = ()
+
+
+C = TypeVar("C", bound=Callable[..., Any])
+
+
+class HandlerThreadPool(BoundedPool):
+    """
+    A bounded pool of threads for running blocking route handlers.
+
+    @see: L{BoundedPool}
+    """
+
+    def __init__(
+        self,
+        size: int = 10,
+        maxQueue: int = 100,
+        retryAfter: Optional[int] = None,
+        reactor: Any = None,
+        threadpool: Optional[ThreadPool] = None,
+        now: Callable[[], float] = perf_counter,
+    ) -> None:
+        super().__init__(size, maxQueue, retryAfter, reactor, now)
+        if threadpool is None:
+            threadpool = ThreadPool(0, size, name="klein-handlers")
+        self._threadpool = threadpool
+
+    def _startWorkers(self) -> None:
+        self._threadpool.start()
+
+    def _stopWorkers(self) -> None:
+        """
+        Stop this pool's threads, once those running now have finished.
+        """
+        self._threadpool.stop()
+
+    def _dispatch(self, job: PoolJob) -> "Deferred[Any]":
+        return deferToThreadPool(
+            self._reactor, self._threadpool, job.f, *job.args, **job.kwargs
+        )
+
+
+_defaultPool: Optional[HandlerThreadPool] = None
+
+
+def defaultPool() -> HandlerThreadPool:
+    """
+    The L{HandlerThreadPool} used by L{blocking} handlers and threaded routes
+    which aren't given one.
+    """
+    global _defaultPool
+    if _defaultPool is None:
+        _defaultPool = HandlerThreadPool()
+    return _defaultPool
+
+
+def _callBound(
+    instance: Any, f: Callable[..., Any], *args: Any, **kwargs: Any
+) -> Any:
+    """
+    Call C{f} with C{args} and C{kwargs}, preceded by C{instance} if it is
+    a method or L{bindable}.
+    """
+    if instance is not None or getattr(f, "__klein_bound__", False):
+        args = (instance,) + args
+    return f(*args, **kwargs)
+
+
+def _awaited(result: object) -> object:
+    """
+    Run a coroutine returned by a handler on the reactor.
+    """
+    if iscoroutine(result):
+        return ensureDeferred(result)
+    return result
+
+
+@overload
+def blocking(f: C) -> C:
+    ...  # pragma: no cover
+
+
+@overload
+def blocking(
+    *, pool: Optional[HandlerThreadPool] = None
+) -> Callable[[C], C]:
+    ...  # pragma: no cover
+
+
+def blocking(
+    f: Optional[C] = None, *, pool: Optional[HandlerThreadPool] = None
+) -> Union[C, Callable[[C], C]]:
+    """
+    Decorate a route handler, or a function beneath other decorators such as
+    L{klein.Requirer.require}, so that it is called in a thread of C{pool},
+    or of L{defaultPool} if none is given.
+
+    ::
+        @app.route("/report")
+        @blocking
+        def report(request):
+            return database.query(...)
+
+    @return: A L{bindable} function taking the same arguments as C{f}, and
+        returning a L{Deferred} which fires with its result.
+    """
+
+    def decorator(f: C) -> C:
+        @modified("blocking", f)
+        @bindable
+        def inThread(instance: Any, *args: Any, **kwargs: Any) -> Any:
+            threads = defaultPool() if pool is None else pool
+            running = threads.run(_callBound, instance, f, *args, **kwargs)
+            return running.addCallback(_awaited)
+
+        return cast(C, inThread)
+
+    if f is None:
+        return decorator
+    return decorator(f)
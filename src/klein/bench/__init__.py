@@ -0,0 +1,29 @@
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Microbenchmarks for Klein's request routing.
+
+Run them with::
+
+    python -m klein.bench [--scenario NAME ...] [--routes N ...]
+
+Each scenario renders real L{twisted.web.server.Request}s with a
+L{klein.resource.KleinResource} over an in-memory connection, for
+applications with (by default) 10, 100, 1000 and 10000 routes, and reports
+requests per second and memory allocated per request as JSON.
+"""
+
+from ._request import FakeChannel, fakeRequest
+from ._runner import BenchResult, main, runScenario
+from ._scenarios import Scenario, scenarios
+
+
+__all__ = (
+    "BenchResult",
+    "FakeChannel",
+    "Scenario",
+    "fakeRequest",
+    "main",
+    "runScenario",
+    "scenarios",
+)
@@ -0,0 +1,7 @@
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+from . import main
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,99 @@
+# -*- test-case-name: klein.test.test_bench -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+An in-memory stand-in for an HTTP connection, so that real
+L{twisted.web.server.Request}s can be rendered without any networking.
+"""
+
+from typing import Iterable, Optional
+
+from twisted.internet.address import IPv4Address
+from twisted.internet.interfaces import IProducer
+from twisted.web.http_headers import Headers
+from twisted.web.resource import Resource
+from twisted.web.server import Request, Site
+
+
+__all__ = ()
+
+
+class FakeChannel:
+    """
+    Just enough of an L{twisted.web.http.HTTPChannel} for L{Request}: it
+    counts, then discards, everything written to it.
+
+    @ivar site: A L{Site}, which is only consulted for its configuration.
+
+    @ivar written: The number of bytes of response headers and body written.
+    @ivar requests: The number of requests finished.
+    """
+
+    factory = None
+
+    def __init__(self) -> None:
+        self.site = Site(Resource())
+        self.transport = self
+        self.written = 0
+        self.requests = 0
+        self._peer = IPv4Address("TCP", "127.0.0.1", 54321)
+        self._host = IPv4Address("TCP", "127.0.0.1", 8080)
+
+    def getPeer(self) -> IPv4Address:
+        return self._peer
+
+    def getHost(self) -> IPv4Address:
+        return self._host
+
+    def isSecure(self) -> bool:
+        return False
+
+    def writeHeaders(
+        self, version: bytes, code: bytes, reason: bytes, headers: Headers
+    ) -> None:
+        self.written += len(version) + len(code) + len(reason)
+        for name, values in headers.getAllRawHeaders():
+            self.written += len(name) + sum(len(value) for value in values)
+
+    def write(self, data: bytes) -> None:
+        self.written += len(data)
+
+    def writeSequence(self, data: Iterable[bytes]) -> None:
+        for each in data:
+            self.written += len(each)
+
+    def registerProducer(self, producer: IProducer, streaming: bool) -> None:
+        pass
+
+    def unregisterProducer(self) -> None:
+        pass
+
+    def loseConnection(self) -> None:
+        pass
+
+    def requestDone(self, request: Request) -> None:
+        self.requests += 1
+
+
+def fakeRequest(
+    channel: FakeChannel,
+    path: bytes,
+    method: bytes = b"GET",
+    host: Optional[bytes] = b"localhost:8080",
+) -> Request:
+    """
+    Create a L{Request} for C{path} on C{channel}, in the state that
+    L{twisted.web.server.Site} would leave it in before rendering a leaf
+    resource at the root of the site.
+    """
+    request = Request(channel)
+    request.method = method
+    request.uri = path
+    request.path = path
+    request.clientproto = b"HTTP/1.1"
+    request.prepath = []
+    request.postpath = path.split(b"/")[1:]
+    request.args = {}
+    if host is not None:
+        request.requestHeaders.setRawHeaders(b"host", [host])
+    return request
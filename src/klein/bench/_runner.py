@@ -0,0 +1,238 @@
+# -*- test-case-name: klein.test.test_bench -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+Running L{Scenario}s and reporting the results.
+"""
+
+import gc
+import json
+import platform
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+from itertools import cycle
+from time import perf_counter
+from typing import IO, Any, Dict, List, Optional, Sequence
+
+import attr
+
+from .. import __version__
+from .._resource import KleinResource
+from ._request import FakeChannel, fakeRequest
+from ._scenarios import Scenario, scenarios
+
+
+__all__ = ()
+
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+def _distributionVersion(name: str) -> Optional[str]:
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # pragma: no cover
+        # Python < 3.8
+        return None
+    try:
+        return version(name)
+    except PackageNotFoundError:  # pragma: no cover
+        return None
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class BenchResult:
+    """
+    The measurements from running a L{Scenario}.
+
+    @ivar scenario: The name of the scenario.
+    @ivar routes: The number of routes the application had.
+    @ivar requests: The number of requests timed.
+    @ivar seconds: How long they took.
+    @ivar ops_per_sec: Requests rendered per second.
+    @ivar alloc_bytes: The mean peak of memory allocated while rendering a
+        single request, in bytes, or L{None} if it could not be measured.
+    @ivar alloc_blocks: The mean number of memory blocks still allocated after
+        rendering a request; non-zero values suggest a leak or a cache being
+        filled.
+    @ivar build_seconds: How long building and freezing the application
+        took.
+    """
+
+    scenario: str
+    routes: int
+    requests: int
+    seconds: float
+    ops_per_sec: float
+    alloc_bytes: Optional[float]
+    alloc_blocks: float
+    build_seconds: float
+
+
+def _render(resource: KleinResource, channel: FakeChannel, path: bytes) -> int:
+    """
+    Render a request for C{path} with C{resource} and return its code.
+    """
+    request = fakeRequest(channel, path)
+    result = resource.render(request)
+    if isinstance(result, bytes):
+        request.write(result)
+        request.finish()
+    return request.code
+
+
+def _measureAllocations(
+    resource: KleinResource,
+    channel: FakeChannel,
+    paths: Sequence[bytes],
+    count: int,
+) -> Optional[float]:
+    if not hasattr(tracemalloc, "reset_peak"):
+        # Python < 3.9
+        return None
+    tracemalloc.start()
+    try:
+        total = 0
+        for _, path in zip(range(count), cycle(paths)):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            _render(resource, channel, path)
+            total += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return total / count
+
+
+def runScenario(
+    scenario: Scenario,
+    size: int,
+    duration: float = 1.0,
+    options: Optional[Dict[str, Any]] = None,
+) -> BenchResult:
+    """
+    Measure rendering requests for C{scenario} with C{size} routes.
+
+    @param duration: The minimum number of seconds to spend timing requests.
+    @param options: Keyword arguments to pass to L{Klein}.
+
+    @raise AssertionError: If a request does not get the expected response.
+    """
+    start = perf_counter()
+    app, paths = scenario.build(size, options or {})
+    app.freeze()
+    resource = app.resource()
+    channel = FakeChannel()
+    buildSeconds = perf_counter() - start
+
+    # Warm up, checking that the scenario is doing what it says.
+    for path in paths:
+        code = _render(resource, channel, path)
+        if code != scenario.expectedCode:
+            raise AssertionError(
+                f"{scenario.name}: {path!r} got {code}, "
+                f"not {scenario.expectedCode}"
+            )
+
+    requests = 0
+    batch = len(paths)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    start = perf_counter()
+    while True:
+        for path in paths:
+            _render(resource, channel, path)
+        requests += batch
+        seconds = perf_counter() - start
+        if seconds >= duration:
+            break
+    gc.collect()
+    blocks = sys.getallocatedblocks() - blocks
+
+    return BenchResult(
+        scenario=scenario.name,
+        routes=size,
+        requests=requests,
+        seconds=seconds,
+        ops_per_sec=requests / seconds,
+        alloc_bytes=_measureAllocations(resource, channel, paths, batch),
+        alloc_blocks=blocks / requests,
+        build_seconds=buildSeconds,
+    )
+
+
+def main(
+    argv: Optional[Sequence[str]] = None, out: IO[str] = sys.stdout
+) -> int:
+    """
+    Run the benchmarks selected by the command line C{argv}, writing the
+    results to C{out} as JSON.
+    """
+    parser = ArgumentParser(
+        prog="python -m klein.bench",
+        description="Measure Klein's request routing.",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(scenarios),
+        help="A scenario to run (default: all of them).",
+    )
+    parser.add_argument(
+        "--routes",
+        action="append",
+        type=int,
+        help=f"A number of routes to test with (default: {DEFAULT_SIZES}).",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=1.0,
+        help="Seconds to spend timing each scenario (default: 1).",
+    )
+    parser.add_argument(
+        "--compiled-routes",
+        action="store_true",
+        help="Use Klein(compiled_routes=True).",
+    )
+    parser.add_argument(
+        "--match-cache-size",
+        type=int,
+        default=0,
+        help="Use Klein(match_cache_size=N).",
+    )
+    parser.add_argument(
+        "--defer-routes",
+        action="store_true",
+        help="Use Klein(defer_routes=True).",
+    )
+    arguments = parser.parse_args(argv)
+
+    options: Dict[str, Any] = {
+        "compiled_routes": arguments.compiled_routes,
+        "match_cache_size": arguments.match_cache_size,
+        "defer_routes": arguments.defer_routes,
+    }
+    results: List[Dict[str, Any]] = []
+    for name in arguments.scenario or scenarios:
+        for size in arguments.routes or DEFAULT_SIZES:
+            result = runScenario(
+                scenarios[name], size, arguments.duration, options
+            )
+            results.append(attr.asdict(result))
+
+    json.dump(
+        {
+            "python": platform.python_implementation(),
+            "python_version": platform.python_version(),
+            "klein": __version__,
+            "twisted": _distributionVersion("Twisted"),
+            "werkzeug": _distributionVersion("Werkzeug"),
+            "options": options,
+            "results": results,
+        },
+        out,
+        indent=2,
+    )
+    out.write("\n")
+    return 0
@@ -0,0 +1,151 @@
+# -*- test-case-name: klein.test.test_bench -*-
+# Copyright (c) 2011-2021. See LICENSE for details.
+
+"""
+The routing workloads measured by L{klein.bench}.
+
+Each scenario builds an application with a given number of routes, and the
+list of request paths to cycle through while measuring it.  Paths are spread
+evenly over the route table so that neither the first nor the last route
+registered is favoured.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+
+import attr
+
+from twisted.python.failure import Failure
+from twisted.web.iweb import IRequest
+
+from .._app import Klein, KleinRenderable
+
+
+__all__ = ()
+
+
+AppFactory = Callable[[int, Dict[str, Any]], Tuple[Klein, List[bytes]]]
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Scenario:
+    """
+    A routing workload.
+
+    @ivar name: The name of the scenario.
+    @ivar description: A one-line description of the scenario.
+    @ivar build: Builds the application, given the number of routes and the
+        keyword arguments to pass to L{Klein}, and returns it with the paths
+        to request.
+    @ivar expectedCode: The response code every request should get.
+    """
+
+    name: str
+    description: str
+    build: AppFactory
+    expectedCode: int = 200
+
+
+def _spread(size: int, count: int = 64) -> List[int]:
+    """
+    Pick up to C{count} route indexes evenly spread over C{size} routes.
+    """
+    count = min(size, count)
+    return [(i * size) // count for i in range(count)]
+
+
+def _ok(request: IRequest, **kwargs: Any) -> KleinRenderable:
+    return b"ok"
+
+
+class BenchmarkError(Exception):
+    """
+    Raised by the routes of the C{error} scenario.
+    """
+
+
+class _Unrelated(Exception):
+    """
+    An exception handled by error handlers which don't apply to
+    L{BenchmarkError}.
+    """
+
+
+def _static(size: int, options: Dict[str, Any]) -> Tuple[Klein, List[bytes]]:
+    app = Klein(**options)
+    for i in range(size):
+        app.route(f"/static/route{i}", endpoint=f"r{i}")(_ok)
+    return app, [b"/static/route%d" % (i,) for i in _spread(size)]
+
+
+def _param(size: int, options: Dict[str, Any]) -> Tuple[Klein, List[bytes]]:
+    app = Klein(**options)
+    for i in range(size):
+        app.route(f"/param{i}/<int:item>/<name>", endpoint=f"r{i}")(_ok)
+    return app, [b"/param%d/%d/thing" % (i, i) for i in _spread(size)]
+
+
+def _branch(size: int, options: Dict[str, Any]) -> Tuple[Klein, List[bytes]]:
+    app = Klein(**options)
+    for i in range(size):
+        app.route(f"/branch{i}/", endpoint=f"r{i}", branch=True)(_ok)
+    return app, [b"/branch%d/some/deeper/path" % (i,) for i in _spread(size)]
+
+
+def _subroute(size: int, options: Dict[str, Any]) -> Tuple[Klein, List[bytes]]:
+    app = Klein(**options)
+    groups = max(1, size // 10)
+    for group in range(groups):
+        with app.subroute(f"/group{group}") as sub:
+            for i in range(
+                group * size // groups, (group + 1) * size // groups
+            ):
+                sub.route(f"/route{i}", endpoint=f"r{i}")(_ok)
+    return app, [
+        b"/group%d/route%d" % (i * groups // size, i) for i in _spread(size)
+    ]
+
+
+def _notFound(size: int, options: Dict[str, Any]) -> Tuple[Klein, List[bytes]]:
+    app, paths = _static(size, options)
+    return app, [b"/missing" + path for path in paths]
+
+
+def _error(size: int, options: Dict[str, Any]) -> Tuple[Klein, List[bytes]]:
+    app = Klein(**options)
+
+    def fail(request: IRequest) -> KleinRenderable:
+        raise BenchmarkError()
+
+    for i in range(size):
+        app.route(f"/error/route{i}", endpoint=f"r{i}")(fail)
+
+    def unrelated(request: IRequest, failure: Failure) -> KleinRenderable:
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    for i in range(10):
+        app.handle_errors(_Unrelated)(unrelated)
+
+    @app.handle_errors(BenchmarkError)
+    def handled(request: IRequest, failure: Failure) -> KleinRenderable:
+        request.setResponseCode(500)
+        return b"handled"
+
+    return app, [b"/error/route%d" % (i,) for i in _spread(size)]
+
+
+scenarios: Dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario("static", "Fully static routes.", _static),
+        Scenario("param", "Routes with int and string parameters.", _param),
+        Scenario("branch", "Branch routes matching deeper paths.", _branch),
+        Scenario("subroute", "Static routes grouped in subroutes.", _subroute),
+        Scenario("notfound", "Requests matching no route.", _notFound, 404),
+        Scenario(
+            "error",
+            "Routes raising an exception for an error handler.",
+            _error,
+            500,
+        ),
+    ]
+}
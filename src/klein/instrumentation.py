@@ -0,0 +1,20 @@
+"""
+Timing each stage of the requests handled by Klein applications.
+"""
+
+from ._instrumentation import (
+    DEFAULT_BUCKETS,
+    RequestTimings,
+    StageHistograms,
+    TimingObserver,
+    exposeMetrics,
+)
+
+
+__all__ = (
+    "DEFAULT_BUCKETS",
+    "RequestTimings",
+    "StageHistograms",
+    "TimingObserver",
+    "exposeMetrics",
+)
@@ -0,0 +1,22 @@
+"""
+Choosing how Klein encodes and decodes JSON.
+"""
+
+from ._jsoncodec import (
+    STDLIB_JSON,
+    JSONCodec,
+    availableCodecs,
+    fastestCodec,
+    parsedJSONBody,
+    registerCodec,
+)
+
+
+__all__ = (
+    "JSONCodec",
+    "STDLIB_JSON",
+    "availableCodecs",
+    "fastestCodec",
+    "parsedJSONBody",
+    "registerCodec",
+)
@@ -0,0 +1,21 @@
+"""
+Profiling a sample of the requests handled by Klein applications, and
+keeping the profiles of the slow ones.
+"""
+
+from ._profiling import (
+    RequestProfiler,
+    SlowRequest,
+    collapsedStacks,
+    exposeProfiles,
+    pstatsText,
+)
+
+
+__all__ = (
+    "RequestProfiler",
+    "SlowRequest",
+    "collapsedStacks",
+    "exposeProfiles",
+    "pstatsText",
+)
@@ -0,0 +1,22 @@
+"""
+Shedding load when the reactor falls behind, except from critical routes.
+"""
+
+from ._shedding import (
+    CRITICAL,
+    LOW,
+    NORMAL,
+    AdmissionController,
+    LagMonitor,
+    SheddingStats,
+)
+
+
+__all__ = (
+    "AdmissionController",
+    "CRITICAL",
+    "LagMonitor",
+    "LOW",
+    "NORMAL",
+    "SheddingStats",
+)
@@ -0,0 +1,11 @@
+"""
+Serving directories of static files from Klein applications.
+"""
+
+from ._static import StaticFiles, mount
+
+
+__all__ = (
+    "StaticFiles",
+    "mount",
+)
@@ -0,0 +1,124 @@
+"""
+Tests for L{klein._adapters}.
+"""
+
+from werkzeug.routing import Map, Rule
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._adapters import AdapterPool
+from .._dispatch import CacheStats
+from .test_resource import MockRequest, _render
+
+
+class AdapterPoolTests(SynchronousTestCase):
+    """
+    Tests for L{AdapterPool}.
+    """
+
+    def setUp(self) -> None:
+        self.map = Map([Rule("/<int:x>", endpoint="x")])
+        self.pool = AdapterPool(maxsize=2)
+
+    def test_bindEquivalent(self) -> None:
+        """
+        L{AdapterPool.bind} returns an adapter equivalent to one returned by
+        L{Map.bind}.
+        """
+        adapter = self.pool.bind(
+            self.map, "localhost:8080", "/app", "https", "/3", "POST"
+        )
+        expected = self.map.bind(
+            "localhost:8080",
+            "/app",
+            path_info="/3",
+            default_method="POST",
+            url_scheme="https",
+        )
+        self.assertEqual(vars(adapter), vars(expected))
+
+    def test_bindNotShared(self) -> None:
+        """
+        Each call to L{AdapterPool.bind} returns a new adapter with its own
+        path and method, but only the first binds a new template.
+        """
+        one = self.pool.bind(self.map, "localhost", "", "http", "/1", "GET")
+        two = self.pool.bind(self.map, "localhost", "", "http", "/2", "PUT")
+        self.assertIsNot(one, two)
+        self.assertEqual((one.path_info, one.default_method), ("/1", "GET"))
+        self.assertEqual((two.path_info, two.default_method), ("/2", "PUT"))
+        self.assertEqual(one.match(), ("x", {"x": 1}))
+        self.assertEqual(self.pool.stats(), CacheStats(1, 1, 1))
+
+    def test_keys(self) -> None:
+        """
+        Adapters are pooled separately per server name, script name and
+        scheme.
+        """
+        self.pool.adapterFor(self.map, "a")
+        self.pool.adapterFor(self.map, "a", "/s")
+        self.pool.adapterFor(self.map, "a", "/s")
+        self.assertEqual(self.pool.stats(), CacheStats(1, 2, 2))
+
+    def test_evictsLeastRecentlyUsed(self) -> None:
+        """
+        When the pool is full, the least recently used adapter is evicted.
+        """
+        a = self.pool.adapterFor(self.map, "a")
+        b = self.pool.adapterFor(self.map, "b")
+        self.assertIs(self.pool.adapterFor(self.map, "a"), a)
+        self.pool.adapterFor(self.map, "c")
+        self.assertIs(self.pool.adapterFor(self.map, "a"), a)
+        self.assertIsNot(self.pool.adapterFor(self.map, "b"), b)
+        self.assertEqual(self.pool.stats(), CacheStats(2, 4, 2))
+
+    def test_invalidatedByNewRules(self) -> None:
+        """
+        Adding rules to the map, or using a different map, empties the pool.
+        """
+        a = self.pool.adapterFor(self.map, "a")
+        self.map.add(Rule("/new", endpoint="new"))
+        self.assertIsNot(self.pool.adapterFor(self.map, "a"), a)
+        self.assertEqual(self.pool.stats().size, 1)
+
+        other = Map()
+        self.assertIs(self.pool.adapterFor(other, "a").map, other)
+        self.assertEqual(self.pool.stats(), CacheStats(0, 3, 1))
+
+
+class KleinAdapterPoolTests(SynchronousTestCase):
+    """
+    Tests for L{Klein}'s use of an L{AdapterPool}.
+    """
+
+    def test_renderAndBuild(self) -> None:
+        """
+        L{KleinResource} and L{Klein.urlFor} bind through the application's
+        adapter pool.
+        """
+        app = Klein()
+
+        @app.route("/<int:x>")
+        def x(request: IRequest, x: int) -> KleinRenderable:
+            return app.urlFor(request, "x", {"x": x + 1})
+
+        resource = app.resource()
+        for path, expected in [(b"/1", b"/2"), (b"/2", b"/3")]:
+            request = MockRequest(path)
+            self.successResultOf(_render(resource, request))
+            self.assertEqual(request.getWrittenData(), expected)
+
+        # One miss each for matching and building, then hits.
+        self.assertEqual(app.adapter_pool.stats(), CacheStats(2, 2, 2))
+
+    def test_sharedWhenBound(self) -> None:
+        """
+        Instance-bound applications share their class's adapter pool.
+        """
+
+        class Thing:
+            app = Klein()
+
+        self.assertIs(Thing().app.adapter_pool, Thing.app.adapter_pool)
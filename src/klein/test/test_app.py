@@ -1,5 +1,5 @@
 from sys import stdout
-from typing import Any, List, Tuple, cast
+from typing import Any, Dict, List, Tuple, cast
 from unittest.mock import Mock, patch
 
 from zope.interface import implementer
@@ -7,11 +7,14 @@ from zope.interface import implementer
 from twisted.python.components import registerAdapter
 from twisted.trial import unittest
 from twisted.web.iweb import IRequest
+from twisted.web.server import Request
 
 from .. import Klein
 from .._app import KleinRenderable, KleinRequest
 from .._decorators import bindable, modified, originalName
 from .._interfaces import IKleinRequest
+from .._multipart import FormRequest
+from .._requestbody import StreamingRequest
 from .test_resource import MockRequest
 from .util import EqualityTestsMixin
 
@@ -142,8 +145,7 @@ class KleinTestCase(unittest.TestCase):
         Repeated accesses of the same L{Klein} attribute on the same instance
         should result in an identically bound instance, when possible.
         "Possible" is defined by a writable instance-level attribute named
-        C{__klein_bound_<the name of the Klein attribute on the class>__}, and
-        something is maintaining a strong reference to the L{Klein} instance.
+        C{__klein_bound_<the name of the Klein attribute on the class>__}.
         """
 
         # This is the desirable property.
@@ -205,6 +207,75 @@ class KleinTestCase(unittest.TestCase):
 
         self.assertIsInstance(Oddment().app, Klein)
 
+    def test_boundAsFromSetName(self) -> None:
+        """
+        L{Klein} learns the name of the class attribute it is assigned to when
+        the class is created.
+        """
+
+        class Thing:
+            app = Klein()
+            alias = app
+
+        self.assertEqual(vars(Thing)["app"]._boundAs, "app")
+
+    def test_boundViewCached(self) -> None:
+        """
+        The view of a L{Klein} bound to an instance is kept by the instance,
+        even if nothing else refers to it.
+        """
+
+        class Thing:
+            app = Klein()
+
+        thing = Thing()
+        bound = thing.app
+        boundID = id(bound)
+        del bound
+        self.assertEqual(id(thing.app), boundID)
+        self.assertIs(vars(thing)["__klein_bound_app__"], thing.app)
+        self.assertIs(thing.app._instance, thing)
+
+    def test_boundViewSharesState(self) -> None:
+        """
+        Bound views share the routing state of the L{Klein} they are views of,
+        including routes added and state derived after they were created.
+        """
+
+        class Thing:
+            app = Klein(compiled_routes=True)
+
+        thing = Thing()
+        bound = thing.app
+
+        @Thing.app.route("/later")
+        def later(self: Thing, request: IRequest) -> KleinRenderable:
+            return "later"  # pragma: no cover
+
+        self.assertIs(bound.url_map, Thing.app.url_map)
+        self.assertIn("later", bound.endpoints)
+        bound.freeze()
+        self.assertIsNotNone(Thing.app._state.dispatcher)
+        self.assertIs(Thing.app._state, Thing().app._state)
+
+    def test_boundViewsOfSameName(self) -> None:
+        """
+        Views of different L{Klein}s assigned to the same name in a class
+        hierarchy are not confused with each other.
+        """
+
+        class Base:
+            app = Klein()
+
+        class Derived(Base):
+            app = Klein()
+
+        derived = Derived()
+        self.assertIs(derived.app._state, vars(Derived)["app"]._state)
+        baseApp = vars(Base)["app"].__get__(derived, Derived)
+        self.assertIs(baseApp._state, vars(Base)["app"]._state)
+        self.assertIs(derived.app._state, vars(Derived)["app"]._state)
+
     def test_submountedRoute(self) -> None:
         """
         L{Klein.subroute} adds functions as routable endpoints.
@@ -441,9 +512,9 @@ class KleinTestCase(unittest.TestCase):
         self, reactor: Any, mock_log: Any, mock_site: Any, mock_kr: Any
     ) -> None:
         """
-        L{Klein.run} configures a L{KleinResource} and a L{Site}
-        listening on the specified interface and port, and logs
-        to stdout.
+        L{Klein.run} configures a L{KleinResource} and a L{Site} making
+        L{FormRequest}s, listening on the specified interface and port, and
+        logs to stdout.
         """
         app = Klein()
 
@@ -454,7 +525,11 @@ class KleinTestCase(unittest.TestCase):
         )
         reactor.run.assert_called_with()
 
-        mock_site.assert_called_with(mock_kr.return_value)
+        mock_site.assert_called_with(
+            mock_kr.return_value,
+            requestFactory=FormRequest,
+            parsePOSTFormSubmission=False,
+        )
         mock_kr.assert_called_with(app)
         mock_log.startLogging.assert_called_with(stdout)
 
@@ -479,10 +554,62 @@ class KleinTestCase(unittest.TestCase):
 
         reactor.run.assert_called_with()
 
-        mock_site.assert_called_with(mock_kr.return_value)
+        mock_site.assert_called_with(
+            mock_kr.return_value,
+            requestFactory=FormRequest,
+            parsePOSTFormSubmission=False,
+        )
         mock_kr.assert_called_with(app)
         mock_log.startLogging.assert_called_with(logFile)
 
+    @patch("klein._app.canSkipFormParsing", False)
+    @patch("klein._app.KleinResource")
+    @patch("klein._app.Site")
+    @patch("klein._app.log")
+    @patch("klein._app.reactor")
+    def test_runParsingForms(
+        self, reactor: Any, mock_log: Any, mock_site: Any, mock_kr: Any
+    ) -> None:
+        """
+        L{Klein.run} leaves Twisted's form parsing on if it can't be turned
+        off.
+        """
+        Klein().run("localhost", 8080)
+
+        mock_site.assert_called_with(
+            mock_kr.return_value, requestFactory=Request
+        )
+
+    @patch("klein._app.KleinResource")
+    @patch("klein._app.Site")
+    @patch("klein._app.log")
+    @patch("klein._app.reactor")
+    def test_runStreamingBodies(
+        self, reactor: Any, mock_log: Any, mock_site: Any, mock_kr: Any
+    ) -> None:
+        """
+        L{Klein.run} serves with L{StreamingRequest}s if a route streams its
+        body, or limits its size.
+        """
+        allOptions: List[Dict[str, Any]] = [
+            {"stream_body": True},
+            {"max_body_size": 0},
+        ]
+        for options in allOptions:
+            app = Klein()
+
+            @app.route("/", **options)
+            def root(request: IRequest) -> KleinRenderable:
+                return b""
+
+            app.run("localhost", 8080)
+
+            mock_site.assert_called_with(
+                mock_kr.return_value,
+                requestFactory=StreamingRequest,
+                parsePOSTFormSubmission=False,
+            )
+
     @patch("klein._app.KleinResource")
     @patch("klein._app.log")
     @patch("klein._app.serverFromString")
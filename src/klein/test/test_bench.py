@@ -0,0 +1,111 @@
+"""
+Tests for L{klein.bench}.
+"""
+
+import json
+from io import StringIO
+from typing import Any, Dict, List, Tuple
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from ..bench import (
+    FakeChannel,
+    Scenario,
+    fakeRequest,
+    main,
+    runScenario,
+    scenarios,
+)
+
+
+class FakeRequestTests(SynchronousTestCase):
+    """
+    Tests for L{fakeRequest} and L{FakeChannel}.
+    """
+
+    def test_render(self) -> None:
+        """
+        A fake request can be rendered by a L{klein.resource.KleinResource},
+        and the channel counts what it writes.
+        """
+        app = Klein()
+
+        @app.route("/<name>")
+        def hello(request: IRequest, name: str) -> KleinRenderable:
+            return f"Hello, {name}!"
+
+        channel = FakeChannel()
+        request = fakeRequest(channel, b"/world")
+        app.resource().render(request)
+        self.assertTrue(request.finished)
+        self.assertEqual(request.code, 200)
+        self.assertEqual(channel.requests, 1)
+        self.assertGreater(channel.written, len(b"Hello, world!"))
+
+
+class RunScenarioTests(SynchronousTestCase):
+    """
+    Tests for L{runScenario}.
+    """
+
+    def test_scenarios(self) -> None:
+        """
+        Every scenario gets the responses it expects, with and without
+        compiled or deferred routes.
+        """
+        for options in [
+            {},
+            {"compiled_routes": True},
+            {"defer_routes": True},
+        ]:
+            for name, scenario in scenarios.items():
+                result = runScenario(scenario, 20, 0, options)
+                self.assertEqual(result.scenario, name)
+                self.assertEqual(result.routes, 20)
+                self.assertEqual(result.requests, 20)
+                self.assertGreater(result.ops_per_sec, 0)
+
+    def test_unexpectedCode(self) -> None:
+        """
+        L{runScenario} raises L{AssertionError} if a request gets a response
+        code other than the scenario's expected one.
+        """
+
+        def build(
+            size: int, options: Dict[str, Any]
+        ) -> Tuple[Klein, List[bytes]]:
+            return Klein(**options), [b"/"]
+
+        scenario = Scenario("broken", "Nothing routes.", build)
+        self.assertRaises(AssertionError, runScenario, scenario, 1, 0)
+
+
+class MainTests(SynchronousTestCase):
+    """
+    Tests for L{klein.bench.main}.
+    """
+
+    def test_json(self) -> None:
+        """
+        L{main} runs the selected scenarios for each number of routes and
+        reports the results as JSON.
+        """
+        out = StringIO()
+        argv = ["--scenario=static", "--scenario=notfound"]
+        argv += ["--routes=1", "--routes=5", "--duration=0"]
+        self.assertEqual(main(argv, out), 0)
+        report = json.loads(out.getvalue())
+        self.assertEqual(
+            [(r["scenario"], r["routes"]) for r in report["results"]],
+            [("static", 1), ("static", 5), ("notfound", 1), ("notfound", 5)],
+        )
+        self.assertEqual(
+            report["options"],
+            {
+                "compiled_routes": False,
+                "match_cache_size": 0,
+                "defer_routes": False,
+            },
+        )
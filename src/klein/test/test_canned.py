@@ -0,0 +1,120 @@
+"""
+Tests for L{klein._canned}.
+"""
+
+from typing import List, Tuple
+
+from werkzeug.exceptions import (
+    BadRequest,
+    HTTPException,
+    MethodNotAllowed,
+    NotFound,
+    Unauthorized,
+)
+from werkzeug.routing import RequestRedirect
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._canned import CannedResponses
+from .._dispatch import CacheStats
+from .test_resource import MockRequest, _render
+
+
+def werkzeugResponse(
+    exception: HTTPException,
+) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    response = exception.get_response({})
+    assert isinstance(response, WerkzeugResponse)
+    return (
+        response.status_code,
+        sorted(
+            (name.encode("utf-8"), value.encode("utf-8"))
+            for name, value in response.headers
+        ),
+        b"".join(response.iter_encoded()),
+    )
+
+
+class CannedResponsesTests(SynchronousTestCase):
+    """
+    Tests for L{CannedResponses}.
+    """
+
+    def setUp(self) -> None:
+        self.canned = CannedResponses(maxsize=2)
+
+    def assertSameAsWerkzeug(self, exception: HTTPException) -> None:
+        found = self.canned.responseFor(exception)
+        assert found is not None
+        code, headers, body = found
+        self.assertEqual(
+            (code, sorted(headers), body), werkzeugResponse(exception)
+        )
+
+    def test_equivalent(self) -> None:
+        """
+        The canned response is the one Werkzeug would have sent.
+        """
+        for exception in [
+            NotFound(),
+            NotFound("<b>not</b>\nhere"),
+            BadRequest(),
+            MethodNotAllowed(),
+            MethodNotAllowed(["GET", "HEAD"]),
+            MethodNotAllowed(["POST"], "No."),
+        ]:
+            self.assertSameAsWerkzeug(exception)
+            self.assertSameAsWerkzeug(exception)
+
+    def test_sharedPerCodeAndDescription(self) -> None:
+        """
+        Responses are cached per status code and description, with
+        L{MethodNotAllowed}'s C{Allow} header added to the cached response.
+        """
+        self.canned.responseFor(MethodNotAllowed(["GET"]))
+        self.canned.responseFor(MethodNotAllowed(["PUT"]))
+        self.canned.responseFor(NotFound())
+        self.assertEqual(self.canned.stats(), CacheStats(1, 2, 2))
+        self.canned.responseFor(NotFound("gone"))
+        self.assertEqual(self.canned.stats(), CacheStats(1, 3, 2))
+
+    def test_notCannable(self) -> None:
+        """
+        Exceptions with their own response, or whose headers or body depend on
+        more than their code and description, are not canned.
+        """
+        for exception in [
+            NotFound(response=WerkzeugResponse(b"custom", 404)),
+            Unauthorized(www_authenticate=None),
+            RequestRedirect("http://localhost/"),
+        ]:
+            self.assertIsNone(self.canned.responseFor(exception))
+        self.assertEqual(self.canned.stats(), CacheStats(0, 0, 0))
+
+
+class KleinCannedResponsesTests(SynchronousTestCase):
+    """
+    Tests for L{KleinResource}'s use of canned responses.
+    """
+
+    def test_methodNotAllowed(self) -> None:
+        """
+        An unhandled L{MethodNotAllowed} from routing is sent with an C{Allow}
+        header listing the route's methods.
+        """
+        app = Klein()
+
+        @app.route("/", methods=["GET", "PUT"])
+        def root(request: IRequest) -> KleinRenderable:
+            return b"root"  # pragma: no cover
+
+        request = MockRequest(b"/", method=b"DELETE")
+        self.successResultOf(_render(app.resource(), request))
+        expected = werkzeugResponse(MethodNotAllowed())
+        self.assertEqual(request.code, 405)
+        self.assertEqual(request.getWrittenData(), expected[2])
+        [allow] = request.responseHeaders.getRawHeaders(b"allow", [])
+        self.assertEqual(sorted(allow.split(b", ")), [b"GET", b"HEAD", b"PUT"])
@@ -0,0 +1,481 @@
+"""
+Tests for L{klein._compression}.
+"""
+
+import gzip
+import os
+import zlib
+from typing import Any, Iterator, List, Optional
+
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+from twisted.web.server import Request
+from twisted.web.test.requesthelper import DummyChannel
+
+from .. import (
+    CachePolicy,
+    CompressionPolicy,
+    Klein,
+    KleinRenderable,
+    Response,
+    _compression,
+)
+from .._compression import (
+    CompressedBodies,
+    acceptedEncodings,
+    negotiate,
+    resolvePolicy,
+)
+from ..static import mount
+from .test_resource import MockRequest, _render
+
+
+def requestWith(
+    acceptEncoding: Optional[bytes], path: bytes = b"/"
+) -> MockRequest:
+    request = MockRequest(path)
+    if acceptEncoding is not None:
+        request.requestHeaders.setRawHeaders(
+            b"accept-encoding", [acceptEncoding]
+        )
+    return request
+
+
+def dechunk(body: bytes) -> List[bytes]:
+    """
+    Split a chunked HTTP/1.1 body into its chunks.
+    """
+    chunks: List[bytes] = []
+    while True:
+        size, body = body.split(b"\r\n", 1)
+        length = int(size, 16)
+        if not length:
+            return chunks
+        chunks.append(body[:length])
+        body = body[length:][2:]
+
+
+class CompressionPolicyTests(SynchronousTestCase):
+    """
+    Tests for L{CompressionPolicy}.
+    """
+
+    def test_compresses(self) -> None:
+        """
+        Text and unknown types are compressed; types which are already
+        compressed are not, except for the few image types which compress
+        well.
+        """
+        policy = CompressionPolicy()
+        for contentType in [
+            None,
+            b"text/html; charset=utf-8",
+            b"application/json",
+            b"image/svg+xml",
+        ]:
+            self.assertTrue(policy.compresses(contentType), contentType)
+        for contentType in [
+            b"image/png",
+            b"Video/MP4",
+            b"application/zip",
+            b"application/octet-stream",
+            b"font/woff2",
+        ]:
+            self.assertFalse(policy.compresses(contentType), contentType)
+
+    def test_excludedTypes(self) -> None:
+        """
+        The excluded types can be replaced, and are matched case
+        insensitively.
+        """
+        policy = CompressionPolicy(excluded_types=["Text/CSV", "model/"])
+        self.assertFalse(policy.compresses(b"text/csv"))
+        self.assertFalse(policy.compresses(b"model/gltf+json"))
+        self.assertTrue(policy.compresses(b"image/png"))
+
+    def test_resolvePolicy(self) -> None:
+        """
+        A route's C{compress} setting overrides its application's policy.
+        """
+        appPolicy = CompressionPolicy(level=1)
+        routePolicy = CompressionPolicy(level=9)
+        self.assertIs(resolvePolicy(None, appPolicy), appPolicy)
+        self.assertIsNone(resolvePolicy(None, None))
+        self.assertIs(resolvePolicy(True, appPolicy), appPolicy)
+        self.assertEqual(resolvePolicy(True, None), CompressionPolicy())
+        self.assertIsNone(resolvePolicy(False, appPolicy))
+        self.assertIs(resolvePolicy(routePolicy, appPolicy), routePolicy)
+
+
+class NegotiationTests(SynchronousTestCase):
+    """
+    Tests for L{acceptedEncodings} and L{negotiate}.
+    """
+
+    def test_acceptedEncodings(self) -> None:
+        """
+        Codings are lowercased and mapped to their quality values.
+        """
+        self.assertEqual(
+            acceptedEncodings(b"GZip, br;q=0.5, identity;q=x, *;q=0"),
+            {"gzip": 1.0, "br": 0.5, "identity": 0.0, "*": 0.0},
+        )
+        self.assertEqual(acceptedEncodings(None), {})
+
+    def test_negotiate(self) -> None:
+        """
+        The accepted coding with the highest quality is picked, preferring
+        C{gzip} to C{deflate} on a tie.
+        """
+        for header, expected in [
+            (None, None),
+            (b"br", None),
+            (b"gzip;q=0, deflate;q=0", None),
+            (b"deflate, gzip", b"gzip"),
+            (b"gzip;q=0.5, deflate", b"deflate"),
+            (b"*", b"gzip"),
+            (b"*, gzip;q=0", b"deflate"),
+        ]:
+            self.assertEqual(negotiate(requestWith(header)), expected, header)
+
+
+class CompressedBodiesTests(SynchronousTestCase):
+    """
+    Tests for L{CompressedBodies}.
+    """
+
+    def test_identity(self) -> None:
+        """
+        A body is compressed once for each coding and level, and only bodies
+        which are the very same object share a compressed form.
+        """
+        bodies = CompressedBodies()
+        body = b"x" * 1000
+        compressed = bodies.compress(body, b"gzip", 6)
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertIs(bodies.compress(body, b"gzip", 6), compressed)
+        self.assertIsNot(bodies.compress(body, b"deflate", 6), compressed)
+        equal = body[:500] + body[500:]
+        self.assertIsNot(bodies.compress(equal, b"gzip", 6), compressed)
+
+    def test_eviction(self) -> None:
+        """
+        The least recently used bodies are evicted once the total size of
+        the bodies held exceeds the limit, and bodies too large to be worth
+        keeping are not held at all.
+        """
+        bodies = CompressedBodies(maxBytes=8000)
+        self.assertEqual(
+            gzip.decompress(bodies.compress(b"x" * 2000, b"gzip", 6)),
+            b"x" * 2000,
+        )
+        self.assertEqual(len(bodies._bodies), 0)
+        first = b"a" * 900
+        compressed = bodies.compress(first, b"gzip", 6)
+        for filler in range(7):
+            bodies.compress(b"%d" % (filler,) * 900, b"gzip", 6)
+            self.assertIs(bodies.compress(first, b"gzip", 6), compressed)
+        for filler in range(7, 9):
+            bodies.compress(b"%d" % (filler,) * 900, b"gzip", 6)
+        self.assertIn((id(first), b"gzip", 6), bodies._bodies)
+        self.assertNotIn((id(b"0" * 900), b"gzip", 6), bodies._bodies)
+        self.assertLessEqual(bodies._bytes, bodies.maxBytes)
+
+
+class CompressedRouteTests(SynchronousTestCase):
+    """
+    Tests for routes whose responses are compressed.
+    """
+
+    body = b"compress me " * 200
+
+    def setUp(self) -> None:
+        self.app = Klein(compression=CompressionPolicy())
+
+    def render(
+        self, acceptEncoding: Optional[bytes] = b"gzip", path: bytes = b"/"
+    ) -> MockRequest:
+        request = requestWith(acceptEncoding, path)
+        self.successResultOf(_render(self.app.resource(), request))
+        return request
+
+    def test_gzip(self) -> None:
+        """
+        A body is compressed with the negotiated coding and sent with the
+        compressed C{Content-Length}, a C{Content-Encoding} and a C{Vary}.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            request.setHeader(b"vary", b"Cookie")
+            return self.body
+
+        request = self.render()
+        written = request.getWrittenData()
+        self.assertEqual(gzip.decompress(written), self.body)
+        headers = request.responseHeaders
+        self.assertEqual(headers.getRawHeaders(b"content-encoding"), [b"gzip"])
+        self.assertEqual(
+            headers.getRawHeaders(b"content-length"), [b"%d" % len(written)]
+        )
+        self.assertEqual(
+            headers.getRawHeaders(b"vary"), [b"Cookie", b"accept-encoding"]
+        )
+
+    def test_deflate(self) -> None:
+        """
+        Clients which only accept C{deflate} get a zlib stream.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return self.body
+
+        request = self.render(b"deflate")
+        self.assertEqual(zlib.decompress(request.getWrittenData()), self.body)
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"content-encoding"),
+            [b"deflate"],
+        )
+
+    def test_notAccepted(self) -> None:
+        """
+        Clients which accept neither coding get the body as it is, but the
+        response still varies on C{Accept-Encoding}.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return self.body
+
+        request = self.render(None)
+        self.assertEqual(request.getWrittenData(), self.body)
+        headers = request.responseHeaders
+        self.assertIsNone(headers.getRawHeaders(b"content-encoding"))
+        self.assertEqual(headers.getRawHeaders(b"vary"), [b"accept-encoding"])
+
+    def test_notCompressed(self) -> None:
+        """
+        Small bodies, excluded types, responses which may not be
+        transformed and routes which opt out are not compressed.
+        """
+
+        @self.app.route("/small")
+        def small(request: IRequest) -> KleinRenderable:
+            return b"tiny"
+
+        @self.app.route("/png")
+        def png(request: IRequest) -> KleinRenderable:
+            request.setHeader(b"content-type", b"image/png")
+            return self.body
+
+        @self.app.route("/no-transform")
+        def noTransform(request: IRequest) -> KleinRenderable:
+            request.setHeader(b"cache-control", b"public, no-transform")
+            return self.body
+
+        @self.app.route("/off", compress=False)
+        def off(request: IRequest) -> KleinRenderable:
+            return self.body
+
+        for path in [b"/small", b"/png", b"/no-transform", b"/off"]:
+            request = self.render(path=path)
+            self.assertIsNone(
+                request.responseHeaders.getRawHeaders(b"content-encoding"),
+                path,
+            )
+            self.assertIn(request.getWrittenData(), (b"tiny", self.body))
+
+    def test_routePolicy(self) -> None:
+        """
+        A route may be compressed even if its application isn't.
+        """
+        self.app = Klein()
+
+        @self.app.route("/", compress=CompressionPolicy(minimum_size=1))
+        def root(request: IRequest) -> KleinRenderable:
+            return b"tiny"
+
+        @self.app.route("/default")
+        def default(request: IRequest) -> KleinRenderable:
+            return self.body
+
+        request = self.render()
+        self.assertEqual(gzip.decompress(request.getWrittenData()), b"tiny")
+        request = self.render(path=b"/default")
+        self.assertEqual(request.getWrittenData(), self.body)
+
+    def test_etag(self) -> None:
+        """
+        The strong C{ETag} of a compressed response is weakened, and still
+        answers a conditional request with that weak tag.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return Response(body=self.body)
+
+        request = self.render()
+        [etag] = request.responseHeaders.getRawHeaders(b"etag", [])
+        self.assertTrue(etag.startswith(b'W/"'))
+
+        request = requestWith(b"gzip")
+        request.requestHeaders.setRawHeaders(b"if-none-match", [etag])
+        self.successResultOf(_render(self.app.resource(), request))
+        self.assertEqual(request.code, 304)
+        self.assertEqual(request.getWrittenData(), b"")
+
+    def test_deferred(self) -> None:
+        """
+        Bodies returned asynchronously are compressed too.
+        """
+        waiting: Deferred[bytes] = Deferred()
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return waiting
+
+        request = requestWith(b"gzip")
+        d = _render(self.app.resource(), request)
+        waiting.callback(self.body)
+        self.successResultOf(d)
+        self.assertEqual(gzip.decompress(request.getWrittenData()), self.body)
+
+    def compressions(self) -> List[bytes]:
+        """
+        Record the bodies compressed in one go from now on.
+        """
+        compressed: List[bytes] = []
+        original = _compression.compress
+
+        def compress(body: bytes, coding: bytes, level: int) -> bytes:
+            compressed.append(body)
+            return original(body, coding, level)
+
+        self.patch(_compression, "compress", compress)
+        return compressed
+
+    def test_constantBody(self) -> None:
+        """
+        The body of a constant L{Response} is only compressed once.
+        """
+        response = Response(body=self.body)
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return response
+
+        compressed = self.compressions()
+        first = self.render().getWrittenData()
+        self.assertEqual(self.render().getWrittenData(), first)
+        self.assertEqual(compressed, [self.body])
+
+    def test_cachedBody(self) -> None:
+        """
+        The body of a response served from the response cache is only
+        compressed once, however often it is served from there.
+        """
+
+        @self.app.route("/", cache=CachePolicy(ttl=5))
+        def root(request: IRequest) -> KleinRenderable:
+            return self.body.decode("ascii")
+
+        compressed = self.compressions()
+        first = self.render().getWrittenData()
+        self.assertEqual(self.render().getWrittenData(), first)
+        self.assertEqual(self.render().getWrittenData(), first)
+        self.assertEqual(len(compressed), 2)
+
+    def test_dynamicBody(self) -> None:
+        """
+        Other bodies are compressed every time, and not kept.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return self.body
+
+        compressed = self.compressions()
+        before = len(_compression.compressedBodies._bodies)
+        first = self.render().getWrittenData()
+        self.assertEqual(self.render().getWrittenData(), first)
+        self.assertEqual(compressed, [self.body, self.body])
+        self.assertEqual(len(_compression.compressedBodies._bodies), before)
+
+
+class StreamedCompressionTests(SynchronousTestCase):
+    """
+    Tests for compressing responses written in several parts, which needs a
+    real L{Request} to apply its encoder.
+    """
+
+    def setUp(self) -> None:
+        self.channel = DummyChannel()
+
+    def request(self, path: bytes = b"/") -> Request:
+        request = Request(self.channel, False)
+        request.method = b"GET"
+        request.uri = request.path = path
+        request.clientproto = b"HTTP/1.1"
+        request.setHost(b"localhost", 8080)
+        request.prepath = []
+        request.postpath = path.split(b"/")[1:]
+        request.requestHeaders.setRawHeaders(b"accept-encoding", [b"gzip"])
+        return request
+
+    def written(self) -> bytes:
+        written = self.channel.transport.written.getvalue()
+        return written.split(b"\r\n\r\n", 1)[1]
+
+    def test_stream(self) -> None:
+        """
+        Streamed chunks are compressed as they are written, each of them
+        flushed so that the client can decompress it straight away.
+        """
+        app = Klein(compression=CompressionPolicy())
+        produced: List[bytes] = []
+
+        @app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            def rows() -> Iterator[bytes]:
+                for i in range(3):
+                    row = b"row %d\n" % (i,)
+                    produced.append(row)
+                    yield row
+
+            return rows()
+
+        request = self.request()
+        request.render(app.resource())
+        self.assertTrue(request.finished)
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"content-encoding"),
+            [b"gzip"],
+        )
+        chunks = dechunk(self.written())
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(chunks[0]), b"row 0\n")
+        self.assertEqual(
+            b"".join(decompressor.decompress(each) for each in chunks[1:]),
+            b"".join(produced[1:]),
+        )
+        self.assertTrue(decompressor.eof)
+
+    def test_static(self) -> None:
+        """
+        Responses which set their own C{Content-Length}, such as those of
+        static files, are left alone.
+        """
+        directory = self.mktemp()
+        os.mkdir(directory)
+        with open(os.path.join(directory, "big.txt"), "wb") as f:
+            f.write(b"static " * 1000)
+        app = Klein(compression=CompressionPolicy())
+        mount(app, "/", directory)
+        request = self.request(b"/big.txt")
+        request.render(app.resource())
+        self.assertIsNone(
+            request.responseHeaders.getRawHeaders(b"content-encoding")
+        )
+        self.assertEqual(self.written(), b"static " * 1000)
@@ -0,0 +1,311 @@
+"""
+Tests for L{klein._conditional} and conditional requests for L{Response}s.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+from twisted.web.template import Element, Flattenable, TagLoader, tags
+
+from .. import CachePolicy, Klein, Response
+from .._conditional import (
+    _matches,
+    bodyETag,
+    formatETag,
+    formatTimestamp,
+    notModified,
+)
+from .test_resource import MockRequest, _render
+
+
+def requestWith(
+    method: bytes = b"GET", headers: Optional[Dict[bytes, bytes]] = None
+) -> MockRequest:
+    request = MockRequest(b"/", method=method)
+    for name, value in (headers or {}).items():
+        request.requestHeaders.setRawHeaders(name, [value])
+    return request
+
+
+class ValidatorTests(SynchronousTestCase):
+    """
+    Tests for formatting and comparing validators.
+    """
+
+    def test_formatETag(self) -> None:
+        """
+        Entity tags are quoted unless they already are.
+        """
+        self.assertEqual(formatETag("abc"), b'"abc"')
+        self.assertEqual(formatETag(b'"abc"'), b'"abc"')
+        self.assertEqual(formatETag(b'W/"abc"'), b'W/"abc"')
+
+    def test_bodyETag(self) -> None:
+        """
+        Entity tags computed from bodies are strong, and differ between
+        different bodies.
+        """
+        etag = bodyETag(b"hello")
+        self.assertEqual(etag, bodyETag(b"hello"))
+        self.assertNotEqual(etag, bodyETag(b"hello!"))
+        self.assertTrue(etag.startswith(b'"') and etag.endswith(b'"'))
+
+    def test_formatTimestamp(self) -> None:
+        """
+        Timestamps and aware datetimes are formatted as HTTP dates, rounding
+        fractional seconds up.
+        """
+        self.assertEqual(
+            formatTimestamp(784111776.5), b"Sun, 06 Nov 1994 08:49:37 GMT"
+        )
+        self.assertEqual(
+            formatTimestamp(
+                datetime(1994, 11, 6, 8, 49, 37, tzinfo=timezone.utc)
+            ),
+            b"Sun, 06 Nov 1994 08:49:37 GMT",
+        )
+
+    def test_matches(self) -> None:
+        """
+        C{If-None-Match} uses the weak comparison, and accepts lists and
+        C{*}.
+        """
+        self.assertTrue(_matches(b'"a"', b'"a"'))
+        self.assertTrue(_matches(b'"x", W/"a"', b'"a"'))
+        self.assertTrue(_matches(b'"a"', b'W/"a"'))
+        self.assertTrue(_matches(b"*", b'"a"'))
+        self.assertFalse(_matches(b'"b", "c"', b'"a"'))
+
+
+class NotModifiedTests(SynchronousTestCase):
+    """
+    Tests for L{notModified}.
+    """
+
+    lastModified = b"Sun, 06 Nov 1994 08:49:37 GMT"
+
+    def check(
+        self,
+        headers: Dict[bytes, bytes],
+        method: bytes = b"GET",
+        code: int = 200,
+    ) -> bool:
+        request = requestWith(method, headers)
+        request.setResponseCode(code)
+        request.setHeader(b"etag", b'"a"')
+        request.setHeader(b"last-modified", self.lastModified)
+        return notModified(request)
+
+    def test_ifNoneMatch(self) -> None:
+        """
+        A matching C{If-None-Match} means the response is not modified.
+        """
+        self.assertTrue(self.check({b"if-none-match": b'"a"'}))
+        self.assertTrue(self.check({b"if-none-match": b'"a"'}, b"HEAD"))
+        self.assertFalse(self.check({b"if-none-match": b'"b"'}))
+
+    def test_ifModifiedSince(self) -> None:
+        """
+        C{If-Modified-Since} at or after C{Last-Modified} means the response
+        is not modified.
+        """
+        self.assertTrue(self.check({b"if-modified-since": self.lastModified}))
+        later = b"Mon, 07 Nov 1994 08:49:37 GMT; length=3"
+        self.assertTrue(self.check({b"if-modified-since": later}))
+        earlier = b"Sat, 05 Nov 1994 08:49:37 GMT"
+        self.assertFalse(self.check({b"if-modified-since": earlier}))
+        self.assertFalse(self.check({b"if-modified-since": b"garbage"}))
+        self.assertFalse(self.check({b"if-modified-since": b""}))
+
+    def test_ifNoneMatchTakesPrecedence(self) -> None:
+        """
+        When both are given, C{If-Modified-Since} is ignored in favour of
+        C{If-None-Match}.
+        """
+        self.assertFalse(
+            self.check(
+                {
+                    b"if-none-match": b'"b"',
+                    b"if-modified-since": self.lastModified,
+                }
+            )
+        )
+
+    def test_unconditional(self) -> None:
+        """
+        Requests without conditions, other methods and other codes are never
+        answered with C{304}.
+        """
+        self.assertFalse(self.check({}))
+        self.assertFalse(self.check({b"if-none-match": b'"a"'}, b"POST"))
+        self.assertFalse(self.check({b"if-none-match": b'"a"'}, code=404))
+
+
+class ConditionalResponseTests(SynchronousTestCase):
+    """
+    Tests for conditional requests to routes returning L{Response}s.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.rendered: List[str] = []
+
+    def render(
+        self,
+        headers: Optional[Dict[bytes, bytes]] = None,
+        method: bytes = b"GET",
+    ) -> MockRequest:
+        request = requestWith(method, headers)
+        self.successResultOf(_render(self.app.resource(), request))
+        return request
+
+    def test_explicitValidators(self) -> None:
+        """
+        A L{Response}'s C{etag} and C{last_modified} are sent as headers, and
+        matching requests get a bodiless C{304}.
+        """
+
+        @self.app.route("/", methods=["GET", "POST"])
+        def root(request: IRequest) -> Any:
+            return Response(body=b"hello", etag="v1", last_modified=784111777)
+
+        request = self.render()
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"hello")
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"etag"), [b'"v1"']
+        )
+        lastModified = request.responseHeaders.getRawHeaders(b"last-modified")
+        assert lastModified is not None
+        self.assertEqual(lastModified, [b"Sun, 06 Nov 1994 08:49:37 GMT"])
+
+        request = self.render({b"if-none-match": b'"v1"'})
+        self.assertEqual(request.code, 304)
+        self.assertEqual(request.getWrittenData(), b"")
+        self.assertIsNone(
+            request.responseHeaders.getRawHeaders(b"content-length")
+        )
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"etag"), [b'"v1"']
+        )
+
+        request = self.render({b"if-modified-since": lastModified[0]})
+        self.assertEqual(request.code, 304)
+
+        request = self.render({b"if-none-match": b'"v1"'}, method=b"POST")
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"hello")
+
+    def test_automaticETag(self) -> None:
+        """
+        Without an explicit C{etag}, one is computed from a C{str} or
+        C{bytes} body.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return Response(body="\N{SNOWMAN}")
+
+        request = self.render()
+        etag = bodyETag("\N{SNOWMAN}".encode("utf-8"))
+        self.assertEqual(request.responseHeaders.getRawHeaders(b"etag"), [etag])
+        request = self.render({b"if-none-match": etag})
+        self.assertEqual(request.code, 304)
+        self.assertEqual(request.getWrittenData(), b"")
+        request = self.render({b"if-none-match": b'"other"'})
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), "\N{SNOWMAN}".encode())
+
+    def test_automaticETagOptOut(self) -> None:
+        """
+        No C{ETag} is computed for a L{Response} with C{auto_etag=False}.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return Response(body=b"hello", auto_etag=False)
+
+        request = self.render({b"if-none-match": bodyETag(b"hello")})
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"hello")
+        self.assertIsNone(request.responseHeaders.getRawHeaders(b"etag"))
+
+    def test_noAutomaticETag(self) -> None:
+        """
+        No C{ETag} is computed for non-C{200} responses, or when the route
+        has set one itself.
+        """
+
+        @self.app.route("/missing")
+        def missing(request: IRequest) -> Any:
+            return Response(404, body=b"nope")
+
+        @self.app.route("/own")
+        def own(request: IRequest) -> Any:
+            return Response(headers={"etag": '"mine"'}, body=b"hello")
+
+        request = requestWith()
+        request.uri = request.path = b"/missing"
+        request.postpath = [b"missing"]
+        self.successResultOf(_render(self.app.resource(), request))
+        self.assertIsNone(request.responseHeaders.getRawHeaders(b"etag"))
+
+        request = requestWith(headers={b"if-none-match": b'"mine"'})
+        request.uri = request.path = b"/own"
+        request.postpath = [b"own"]
+        self.successResultOf(_render(self.app.resource(), request))
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"etag"), [b'"mine"']
+        )
+        self.assertEqual(request.code, 304)
+
+    def test_validatorSkipsRendering(self) -> None:
+        """
+        A C{validator} is called to get the validators, and when the request
+        matches them the body is never rendered.
+        """
+        rendered = self.rendered
+
+        class Page(Element):
+            loader = TagLoader(tags.p("page"))
+
+            def render(self, request: Optional[IRequest]) -> Flattenable:
+                rendered.append("page")
+                return super().render(request)
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return Response(body=Page(), validator=lambda: ("v2", None))
+
+        request = self.render()
+        self.assertEqual(
+            request.getWrittenData(), b"<!DOCTYPE html>\n<p>page</p>"
+        )
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"etag"), [b'"v2"']
+        )
+        self.assertEqual(self.rendered, ["page"])
+
+        request = self.render({b"if-none-match": b'"v2"'})
+        self.assertEqual(request.code, 304)
+        self.assertEqual(request.getWrittenData(), b"")
+        self.assertEqual(self.rendered, ["page"])
+
+    def test_cachedResponse(self) -> None:
+        """
+        Responses served from the response cache are answered with C{304}
+        when their validators match.
+        """
+
+        @self.app.route("/", cache=CachePolicy(ttl=5))
+        def root(request: IRequest) -> Any:
+            self.rendered.append("root")
+            return Response(body=b"hello", etag="v3")
+
+        self.render()
+        request = self.render({b"if-none-match": b'"v3"'})
+        self.assertEqual(self.rendered, ["root"])
+        self.assertEqual(request.code, 304)
+        self.assertEqual(request.getWrittenData(), b"")
@@ -0,0 +1,607 @@
+"""
+Tests for L{klein._dispatch}.
+"""
+
+from typing import Any, List, Optional, Tuple
+
+from werkzeug.exceptions import HTTPException, MethodNotAllowed, NotFound
+from werkzeug.routing import BaseConverter, Map, Rule, Submount
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._dispatch import (
+    CacheStats,
+    LazyRule,
+    MatchCache,
+    RouteDispatcher,
+    RouteMatch,
+    VersionedMap,
+    mapVersion,
+)
+from .test_resource import MockRequest, _render
+
+
+class EvenConverter(BaseConverter):
+    regex = r"\d*[02468]"
+
+
+def exampleMap() -> Map:
+    """
+    A map that exercises static, parametric, branch, method-restricted,
+    slash-sensitive and uncompilable rules.
+    """
+    urlMap = Map(converters={"even": EvenConverter})
+    for rule in [
+        Rule("/", endpoint="root"),
+        Rule("/about", endpoint="about", methods=["GET"]),
+        Rule("/about", endpoint="about_post", methods=["POST"]),
+        Rule("/slash/", endpoint="slash"),
+        Rule("/lax/", endpoint="lax", strict_slashes=False),
+        Rule("/users/<name>", endpoint="user"),
+        Rule("/users/<int:uid>", endpoint="user_id"),
+        Rule("/users/me", endpoint="me"),
+        Rule("/users/<name>/posts/<int(min=1):post>", endpoint="post"),
+        Rule("/items/<uuid:item>", endpoint="item"),
+        Rule("/static/", endpoint="static"),
+        Rule("/static/<path:__rest__>", endpoint="static_branch"),
+        Rule("/old", endpoint="old", redirect_to="/about"),
+        Rule("/even/<even:number>", endpoint="even"),
+        Rule("/files/<name>.txt", endpoint="text"),
+        Rule("/put-only", endpoint="put", methods=["PUT"]),
+        Submount(
+            "/sub",
+            [Rule("/", endpoint="sub"), Rule("/<int:n>", endpoint="sub_n")],
+        ),
+    ]:
+        urlMap.add(rule)
+    return urlMap
+
+
+paths = [
+    "",
+    "/",
+    "/about",
+    "/about/",
+    "/slash",
+    "/slash/",
+    "/lax",
+    "/lax/",
+    "/users/bob",
+    "/users/12",
+    "/users/me",
+    "/users/bob/posts/3",
+    "/users/bob/posts/0",
+    "/users/bob/posts/x",
+    "/items/6fa459ea-ee8a-3ca4-894e-db77e160355e",
+    "/items/nope",
+    "/static",
+    "/static/",
+    "/static/css/site.css",
+    "/old",
+    "/even/4",
+    "/even/3",
+    "/files/a.txt",
+    "/put-only",
+    "/sub",
+    "/sub/",
+    "/sub/7",
+    "/nowhere",
+    "//about",
+]
+
+
+def werkzeugOutcome(
+    urlMap: Map, path: str, method: str
+) -> Tuple[Optional[str], Any]:
+    adapter = urlMap.bind("localhost", path_info=path, default_method=method)
+    try:
+        rule, arguments = adapter.match(return_rule=True)
+    except HTTPException as e:
+        return None, type(e)
+    return rule.endpoint, arguments
+
+
+class RouteDispatcherTests(SynchronousTestCase):
+    """
+    Tests for L{RouteDispatcher}.
+    """
+
+    def test_agreesWithWerkzeug(self) -> None:
+        """
+        Whenever L{RouteDispatcher.match} returns a result, it is the same rule
+        and arguments that L{MapAdapter.match} returns.
+        """
+        urlMap = exampleMap()
+        dispatcher = RouteDispatcher(urlMap)
+        decided = 0
+        for method in ["GET", "POST", "HEAD", "PUT"]:
+            for path in paths:
+                found = dispatcher.match(path, method)
+                if found is None:
+                    continue
+                decided += 1
+                rule, arguments = found
+                self.assertEqual(
+                    (rule.endpoint, arguments),
+                    werkzeugOutcome(urlMap, path, method),
+                    f"{method} {path!r}",
+                )
+        # Make sure we are actually testing something.
+        self.assertGreater(decided, 40)
+
+    def test_decidesCompilableRoutes(self) -> None:
+        """
+        Static, parametric and C{path} routes built only from the built-in
+        converters are decided without Werkzeug.
+        """
+        dispatcher = RouteDispatcher(exampleMap())
+        expected = [
+            ("/", "root", {}),
+            ("/users/me", "me", {}),
+            ("/users/12", "user_id", {"uid": 12}),
+            ("/users/bob", "user", {"name": "bob"}),
+            ("/users/bob/posts/3", "post", {"name": "bob", "post": 3}),
+            ("/static/a/b", "static_branch", {"__rest__": "a/b"}),
+            ("/lax", "lax", {}),
+            ("/sub/7", "sub_n", {"n": 7}),
+        ]
+        for path, endpoint, arguments in expected:
+            found = dispatcher.match(path, "GET")
+            assert found is not None, path
+            self.assertEqual(
+                (found[0].endpoint, found[1]), (endpoint, arguments)
+            )
+
+    def test_methods(self) -> None:
+        """
+        Rules restricted to other methods are skipped in favor of later rules
+        for the same path.
+        """
+        dispatcher = RouteDispatcher(exampleMap())
+        found = dispatcher.match("/about", "post")
+        assert found is not None
+        self.assertEqual(found[0].endpoint, "about_post")
+
+    def test_leavesOutcomesToWerkzeug(self) -> None:
+        """
+        Non-matches, slash redirects, validation failures and rules with
+        custom converters, redirects or mixed segments are not decided.
+        """
+        dispatcher = RouteDispatcher(exampleMap())
+        for path, method in [
+            ("/nowhere", "GET"),
+            ("/put-only", "GET"),
+            ("/slash", "GET"),
+            ("/users/bob/posts/0", "GET"),
+            ("/old", "GET"),
+            ("/even/4", "GET"),
+            ("/files/a.txt", "GET"),
+        ]:
+            self.assertIsNone(dispatcher.match(path, method), path)
+
+    def test_defaultsAreOpaque(self) -> None:
+        """
+        Endpoints with rules providing defaults, which may cause Werkzeug to
+        redirect, are not decided.
+        """
+        urlMap = Map(
+            [
+                Rule("/page/", endpoint="page", defaults={"n": 1}),
+                Rule("/page/<int:n>", endpoint="page"),
+            ]
+        )
+        dispatcher = RouteDispatcher(urlMap)
+        self.assertIsNone(dispatcher.match("/page/1", "GET"))
+        self.assertIsNone(dispatcher.match("/page/", "GET"))
+
+    def test_mergedSlashes(self) -> None:
+        """
+        Rules with repeated slashes, which Werkzeug matches with the slashes
+        merged, are not decided, and neither are the paths they match.
+        """
+        urlMap = Map(
+            [
+                Rule("/a//b", endpoint="double"),
+                Rule("/a/<x>", endpoint="x"),
+                Rule("/c//", endpoint="c"),
+                Rule("/d//e", endpoint="literal", merge_slashes=False),
+                Rule("/d/<x>", endpoint="d"),
+            ]
+        )
+        dispatcher = RouteDispatcher(urlMap)
+        for path in ["/a/b", "/a//b", "/c/", "/c//", "/d//e"]:
+            self.assertIsNone(dispatcher.match(path, "GET"), path)
+        for path in ["/a/z", "/d/e"]:
+            found = dispatcher.match(path, "GET")
+            assert found is not None, path
+            self.assertEqual(
+                (found[0].endpoint, found[1]),
+                werkzeugOutcome(urlMap, path, "GET"),
+            )
+
+    def test_isCurrentFor(self) -> None:
+        """
+        A dispatcher is current until rules are added to its map.
+        """
+        urlMap = exampleMap()
+        dispatcher = RouteDispatcher(urlMap)
+        self.assertTrue(dispatcher.isCurrentFor(urlMap))
+        urlMap.add(Rule("/new", endpoint="new"))
+        self.assertFalse(dispatcher.isCurrentFor(urlMap))
+
+    def test_hostMatching(self) -> None:
+        """
+        Maps that match on hosts are never decided.
+        """
+        urlMap = Map([Rule("/", endpoint="root", host="a")], host_matching=True)
+        self.assertIsNone(RouteDispatcher(urlMap).match("/", "GET"))
+
+
+class CompiledRoutesTests(SynchronousTestCase):
+    """
+    Tests for L{Klein} applications created with C{compiled_routes=True}.
+    """
+
+    def test_routing(self) -> None:
+        """
+        Requests are routed, with the prepath fixed up for the matched
+        endpoint, and routes added after the first request are noticed.
+        """
+        app = Klein(compiled_routes=True)
+        seen: List[Tuple[Any, ...]] = []
+
+        @app.route("/users/<int:uid>")
+        def user(request: IRequest, uid: int) -> KleinRenderable:
+            seen.append((uid, request.prepath, request.postpath))
+            return b"user"
+
+        request = MockRequest(b"/users/7")
+        self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(request.getWrittenData(), b"user")
+        self.assertEqual(seen, [(7, [b"users", b"7"], [])])
+
+        @app.route("/later")
+        def later(request: IRequest) -> KleinRenderable:
+            return b"later"
+
+        request = MockRequest(b"/later")
+        self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(request.getWrittenData(), b"later")
+
+    def test_notFound(self) -> None:
+        """
+        Outcomes the dispatcher cannot decide are still produced by Werkzeug.
+        """
+        app = Klein(compiled_routes=True)
+
+        @app.route("/", methods=["POST"])
+        def root(request: IRequest) -> KleinRenderable:
+            return b"root"
+
+        request = MockRequest(b"/nowhere")
+        self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(request.code, 404)
+
+        request = MockRequest(b"/")
+        self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(request.code, 405)
+
+    def test_bound(self) -> None:
+        """
+        Instance-bound applications keep using compiled routes.
+        """
+
+        class Thing:
+            app = Klein(compiled_routes=True)
+
+            @app.route("/")
+            def root(self, request: IRequest) -> KleinRenderable:
+                return b"bound"
+
+        request = MockRequest(b"/")
+        self.successResultOf(_render(Thing().app.resource(), request))
+        self.assertEqual(request.getWrittenData(), b"bound")
+
+
+class MapVersionTests(SynchronousTestCase):
+    """
+    Tests for L{mapVersion}.
+    """
+
+    def test_changesWithRules(self) -> None:
+        """
+        The version of a L{Map} or a L{VersionedMap} changes whenever rules
+        are added to it.
+        """
+        for urlMap in [Map(), VersionedMap()]:
+            versions = {mapVersion(urlMap)}
+            urlMap.add(Rule("/a", endpoint="a"))
+            versions.add(mapVersion(urlMap))
+            urlMap.add(Submount("/b", [Rule("/c", endpoint="c")]))
+            versions.add(mapVersion(urlMap))
+            urlMap.add(Rule("/a", endpoint="a", methods=["POST"]))
+            versions.add(mapVersion(urlMap))
+            self.assertEqual(len(versions), 4)
+
+    def test_versionedMap(self) -> None:
+        """
+        L{VersionedMap} counts every addition, including those made when it
+        is created, and is what L{Klein} routes with.
+        """
+        urlMap = VersionedMap([Rule("/a", endpoint="a")])
+        self.assertEqual(mapVersion(urlMap), 1)
+        self.assertIsInstance(Klein().url_map, VersionedMap)
+
+
+class DeferredRulesTests(SynchronousTestCase):
+    """
+    Tests for L{VersionedMap.deferRules}.
+    """
+
+    def setUp(self) -> None:
+        self.map = VersionedMap()
+        self.map.deferRules()
+        self.map.add(Rule("/a", endpoint="a"))
+        self.map.add(Submount("/b", [Rule("/<int:c>", endpoint="c")]))
+
+    def test_notBoundUntilFinalized(self) -> None:
+        """
+        Deferred rules are counted, but not bound until the map is finalized.
+        """
+        self.assertEqual(mapVersion(self.map), 2)
+        self.assertEqual(self.map._rules_by_endpoint, {})
+        self.map.finalize()
+        self.assertEqual(sorted(self.map._rules_by_endpoint), ["a", "c"])
+        self.assertEqual(mapVersion(self.map), 2)
+
+    def test_boundWhenUsed(self) -> None:
+        """
+        Matching, building, or looking at the rules of a map binds its
+        deferred rules.
+        """
+        adapter = self.map.bind("localhost")
+        self.assertEqual(adapter.match("/b/1"), ("c", {"c": 1}))
+
+        self.map.deferRules()
+        self.map.add(Rule("/d", endpoint="d"))
+        self.assertEqual(adapter.build("d"), "/d")
+
+        self.map.deferRules()
+        self.map.add(Rule("/e", endpoint="e"))
+        self.assertEqual(len(list(self.map.iter_rules())), 4)
+
+        self.map.deferRules()
+        self.map.add(Rule("/<f>", endpoint="f"))
+        self.assertTrue(self.map.is_endpoint_expecting("f", "f"))
+
+    def test_addAfterFinalize(self) -> None:
+        """
+        Once finalized, rules are bound as they are added.
+        """
+        self.map.finalize()
+        self.map.add(Rule("/d", endpoint="d"))
+        self.assertIn("d", self.map._rules_by_endpoint)
+
+    def test_timings(self) -> None:
+        """
+        L{VersionedMap.timings} reports the number of additions and the time
+        spent adding and finalizing.
+        """
+        self.map.finalize()
+        timings = self.map.timings()
+        self.assertEqual(timings.additions, 2)
+        self.assertGreater(timings.adding, 0)
+        self.assertGreater(timings.finalizing, 0)
+
+
+class LazyRuleTests(SynchronousTestCase):
+    """
+    Tests for L{LazyRule}.
+    """
+
+    def test_buildsLikeRule(self) -> None:
+        """
+        L{LazyRule}s build the same URLs as L{Rule}s, compiling their builders
+        the first time they are used.
+        """
+        urls = ["/", "/x/<int:y>", "/<path:rest>", "/q/<a>/<int(min=2):b>"]
+        lazy = Map([LazyRule(url, endpoint=url) for url in urls])
+        eager = Map([Rule(url, endpoint=url) for url in urls])
+        values = {"y": 3, "rest": "a/b", "a": "x y", "b": 4, "z": "?"}
+        for append in True, False:
+            for url in urls:
+                self.assertEqual(
+                    lazy.bind("localhost").build(url, values, None, append),
+                    eager.bind("localhost").build(url, values, None, append),
+                )
+        rule = next(lazy.iter_rules("/x/<int:y>"))
+        self.assertEqual(rule.build({"y": 5}), ("", "/x/5"))
+        self.assertEqual(rule.build({"y": 5}), ("", "/x/5"))
+
+    def test_klein(self) -> None:
+        """
+        L{Klein.route} adds L{LazyRule}s.
+        """
+        app = Klein()
+
+        @app.route("/", branch=True)
+        def root(request: IRequest) -> KleinRenderable:
+            return b""  # pragma: no cover
+
+        rules = list(app.url_map.iter_rules())
+        self.assertEqual(len(rules), 2)
+        for rule in rules:
+            self.assertIsInstance(rule, LazyRule)
+
+
+class KleinDeferredRoutesTests(SynchronousTestCase):
+    """
+    Tests for L{Klein} applications created with C{defer_routes=True}.
+    """
+
+    def test_freeze(self) -> None:
+        """
+        Routes, including those in subroutes, are added to the route table
+        when L{Klein.freeze} is called, along with compiling it.
+        """
+        app = Klein(defer_routes=True, compiled_routes=True)
+
+        @app.route("/a")
+        def a(request: IRequest) -> KleinRenderable:
+            return b"a"  # pragma: no cover
+
+        with app.subroute("/b") as sub:
+
+            @sub.route("/c")
+            def c(request: IRequest) -> KleinRenderable:
+                return b"c"  # pragma: no cover
+
+        self.assertEqual(app.url_map._rules_by_endpoint, {})
+        app.freeze()
+        self.assertEqual(sorted(app.url_map._rules_by_endpoint), ["a", "c"])
+        dispatcher = app._state.dispatcher
+        assert dispatcher is not None
+        self.assertTrue(dispatcher.isCurrentFor(app.url_map))
+        self.assertEqual(app.route_timings.additions, 2)
+
+    def test_firstRequest(self) -> None:
+        """
+        Without L{Klein.freeze}, the first request builds the route table.
+        """
+        app = Klein(defer_routes=True)
+
+        @app.route("/<int:x>")
+        def x(request: IRequest, x: int) -> KleinRenderable:
+            return b"%d" % (x,)
+
+        request = MockRequest(b"/3")
+        self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(request.getWrittenData(), b"3")
+
+
+class MatchCacheTests(SynchronousTestCase):
+    """
+    Tests for L{MatchCache}.
+    """
+
+    def setUp(self) -> None:
+        self.map = exampleMap()
+        self.cache = MatchCache(maxsize=3)
+        self.calls: List[str] = []
+
+    def matcher(self, mapper: Any) -> RouteMatch:
+        self.calls.append(mapper.path_info)
+        result: RouteMatch = mapper.match(return_rule=True)
+        return result
+
+    def match(self, path: str, method: str = "GET") -> RouteMatch:
+        adapter = self.map.bind(
+            "localhost", path_info=path, default_method=method
+        )
+        return self.cache.match(adapter, self.matcher)
+
+    def test_memoizes(self) -> None:
+        """
+        Repeated matches of the same method, host and path are answered
+        without calling the matcher, with a fresh arguments C{dict}.
+        """
+        rule, arguments = self.match("/users/7")
+        arguments["mutated"] = True
+        again, arguments = self.match("/users/7")
+        self.assertIs(again, rule)
+        self.assertEqual(arguments, {"uid": 7})
+        self.assertEqual(self.calls, ["/users/7"])
+
+        self.match("/users/7", "POST")
+        self.assertEqual(self.calls, ["/users/7"] * 2)
+        self.assertEqual(self.cache.stats(), CacheStats(1, 2, 2))
+
+    def test_negative(self) -> None:
+        """
+        L{NotFound} and L{MethodNotAllowed} outcomes are cached, and raised
+        anew on every hit.
+        """
+        first = self.assertRaises(NotFound, self.match, "/nowhere")
+        second = self.assertRaises(NotFound, self.match, "/nowhere")
+        self.assertIsNot(first, second)
+
+        e = self.assertRaises(MethodNotAllowed, self.match, "/put-only")
+        e2 = self.assertRaises(MethodNotAllowed, self.match, "/put-only")
+        self.assertEqual(e2.valid_methods, e.valid_methods)
+        self.assertEqual(self.calls, ["/nowhere", "/put-only"])
+
+    def test_redirectsNotCached(self) -> None:
+        """
+        Redirects depend on more than the cache key, so they are not cached.
+        """
+        self.assertRaises(HTTPException, self.match, "/slash")
+        self.assertRaises(HTTPException, self.match, "/slash")
+        self.assertEqual(self.calls, ["/slash", "/slash"])
+        self.assertEqual(self.cache.stats().size, 0)
+
+    def test_evictsLeastRecentlyUsed(self) -> None:
+        """
+        When the cache is full, the least recently used outcome is evicted.
+        """
+        for path in ["/", "/users/1", "/", "/users/2", "/users/3", "/"]:
+            self.match(path)
+        self.match("/users/1")
+        self.assertEqual(
+            self.calls, ["/", "/users/1", "/users/2", "/users/3", "/users/1"]
+        )
+
+    def test_invalidatedByNewRules(self) -> None:
+        """
+        Adding rules to the map discards cached outcomes, including 404s.
+        """
+        self.assertRaises(NotFound, self.match, "/new")
+        self.map.add(Rule("/new", endpoint="new"))
+        self.assertEqual(self.match("/new")[0].endpoint, "new")
+
+
+class KleinMatchCacheTests(SynchronousTestCase):
+    """
+    Tests for L{Klein} applications created with a C{match_cache_size}.
+    """
+
+    def test_noCacheByDefault(self) -> None:
+        """
+        Applications do not cache routing outcomes unless asked to.
+        """
+        self.assertIsNone(Klein().match_cache)
+
+    def test_routeAndSubrouteInvalidate(self) -> None:
+        """
+        Routes added with L{Klein.route} or L{Klein.subroute} after a path was
+        cached as not found are matched.
+        """
+        app = Klein(match_cache_size=10)
+        resource = app.resource()
+
+        def render(path: bytes) -> MockRequest:
+            request = MockRequest(path)
+            self.successResultOf(_render(resource, request))
+            return request
+
+        self.assertEqual(render(b"/one").code, 404)
+        self.assertEqual(render(b"/one").code, 404)
+        cache = app.match_cache
+        assert cache is not None
+        self.assertEqual(cache.stats(), CacheStats(1, 1, 1))
+
+        @app.route("/one")
+        def one(request: IRequest) -> KleinRenderable:
+            return b"one"
+
+        self.assertEqual(render(b"/one").getWrittenData(), b"one")
+        self.assertEqual(render(b"/sub/two").code, 404)
+
+        with app.subroute("/sub") as sub:
+
+            @sub.route("/two")
+            def two(request: IRequest) -> KleinRenderable:
+                return b"two"
+
+        self.assertEqual(render(b"/sub/two").getWrittenData(), b"two")
@@ -0,0 +1,312 @@
+"""
+Tests for L{klein._drain}.
+"""
+
+from typing import Any, List
+from unittest.mock import Mock, patch
+
+from twisted.internet.defer import CancelledError, Deferred, succeed
+from twisted.internet.error import ConnectionDone
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._drain import Drainer, InFlight, _flushInterval, currentRSS
+from .test_resource import MockRequest, _render
+
+
+class StoppableClock(Clock):
+    """
+    A clock which can be told to stop, like a reactor.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.stops = 0
+        self.triggers: List[Any] = []
+
+    def stop(self) -> None:
+        self.stops += 1
+
+    def addSystemEventTrigger(self, phase: str, event: str, f: Any) -> None:
+        self.triggers.append((phase, event, f))
+
+
+class InFlightTests(SynchronousTestCase):
+    """
+    Tests for L{InFlight}, and its use by L{KleinResource}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.inFlight = self.app.in_flight
+
+    def test_synchronous(self) -> None:
+        """
+        A request answered synchronously is in flight only while it is
+        rendered.
+        """
+        active = []
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            active.append(self.inFlight.active)
+            return b"ok"
+
+        self.successResultOf(_render(self.app.resource(), MockRequest(b"/")))
+        self.assertEqual(active, [1])
+        self.assertEqual((self.inFlight.active, self.inFlight.handled), (0, 1))
+
+    def test_asynchronous(self) -> None:
+        """
+        A request answered asynchronously is in flight until it is finished,
+        or its connection is lost.
+        """
+        waiting: List[Deferred[bytes]] = []
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            waiting.append(Deferred())
+            return waiting[-1]
+
+        finished = MockRequest(b"/")
+        _render(self.app.resource(), finished)
+        lost = MockRequest(b"/")
+        renderingLost = _render(self.app.resource(), lost)
+        self.assertEqual(self.inFlight.active, 2)
+
+        idle = self.inFlight.idle()
+        lost.connectionLost(Failure(ConnectionDone()))
+        self.failureResultOf(renderingLost, ConnectionDone)
+        self.assertEqual(self.inFlight.active, 1)
+        self.assertNoResult(idle)
+        waiting[0].callback(b"done")
+        self.assertEqual((self.inFlight.active, self.inFlight.handled), (0, 2))
+        self.assertIsNone(self.successResultOf(idle))
+        self.assertIsNone(self.successResultOf(self.inFlight.idle()))
+
+    def test_draining(self) -> None:
+        """
+        Requests which start while draining close their connection once
+        they're answered.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+        request = MockRequest(b"/")
+        channel = request.channel
+        self.inFlight.draining = True
+        self.successResultOf(_render(self.app.resource(), request))
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"connection"), [b"close"]
+        )
+        self.assertFalse(channel.persistent)
+
+    def test_drainInFlight(self) -> None:
+        """
+        Draining closes the connections of the requests in flight once
+        they're answered, but leaves those of finished requests alone.
+        """
+        inFlight = InFlight()
+        answered = MockRequest(b"/")
+        idle = answered.channel
+        inFlight.started(answered)
+        answered.finish()
+        inFlight.finished()
+        pending = MockRequest(b"/")
+        inFlight.started(pending)
+        inFlight.drain()
+        self.assertTrue(inFlight.draining)
+        self.assertFalse(hasattr(idle, "persistent"))
+        self.assertFalse(pending.channel.persistent)
+
+    def test_closing(self) -> None:
+        """
+        Connections which are closing count until they're disconnected.
+        """
+        inFlight = InFlight()
+        request = MockRequest(b"/")
+        inFlight.started(request)
+        transport: Any = request.channel.transport
+        self.assertEqual(inFlight.closing(), 0)
+        transport.connected = True
+        transport.disconnecting = True
+        self.assertEqual(inFlight.closing(), 1)
+        transport.connected = False
+        self.assertEqual(inFlight.closing(), 0)
+
+    def test_cancelIdle(self) -> None:
+        """
+        Cancelling a wait for idleness forgets it.
+        """
+        inFlight = InFlight()
+        inFlight.started(MockRequest(b"/"))
+        waiting = inFlight.idle()
+        waiting.cancel()
+        self.failureResultOf(waiting, CancelledError)
+        self.assertEqual(inFlight._idle, [])
+
+    def test_currentRSS(self) -> None:
+        """
+        The resident set size of a running process is positive.
+        """
+        self.assertGreater(currentRSS(), 0)
+
+
+class DrainerTests(SynchronousTestCase):
+    """
+    Tests for L{Drainer}.
+    """
+
+    def setUp(self) -> None:
+        self.reactor = StoppableClock()
+        self.inFlight = InFlight()
+        self.port = Mock()
+        self.port.stopListening.return_value = succeed(None)
+
+    def drainer(self, **kwargs: Any) -> Drainer:
+        drainer = Drainer(self.reactor, self.inFlight, timeout=10, **kwargs)
+        drainer.listening(self.port)
+        drainer.start()
+        return drainer
+
+    def test_drain(self) -> None:
+        """
+        Before the reactor shuts down, the server stops listening and waits
+        for the requests in flight to finish.
+        """
+        drainer = self.drainer()
+        self.assertEqual(
+            self.reactor.triggers, [("before", "shutdown", drainer.drain)]
+        )
+        self.inFlight.started(MockRequest(b"/"))
+        d = drainer.drain()
+        self.port.stopListening.assert_called_once_with()
+        self.assertTrue(self.inFlight.draining)
+        self.reactor.advance(5)
+        self.assertNoResult(d)
+        self.inFlight.finished()
+        self.assertNoResult(d)
+        self.reactor.advance(0)
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_drainTimeout(self) -> None:
+        """
+        Requests which take longer than the timeout to finish are given up
+        on.
+        """
+        drainer = self.drainer()
+        self.inFlight.started(MockRequest(b"/"))
+        d = drainer.drain()
+        self.reactor.advance(10)
+        self.reactor.advance(0)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.inFlight._idle, [])
+
+    def closingRequest(self) -> MockRequest:
+        """
+        Start a request whose connection is closing, but still writing.
+        """
+        request = MockRequest(b"/")
+        transport: Any = request.channel.transport
+        transport.connected = True
+        transport.disconnecting = True
+        self.inFlight.started(request)
+        return request
+
+    def test_flush(self) -> None:
+        """
+        Once the requests in flight have finished, draining waits for the
+        connections closing after them to finish writing.
+        """
+        drainer = self.drainer()
+        request = self.closingRequest()
+        transport: Any = request.channel.transport
+        d = drainer.drain()
+        self.inFlight.finished()
+        self.reactor.advance(0)
+        self.assertNoResult(d)
+        self.reactor.advance(_flushInterval)
+        self.assertNoResult(d)
+        transport.connected = False
+        self.reactor.advance(_flushInterval)
+        self.assertIsNone(self.successResultOf(d))
+
+    def test_flushTimeout(self) -> None:
+        """
+        Connections which are still writing when the timeout is reached are
+        given up on.
+        """
+        drainer = self.drainer()
+        request = self.closingRequest()
+        d = drainer.drain()
+        self.inFlight.finished()
+        self.reactor.advance(0)
+        self.reactor.pump([_flushInterval] * int(9.9 / _flushInterval))
+        self.assertNoResult(d)
+        self.reactor.pump([_flushInterval] * 3)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+        self.assertEqual(self.inFlight.closing(), 1)
+        self.assertFalse(request.channel.persistent)
+
+    def test_maxRequests(self) -> None:
+        """
+        The reactor is stopped, once, when the server has handled the
+        maximum number of requests.
+        """
+        self.drainer(maxRequests=2)
+        for _ in range(3):
+            self.inFlight.started(MockRequest(b"/"))
+        self.inFlight.finished()
+        self.assertEqual(self.reactor.stops, 0)
+        self.inFlight.finished()
+        self.inFlight.finished()
+        self.assertEqual(self.reactor.stops, 1)
+
+    def test_maxRSS(self) -> None:
+        """
+        The reactor is stopped when the resident set size, checked
+        periodically, exceeds the maximum, and the checks stop when the
+        server drains.
+        """
+        sizes = [100, 200, 300]
+        drainer = self.drainer(
+            maxRSS=250, checkInterval=5, rss=lambda: sizes.pop(0)
+        )
+        self.reactor.advance(5)
+        self.reactor.advance(5)
+        self.assertEqual(self.reactor.stops, 0)
+        self.reactor.advance(5)
+        self.assertEqual(self.reactor.stops, 1)
+        d = drainer.drain()
+        self.reactor.advance(0)
+        self.successResultOf(d)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+
+class RunTests(SynchronousTestCase):
+    """
+    Tests for draining with L{Klein.run}.
+    """
+
+    @patch("klein._app.log")
+    @patch("klein._app.reactor")
+    def test_run(self, reactor: Any, mockLog: Any) -> None:
+        """
+        L{Klein.run} drains the port it listens on before shutting down, and
+        passes on its thresholds.
+        """
+        app = Klein()
+        with patch("klein._app.Drainer") as mockDrainer:
+            app.run("localhost", 8080, max_requests=10, drain_timeout=5)
+        mockDrainer.assert_called_once_with(reactor, app.in_flight, 5, 10, None)
+        drainer = mockDrainer.return_value
+        drainer.listening.assert_called_once_with(
+            reactor.listenTCP.return_value
+        )
+        drainer.start.assert_called_once_with()
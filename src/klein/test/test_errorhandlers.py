@@ -0,0 +1,160 @@
+"""
+Tests for L{klein._errorhandlers}.
+"""
+
+from typing import Any, List, Optional, Type
+
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._app import ErrorMethods
+from .._errorhandlers import ErrorHandlerTable
+from .test_resource import MockRequest, _render
+
+
+class Base(Exception):
+    pass
+
+
+class Derived(Base):
+    pass
+
+
+class Other(Exception):
+    pass
+
+
+def _handler(
+    self: Optional[Klein], request: IRequest, failure: Failure
+) -> KleinRenderable:
+    return None  # pragma: no cover
+
+
+def handlersFor(*exceptions: List[Type[Exception]]) -> ErrorMethods:
+    return [(list(each), _handler) for each in exceptions]
+
+
+def failureOf(exception: Exception) -> Failure:
+    try:
+        raise exception
+    except Exception:
+        return Failure()
+
+
+class ErrorHandlerTableTests(SynchronousTestCase):
+    """
+    Tests for L{ErrorHandlerTable}.
+    """
+
+    def setUp(self) -> None:
+        self.table = ErrorHandlerTable()
+        self.handlers = handlersFor(
+            [Derived],
+            [Other, Base],
+            [Exception],
+            [Other],
+            [Derived, Base],
+        )
+
+    def test_equivalentToCheck(self) -> None:
+        """
+        L{ErrorHandlerTable.candidates} finds exactly the handlers, in order,
+        whose exceptions L{Failure.check} matches.
+        """
+        for exception in [Base(), Derived(), Other(), ValueError()]:
+            failure = failureOf(exception)
+            expected = tuple(
+                index
+                for index, (exceptions, handler) in enumerate(self.handlers)
+                if failure.check(*exceptions)
+            )
+            self.assertEqual(
+                self.table.candidates(self.handlers, type(exception)),
+                expected,
+            )
+
+    def test_nextHandler(self) -> None:
+        """
+        L{ErrorHandlerTable.nextHandler} returns the first applicable handler
+        after the given index.
+        """
+        failure = failureOf(Derived())
+        found = []
+        after = -1
+        while True:
+            result = self.table.nextHandler(self.handlers, failure, after)
+            if result is None:
+                break
+            after = result[0]
+            found.append(after)
+        self.assertEqual(found, [0, 1, 2, 4])
+        self.assertEqual(
+            self.table.nextHandler(self.handlers, failureOf(Other()), 3),
+            None,
+        )
+
+    def test_cachedPerType(self) -> None:
+        """
+        Candidates are computed once per exception type.
+        """
+        first = self.table.candidates(self.handlers, Derived)
+        self.assertIs(self.table.candidates(self.handlers, Derived), first)
+
+    def test_rebuiltForNewHandlers(self) -> None:
+        """
+        Registering another handler, or using a different list of handlers,
+        is noticed.
+        """
+        self.assertEqual(self.table.candidates(self.handlers, Other), (1, 2, 3))
+        self.handlers.extend(handlersFor([Other]))
+        self.assertEqual(
+            self.table.candidates(self.handlers, Other), (1, 2, 3, 5)
+        )
+        self.assertEqual(
+            self.table.candidates(handlersFor([ValueError]), Other), ()
+        )
+
+
+class KleinErrorHandlerTableTests(SynchronousTestCase):
+    """
+    Tests for L{KleinResource}'s use of L{Klein.next_error_handler}.
+    """
+
+    def test_fallbackSkipsInapplicable(self) -> None:
+        """
+        When an error handler fails, the next handler registered after it that
+        handles the new failure is used, even if handlers for the original
+        failure remain.
+        """
+        app = Klein()
+        calls: List[str] = []
+
+        @app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            raise Derived()
+
+        @app.handle_errors(Other)
+        def early(request: IRequest, failure: Failure) -> Any:
+            calls.append("early")  # pragma: no cover
+
+        @app.handle_errors(Base)
+        def base(request: IRequest, failure: Failure) -> KleinRenderable:
+            calls.append("base")
+            raise Other()
+
+        @app.handle_errors(Derived)
+        def derived(request: IRequest, failure: Failure) -> KleinRenderable:
+            calls.append("derived")  # pragma: no cover
+            return b"derived"  # pragma: no cover
+
+        @app.handle_errors(Other)
+        def other(request: IRequest, failure: Failure) -> KleinRenderable:
+            calls.append("other")
+            return b"other"
+
+        request = MockRequest(b"/")
+        self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(calls, ["base", "other"])
+        self.assertEqual(request.getWrittenData(), b"other")
@@ -16,7 +16,10 @@ class PublicSymbolsTestCase(unittest.TestCase):
         """
         import klein as k
         import klein._app as a
+        import klein._multipart as m
         import klein._plating as p
+        import klein._processes as pr
+        import klein._threads as t
 
         self.assertIdentical(k.Klein, a.Klein)
         self.assertIdentical(k.handle_errors, a.handle_errors)
@@ -25,6 +28,12 @@ class PublicSymbolsTestCase(unittest.TestCase):
 
         self.assertIdentical(k.Plating, p.Plating)
 
+        self.assertIdentical(k.HandlerThreadPool, t.HandlerThreadPool)
+        self.assertIdentical(k.blocking, t.blocking)
+        self.assertIdentical(k.HandlerProcessPool, pr.HandlerProcessPool)
+        self.assertIdentical(k.cpuBound, pr.cpuBound)
+        self.assertIdentical(k.UploadedFile, m.UploadedFile)
+
     def test_klein_resource(self) -> None:
         """
         Test export of C{resource} from L{klein}.
@@ -65,3 +74,66 @@ class PublicSymbolsTestCase(unittest.TestCase):
 
         self.assertIdentical(r.KleinResource, _r.KleinResource)
         self.assertIdentical(r.ensure_utf8_bytes, _r.ensure_utf8_bytes)
+
+    def test_static(self) -> None:
+        """
+        Test exports from L{klein.static}.
+        """
+        import klein._static as _s
+        import klein.static as s
+
+        self.assertIdentical(s.StaticFiles, _s.StaticFiles)
+        self.assertIdentical(s.mount, _s.mount)
+
+    def test_instrumentation(self) -> None:
+        """
+        Test exports from L{klein.instrumentation}.
+        """
+        import klein._instrumentation as _i
+        import klein.instrumentation as i
+
+        self.assertIdentical(i.RequestTimings, _i.RequestTimings)
+        self.assertIdentical(i.StageHistograms, _i.StageHistograms)
+        self.assertIdentical(i.exposeMetrics, _i.exposeMetrics)
+        self.assertEqual(i.DEFAULT_BUCKETS, _i.DEFAULT_BUCKETS)
+
+    def test_profiling(self) -> None:
+        """
+        Test exports from L{klein.profiling}.
+        """
+        import klein._profiling as _p
+        import klein.profiling as p
+
+        self.assertIdentical(p.RequestProfiler, _p.RequestProfiler)
+        self.assertIdentical(p.SlowRequest, _p.SlowRequest)
+        self.assertIdentical(p.exposeProfiles, _p.exposeProfiles)
+        self.assertIdentical(p.collapsedStacks, _p.collapsedStacks)
+        self.assertIdentical(p.pstatsText, _p.pstatsText)
+
+    def test_shedding(self) -> None:
+        """
+        Test exports from L{klein.shedding}.
+        """
+        import klein._shedding as _s
+        import klein.shedding as s
+
+        self.assertIdentical(s.AdmissionController, _s.AdmissionController)
+        self.assertIdentical(s.LagMonitor, _s.LagMonitor)
+        self.assertIdentical(s.SheddingStats, _s.SheddingStats)
+        self.assertEqual(
+            (s.CRITICAL, s.NORMAL, s.LOW), (_s.CRITICAL, _s.NORMAL, _s.LOW)
+        )
+
+    def test_jsoncodec(self) -> None:
+        """
+        Test exports from L{klein.jsoncodec}.
+        """
+        import klein._jsoncodec as _j
+        import klein.jsoncodec as j
+
+        self.assertIdentical(j.JSONCodec, _j.JSONCodec)
+        self.assertIdentical(j.STDLIB_JSON, _j.STDLIB_JSON)
+        self.assertIdentical(j.availableCodecs, _j.availableCodecs)
+        self.assertIdentical(j.fastestCodec, _j.fastestCodec)
+        self.assertIdentical(j.parsedJSONBody, _j.parsedJSONBody)
+        self.assertIdentical(j.registerCodec, _j.registerCodec)
@@ -0,0 +1,301 @@
+"""
+Tests for L{klein._instrumentation}.
+"""
+
+from typing import Any, Dict, List
+
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+from twisted.web.template import slot, tags
+
+from .. import CachePolicy, Klein, KleinRenderable, Plating, Requirer
+from .._instrumentation import (
+    FINISH,
+    TOTAL,
+    UNMATCHED,
+    RequestTimings,
+    StageHistograms,
+    exposeMetrics,
+    requestTimings,
+)
+from .test_resource import MockRequest, _render
+
+
+def stageNames(timings: RequestTimings) -> List[str]:
+    return [stage for stage, _, _ in timings.stages()]
+
+
+class RequestTimingsTests(SynchronousTestCase):
+    """
+    Tests for L{RequestTimings}.
+    """
+
+    def test_stages(self) -> None:
+        """
+        Each stage lasts from the end of the one before to its own mark, and
+        the total from the start to the last mark.
+        """
+        timings = RequestTimings(b"GET")
+        timings.marks = [("start", 1.0, 0.5), ("a", 1.5, 0.75)]
+        timings.marks.append(("b", 3.0, 1.0))
+        self.assertEqual(
+            list(timings.stages()), [("a", 0.5, 0.25), ("b", 1.5, 0.25)]
+        )
+        self.assertEqual(timings.total(), (2.0, 0.5))
+
+
+class InstrumentedAppTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.instrument}, and the stages which L{KleinResource},
+    L{Requirer} and L{Plating} mark.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.observed: List[RequestTimings] = []
+        self.app.instrument(self.observed.append)
+
+    def render(self, path: bytes) -> MockRequest:
+        request = MockRequest(path)
+        _render(self.app.resource(), request)
+        return request
+
+    def test_uninstrumented(self) -> None:
+        """
+        Requests to an application without observers aren't timed.
+        """
+        app = Klein()
+        seen = []
+
+        @app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            seen.append(requestTimings(request))
+            return b"ok"
+
+        self.successResultOf(_render(app.resource(), MockRequest(b"/")))
+        self.assertEqual(seen, [None])
+
+    def test_synchronous(self) -> None:
+        """
+        A route answered synchronously is timed, up to its handler returning
+        and its response being written.
+        """
+
+        @self.app.route("/", endpoint="root")
+        def root(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+        self.render(b"/")
+        [timings] = self.observed
+        self.assertEqual(
+            stageNames(timings), ["url", "match", "handler", FINISH]
+        )
+        self.assertEqual((timings.endpoint, timings.code), ("root", 200))
+        self.assertEqual(timings.method, b"GET")
+
+    def test_asynchronous(self) -> None:
+        """
+        Timings for a route answered asynchronously are delivered once its
+        request is finished.
+        """
+        waiting: "Deferred[bytes]" = Deferred()
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return waiting
+
+        self.render(b"/")
+        self.assertEqual(self.observed, [])
+        waiting.callback(b"ok")
+        [timings] = self.observed
+        self.assertEqual(
+            stageNames(timings), ["url", "match", "handler", "render", FINISH]
+        )
+
+    def test_unmatched(self) -> None:
+        """
+        Requests which don't match a route have no endpoint.
+        """
+        request = self.render(b"/missing")
+        self.assertEqual(request.code, 404)
+        [timings] = self.observed
+        self.assertIsNone(timings.endpoint)
+        self.assertEqual(timings.code, 404)
+
+    def test_cached(self) -> None:
+        """
+        Requests answered from the response cache skip the handler.
+        """
+
+        @self.app.route("/", cache=CachePolicy(ttl=60))
+        def root(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+        self.render(b"/")
+        self.render(b"/")
+        self.assertEqual(stageNames(self.observed[1]), ["url", "match", FINISH])
+
+    def test_requirer(self) -> None:
+        """
+        L{Requirer} marks the ends of its prerequisites and its injection.
+        """
+        requirer = Requirer()
+
+        @requirer.require(self.app.route("/"))
+        def root() -> KleinRenderable:
+            return b"ok"
+
+        self.render(b"/")
+        [timings] = self.observed
+        self.assertEqual(
+            stageNames(timings),
+            ["url", "match", "prepare", "inject", "handler", "render", FINISH],
+        )
+
+    def test_plating(self) -> None:
+        """
+        L{Plating} marks the end of its route's method, and of setting up
+        its template.
+        """
+        page = Plating(tags=tags.html(tags.body(slot(Plating.CONTENT))))
+
+        @page.routed(self.app.route("/"), tags.p(slot("greeting")))
+        def root(request: IRequest) -> Dict[str, str]:
+            return {"greeting": "hello"}
+
+        request = self.render(b"/")
+        self.assertIn(b"<p>hello</p>", request.getWrittenData())
+        [timings] = self.observed
+        # The template is flattened synchronously, finishing the request.
+        self.assertEqual(
+            stageNames(timings),
+            ["url", "match", "data", "plating", "handler", FINISH],
+        )
+
+    def test_observerError(self) -> None:
+        """
+        An exception raised by an observer is logged, and the other
+        observers are still called.
+        """
+
+        def broken(timings: RequestTimings) -> None:
+            raise ZeroDivisionError()
+
+        self.app.timing_observers.insert(0, broken)
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+        request = self.render(b"/")
+        self.assertEqual(request.getWrittenData(), b"ok")
+        self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+        self.assertEqual(len(self.observed), 1)
+
+
+def timed(endpoint: Any, *stages: Any) -> RequestTimings:
+    timings = RequestTimings(b"GET")
+    timings.endpoint = endpoint
+    wall = cpu = 0.0
+    timings.marks = [("start", wall, cpu)]
+    for stage, duration in stages:
+        wall += duration
+        cpu += duration / 2
+        timings.marks.append((stage, wall, cpu))
+    return timings
+
+
+class StageHistogramsTests(SynchronousTestCase):
+    """
+    Tests for L{StageHistograms}.
+    """
+
+    def test_buckets(self) -> None:
+        """
+        Each stage, and the whole request, is counted in the first bucket
+        it fits, or the last if it fits none, and its durations are added
+        up.
+        """
+        histograms = StageHistograms(buckets=[0.25, 1.0])
+        histograms(timed("root", ("match", 0.125), ("handler", 2.0)))
+        histograms(timed("root", ("match", 0.25), ("handler", 0.5)))
+        histograms(timed(None, ("match", 0.5)))
+        self.assertEqual(
+            histograms.snapshot(),
+            {
+                ("root", "match"): ([2, 0, 0], 0.375, 0.1875),
+                ("root", "handler"): ([0, 1, 1], 2.5, 1.25),
+                ("root", TOTAL): ([0, 1, 1], 2.875, 1.4375),
+                (UNMATCHED, "match"): ([0, 1, 0], 0.5, 0.25),
+                (UNMATCHED, TOTAL): ([0, 1, 0], 0.5, 0.25),
+            },
+        )
+
+    def test_maxSeries(self) -> None:
+        """
+        Once there are C{maxSeries} histograms, further routes are counted
+        together.
+        """
+        histograms = StageHistograms(maxSeries=2)
+        for endpoint in ["a", "b", "c", "a"]:
+            histograms(timed(endpoint, ("handler", 0.01)))
+        counts = {
+            key: sum(counts)
+            for key, (counts, _, _) in histograms.snapshot().items()
+        }
+        self.assertEqual(
+            counts,
+            {
+                ("a", "handler"): 2,
+                ("a", TOTAL): 2,
+                ("<other>", "handler"): 2,
+                ("<other>", TOTAL): 2,
+            },
+        )
+
+    def test_exposition(self) -> None:
+        """
+        The histograms are presented with cumulative buckets in the
+        Prometheus text format, with their labels escaped.
+        """
+        histograms = StageHistograms(buckets=[0.1, 1.0])
+        histograms(timed('say "hi"', ("handler", 0.5)))
+        lines = histograms.exposition().decode("utf-8").splitlines()
+        labels = 'route="say \\"hi\\"",stage="handler"'
+        self.assertIn("# TYPE klein_request_stage_seconds histogram", lines)
+        self.assertIn(
+            f'klein_request_stage_seconds_bucket{{{labels},le="0.1"}} 0', lines
+        )
+        self.assertIn(
+            f'klein_request_stage_seconds_bucket{{{labels},le="1.0"}} 1', lines
+        )
+        self.assertIn(
+            f'klein_request_stage_seconds_bucket{{{labels},le="+Inf"}} 1', lines
+        )
+        self.assertIn(f"klein_request_stage_seconds_sum{{{labels}}} 0.5", lines)
+        self.assertIn(f"klein_request_stage_seconds_count{{{labels}}} 1", lines)
+        self.assertIn(
+            f"klein_request_stage_cpu_seconds_total{{{labels}}} 0.25", lines
+        )
+
+    def test_exposeMetrics(self) -> None:
+        """
+        L{exposeMetrics} serves the exposition of an application's
+        histograms from a route.
+        """
+        app = Klein()
+        histograms = app.instrument(StageHistograms())
+        exposeMetrics(app, histograms)
+        for _ in range(2):
+            request = MockRequest(b"/metrics")
+            self.successResultOf(_render(app.resource(), request))
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"content-type"),
+            [b"text/plain; version=0.0.4; charset=utf-8"],
+        )
+        self.assertIn(
+            b'klein_request_stage_seconds_count{route="metrics:/metrics",'
+            b'stage="total"} 1',
+            request.getWrittenData(),
+        )
@@ -0,0 +1,196 @@
+"""
+Tests for L{klein._jsoncodec}.
+"""
+
+import json
+from typing import Any, List
+
+from werkzeug.exceptions import BadRequest
+
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+from twisted.web.template import tags
+
+from .. import Field, Klein, KleinRenderable, Plating, Response
+from .._interfaces import IKleinRequest
+from .._jsoncodec import (
+    STDLIB_JSON,
+    JSONCodec,
+    availableCodecs,
+    fastestCodec,
+    parsedJSONBody,
+    requestCodec,
+)
+from .test_resource import MockRequest, _render
+
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+
+class RecordingCodec:
+    """
+    A codec which records what it encodes and decodes.
+    """
+
+    def __init__(self) -> None:
+        self.dumped: List[Any] = []
+        self.loaded: List[bytes] = []
+        self.codec = JSONCodec("recording", self.dumps, self.loads)
+
+    def dumps(self, value: Any) -> bytes:
+        self.dumped.append(value)
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, octets: bytes) -> Any:
+        self.loaded.append(octets)
+        return json.loads(octets)
+
+
+class RegistryTests(SynchronousTestCase):
+    """
+    Tests for the registry of codecs.
+    """
+
+    def test_stdlib(self) -> None:
+        """
+        The standard library's codec is always available, and is the
+        default.
+        """
+        self.assertIdentical(availableCodecs()["json"], STDLIB_JSON)
+        self.assertIdentical(Klein().json_codec, STDLIB_JSON)
+        self.assertEqual(STDLIB_JSON.dumps({"a": [1]}), b'{"a": [1]}')
+        self.assertEqual(STDLIB_JSON.loads(b'{"a": [1]}'), {"a": [1]})
+
+    def test_orjson(self) -> None:
+        """
+        C{orjson} is available, and fastest, if it can be imported.
+        """
+        if orjson is None:  # pragma: no cover
+            raise self.skipTest("orjson isn't installed")
+        codec = Klein().use_json_codec("orjson")
+        self.assertIdentical(codec, availableCodecs()["orjson"])
+        self.assertIdentical(fastestCodec(), codec)
+        self.assertEqual(codec.dumps({"a": [1]}), b'{"a":[1]}')
+
+    def test_unknown(self) -> None:
+        """
+        Applications can't use codecs which aren't registered.
+        """
+        self.assertRaises(ValueError, Klein().use_json_codec, "simdjson")
+
+
+class ParsedJSONBodyTests(SynchronousTestCase):
+    """
+    Tests for L{parsedJSONBody}.
+    """
+
+    def setUp(self) -> None:
+        self.recording = RecordingCodec()
+
+    def request(self, body: bytes) -> MockRequest:
+        request = MockRequest(b"/", method=b"POST", body=body)
+        IKleinRequest(request).json_codec = self.recording.codec
+        return request
+
+    def test_once(self) -> None:
+        """
+        The body is parsed with the request's codec the first time it's
+        asked for, and not again.
+        """
+        request = self.request(b'{"a": 1}')
+        self.assertIdentical(requestCodec(request), self.recording.codec)
+        self.assertEqual(parsedJSONBody(request), {"a": 1})
+        self.assertIdentical(parsedJSONBody(request), parsedJSONBody(request))
+        self.assertEqual(self.recording.loaded, [b'{"a": 1}'])
+        self.assertEqual(request.content.tell(), 0)  # type: ignore[union-attr]
+
+    def test_malformed(self) -> None:
+        """
+        Malformed bodies are a bad request, however often they're asked for.
+        """
+        request = self.request(b'{"a": ')
+        self.assertRaises(BadRequest, parsedJSONBody, request)
+        self.assertRaises(BadRequest, parsedJSONBody, request)
+        self.assertEqual(len(self.recording.loaded), 1)
+
+    def test_fields(self) -> None:
+        """
+        L{Field}s extract their values from the parsed body, which is only
+        parsed once.
+        """
+        request = self.request(b'{"name": "hello", "value": 3}')
+        request.requestHeaders.setRawHeaders(
+            b"content-type", [b"application/json"]
+        )
+        name = Field.text().maybeNamed("name")
+        value = Field.number().maybeNamed("value")
+        missing = Field.text().maybeNamed("missing")
+        self.assertEqual(
+            [field.extractValue(request) for field in [name, value, missing]],
+            ["hello", 3, None],
+        )
+        self.assertEqual(len(self.recording.loaded), 1)
+
+    def test_notAnObject(self) -> None:
+        """
+        Fields aren't found in JSON bodies which aren't objects.
+        """
+        request = self.request(b'["name"]')
+        request.requestHeaders.setRawHeaders(
+            b"content-type", [b"application/json"]
+        )
+        field = Field.text().maybeNamed("name")
+        self.assertIs(field.extractValue(request), None)
+
+
+class UseJSONCodecTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.use_json_codec}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.recording = RecordingCodec()
+        self.assertIdentical(
+            self.app.use_json_codec(self.recording.codec),
+            self.recording.codec,
+        )
+        self.assertIdentical(self.app.json_codec, self.recording.codec)
+
+    def test_response(self) -> None:
+        """
+        L{Response} bodies which are lists or dicts are encoded with the
+        application's codec, as C{application/json}.
+        """
+
+        @self.app.route("/")
+        def index(request: IRequest) -> Any:
+            return Response(body={"a": [1, 2]})
+
+        request = MockRequest(b"/")
+        _render(self.app.resource(), request)
+        self.assertEqual(request.getWrittenData(), b'{"a":[1,2]}')
+        self.assertEqual(self.recording.dumped, [{"a": [1, 2]}])
+        request.setHeader.assert_any_call(
+            b"content-type", b"application/json"
+        )
+
+    def test_plating(self) -> None:
+        """
+        L{Plating} encodes JSON with the application's codec.
+        """
+        plating = Plating(
+            tags=tags.html(tags.body(tags.div(slot=Plating.CONTENT)))
+        )
+
+        @plating.routed(self.app.route("/"), tags.span(slot="a"))
+        def index(request: IRequest) -> KleinRenderable:
+            return {"a": "b"}
+
+        request = MockRequest(b"/?json=1")
+        _render(self.app.resource(), request)
+        self.assertEqual(request.getWrittenData(), b'{"a":"b"}')
+        self.assertEqual(self.recording.dumped, [{"a": "b"}])
@@ -0,0 +1,204 @@
+"""
+Tests for L{klein._limits}.
+"""
+
+from typing import List
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._limits import ConcurrencyLimit
+from .test_resource import MockRequest, _render
+
+
+class ConcurrencyLimitTests(SynchronousTestCase):
+    """
+    Tests for L{ConcurrencyLimit}.
+    """
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.limit = ConcurrencyLimit(1, maxQueue=1, clock=self.clock)
+
+    def test_invalid(self) -> None:
+        """
+        At least one request must be allowed at once.
+        """
+        self.assertRaises(ValueError, ConcurrencyLimit, 0)
+
+    def test_admit(self) -> None:
+        """
+        Requests within the limit are admitted at once, and those beyond it
+        once an earlier one is released.
+        """
+        self.assertIdentical(self.limit.acquire(), None)
+        waiting = self.limit.acquire()
+        assert waiting is not None
+        self.assertNoResult(waiting)
+        self.assertEqual(self.limit.stats().queued, 1)
+        self.limit.release()
+        self.assertIdentical(self.successResultOf(waiting), None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.limit.release()
+        stats = self.limit.stats()
+        self.assertEqual((stats.active, stats.admitted), (0, 2))
+
+    def test_full(self) -> None:
+        """
+        Requests which would make the queue too long are refused.
+        """
+        self.limit.acquire()
+        self.limit.acquire()
+        error = self.assertRaises(ServiceUnavailable, self.limit.acquire)
+        self.assertIn(("Retry-After", "5"), error.get_headers())
+        self.assertEqual(self.limit.stats().rejected, 1)
+
+    def test_timeout(self) -> None:
+        """
+        Requests which wait too long are refused.
+        """
+        self.limit.acquire()
+        waiting = self.limit.acquire()
+        assert waiting is not None
+        self.clock.advance(5)
+        self.failureResultOf(waiting, ServiceUnavailable)
+        stats = self.limit.stats()
+        self.assertEqual((stats.queued, stats.timedOut), (0, 1))
+
+    def test_cancel(self) -> None:
+        """
+        Cancelled requests give up their place in the queue.
+        """
+        self.limit.acquire()
+        waiting = self.limit.acquire()
+        assert waiting is not None
+        waiting.cancel()
+        self.failureResultOf(waiting, CancelledError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        stats = self.limit.stats()
+        self.assertEqual((stats.queued, stats.cancelled), (0, 1))
+
+
+class LimitedRouteTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.route}'s C{max_concurrency}, as enforced by
+    L{KleinResource}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.handled: List[Deferred[bytes]] = []
+
+        @self.app.route("/slow", max_concurrency=1, max_queue=1)
+        def slow(request: IRequest) -> KleinRenderable:
+            d: Deferred[bytes] = Deferred()
+            self.handled.append(d)
+            return d
+
+        self.limit = self.app.concurrency_limits["slow"]
+        self.limit.clock = self.clock = Clock()
+
+    def render(self, path: bytes) -> MockRequest:
+        request = MockRequest(path)
+        _render(self.app.resource(), request)
+        return request
+
+    def test_limits(self) -> None:
+        """
+        Only routes with a C{max_concurrency} are limited.
+        """
+
+        @self.app.route("/fast")
+        def fast(request: IRequest) -> KleinRenderable:
+            return b"fast"
+
+        self.assertEqual(list(self.app.concurrency_limits), ["slow"])
+
+    def test_queued(self) -> None:
+        """
+        Requests beyond the limit are handled, in order, once earlier ones
+        finish.
+        """
+        first = self.render(b"/slow")
+        second = self.render(b"/slow")
+        self.assertEqual(len(self.handled), 1)
+        self.handled[0].callback(b"first")
+        self.assertEqual(first.getWrittenData(), b"first")
+        self.assertEqual(len(self.handled), 2)
+        self.handled[1].callback(b"second")
+        self.assertEqual(second.getWrittenData(), b"second")
+        self.assertEqual(self.limit.stats().active, 0)
+
+    def test_rejected(self) -> None:
+        """
+        Requests which can't wait are answered with a 503 without running
+        the handler.
+        """
+        self.render(b"/slow")
+        self.render(b"/slow")
+        rejected = self.render(b"/slow")
+        rejected.setResponseCode.assert_called_with(503)
+        self.assertEqual(
+            rejected.responseHeaders.getRawHeaders(b"retry-after"), [b"5"]
+        )
+        self.assertEqual(len(self.handled), 1)
+
+    def test_timedOut(self) -> None:
+        """
+        Requests which wait too long are answered with a 503.
+        """
+        self.render(b"/slow")
+        waiting = self.render(b"/slow")
+        self.clock.advance(5)
+        waiting.setResponseCode.assert_called_with(503)
+        self.assertEqual(len(self.handled), 1)
+
+    def test_disconnected(self) -> None:
+        """
+        Requests whose clients go away while they wait are never handled.
+        """
+        self.render(b"/slow")
+        waiting = MockRequest(b"/slow")
+        finished = _render(self.app.resource(), waiting)
+        waiting.connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(finished, ConnectionLost)
+        self.handled[0].callback(b"done")
+        self.assertEqual(len(self.handled), 1)
+        stats = self.limit.stats()
+        self.assertEqual((stats.active, stats.cancelled), (0, 1))
+
+    def test_synchronous(self) -> None:
+        """
+        Requests answered synchronously are released at once.
+        """
+
+        @self.app.route("/sync", max_concurrency=1)
+        def sync(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+        for _ in range(2):
+            self.assertEqual(self.render(b"/sync").getWrittenData(), b"ok")
+        stats = self.app.concurrency_limits["sync"].stats()
+        self.assertEqual((stats.active, stats.admitted), (0, 2))
+
+    def test_failed(self) -> None:
+        """
+        Requests whose handlers fail are released.
+        """
+
+        @self.app.route("/broken", max_concurrency=1)
+        def broken(request: IRequest) -> KleinRenderable:
+            raise ValueError("broken")
+
+        request = self.render(b"/broken")
+        request.setResponseCode.assert_called_with(500)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        stats = self.app.concurrency_limits["broken"].stats()
+        self.assertEqual(stats.active, 0)
@@ -0,0 +1,420 @@
+"""
+Tests for L{klein._multipart}.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+from treq import content
+from treq.testing import StubTreq
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+from twisted.web.resource import Resource
+from twisted.web.server import Request, Site
+from twisted.web.test.requesthelper import DummyChannel
+
+from .. import Field, Klein, Requirer, SessionProcurer, UploadedFile
+from .._form import _formValue
+from .._multipart import (
+    FormRequest,
+    MultipartLimits,
+    MultipartParser,
+    canSkipFormParsing,
+    parseMultipart,
+)
+from ..interfaces import ISession, SessionMechanism
+from ..storage.memory import MemorySessionStore
+from .test_resource import MockRequest
+
+
+BOUNDARY = b"boundary-1234"
+
+
+def encode(*parts: Tuple[str, bytes, Dict[str, str]]) -> bytes:
+    """
+    Encode C{parts}, each a field name, its value and any other parameters
+    of its C{Content-Disposition}, as a C{multipart/form-data} body.
+    """
+    body = b"preamble\r\n"
+    for name, value, params in parts:
+        disposition = f'form-data; name="{name}"'
+        for key, param in params.items():
+            disposition += f'; {key}="{param}"'
+        body += b"--" + BOUNDARY + b"\r\n"
+        body += f"Content-Disposition: {disposition}\r\n".encode()
+        if "filename" in params:
+            body += b"Content-Type: application/octet-stream\r\n"
+        body += b"\r\n" + value + b"\r\n"
+    return body + b"--" + BOUNDARY + b"--\r\nepilogue"
+
+
+BODY = encode(
+    ("name", b"hello", {}),
+    ("upload", b"line one\r\n--boundary-12\r\nline two", {"filename": "a.txt"}),
+    ("empty", b"", {}),
+)
+
+
+class MultipartParserTests(SynchronousTestCase):
+    """
+    Tests for L{MultipartParser}.
+    """
+
+    def parse(
+        self,
+        chunks: List[bytes],
+        limits: MultipartLimits = MultipartLimits(),
+    ) -> List[UploadedFile]:
+        parser = MultipartParser(BOUNDARY, limits)
+        for chunk in chunks:
+            parser.feed(chunk)
+        parts = parser.close()
+        self.addCleanup(parser.abort)
+        return parts
+
+    def assertParsed(self, parts: List[UploadedFile]) -> None:
+        self.assertEqual(
+            [(part.name, part.filename, part.read()) for part in parts],
+            [
+                ("name", None, b"hello"),
+                ("upload", "a.txt", b"line one\r\n--boundary-12\r\nline two"),
+                ("empty", None, b""),
+            ],
+        )
+        self.assertEqual(parts[1].contentType, "application/octet-stream")
+        self.assertEqual(parts[1].size, 33)
+
+    def test_whole(self) -> None:
+        """
+        A body fed all at once is split into its parts.
+        """
+        self.assertParsed(self.parse([BODY]))
+
+    def test_chunked(self) -> None:
+        """
+        A body fed a byte at a time, so that delimiters and headers are split
+        between chunks, is parsed the same way.
+        """
+        self.assertParsed(self.parse([bytes([byte]) for byte in BODY]))
+
+    def test_spooled(self) -> None:
+        """
+        Parts larger than the spool threshold are written to temporary
+        files, and may be mapped into memory.
+        """
+        value = b"x" * 100
+        parts = self.parse(
+            [encode(("upload", value, {"filename": "big.bin"}))],
+            MultipartLimits(spoolThreshold=10),
+        )
+        upload = parts[0]
+        self.assertTrue(getattr(upload.file, "_rolled"))
+        with upload.mmap() as mapped:
+            self.assertEqual(mapped[:], value)
+
+    def test_mmapSmall(self) -> None:
+        """
+        Parts held in memory may be mapped too.
+        """
+        upload = self.parse([BODY])[0]
+        with upload.mmap() as mapped:
+            self.assertEqual(mapped[:], b"hello")
+
+    def test_partTooLarge(self) -> None:
+        """
+        Parts larger than their limit are refused as soon as they're seen.
+        """
+        parser = MultipartParser(
+            BOUNDARY, MultipartLimits(maxPartSize=100, partSizes={"big": 10})
+        )
+        self.addCleanup(parser.abort)
+        parser.feed(encode(("small", b"x" * 20, {}))[:-20])
+        self.assertRaises(
+            RequestEntityTooLarge,
+            parser.feed,
+            encode(("big", b"x" * 20, {})),
+        )
+
+    def test_totalTooLarge(self) -> None:
+        """
+        Bodies larger than the total limit are refused.
+        """
+        parser = MultipartParser(BOUNDARY, MultipartLimits(maxTotalSize=10))
+        self.addCleanup(parser.abort)
+        self.assertRaises(RequestEntityTooLarge, parser.feed, BODY)
+
+    def test_tooManyParts(self) -> None:
+        """
+        Bodies with too many parts are refused.
+        """
+        parser = MultipartParser(BOUNDARY, MultipartLimits(maxParts=2))
+        self.addCleanup(parser.abort)
+        self.assertRaises(RequestEntityTooLarge, parser.feed, BODY)
+
+    def test_headersTooLarge(self) -> None:
+        """
+        Parts whose headers never end are refused.
+        """
+        parser = MultipartParser(BOUNDARY, MultipartLimits(maxHeaderSize=50))
+        self.addCleanup(parser.abort)
+        parser.feed(b"--" + BOUNDARY + b"\r\n")
+        self.assertRaises(RequestEntityTooLarge, parser.feed, b"X" * 100)
+
+    def test_truncated(self) -> None:
+        """
+        Bodies without a closing delimiter are malformed.
+        """
+        parser = MultipartParser(BOUNDARY)
+        self.addCleanup(parser.abort)
+        parser.feed(BODY[:-20])
+        self.assertRaises(BadRequest, parser.close)
+
+    def test_noName(self) -> None:
+        """
+        Parts must be named form fields.
+        """
+        parser = MultipartParser(BOUNDARY)
+        self.addCleanup(parser.abort)
+        self.assertRaises(
+            BadRequest,
+            parser.feed,
+            b"--" + BOUNDARY + b"\r\nContent-Disposition: form-data\r\n\r\n",
+        )
+
+
+class FileFieldTests(SynchronousTestCase):
+    """
+    Tests for L{Field.file}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.uploads: List[Any] = []
+        requirer = Requirer()
+
+        @requirer.prerequisite([ISession])
+        def procureSession(request: Any) -> Any:
+            return SessionProcurer(
+                self.store, secureTokenHeader=b"X-Test-Session"
+            ).procureSession(request)
+
+        @requirer.require(
+            self.app.route("/upload", methods=["POST"]),
+            name=Field.text(),
+            upload=Field.file(maxSize=40),
+        )
+        def upload(name: str, upload: UploadedFile) -> bytes:
+            self.uploads.append((name, upload.filename, upload.read()))
+            return b"uploaded"
+
+        self.store = MemorySessionStore()
+        self.session = self.successResultOf(
+            self.store.newSession(True, SessionMechanism.Header)
+        )
+
+    def post(self, body: bytes) -> Tuple[int, bytes]:
+        # StubTreq's request methods are generated, so mypy can't see them.
+        stub: Any = StubTreq(self.app.resource())
+        response = self.successResultOf(
+            stub.post(
+                "https://localhost/upload",
+                data=body,
+                headers={
+                    b"Content-Type": b"multipart/form-data; boundary="
+                    + BOUNDARY,
+                    b"X-Test-Session": self.session.identifier,
+                },
+            )
+        )
+        return response.code, self.successResultOf(content(response))
+
+    def test_upload(self) -> None:
+        """
+        The handler is given the uploaded file, and text fields from the
+        same body.
+        """
+        self.assertEqual(self.post(BODY), (200, b"uploaded"))
+        self.assertEqual(
+            self.uploads,
+            [("hello", "a.txt", b"line one\r\n--boundary-12\r\nline two")],
+        )
+
+    def test_tooLarge(self) -> None:
+        """
+        Files larger than the field's C{maxSize} are refused with a 413.
+        """
+        body = encode(
+            ("name", b"hello", {}),
+            ("upload", b"x" * 41, {"filename": "big.bin"}),
+        )
+        code, _ = self.post(body)
+        self.assertEqual(code, 413)
+        self.assertEqual(self.uploads, [])
+
+    def test_missing(self) -> None:
+        """
+        A missing file fails validation.
+        """
+        code, _ = self.post(encode(("name", b"hello", {})))
+        self.assertEqual(code, 400)
+        self.assertEqual(self.uploads, [])
+
+    def test_unparsedArgs(self) -> None:
+        """
+        Text fields are found in a multipart body if Twisted didn't parse it
+        into C{request.args}, as when a L{Site} is constructed with
+        C{parsePOSTFormSubmission=False}.
+        """
+        request = MockRequest(b"/upload", method=b"POST", body=BODY)
+        request.requestHeaders.setRawHeaders(
+            b"content-type", [b"multipart/form-data; boundary=" + BOUNDARY]
+        )
+        form = parseMultipart(request)
+        assert form is not None
+        self.assertIdentical(parseMultipart(request), form)
+        self.assertEqual(request.args, {})
+        self.assertEqual(_formValue(request, "name"), "hello")
+        self.assertEqual(_formValue(request, "missing"), None)
+        request.finish()
+        self.assertTrue(form.fields["upload"][0].closed)
+
+
+class FormRequestTests(SynchronousTestCase):
+    """
+    Tests for L{FormRequest}.
+    """
+
+    def setUp(self) -> None:
+        if not canSkipFormParsing:  # pragma: no cover
+            raise self.skipTest("Twisted always parses form submissions")
+        self.patch(Request, "process", lambda request: None)
+
+    def receive(self, contentType: bytes, body: bytes) -> FormRequest:
+        channel = DummyChannel()
+        channel.site = Site(Resource(), parsePOSTFormSubmission=False)
+        request = FormRequest(channel)
+        request.requestHeaders.setRawHeaders(b"content-type", [contentType])
+        request.gotLength(len(body))
+        request.handleContentChunk(body)
+        request.requestReceived(b"POST", b"/form?q=1", b"HTTP/1.1")
+        return request
+
+    def test_urlencoded(self) -> None:
+        """
+        URL-encoded bodies are parsed into C{request.args}, along with the
+        query.
+        """
+        request = self.receive(
+            b"application/x-www-form-urlencoded; charset=utf-8", b"a=1&a=2"
+        )
+        self.assertEqual(request.args, {b"q": [b"1"], b"a": [b"1", b"2"]})
+        assert request.content is not None
+        self.assertEqual(request.content.read(), b"a=1&a=2")
+
+    def test_multipart(self) -> None:
+        """
+        The text fields of multipart bodies are parsed into C{request.args},
+        along with the query, and the whole form is kept for
+        L{parseMultipart}.
+        """
+        request = self.receive(
+            b"multipart/form-data; boundary=" + BOUNDARY, BODY
+        )
+        self.assertEqual(
+            request.args, {b"q": [b"1"], b"name": [b"hello"], b"empty": [b""]}
+        )
+        form = parseMultipart(request)
+        assert form is not None
+        self.assertIs(parseMultipart(request), form)
+        upload = form.get("upload")
+        assert upload is not None
+        self.assertEqual(
+            upload.read(), b"line one\r\n--boundary-12\r\nline two"
+        )
+        self.assertEqual(_formValue(request, "name"), "hello")
+        request.finish()
+        self.assertTrue(upload.closed)
+
+    def test_multipartLimits(self) -> None:
+        """
+        L{parseMultipart} enforces its limits on a form which L{FormRequest}
+        has already parsed.
+        """
+        request = self.receive(
+            b"multipart/form-data; boundary=" + BOUNDARY, BODY
+        )
+        self.assertRaises(
+            RequestEntityTooLarge,
+            parseMultipart,
+            request,
+            MultipartLimits(partSizes={"upload": 10}),
+        )
+        self.assertRaises(
+            RequestEntityTooLarge,
+            parseMultipart,
+            request,
+            MultipartLimits(maxParts=2),
+        )
+        self.assertRaises(
+            RequestEntityTooLarge,
+            parseMultipart,
+            request,
+            MultipartLimits(maxTotalSize=10),
+        )
+        request.finish()
+
+    def test_malformedMultipart(self) -> None:
+        """
+        Malformed multipart bodies are left for L{parseMultipart} to reject.
+        """
+        request = self.receive(
+            b"multipart/form-data; boundary=" + BOUNDARY, BODY[:-20]
+        )
+        self.assertEqual(request.args, {b"q": [b"1"]})
+        self.assertRaises(BadRequest, parseMultipart, request)
+
+
+class FormRequestSiteTests(SynchronousTestCase):
+    """
+    Tests for L{FormRequest}, with a real HTTP channel.
+    """
+
+    def setUp(self) -> None:
+        if not canSkipFormParsing:  # pragma: no cover
+            raise self.skipTest("Twisted always parses form submissions")
+
+    def test_argsHandler(self) -> None:
+        """
+        Under L{klein.Klein.run}'s request factory, handlers which read
+        C{request.args} still get the text fields of multipart bodies.
+        """
+        app = Klein()
+
+        @app.route("/form", methods=["POST"])
+        def form(request: IRequest) -> bytes:
+            return b",".join(request.args[b"name"] + request.args[b"q"])
+
+        site = Site(
+            app.resource(),
+            requestFactory=FormRequest,
+            parsePOSTFormSubmission=False,
+            timeout=None,
+            reactor=Clock(),
+        )
+        channel = site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        channel.dataReceived(
+            b"POST /form?q=1 HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Type: multipart/form-data; boundary="
+            + BOUNDARY
+            + b"\r\n"
+            + f"Content-Length: {len(BODY)}\r\n\r\n".encode()
+            + BODY
+        )
+        response = transport.value()
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(response.endswith(b"\r\n\r\nhello,1"))
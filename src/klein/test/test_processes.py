@@ -0,0 +1,311 @@
+"""
+Tests for L{klein._processes}.
+"""
+
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Tuple
+
+from werkzeug.exceptions import GatewayTimeout, ServiceUnavailable
+
+from twisted.internet.defer import CancelledError, Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase, TestCase
+
+from .. import HandlerProcessPool, Klein, Requirer, cpuBound
+from .._processes import _callByName
+from .test_resource import MockRequest, _render
+
+
+Submitted = Tuple["Future[Any]", Callable[..., Any], Any, Any]
+
+
+class FakeExecutor:
+    """
+    Enough of a L{concurrent.futures.ProcessPoolExecutor} to hold the calls
+    submitted to it until they're run with L{FakeExecutor.runNext}.
+    """
+
+    def __init__(self) -> None:
+        self.submitted: List[Submitted] = []
+        self.killed = False
+
+    def submit(
+        self, f: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> "Future[Any]":
+        future: "Future[Any]" = Future()
+        self.submitted.append((future, f, args, kwargs))
+        return future
+
+    def runNext(self) -> None:
+        future, f, args, kwargs = self.submitted.pop(0)
+        try:
+            future.set_result(f(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def terminate_workers(self) -> None:
+        self.killed = True
+
+
+class FakeReactor(Clock):
+    """
+    Enough of a reactor for L{HandlerProcessPool}.
+    """
+
+    def callFromThread(self, f: Callable[..., Any], *args: Any) -> None:
+        f(*args)
+
+    def addSystemEventTrigger(
+        self, phase: str, event: str, f: Callable[[], None]
+    ) -> None:
+        pass
+
+
+def add(a: int, b: int) -> int:
+    return a + b
+
+
+@cpuBound
+def multiply(a: int, b: int) -> int:
+    """
+    A function run in a worker process.
+    """
+    return a * b
+
+
+def crash() -> None:
+    os._exit(1)
+
+
+class Multiplier:
+    def __init__(self, factor: int) -> None:
+        self.factor = factor
+
+    def times(self, value: int) -> int:
+        return self.factor * value
+
+
+def describe(a: int, b: int) -> str:
+    return f"{a} * {b} = {a * b}"
+
+
+def fakePool() -> Tuple[HandlerProcessPool, FakeExecutor]:
+    executor = FakeExecutor()
+    pool = HandlerProcessPool(
+        size=1,
+        reactor=FakeReactor(),
+        executorFactory=lambda: executor,  # type: ignore[arg-type,return-value]
+    )
+    return pool, executor
+
+
+class HandlerProcessPoolTests(SynchronousTestCase):
+    """
+    Tests for L{HandlerProcessPool}.
+    """
+
+    def setUp(self) -> None:
+        self.reactor = FakeReactor()
+        self.executors: List[FakeExecutor] = []
+        self.pool = HandlerProcessPool(
+            size=2,
+            maxQueue=1,
+            timeout=10,
+            reactor=self.reactor,
+            executorFactory=self.newExecutor,  # type: ignore[arg-type]
+        )
+
+    def newExecutor(self) -> FakeExecutor:
+        executor = FakeExecutor()
+        self.executors.append(executor)
+        return executor
+
+    def test_run(self) -> None:
+        """
+        Each call runs in a worker process of its own, which are started
+        as needed and reused.
+        """
+        first = self.pool.run(add, 1, 2)
+        second = self.pool.run(add, 3, b=4)
+        self.assertEqual(len(self.executors), 2)
+        for executor in self.executors:
+            executor.runNext()
+        self.assertEqual(self.successResultOf(first), 3)
+        self.assertEqual(self.successResultOf(second), 7)
+        third = self.pool.run(add, 5, 6)
+        self.assertEqual(len(self.executors), 2)
+        self.executors[1].runNext()
+        self.assertEqual(self.successResultOf(third), 11)
+        self.assertEqual(self.pool.stats().completed, 3)
+
+    def test_failure(self) -> None:
+        """
+        Exceptions raised in a worker fail the result, and the worker is
+        reused.
+        """
+        d = self.pool.run(lambda: 1 // 0)
+        self.executors[0].runNext()
+        self.failureResultOf(d, ZeroDivisionError)
+        self.assertFalse(self.executors[0].killed)
+        self.assertEqual(self.pool.restarts, 0)
+
+    def test_queue(self) -> None:
+        """
+        Calls beyond the pool's size wait for a worker, and those beyond its
+        queue are refused.
+        """
+        self.pool.run(add, 1, 1)
+        self.pool.run(add, 1, 1)
+        queued = self.pool.run(add, 2, 2)
+        self.failureResultOf(self.pool.run(add, 3, 3), ServiceUnavailable)
+        self.assertEqual(self.pool.stats().queued, 1)
+        self.executors[0].runNext()
+        self.executors[0].runNext()
+        self.assertEqual(self.successResultOf(queued), 4)
+
+    def test_crash(self) -> None:
+        """
+        Workers which crash are replaced.
+        """
+        d = self.pool.run(add, 1, 1)
+        future, _, _, _ = self.executors[0].submitted.pop()
+        future.set_exception(BrokenProcessPool("gone"))
+        self.failureResultOf(d, BrokenProcessPool)
+        self.assertTrue(self.executors[0].killed)
+        self.assertEqual(self.pool.restarts, 1)
+        self.pool.run(add, 1, 1)
+        self.assertEqual(len(self.executors), 2)
+
+    def test_timeout(self) -> None:
+        """
+        Calls which run for too long fail with L{GatewayTimeout}, and their
+        workers are killed.
+        """
+        d = self.pool.run(add, 1, 1)
+        self.reactor.advance(10)
+        self.failureResultOf(d, GatewayTimeout)
+        self.assertTrue(self.executors[0].killed)
+        self.executors[0].runNext()
+        self.assertEqual(self.pool.stats().running, 0)
+
+    def test_cancelRunning(self) -> None:
+        """
+        Cancelling a running call kills its worker, and the next call gets a
+        new one.
+        """
+        self.pool.size = 1
+        d = self.pool.run(add, 1, 1)
+        queued = self.pool.run(add, 2, 2)
+        d.cancel()
+        self.failureResultOf(d, CancelledError)
+        self.assertTrue(self.executors[0].killed)
+        self.assertEqual(len(self.reactor.getDelayedCalls()), 1)
+        self.assertEqual(len(self.executors), 2)
+        self.executors[1].runNext()
+        self.assertEqual(self.successResultOf(queued), 4)
+
+    def test_stop(self) -> None:
+        """
+        Stopping the pool kills its workers.
+        """
+        self.pool.run(add, 1, 1)
+        self.pool.stop()
+        self.assertTrue(self.executors[0].killed)
+
+
+class CpuBoundTests(SynchronousTestCase):
+    """
+    Tests for L{cpuBound}.
+    """
+
+    def test_locals(self) -> None:
+        """
+        Functions which worker processes can't find aren't allowed.
+        """
+
+        def local() -> None:
+            pass  # pragma: no cover
+
+        self.assertRaises(ValueError, cpuBound, local)
+
+    def test_callByName(self) -> None:
+        """
+        Worker processes find functions and methods by name, whether or not
+        they're decorated.
+        """
+        self.assertEqual(_callByName(__name__, "multiply", (2, 3), {}), 6)
+        self.assertEqual(_callByName(__name__, "add", (2, 3), {}), 5)
+        self.assertEqual(
+            _callByName(__name__, "Multiplier.times", (Multiplier(3), 5), {}),
+            15,
+        )
+
+    def test_pool(self) -> None:
+        """
+        Decorated functions are run in the given pool.
+        """
+        pool, executor = fakePool()
+        decorated = cpuBound(pool=pool)(add)
+        self.assertEqual(decorated.__name__, "cpu-bound for add")
+        d = decorated(4, b=3)
+        executor.runNext()
+        self.assertEqual(self.successResultOf(d), 7)
+
+    def test_requirer(self) -> None:
+        """
+        L{cpuBound} functions can be beneath L{Requirer.require}, which calls
+        them with the parameters from the URL.
+        """
+        pool, executor = fakePool()
+        app = Klein()
+        requirer = Requirer()
+        requirer.require(app.route("/<int:a>/<int:b>"))(
+            cpuBound(pool=pool)(describe)
+        )
+        request = MockRequest(b"/6/7")
+        _render(app.resource(), request)
+        executor.runNext()
+        self.assertEqual(request.getWrittenData(), b"6 * 7 = 42")
+
+
+class WorkerProcessTests(TestCase):
+    """
+    Tests for L{HandlerProcessPool} with real worker processes.
+    """
+
+    def setUp(self) -> None:
+        self.pool = HandlerProcessPool(size=1, timeout=60)
+        self.addCleanup(self.pool.stop)
+
+    def test_run(self) -> "Deferred[Any]":
+        """
+        Calls are run in another process.
+        """
+        d: "Deferred[Any]" = self.pool.run(os.getpid)
+        d.addCallback(self.assertNotEqual, os.getpid())
+        return d
+
+    def test_cpuBound(self) -> "Deferred[Any]":
+        """
+        L{cpuBound} functions and methods run in worker processes.
+        """
+        times = cpuBound(pool=self.pool)(Multiplier.times)
+        original = getattr(multiply, "__klein_cpu_bound__")
+        d = cpuBound(pool=self.pool)(original)(6, 7)
+        d.addCallback(self.assertEqual, 42)
+        d.addCallback(lambda _: times(Multiplier(2), 4))
+        d.addCallback(self.assertEqual, 8)
+        return d
+
+    def test_crash(self) -> "Deferred[Any]":
+        """
+        Workers which crash are replaced.
+        """
+        d = self.pool.run(crash)
+        d = self.assertFailure(d, BrokenProcessPool)
+        d.addCallback(lambda _: self.pool.run(add, 1, 2))
+        d.addCallback(self.assertEqual, 3)
+        d.addCallback(lambda _: self.assertEqual(self.pool.restarts, 1))
+        return d
@@ -0,0 +1,281 @@
+"""
+Tests for L{klein._profiling}.
+"""
+
+import json
+import marshal
+from typing import List
+
+from twisted.internet.defer import Deferred
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._profiling import (
+    ProfileStats,
+    RequestProfiler,
+    collapsedStacks,
+    exposeProfiles,
+    pstatsText,
+)
+from .test_resource import MockRequest, _render
+
+
+def busy() -> int:
+    return sum(range(1000))
+
+
+class Clock:
+    """
+    A clock which moves forward by C{step} seconds each time it's read.
+    """
+
+    def __init__(self, step: float) -> None:
+        self.step = step
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        self.time += self.step
+        return self.time
+
+
+class ProfiledAppTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.profile}, and the profiling done by L{KleinResource}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.clock = Clock(2.0)
+        self.sampled: List[float] = []
+        self.profiler = self.app.profile(
+            RequestProfiler(
+                sampleRate=0.5,
+                threshold=1.0,
+                capacity=2,
+                sample=lambda: self.sampled.pop(0),
+                now=self.clock,
+            )
+        )
+
+        @self.app.route("/", endpoint="root")
+        def root(request: IRequest) -> KleinRenderable:
+            busy()
+            return b"ok"
+
+    def render(self, path: bytes) -> MockRequest:
+        request = MockRequest(path)
+        _render(self.app.resource(), request)
+        return request
+
+    def test_unprofiled(self) -> None:
+        """
+        Applications aren't profiled unless given a profiler.
+        """
+        self.assertIdentical(Klein().profiler, None)
+        self.assertIdentical(self.app.profiler, self.profiler)
+
+    def test_sampled(self) -> None:
+        """
+        Requests are profiled when the sample falls under the sample rate,
+        and their profiles are kept when they're slow.
+        """
+        self.sampled[:] = [0.9, 0.1]
+        self.render(b"/")
+        self.assertEqual(list(self.profiler.slow), [])
+        request = self.render(b"/")
+        self.assertEqual(request.getWrittenData(), b"ok")
+        [slow] = self.profiler.slow
+        self.assertEqual(slow.endpoint, "root")
+        self.assertEqual((slow.method, slow.uri), (b"GET", b"/"))
+        self.assertEqual(slow.duration, 2.0)
+        self.assertIn("busy", {name for _, _, name in slow.stats})
+
+    def test_fast(self) -> None:
+        """
+        The profiles of requests which finish within the threshold aren't
+        kept.
+        """
+        self.clock.step = 0.5
+        self.sampled[:] = [0.0]
+        self.render(b"/")
+        self.assertEqual(list(self.profiler.slow), [])
+
+    def test_endpoints(self) -> None:
+        """
+        Every request to the profiler's endpoints is profiled.
+        """
+        self.profiler.sampleRate = 0.0
+        self.profiler.endpoints = frozenset(["root"])
+        self.sampled[:] = [0.0, 0.0]
+        self.render(b"/")
+        self.render(b"/")
+        self.assertEqual(len(self.profiler.slow), 2)
+
+    def test_capacity(self) -> None:
+        """
+        Once the profiler holds its capacity, the oldest profile is
+        discarded for each new one.
+        """
+        self.sampled[:] = [0.0, 0.0, 0.0]
+        for _ in range(3):
+            self.render(b"/")
+        self.assertEqual(
+            [slow.identifier for slow in self.profiler.slow], [2, 3]
+        )
+        self.assertIdentical(self.profiler.find(1), None)
+        self.assertEqual(self.profiler.find(3).identifier, 3)  # type: ignore
+
+    def test_asynchronous(self) -> None:
+        """
+        Requests answered asynchronously are kept once they finish, and
+        their profile includes the rendering of their result, but not the
+        code run while it was awaited.
+        """
+        waiting: "Deferred[bytes]" = Deferred()
+
+        @self.app.route("/later", endpoint="later")
+        def later(request: IRequest) -> KleinRenderable:
+            return waiting.addCallback(lambda body: busy() and body)
+
+        self.sampled[:] = [0.0]
+        request = self.render(b"/later")
+        self.assertEqual(list(self.profiler.slow), [])
+        waiting.callback(b"done")
+        self.assertEqual(request.getWrittenData(), b"done")
+        [slow] = self.profiler.slow
+        self.assertEqual(slow.endpoint, "later")
+        names = {name for _, _, name in slow.stats}
+        self.assertIn("later", names)
+        self.assertIn("_writeResponse", names)
+        self.assertNotIn("busy", names)
+
+
+def stats() -> ProfileStats:
+    """
+    Statistics for C{handler} calling C{a} twice and C{b} once, and C{a}
+    calling C{b} once.
+    """
+    handler = ("app.py", 1, "handler")
+    a = ("app.py", 10, "a")
+    b = ("lib.py", 20, "b")
+    return {
+        handler: (1, 1, 0.001, 0.010, {}),
+        a: (2, 2, 0.002, 0.006, {handler: (2, 2, 0.002, 0.006)}),
+        b: (
+            2,
+            2,
+            0.004,
+            0.004,
+            {handler: (1, 1, 0.001, 0.001), a: (1, 1, 0.003, 0.003)},
+        ),
+    }
+
+
+class FormatTests(SynchronousTestCase):
+    """
+    Tests for L{collapsedStacks} and L{pstatsText}.
+    """
+
+    def test_collapsed(self) -> None:
+        """
+        Each stack gets the time spent in its innermost frame, a function's
+        time being divided between its callers.
+        """
+        self.assertEqual(
+            list(collapsedStacks(stats())),
+            [
+                "handler (app.py:1) 1000",
+                "handler (app.py:1);a (app.py:10) 2000",
+                "handler (app.py:1);a (app.py:10);b (lib.py:20) 3000",
+                "handler (app.py:1);b (lib.py:20) 1000",
+            ],
+        )
+
+    def test_pstatsText(self) -> None:
+        """
+        L{pstatsText} reports each function, sorted by cumulative time.
+        """
+        text = pstatsText(stats())
+        self.assertIn("cumulative", text)
+        self.assertLess(text.index("(handler)"), text.index("(b)"))
+
+
+class ExposeProfilesTests(SynchronousTestCase):
+    """
+    Tests for L{exposeProfiles}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.profiler = RequestProfiler()
+        self.profiler.keep("root", b"GET", b"/", 2.0, 100.0, stats())
+        exposeProfiles(self.app, self.profiler, "secret")
+
+    def get(self, path: bytes, token: bytes = b"secret") -> MockRequest:
+        request = MockRequest(path)
+        request.requestHeaders.setRawHeaders(
+            b"authorization", [b"Bearer " + token]
+        )
+        _render(self.app.resource(), request)
+        return request
+
+    def test_tokenRequired(self) -> None:
+        """
+        Profiles can't be exposed without a token.
+        """
+        self.assertRaises(
+            ValueError, exposeProfiles, Klein(), self.profiler, ""
+        )
+
+    def test_unauthorized(self) -> None:
+        """
+        Clients without the token are refused.
+        """
+        for path in [b"/debug/profiles", b"/debug/profiles/1"]:
+            request = self.get(path, token=b"wrong")
+            request.setResponseCode.assert_called_with(401)
+            self.assertEqual(request.getWrittenData(), b"Unauthorized")
+
+    def test_list(self) -> None:
+        """
+        The profiles kept are listed as JSON.
+        """
+        request = self.get(b"/debug/profiles")
+        self.assertEqual(
+            json.loads(request.getWrittenData()),
+            [
+                {
+                    "id": 1,
+                    "endpoint": "root",
+                    "method": "GET",
+                    "uri": "/",
+                    "duration": 2.0,
+                    "started": 100.0,
+                }
+            ],
+        )
+
+    def test_formats(self) -> None:
+        """
+        A profile is served as a L{pstats} report by default, or in the
+        requested format.
+        """
+        text = self.get(b"/debug/profiles/1").getWrittenData()
+        self.assertIn(b"cumulative", text)
+        dump = self.get(b"/debug/profiles/1?format=pstats").getWrittenData()
+        self.assertEqual(marshal.loads(dump), stats())
+        collapsed = self.get(b"/debug/profiles/1?format=collapsed")
+        self.assertIn(
+            b"handler (app.py:1);a (app.py:10) 2000\n",
+            collapsed.getWrittenData(),
+        )
+        bad = self.get(b"/debug/profiles/1?format=svg")
+        bad.setResponseCode.assert_called_with(400)
+
+    def test_missing(self) -> None:
+        """
+        Profiles which aren't kept are not found.
+        """
+        request = self.get(b"/debug/profiles/7")
+        request.setResponseCode.assert_called_with(404)
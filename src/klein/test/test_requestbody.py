@@ -0,0 +1,451 @@
+"""
+Tests for L{klein._requestbody}.
+"""
+
+from io import BytesIO
+from tempfile import TemporaryFile
+from typing import Any, List, Optional
+
+from tubes.itube import IDrain, IFount, ISegment
+from zope.interface import implementer
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+from twisted.web.server import Site
+from twisted.web.test.requesthelper import DummyChannel
+
+from .. import Klein, KleinRenderable
+from .._interfaces import IKleinRequest
+from .._message import FountAlreadyAccessedError
+from .._requestbody import BodyFount, StreamingRequest, bodyFount
+from .._tubes import fountToBytes
+from .test_resource import MockRequest, _render
+
+
+@implementer(IDrain)
+class CollectingDrain:
+    """
+    A drain which collects what it receives.
+    """
+
+    inputType = ISegment
+
+    def __init__(self) -> None:
+        self.fount: Optional[IFount] = None
+        self.received: List[bytes] = []
+        self.stopped: List[Failure] = []
+
+    def flowingFrom(self, fount: Optional[IFount]) -> None:
+        self.fount = fount
+
+    def receive(self, item: Any) -> None:
+        self.received.append(bytes(item))
+
+    def flowStopped(self, reason: Failure) -> None:
+        self.stopped.append(reason)
+
+
+class FakeProducer:
+    def __init__(self) -> None:
+        self.state = "producing"
+
+    def pauseProducing(self) -> None:
+        self.state = "paused"
+
+    def resumeProducing(self) -> None:
+        self.state = "producing"
+
+
+class BodyFountTests(SynchronousTestCase):
+    """
+    Tests for L{BodyFount}.
+    """
+
+    def setUp(self) -> None:
+        self.producer = FakeProducer()
+        self.fount = BodyFount(self.producer, highWater=4)
+        self.drain = CollectingDrain()
+
+    def test_buffered(self) -> None:
+        """
+        Chunks received before the drain is attached are buffered, pausing
+        the producer once there are too many of them.
+        """
+        self.fount.receive(b"abc")
+        self.assertEqual(self.producer.state, "producing")
+        self.fount.receive(b"def")
+        self.assertEqual(self.producer.state, "paused")
+        self.fount.flowTo(self.drain)
+        self.assertEqual(self.drain.received, [b"abc", b"def"])
+        self.assertEqual(self.producer.state, "producing")
+
+    def test_paused(self) -> None:
+        """
+        Pausing the flow pauses the producer, and chunks are held until it's
+        resumed.
+        """
+        self.fount.flowTo(self.drain)
+        pause = self.fount.pauseFlow()
+        self.assertEqual(self.producer.state, "paused")
+        self.fount.receive(b"abc")
+        self.fount.finish()
+        self.assertEqual((self.drain.received, self.drain.stopped), ([], []))
+        pause.unpause()
+        self.assertEqual(self.drain.received, [b"abc"])
+        self.drain.stopped[0].trap(StopIteration)
+        self.assertEqual(self.producer.state, "producing")
+
+    def test_stopped(self) -> None:
+        """
+        Once the flow is stopped, the rest of the body is discarded.
+        """
+        self.fount.receive(b"abcdef")
+        self.fount.stopFlow()
+        self.assertEqual(self.producer.state, "producing")
+        self.fount.receive(b"ghi")
+        self.fount.flowTo(self.drain)
+        self.assertEqual(self.drain.received, [])
+
+
+class BufferedBodyTests(SynchronousTestCase):
+    """
+    Tests for L{bodyFount} with bodies that Twisted has buffered.
+    """
+
+    def collect(self, fount: IFount) -> List[Any]:
+        drain = CollectingDrain()
+        received: List[Any] = []
+        drain.receive = received.append  # type: ignore[assignment]
+        fount.flowTo(drain)
+        return received
+
+    def test_memory(self) -> None:
+        """
+        Bodies held in memory are delivered as a view of their buffer.
+        """
+        request = MockRequest(b"/", method=b"PUT", body=b"hello")
+        [chunk] = self.collect(bodyFount(request))
+        self.assertIsInstance(chunk, memoryview)
+        self.assertEqual(bytes(chunk), b"hello")
+        self.assertRaises(FountAlreadyAccessedError, bodyFount, request)
+
+    def test_file(self) -> None:
+        """
+        Bodies in files are delivered as a view of a memory map of the file.
+        """
+        request = MockRequest(b"/", method=b"PUT")
+        content = TemporaryFile()
+        content.write(b"hello")
+        request.content = content
+        [chunk] = self.collect(bodyFount(request))
+        self.assertEqual(bytes(chunk), b"hello")
+        chunk.release()
+        request.finish()
+        self.assertTrue(content.closed)
+
+    def test_empty(self) -> None:
+        """
+        Empty bodies deliver nothing.
+        """
+        request = MockRequest(b"/", method=b"PUT")
+        request.content = BytesIO()
+        self.assertEqual(self.collect(bodyFount(request)), [])
+
+
+class StreamBodyRouteTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.route}'s C{stream_body} and C{max_body_size}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.drains: List[CollectingDrain] = []
+        self.handled: List[IRequest] = []
+
+        @self.app.route(
+            "/upload", methods=["PUT"], stream_body=True, max_body_size=10
+        )
+        def upload(request: IRequest) -> KleinRenderable:
+            drain = CollectingDrain()
+            self.drains.append(drain)
+            done: Deferred[bytes] = Deferred()
+
+            def flowStopped(reason: Failure) -> None:
+                if reason.check(StopIteration):
+                    done.callback(b"%d" % len(b"".join(drain.received)))
+                else:
+                    done.errback(reason)
+
+            drain.flowStopped = flowStopped  # type: ignore[method-assign]
+            IKleinRequest(request).body_fount.flowTo(drain)
+            return done
+
+        @self.app.route("/form", methods=["POST"], max_body_size=10)
+        def form(request: IRequest) -> KleinRenderable:
+            self.handled.append(request)
+            return b"".join(request.args[b"a"])
+
+        @self.app.route("/async", methods=["PUT"], stream_body=True)
+        async def asyncUpload(request: IRequest) -> bytes:
+            return await fountToBytes(IKleinRequest(request).body_fount)
+
+    def test_buffered(self) -> None:
+        """
+        Handlers of routes with C{stream_body} get a fount of the body even
+        when it was buffered.
+        """
+        request = MockRequest(b"/upload", method=b"PUT", body=b"hello")
+        _render(self.app.resource(), request)
+        self.assertEqual(request.getWrittenData(), b"5")
+        request = MockRequest(b"/async", method=b"PUT", body=b"hello")
+        _render(self.app.resource(), request)
+        self.assertEqual(request.getWrittenData(), b"hello")
+
+    def test_bufferedTooLarge(self) -> None:
+        """
+        Buffered bodies larger than C{max_body_size} are refused with a 413.
+        """
+        request = MockRequest(b"/upload", method=b"PUT", body=b"x" * 11)
+        _render(self.app.resource(), request)
+        request.setResponseCode.assert_called_with(413)
+        self.assertEqual(self.drains, [])
+
+
+class StreamingRequestTests(StreamBodyRouteTests):
+    """
+    Tests for L{StreamingRequest}, with a real HTTP channel.
+    """
+
+    def connect(self) -> StringTransport:
+        site = Site(
+            self.app.resource(),
+            requestFactory=StreamingRequest,
+            timeout=None,
+            reactor=Clock(),
+        )
+        self.channel = site.buildProtocol(None)
+        transport = StringTransport()
+        self.channel.makeConnection(transport)
+        return transport
+
+    def test_streamed(self) -> None:
+        """
+        Routes with C{stream_body} are handled as soon as the headers have
+        arrived, and get the body as it arrives, pausing the transport while
+        their drain is paused.
+        """
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"PUT /upload HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Length: 8\r\n\r\n"
+        )
+        [drain] = self.drains
+        self.channel.dataReceived(b"abcd")
+        self.assertEqual(drain.received, [b"abcd"])
+        assert drain.fount is not None
+        pause = drain.fount.pauseFlow()
+        self.assertEqual(transport.producerState, "paused")
+        self.channel.dataReceived(b"efgh")
+        self.assertEqual(drain.received, [b"abcd"])
+        pause.unpause()
+        self.assertEqual(transport.producerState, "producing")
+        self.assertEqual(drain.received, [b"abcd", b"efgh"])
+        response = transport.value()
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertTrue(response.endswith(b"\r\n\r\n8"))
+
+    def test_continue(self) -> None:
+        """
+        Clients expecting C{100 Continue} get it before the handler's
+        response.
+        """
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"PUT /upload HTTP/1.1\r\nHost: example.com\r\n"
+            b"Expect: 100-continue\r\nContent-Length: 2\r\n\r\nab"
+        )
+        response = transport.value()
+        self.assertTrue(response.startswith(b"HTTP/1.1 100 Continue\r\n\r\n"))
+        self.assertEqual(response.count(b"100 Continue"), 1)
+        self.assertIn(b"HTTP/1.1 200 OK", response)
+
+    def test_contentLengthTooLarge(self) -> None:
+        """
+        Requests whose C{Content-Length} is larger than their route's
+        C{max_body_size} are refused without reading the body or running
+        the handler.
+        """
+        for request in [b"PUT /upload", b"POST /form"]:
+            transport = self.connect()
+            self.channel.dataReceived(
+                request + b" HTTP/1.1\r\nHost: example.com\r\n"
+                b"Expect: 100-continue\r\nContent-Length: 11\r\n\r\n"
+            )
+            self.assertEqual(
+                transport.value().split(b"\r\n")[0],
+                b"HTTP/1.1 413 Request Entity Too Large",
+            )
+            self.assertNotIn(b"100 Continue", transport.value())
+            self.assertTrue(transport.disconnecting)
+        self.assertEqual((self.drains, self.handled), ([], []))
+
+    def test_chunkedTooLarge(self) -> None:
+        """
+        Chunked bodies are refused once they grow larger than their route's
+        C{max_body_size}, and the handler's drain is told why.
+        """
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"PUT /upload HTTP/1.1\r\nHost: example.com\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+            b"6\r\nabcdef\r\n6\r\nghijkl\r\n"
+        )
+        self.assertIn(b"413", transport.value())
+        self.assertTrue(transport.disconnecting)
+        [drain] = self.drains
+        self.assertEqual(drain.received, [b"abcdef"])
+
+    def test_buffered(self) -> None:
+        """
+        Routes without C{stream_body} are handled once the body has arrived,
+        as usual.
+        """
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"POST /form HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Type: application/x-www-form-urlencoded\r\n"
+            b"Content-Length: 5\r\n\r\na=b"
+        )
+        self.assertEqual(self.handled, [])
+        self.channel.dataReceived(b"cd")
+        self.assertEqual(len(self.handled), 1)
+        self.assertTrue(transport.value().endswith(b"\r\n\r\nbcd"))
+
+    def test_bufferedTooLarge(self) -> None:
+        """
+        Bodies without a C{Content-Length} are refused once they grow larger
+        than C{max_body_size} even if their route doesn't stream them.
+        """
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"POST /form HTTP/1.1\r\nHost: example.com\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+            b"b\r\na=bcdefghij\r\n0\r\n\r\n"
+        )
+        self.assertIn(b"413", transport.value())
+        self.assertEqual(self.handled, [])
+
+    def test_respondedEarly(self) -> None:
+        """
+        If the handler responds before the body has all arrived, the rest of
+        it is discarded, and the connection can be used for the next
+        request.
+        """
+
+        @self.app.route("/reject", methods=["PUT"], stream_body=True)
+        def reject(request: IRequest) -> KleinRenderable:
+            request.setResponseCode(403)
+            return b"no"
+
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"PUT /reject HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Length: 4\r\n\r\nab"
+        )
+        self.assertIn(b"403", transport.value())
+        transport.clear()
+        self.channel.dataReceived(
+            b"cdPOST /form HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Type: application/x-www-form-urlencoded\r\n"
+            b"Content-Length: 3\r\n\r\na=b"
+        )
+        self.assertEqual(len(self.handled), 1)
+        self.assertIn(b"200 OK", transport.value())
+        self.assertFalse(transport.disconnecting)
+
+    def test_disconnected(self) -> None:
+        """
+        If the connection is lost, the handler's drain is told why, failing
+        its response.
+        """
+        self.connect()
+        self.channel.dataReceived(
+            b"PUT /upload HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Length: 8\r\n\r\nabcd"
+        )
+        self.channel.connectionLost(Failure(ConnectionError()))
+        [drain] = self.drains
+        self.assertEqual(drain.received, [b"abcd"])
+        self.assertEqual(len(self.flushLoggedErrors(ConnectionError)), 1)
+
+    def test_encodedPath(self) -> None:
+        """
+        Requests are routed before their body arrives by their decoded path,
+        as they are once it has.
+        """
+
+        @self.app.route("/caf\u00e9", methods=["PUT"], max_body_size=10)
+        def cafe(request: IRequest) -> KleinRenderable:
+            return b"cafe"
+
+        transport = self.connect()
+        self.channel.dataReceived(
+            b"PUT /caf%C3%A9 HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Length: 11\r\n\r\n"
+        )
+        self.assertEqual(
+            transport.value().split(b"\r\n")[0],
+            b"HTTP/1.1 413 Request Entity Too Large",
+        )
+
+    def test_pathRestored(self) -> None:
+        """
+        Routing a request before its body arrives leaves its C{prepath} and
+        C{postpath} as they were, for processing it to set.
+        """
+        requests: List[StreamingRequest] = []
+
+        def recordingRequest(*args: Any, **kwargs: Any) -> StreamingRequest:
+            request = StreamingRequest(*args, **kwargs)
+            requests.append(request)
+            return request
+
+        site = Site(
+            self.app.resource(),
+            requestFactory=recordingRequest,
+            timeout=None,
+            reactor=Clock(),
+        )
+        self.channel = site.buildProtocol(None)
+        self.channel.makeConnection(StringTransport())
+        self.channel.dataReceived(
+            b"POST /form HTTP/1.1\r\nHost: example.com\r\n"
+            b"Content-Length: 3\r\n\r\n"
+        )
+        [request] = requests
+        self.assertIsNone(request.prepath)
+        self.assertIsNone(request.postpath)
+
+    def test_otherChannel(self) -> None:
+        """
+        Requests on channels which don't expose the request line before the
+        body, such as HTTP/2 ones, have their bodies buffered, and are
+        handled once they've arrived.
+        """
+        channel = DummyChannel()
+        channel.site = Site(self.app.resource())
+        request = StreamingRequest(channel)
+        request.requestHeaders.setRawHeaders(
+            b"content-type", [b"application/x-www-form-urlencoded"]
+        )
+        request.gotLength(3)
+        self.assertIsNone(request.bodyStream)
+        self.assertIsNone(request.postpath)
+        request.handleContentChunk(b"a=b")
+        request.requestReceived(b"POST", b"/form", b"HTTP/2")
+        self.assertEqual(len(self.handled), 1)
+        self.assertTrue(channel.transport.written.getvalue().endswith(b"b"))
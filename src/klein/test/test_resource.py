@@ -23,7 +23,7 @@ from twisted.web.static import File
 from twisted.web.template import Element, Tag, XMLString, renderer
 from twisted.web.test.test_web import DummyChannel
 
-from .. import Klein, KleinRenderable
+from .. import Klein, KleinRenderable, Response
 from .._interfaces import IKleinRequest
 from .._resource import (
     KleinResource,
@@ -1277,6 +1277,136 @@ class KleinResourceTests(SynchronousTestCase):
         self.assertEqual(reported_length, actual_length)
 
 
+class SynchronousFastPathTests(SynchronousTestCase):
+    """
+    Tests for L{KleinResource}'s handling of routes that synchronously return
+    a response body.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.kr = KleinResource(self.app)
+
+    def render(self, path: bytes) -> MockRequest:
+        request = MockRequest(path)
+        self.notifyFinish = Mock(wraps=request.notifyFinish)
+        request.notifyFinish = self.notifyFinish  # type: ignore[method-assign]
+        self.successResultOf(_render(self.kr, request, notifyFinish=False))
+        return request
+
+    def contentLength(
+        self, request: MockRequest
+    ) -> Optional[Sequence[bytes]]:
+        return request.responseHeaders.getRawHeaders(b"content-length")
+
+    def test_bytes(self) -> None:
+        """
+        A synchronously returned C{bytes} body is written with a
+        C{Content-Length} and without waiting on the request's completion.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return b"hello"
+
+        request = self.render(b"/")
+        self.assertEqual(request.getWrittenData(), b"hello")
+        self.assertEqual(self.contentLength(request), [b"5"])
+        self.assertFalse(request.chunked)
+        self.assertEqual(request.finishCount, 1)
+        self.assertFalse(self.notifyFinish.called)
+
+    def test_text(self) -> None:
+        """
+        A synchronously returned C{str} body's C{Content-Length} is that of
+        its UTF-8 encoding.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return "\N{SNOWMAN}"
+
+        request = self.render(b"/")
+        self.assertEqual(request.getWrittenData(), b"\xe2\x98\x83")
+        self.assertEqual(self.contentLength(request), [b"3"])
+
+    def test_response(self) -> None:
+        """
+        A synchronously returned L{Response} with a C{bytes} body takes the
+        fast path too, applying its code and headers.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return Response(201, {"x-thing": "yes"}, b"made")
+
+        request = self.render(b"/")
+        self.assertEqual(request.code, 201)
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders(b"x-thing"), [b"yes"]
+        )
+        self.assertEqual(self.contentLength(request), [b"4"])
+        self.assertFalse(self.notifyFinish.called)
+
+    def test_explicitContentLength(self) -> None:
+        """
+        A C{Content-Length} set by the route is left alone.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            request.setHeader(b"content-length", b"2")
+            return b"hi"
+
+        request = self.render(b"/")
+        self.assertEqual(self.contentLength(request), [b"2"])
+
+    def test_noBodyCode(self) -> None:
+        """
+        Responses whose status code forbids a body get no C{Content-Length}.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            request.setResponseCode(204)
+            return b""
+
+        request = self.render(b"/")
+        self.assertIsNone(self.contentLength(request))
+
+    def test_alreadyWriting(self) -> None:
+        """
+        If the route has already started writing, the rest of the body is
+        written without a C{Content-Length}.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            request.write(b"a")
+            return b"b"
+
+        request = self.render(b"/")
+        self.assertEqual(request.getWrittenData(), b"ab")
+        self.assertIsNone(self.contentLength(request))
+
+    def test_deferred(self) -> None:
+        """
+        Bodies from L{Deferred}s go through the asynchronous path, which
+        watches for the request finishing and also sets a C{Content-Length}.
+        """
+        d: Deferred[bytes] = Deferred()
+
+        @self.app.route("/")
+        def root(request: IRequest) -> KleinRenderable:
+            return d
+
+        request = self.render(b"/")
+        self.assertTrue(self.notifyFinish.called)
+        d.callback(b"later")
+        self.assertEqual(request.getWrittenData(), b"later")
+        self.assertEqual(self.contentLength(request), [b"5"])
+
+
 class ExtractURLpartsTests(SynchronousTestCase):
     """
     Tests for L{klein.resource.extractURLparts}.
@@ -0,0 +1,327 @@
+"""
+Tests for L{klein._responsecache}.
+"""
+
+from typing import Dict, List, Optional
+
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import CachePolicy, Klein, KleinRenderable
+from .._dispatch import CacheStats
+from .._responsecache import (
+    ResponseCache,
+    cacheKey,
+    mayServeFromCache,
+    mayStore,
+)
+from .test_resource import MockRequest, _render
+
+
+def requestWith(
+    path: bytes = b"/", headers: Optional[Dict[bytes, bytes]] = None
+) -> MockRequest:
+    request = MockRequest(path)
+    for name, value in (headers or {}).items():
+        request.requestHeaders.setRawHeaders(name, [value])
+    return request
+
+
+class CachePolicyTests(SynchronousTestCase):
+    """
+    Tests for L{CachePolicy}.
+    """
+
+    def test_varyNormalized(self) -> None:
+        """
+        Header names to vary on are stored as lowercase C{bytes}.
+        """
+        policy = CachePolicy(5, vary=["Accept-Language", b"X-Thing"])
+        self.assertEqual(policy.vary, (b"accept-language", b"x-thing"))
+
+    def test_key(self) -> None:
+        """
+        L{cacheKey} distinguishes requests by endpoint, server name, URI and
+        the values of the headers the policy varies on.
+        """
+        policy = CachePolicy(5, vary=[b"accept-language"])
+        request = requestWith(b"/a", {b"accept-language": b"fr"})
+        request.uri = b"/a?b=c"
+        self.assertEqual(
+            cacheKey("e", "localhost", request, policy),
+            ("e", "localhost", b"/a?b=c", (b"fr",)),
+        )
+
+
+class DirectivesTests(SynchronousTestCase):
+    """
+    Tests for L{mayServeFromCache} and L{mayStore}.
+    """
+
+    def test_mayServeFromCache(self) -> None:
+        """
+        Requests may be served from the cache unless they say otherwise.
+        """
+        self.assertTrue(mayServeFromCache(requestWith()))
+        for name, value in [
+            (b"cache-control", b"max-age=0, No-Cache"),
+            (b"cache-control", b"no-store"),
+            (b"pragma", b"no-cache"),
+        ]:
+            self.assertFalse(
+                mayServeFromCache(requestWith(headers={name: value}))
+            )
+
+    def test_mayStore(self) -> None:
+        """
+        Only untouched C{200} responses that don't set cookies or forbid
+        caching may be stored.
+        """
+        self.assertTrue(mayStore(requestWith()))
+
+        request = requestWith(headers={b"cache-control": b"no-store"})
+        self.assertFalse(mayStore(request))
+
+        for directive in [b"private", b"no-store", b"no-cache"]:
+            request = requestWith()
+            request.setHeader(b"cache-control", directive)
+            self.assertFalse(mayStore(request))
+
+        request = requestWith()
+        request.setResponseCode(404)
+        self.assertFalse(mayStore(request))
+
+        request = requestWith()
+        request.addCookie(b"a", b"b")
+        self.assertFalse(mayStore(request))
+
+        request = requestWith()
+        request.write(b"already")
+        self.assertFalse(mayStore(request))
+
+
+class ResponseCacheTests(SynchronousTestCase):
+    """
+    Tests for L{ResponseCache}.
+    """
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.cache = ResponseCache(maxBytes=1000, now=self.clock.seconds)
+        self.policy = CachePolicy(ttl=5)
+
+    def store(self, key: str, body: bytes) -> None:
+        request = requestWith()
+        request.setHeader(b"content-type", b"text/plain")
+        request.setHeader(b"date", b"today")
+        self.cache.store((key, "", b"", ()), self.policy, request, body)
+
+    def get(self, key: str) -> Optional[bytes]:
+        response = self.cache.get((key, "", b"", ()))
+        return None if response is None else response.body
+
+    def test_storeAndGet(self) -> None:
+        """
+        Stored responses can be retrieved, without the headers that are
+        specific to one transmission of the response.
+        """
+        self.store("a", b"body")
+        response = self.cache.get(("a", "", b"", ()))
+        assert response is not None
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b"body")
+        self.assertEqual(
+            response.headers, ((b"Content-Type", (b"text/plain",)),)
+        )
+        self.assertIsNone(self.get("b"))
+        self.assertEqual(self.cache.stats(), CacheStats(1, 1, 1))
+
+    def test_expires(self) -> None:
+        """
+        Responses are no longer served once their time to live has passed.
+        """
+        self.store("a", b"body")
+        self.clock.advance(4.9)
+        self.assertEqual(self.get("a"), b"body")
+        self.clock.advance(0.1)
+        self.assertIsNone(self.get("a"))
+        self.assertEqual(self.cache.totalBytes, 0)
+
+    def test_evictsLeastRecentlyUsedByBytes(self) -> None:
+        """
+        Once the total size of the responses exceeds the limit, the least
+        recently used responses are evicted.
+        """
+        self.store("a", b"a" * 200)
+        self.store("b", b"b" * 200)
+        self.get("a")
+        self.store("c", b"c" * 200)
+        self.assertIsNotNone(self.get("a"))
+        self.assertIsNone(self.get("b"))
+        self.assertIsNotNone(self.get("c"))
+        self.assertLessEqual(self.cache.totalBytes, 1000)
+
+    def test_tooLarge(self) -> None:
+        """
+        Responses larger than the whole cache aren't stored.
+        """
+        self.store("a", b"a" * 100)
+        self.store("big", b"b" * 1000)
+        self.assertIsNone(self.get("big"))
+        self.assertIsNotNone(self.get("a"))
+
+    def test_invalidate(self) -> None:
+        """
+        L{ResponseCache.invalidate} discards all responses.
+        """
+        self.store("a", b"a")
+        self.cache.invalidate()
+        self.assertIsNone(self.get("a"))
+        self.assertEqual(self.cache.totalBytes, 0)
+
+
+class KleinResponseCacheTests(SynchronousTestCase):
+    """
+    Tests for routes with a L{CachePolicy}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.clock = Clock()
+        self.app.response_cache.now = self.clock.seconds
+        self.calls: List[bytes] = []
+
+    def render(
+        self, path: bytes = b"/", headers: Optional[Dict[bytes, bytes]] = None
+    ) -> MockRequest:
+        request = requestWith(path, headers)
+        self.successResultOf(_render(self.app.resource(), request))
+        return request
+
+    def test_hit(self) -> None:
+        """
+        Within the time to live, a request for the same URL is answered with
+        the same code, headers and body, without calling the handler.
+        """
+
+        @self.app.route("/", cache=CachePolicy(ttl=5))
+        @self.app.route("/other", cache=CachePolicy(ttl=5))
+        def root(request: IRequest) -> KleinRenderable:
+            self.calls.append(request.uri)
+            request.setResponseCode(200)
+            request.setHeader(b"x-thing", b"yes")
+            return "hello"
+
+        first = self.render()
+        self.clock.advance(2)
+        second = self.render()
+        self.assertEqual(self.calls, [b"/"])
+        self.assertEqual(second.getWrittenData(), b"hello")
+        self.assertEqual(
+            second.responseHeaders.getRawHeaders(b"x-thing"), [b"yes"]
+        )
+        self.assertEqual(second.responseHeaders.getRawHeaders(b"age"), [b"2"])
+        self.assertEqual(
+            second.responseHeaders.getRawHeaders(b"content-length"),
+            first.responseHeaders.getRawHeaders(b"content-length"),
+        )
+
+        self.clock.advance(3)
+        self.render()
+        self.render(b"/other")
+        self.assertEqual(self.calls, [b"/", b"/", b"/other"])
+
+    def test_vary(self) -> None:
+        """
+        Requests with different values for the headers the policy varies on
+        are cached separately.
+        """
+
+        @self.app.route(
+            "/", cache=CachePolicy(ttl=5, vary=[b"accept-language"])
+        )
+        def root(request: IRequest) -> KleinRenderable:
+            language = request.getHeader(b"accept-language") or b"en"
+            self.calls.append(language)
+            return language
+
+        fr = {b"accept-language": b"fr"}
+        self.assertEqual(self.render(headers=fr).getWrittenData(), b"fr")
+        self.assertEqual(self.render().getWrittenData(), b"en")
+        self.assertEqual(self.render(headers=fr).getWrittenData(), b"fr")
+        self.assertEqual(self.calls, [b"fr", b"en"])
+
+    def test_noCache(self) -> None:
+        """
+        A request with C{Cache-Control: no-cache} calls the handler, and its
+        response replaces the cached one.
+        """
+        count = iter(range(10))
+
+        @self.app.route("/", cache=CachePolicy(ttl=5))
+        def root(request: IRequest) -> KleinRenderable:
+            return b"%d" % (next(count),)
+
+        self.assertEqual(self.render().getWrittenData(), b"0")
+        noCache = {b"cache-control": b"no-cache"}
+        self.assertEqual(self.render(headers=noCache).getWrittenData(), b"1")
+        self.assertEqual(self.render().getWrittenData(), b"1")
+
+    def test_deferred(self) -> None:
+        """
+        Bodies produced asynchronously are cached too.
+        """
+
+        @self.app.route("/", cache=CachePolicy(ttl=5))
+        def root(request: IRequest) -> KleinRenderable:
+            self.calls.append(request.uri)
+            return succeed(b"later")
+
+        self.render()
+        self.assertEqual(self.render().getWrittenData(), b"later")
+        self.assertEqual(self.calls, [b"/"])
+
+    def test_notCached(self) -> None:
+        """
+        Errors, responses setting cookies, uncached routes and methods other
+        than C{GET} and C{HEAD} are not cached.
+        """
+
+        @self.app.route("/error", cache=CachePolicy(ttl=5))
+        def error(request: IRequest) -> KleinRenderable:
+            self.calls.append(request.uri)
+            raise ValueError("no")
+
+        @self.app.route("/cookie", cache=CachePolicy(ttl=5))
+        def cookie(request: IRequest) -> KleinRenderable:
+            self.calls.append(request.uri)
+            request.addCookie(b"session", b"secret")
+            return b"cookie"
+
+        @self.app.route("/uncached")
+        def uncached(request: IRequest) -> KleinRenderable:
+            self.calls.append(request.uri)
+            return b"uncached"
+
+        @self.app.route("/post", methods=["POST"], cache=CachePolicy(ttl=5))
+        def post(request: IRequest) -> KleinRenderable:
+            self.calls.append(request.uri)
+            return b"post"
+
+        for path in [b"/error", b"/cookie", b"/uncached"]:
+            self.render(path)
+            self.render(path)
+        for _ in range(2):
+            request = MockRequest(b"/post", method=b"POST")
+            self.successResultOf(_render(self.app.resource(), request))
+        self.assertEqual(
+            self.calls,
+            [b"/error"] * 2
+            + [b"/cookie"] * 2
+            + [b"/uncached"] * 2
+            + [b"/post"] * 2,
+        )
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 2)
+        self.assertEqual(self.app.response_cache.stats().size, 0)
@@ -0,0 +1,371 @@
+"""
+Tests for L{klein._serve}.
+"""
+
+import gc
+import os
+import socket
+from typing import Any, Dict, List, Tuple
+from unittest.mock import Mock, patch
+
+from twisted.internet.error import ProcessDone, ProcessTerminated
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.server import Site
+
+from .. import Klein
+from .._serve import (
+    LISTEN_FD_ENV,
+    WORKER_ENV,
+    Supervisor,
+    listeningSocket,
+    loadApp,
+    main,
+    parseSize,
+    serveWorkers,
+)
+
+
+app = Klein()
+
+
+class FakeProcess:
+    def __init__(self, protocol: Any) -> None:
+        self.protocol = protocol
+        self.signals: List[str] = []
+
+    def signalProcess(self, signal: str) -> None:
+        self.signals.append(signal)
+
+
+class FakeReactor(Clock):
+    """
+    Enough of a reactor to start processes and adopt sockets.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.spawned: List[Tuple[FakeProcess, List[str], Dict[str, Any]]] = []
+        self.adopted: List[Tuple[int, int, object]] = []
+        self.whenRunning: List[Any] = []
+        self.triggers: List[Tuple[str, str, Any]] = []
+
+    def spawnProcess(
+        self, protocol: Any, executable: str, args: List[str], **kw: Any
+    ) -> FakeProcess:
+        process = FakeProcess(protocol)
+        self.spawned.append((process, args, kw))
+        return process
+
+    def adoptStreamPort(self, fd: int, family: int, factory: object) -> Mock:
+        os.fstat(fd)
+        self.adopted.append((fd, family, factory))
+        return Mock()
+
+    def callWhenRunning(self, f: Any) -> None:
+        self.whenRunning.append(f)
+
+    def addSystemEventTrigger(self, phase: str, event: str, f: Any) -> None:
+        self.triggers.append((phase, event, f))
+
+
+def exit(process: FakeProcess, code: int = 0) -> None:
+    reason = ProcessDone(0) if not code else ProcessTerminated(code)
+    process.protocol.processEnded(Failure(reason))
+
+
+class SupervisorTests(SynchronousTestCase):
+    """
+    Tests for L{Supervisor}.
+    """
+
+    def setUp(self) -> None:
+        self.reactor = FakeReactor()
+        self.supervisor = Supervisor(
+            self.reactor,
+            2,
+            ["python", "-m", "app"],
+            {"PATH": "/bin"},
+            {0: 0, 1: 1, 2: 2, 5: 5},
+            now=self.reactor.seconds,
+        )
+        self.supervisor.start()
+
+    def test_start(self) -> None:
+        """
+        Each worker runs the command with its index in its environment, and
+        the given file descriptors.
+        """
+        self.assertEqual(len(self.reactor.spawned), 2)
+        for index, (_, args, kw) in enumerate(self.reactor.spawned):
+            self.assertEqual(args, ["python", "-m", "app"])
+            self.assertEqual(
+                kw["env"], {"PATH": "/bin", WORKER_ENV: str(index)}
+            )
+            self.assertEqual(kw["childFDs"], {0: 0, 1: 1, 2: 2, 5: 5})
+
+    def test_restart(self) -> None:
+        """
+        A worker which exits after running for a while is restarted
+        straight away, with the same index.
+        """
+        self.reactor.advance(10)
+        exit(self.reactor.spawned[1][0], 1)
+        self.assertNotIn(1, self.supervisor.workers)
+        self.reactor.advance(0)
+        self.assertEqual(len(self.reactor.spawned), 3)
+        self.assertEqual(self.reactor.spawned[2][2]["env"][WORKER_ENV], "1")
+        self.assertIs(self.supervisor.workers[1], self.reactor.spawned[2][0])
+
+    def test_backoff(self) -> None:
+        """
+        A worker which keeps exiting soon after starting is restarted after
+        a delay which doubles each time, up to a limit.
+        """
+        delays = []
+        for _ in range(7):
+            exit(self.supervisor.workers[0], 1)
+            spawned = len(self.reactor.spawned)
+            [call] = self.reactor.getDelayedCalls()
+            delays.append(call.getTime() - self.reactor.seconds())
+            self.reactor.advance(delays[-1])
+            self.assertEqual(len(self.reactor.spawned), spawned + 1)
+        self.assertEqual(delays, [1, 2, 4, 8, 16, 30, 30])
+
+        self.reactor.advance(10)
+        exit(self.supervisor.workers[0])
+        self.reactor.advance(0)
+        self.reactor.advance(0.5)
+        exit(self.supervisor.workers[0])
+        [call] = self.reactor.getDelayedCalls()
+        self.assertEqual(call.getTime() - self.reactor.seconds(), 1)
+
+    def test_stop(self) -> None:
+        """
+        Stopping signals every worker, cancels pending restarts, and fires
+        once every worker has exited.
+        """
+        first, second = (each[0] for each in self.reactor.spawned)
+        exit(second, 1)
+        d = self.supervisor.stop()
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+        self.assertEqual(first.signals, ["TERM"])
+        self.assertNoResult(d)
+        exit(first)
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(len(self.reactor.spawned), 2)
+        self.assertIsNone(self.successResultOf(self.supervisor.stop()))
+
+
+class ServeWorkersTests(SynchronousTestCase):
+    """
+    Tests for L{serveWorkers}.
+    """
+
+    def setUp(self) -> None:
+        self.reactor = FakeReactor()
+        self.site = Site(Mock())
+        self.environ: Dict[str, str] = {}
+        self.patch(os, "environ", self.environ)
+        self.frozen: List[bool] = []
+        self.patch(gc, "freeze", lambda: self.frozen.append(True))
+
+    def test_supervisor(self) -> None:
+        """
+        Outside a worker, the socket is bound once and passed to the workers
+        started when the reactor runs; they are stopped when it shuts down.
+        """
+        supervisor = serveWorkers(self.reactor, self.site, "127.0.0.1", 0, 3)
+        assert isinstance(supervisor, Supervisor)
+        [(phase, event, closeSocket), stopTrigger] = self.reactor.triggers
+        self.addCleanup(closeSocket)
+        self.assertEqual(stopTrigger, ("before", "shutdown", supervisor.stop))
+        self.assertEqual(self.reactor.whenRunning, [supervisor.start])
+        supervisor.start()
+        self.assertEqual(len(self.reactor.spawned), 3)
+        env = self.reactor.spawned[0][2]["env"]
+        fd = int(env[LISTEN_FD_ENV])
+        self.assertEqual(self.reactor.spawned[0][2]["childFDs"][fd], fd)
+        self.assertTrue(os.get_inheritable(fd))
+        sock = socket.socket(fileno=os.dup(fd))
+        self.addCleanup(sock.close)
+        self.assertNotEqual(sock.getsockname()[1], 0)
+        self.assertEqual(self.frozen, [])
+
+    def test_worker(self) -> None:
+        """
+        In a worker, the inherited socket is adopted, and objects allocated
+        so far are frozen.
+        """
+        sock = listeningSocket("127.0.0.1", 0)
+        self.addCleanup(sock.close)
+        self.environ[WORKER_ENV] = "0"
+        self.environ[LISTEN_FD_ENV] = str(os.dup(sock.fileno()))
+        port = serveWorkers(self.reactor, self.site, "127.0.0.1", 0, 3)
+        [(fd, family, factory)] = self.reactor.adopted
+        self.assertIsInstance(port, Mock)
+        self.assertEqual(family, socket.AF_INET)
+        self.assertIs(factory, self.site)
+        self.assertEqual(self.frozen, [True])
+        self.assertRaises(OSError, os.fstat, int(self.environ[LISTEN_FD_ENV]))
+
+    def test_reusePort(self) -> None:
+        """
+        With C{reusePort}, each worker binds its own socket.
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise self.skipTest("SO_REUSEPORT is not supported here")
+        other = listeningSocket("127.0.0.1", 0, reusePort=True)
+        self.addCleanup(other.close)
+        port = other.getsockname()[1]
+        supervisor = serveWorkers(
+            self.reactor, self.site, "127.0.0.1", port, 2, True
+        )
+        assert isinstance(supervisor, Supervisor)
+        self.assertEqual(
+            self.reactor.triggers, [("before", "shutdown", supervisor.stop)]
+        )
+        supervisor.start()
+        self.assertNotIn(LISTEN_FD_ENV, self.reactor.spawned[0][2]["env"])
+        self.assertEqual(
+            self.reactor.spawned[0][2]["childFDs"], {0: 0, 1: 1, 2: 2}
+        )
+
+        self.environ[WORKER_ENV] = "1"
+        serveWorkers(self.reactor, self.site, "127.0.0.1", port, 2, True)
+        self.assertEqual(len(self.reactor.adopted), 1)
+
+    def test_reusePortNeedsPort(self) -> None:
+        """
+        C{reusePort} without a port is rejected, since each worker would
+        bind a different one.
+        """
+        self.assertRaises(
+            ValueError,
+            serveWorkers,
+            self.reactor,
+            self.site,
+            "127.0.0.1",
+            0,
+            2,
+            True,
+        )
+        self.assertEqual(self.reactor.triggers, [])
+
+    def test_badInheritedSocket(self) -> None:
+        """
+        A worker rejects an inherited file descriptor which isn't one.
+        """
+        self.environ[WORKER_ENV] = "0"
+        for fd in ["", "socket", "-1"]:
+            self.environ[LISTEN_FD_ENV] = fd
+            self.assertRaises(
+                ValueError,
+                serveWorkers,
+                self.reactor,
+                self.site,
+                "127.0.0.1",
+                8080,
+                2,
+            )
+        self.assertEqual(self.reactor.adopted, [])
+
+
+class RunTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.run} with workers.
+    """
+
+    @patch("klein._app.serveWorkers")
+    @patch("klein._app.log")
+    @patch("klein._app.reactor")
+    def test_workers(
+        self, reactor: Any, mockLog: Any, mockServeWorkers: Any
+    ) -> None:
+        """
+        With more than one worker, L{Klein.run} serves with
+        L{serveWorkers}.
+        """
+        app = Klein()
+        app.run("localhost", 8080, workers=4)
+        [(args, kwargs)] = mockServeWorkers.call_args_list
+        self.assertEqual(args[0], reactor)
+        self.assertEqual(args[2:], ("localhost", 8080, 4, False))
+        reactor.run.assert_called_with()
+
+    def test_endpoint(self) -> None:
+        """
+        Workers can't be combined with an endpoint description.
+        """
+        self.assertRaises(
+            ValueError,
+            Klein().run,
+            endpoint_description="tcp:8080",
+            workers=2,
+        )
+
+
+class MainTests(SynchronousTestCase):
+    """
+    Tests for L{main}.
+    """
+
+    def test_loadApp(self) -> None:
+        """
+        Applications are found by module and attribute name, which defaults
+        to C{app}.
+        """
+        self.assertIs(loadApp("klein.test.test_serve"), app)
+        self.assertIs(loadApp("klein.test.test_serve:app"), app)
+        self.assertIs(
+            loadApp("klein.test.test_serve:RunTests.test_endpoint"),
+            RunTests.test_endpoint,
+        )
+        self.assertRaises(AttributeError, loadApp, "klein.test.test_serve:x")
+
+    def test_parseSize(self) -> None:
+        """
+        Sizes are given in bytes, optionally with a binary suffix.
+        """
+        self.assertEqual(parseSize("1000"), 1000)
+        self.assertEqual(parseSize("2k"), 2048)
+        self.assertEqual(parseSize("1.5M"), 1536 * 1024)
+        self.assertEqual(parseSize("1G"), 1024**3)
+        self.assertRaises(ValueError, parseSize, "lots")
+
+    def test_serve(self) -> None:
+        """
+        C{serve} runs the application with the given options.
+        """
+        run = Mock()
+        self.patch(app, "run", run)
+        self.assertEqual(
+            main(
+                [
+                    "serve",
+                    "klein.test.test_serve:app",
+                    "--port",
+                    "9000",
+                    "--workers",
+                    "4",
+                    "--reuse-port",
+                    "--max-requests",
+                    "1000",
+                    "--max-rss",
+                    "512M",
+                ]
+            ),
+            0,
+        )
+        run.assert_called_once_with(
+            "0.0.0.0",
+            9000,
+            endpoint_description=None,
+            displayTracebacks=True,
+            workers=4,
+            reuse_port=True,
+            max_requests=1000,
+            max_rss=512 * 1024 * 1024,
+            drain_timeout=30.0,
+        )
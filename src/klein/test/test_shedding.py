@@ -0,0 +1,187 @@
+"""
+Tests for L{klein._shedding}.
+"""
+
+from typing import List
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable
+from .._shedding import CRITICAL, LOW, NORMAL, AdmissionController, LagMonitor
+from .test_resource import MockRequest, _render
+
+
+class LagMonitorTests(SynchronousTestCase):
+    """
+    Tests for L{LagMonitor}.
+    """
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.monitor = LagMonitor(interval=1, smoothing=0.5, clock=self.clock)
+
+    def test_onTime(self) -> None:
+        """
+        Heartbeats which run on time measure no lag.
+        """
+        self.monitor.start()
+        self.clock.pump([1, 1, 1])
+        self.assertEqual(self.monitor.lag, 0.0)
+
+    def test_late(self) -> None:
+        """
+        Late heartbeats raise the moving average of the lag, and on-time ones
+        lower it again.
+        """
+        self.monitor.start()
+        self.clock.advance(3)
+        self.assertEqual((self.monitor.lag, self.monitor.maxLag), (1.0, 2.0))
+        self.clock.advance(1)
+        self.assertEqual((self.monitor.lag, self.monitor.maxLag), (0.5, 2.0))
+
+    def test_stop(self) -> None:
+        """
+        Stopping the monitor cancels its heartbeat.
+        """
+        self.monitor.start()
+        self.monitor.start()
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.monitor.stop()
+        self.assertFalse(self.monitor.running)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class AdmissionControllerTests(SynchronousTestCase):
+    """
+    Tests for L{AdmissionController}.
+    """
+
+    def setUp(self) -> None:
+        self.monitor = LagMonitor(clock=Clock())
+        self.samples: List[float] = []
+        self.controller = AdmissionController(
+            self.monitor,
+            lowLag=0.1,
+            highLag=0.5,
+            retryAfter=2,
+            sample=self.samples.pop,
+        )
+
+    def test_invalid(self) -> None:
+        """
+        Shedding must start at a lower lag than it's complete.
+        """
+        self.assertRaises(
+            ValueError, AdmissionController, self.monitor, 0.5, 0.5
+        )
+
+    def test_fraction(self) -> None:
+        """
+        The fraction of requests shed grows with the lag, faster for those
+        with L{LOW} priority, and is always 0 for those with L{CRITICAL}
+        priority.
+        """
+        fractions = []
+        for lag in [0.0, 0.1, 0.2, 0.3, 0.5, 1.0]:
+            self.monitor.lag = lag
+            fractions.append(
+                tuple(
+                    round(self.controller.fraction(priority), 2)
+                    for priority in [CRITICAL, NORMAL, LOW]
+                )
+            )
+        self.assertEqual(
+            fractions,
+            [
+                (0.0, 0.0, 0.0),
+                (0.0, 0.0, 0.0),
+                (0.0, 0.25, 0.5),
+                (0.0, 0.5, 1.0),
+                (0.0, 1.0, 1.0),
+                (0.0, 1.0, 1.0),
+            ],
+        )
+
+    def test_admit(self) -> None:
+        """
+        Requests are shed when the sample falls below the fraction to shed.
+        """
+        self.monitor.lag = 0.3
+        self.samples[:] = [0.4, 0.6]
+        self.controller.admit(NORMAL)
+        error = self.assertRaises(
+            ServiceUnavailable, self.controller.admit, NORMAL
+        )
+        self.assertIn(("Retry-After", "2"), error.get_headers())
+        self.controller.admit(CRITICAL)
+        stats = self.controller.stats()
+        self.assertAlmostEqual(stats.fraction, 0.5)
+        self.assertEqual((stats.admitted, stats.shed), (2, 1))
+
+    def test_unloaded(self) -> None:
+        """
+        Nothing is sampled, or shed, while the lag is low.
+        """
+        self.controller.admit(LOW)
+        self.assertEqual(self.controller.stats().admitted, 1)
+
+
+class ShedLoadTests(SynchronousTestCase):
+    """
+    Tests for L{Klein.shed_load}, as enforced by L{KleinResource}.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+        self.clock = Clock()
+        self.controller = self.app.shed_load(
+            AdmissionController(
+                LagMonitor(clock=self.clock), sample=lambda: 0.5
+            )
+        )
+
+        @self.app.route("/")
+        def index(request: IRequest) -> KleinRenderable:
+            return b"index"
+
+        @self.app.route("/health", priority=CRITICAL)
+        def health(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+    def render(self, path: bytes) -> MockRequest:
+        request = MockRequest(path)
+        _render(self.app.resource(), request)
+        return request
+
+    def test_started(self) -> None:
+        """
+        L{Klein.shed_load} starts the monitor.
+        """
+        self.assertIdentical(self.app.admission_controller, self.controller)
+        self.assertTrue(self.controller.monitor.running)
+
+    def test_shed(self) -> None:
+        """
+        When the reactor falls behind, requests are answered with a 503
+        without running the handler, unless their route is critical.
+        """
+        self.assertEqual(self.render(b"/").getWrittenData(), b"index")
+        self.controller.monitor.lag = 1.0
+        shed = self.render(b"/")
+        shed.setResponseCode.assert_called_with(503)
+        self.assertEqual(
+            shed.responseHeaders.getRawHeaders(b"retry-after"), [b"1"]
+        )
+        self.assertEqual(self.render(b"/health").getWrittenData(), b"ok")
+
+    def test_invalidPriority(self) -> None:
+        """
+        Routes must have a known priority.
+        """
+        self.assertRaises(
+            ValueError, self.app.route, "/other", priority="urgent"
+        )
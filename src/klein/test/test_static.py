@@ -0,0 +1,400 @@
+"""
+Tests for L{klein.static}.
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.trial.unittest import SynchronousTestCase
+
+from .. import Klein
+from .._static import (
+    FileProducer,
+    StaticFiles,
+    _sendfileThreshold,
+    parseRanges,
+)
+from ..static import mount
+from .test_resource import MockRequest, _render
+
+
+class ParseRangesTests(SynchronousTestCase):
+    """
+    Tests for L{parseRanges}.
+    """
+
+    def test_ranges(self) -> None:
+        """
+        First-last, open-ended and suffix ranges are clamped to the size of
+        the representation.
+        """
+        self.assertEqual(parseRanges(b"bytes=0-9", 100), [(0, 9)])
+        self.assertEqual(parseRanges(b"bytes=90-", 100), [(90, 99)])
+        self.assertEqual(parseRanges(b"bytes=-10", 100), [(90, 99)])
+        self.assertEqual(parseRanges(b"bytes=-1000", 100), [(0, 99)])
+        self.assertEqual(parseRanges(b"bytes=95-1000", 100), [(95, 99)])
+        self.assertEqual(parseRanges(b"bytes=0-0, 5-6", 100), [(0, 0), (5, 6)])
+
+    def test_unsatisfiable(self) -> None:
+        """
+        Ranges beyond the end are dropped, leaving an empty list if none
+        remain.
+        """
+        self.assertEqual(parseRanges(b"bytes=100-", 100), [])
+        self.assertEqual(parseRanges(b"bytes=200-300, 0-1", 100), [(0, 1)])
+        self.assertEqual(parseRanges(b"bytes=-0", 100), [])
+
+    def test_invalid(self) -> None:
+        """
+        Invalid headers, other units and too many ranges are ignored.
+        """
+        for header in [
+            b"items=0-1",
+            b"bytes=",
+            b"bytes=1",
+            b"bytes=a-b",
+            b"bytes=5-1",
+            b"bytes=" + b",".join([b"0-1"] * 17),
+        ]:
+            self.assertIsNone(parseRanges(header, 100), header)
+
+
+class StaticFilesTests(SynchronousTestCase):
+    """
+    Tests for L{StaticFiles} mounted with L{mount}.
+    """
+
+    def setUp(self) -> None:
+        self.root = FilePath(self.mktemp())
+        self.root.makedirs()
+        self.root.child("hello.txt").setContent(b"Hello, world!")
+        self.clock = Clock()
+        self.app = Klein()
+        self.files = mount(
+            self.app, "/static", self.root.path, now=self.clock.seconds
+        )
+
+    def render(
+        self,
+        path: bytes,
+        headers: Optional[Dict[bytes, bytes]] = None,
+        method: bytes = b"GET",
+    ) -> MockRequest:
+        request = MockRequest(b"/static/" + path, method=method)
+        for name, value in (headers or {}).items():
+            request.requestHeaders.setRawHeaders(name, [value])
+        self.successResultOf(_render(self.app.resource(), request))
+        return request
+
+    def header(self, request: MockRequest, name: bytes) -> Optional[bytes]:
+        values = request.responseHeaders.getRawHeaders(name)
+        return None if values is None else values[0]
+
+    def test_file(self) -> None:
+        """
+        Files are served with their type, length, validators and support for
+        ranges.
+        """
+        request = self.render(b"hello.txt")
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"Hello, world!")
+        self.assertEqual(self.header(request, b"content-type"), b"text/plain")
+        self.assertEqual(self.header(request, b"content-length"), b"13")
+        self.assertEqual(self.header(request, b"accept-ranges"), b"bytes")
+        self.assertIsNone(self.header(request, b"vary"))
+        etag = self.header(request, b"etag")
+        assert etag is not None
+        self.assertTrue(etag.startswith(b'"'))
+        self.assertIsNotNone(self.header(request, b"last-modified"))
+
+    def test_head(self) -> None:
+        """
+        C{HEAD} requests get the headers without the body.
+        """
+        request = self.render(b"hello.txt", method=b"HEAD")
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"")
+        self.assertEqual(self.header(request, b"content-length"), b"13")
+
+    def test_notModified(self) -> None:
+        """
+        Conditional requests matching the file's C{ETag} get a C{304}.
+        """
+        etag = self.header(self.render(b"hello.txt"), b"etag")
+        assert etag is not None
+        request = self.render(b"hello.txt", {b"if-none-match": etag})
+        self.assertEqual(request.code, 304)
+        self.assertEqual(request.getWrittenData(), b"")
+
+    def test_notFound(self) -> None:
+        """
+        Missing files, and paths that would escape the directory, are not
+        found.
+        """
+        self.root.sibling("secret.txt").setContent(b"secret")
+        for path in [b"missing.txt", b"../secret.txt", b"%2e%2e/secret.txt"]:
+            request = self.render(path)
+            self.assertEqual(request.code, 404, path)
+
+    def test_directories(self) -> None:
+        """
+        Directories are redirected to their path with a trailing slash, where
+        their index file is served.  There are no directory listings.
+        """
+        sub = self.root.child("sub")
+        sub.makedirs()
+        request = self.render(b"sub")
+        self.assertEqual(request.code, 301)
+        self.assertEqual(self.header(request, b"location"), b"/static/sub/")
+        self.assertEqual(self.render(b"sub/").code, 404)
+
+        sub.child("index.html").setContent(b"<p>index</p>")
+        self.clock.advance(10)
+        request = self.render(b"sub/")
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"<p>index</p>")
+        self.assertEqual(self.header(request, b"content-type"), b"text/html")
+
+    def test_precompressed(self) -> None:
+        """
+        Precompressed variants are served to clients accepting their
+        encoding, preferring Brotli.
+        """
+        self.root.child("hello.txt.gz").setContent(b"gzipped")
+        self.root.child("hello.txt.br").setContent(b"brotli")
+
+        request = self.render(b"hello.txt", {b"accept-encoding": b"gzip, br"})
+        self.assertEqual(request.getWrittenData(), b"brotli")
+        self.assertEqual(self.header(request, b"content-encoding"), b"br")
+        self.assertEqual(self.header(request, b"content-type"), b"text/plain")
+        self.assertEqual(self.header(request, b"vary"), b"accept-encoding")
+        brotli = self.header(request, b"etag")
+
+        request = self.render(
+            b"hello.txt", {b"accept-encoding": b"gzip, br;q=0"}
+        )
+        self.assertEqual(request.getWrittenData(), b"gzipped")
+        self.assertEqual(self.header(request, b"content-encoding"), b"gzip")
+        self.assertNotEqual(self.header(request, b"etag"), brotli)
+
+        request = self.render(b"hello.txt")
+        self.assertEqual(request.getWrittenData(), b"Hello, world!")
+        self.assertIsNone(self.header(request, b"content-encoding"))
+        self.assertEqual(self.header(request, b"vary"), b"accept-encoding")
+
+    def test_stalePrecompressed(self) -> None:
+        """
+        Variants older than their file are ignored.
+        """
+        variant = self.root.child("hello.txt.gz")
+        variant.setContent(b"stale")
+        os.utime(variant.path, ns=(0, 0))
+        request = self.render(b"hello.txt", {b"accept-encoding": b"gzip"})
+        self.assertEqual(request.getWrittenData(), b"Hello, world!")
+
+    def test_range(self) -> None:
+        """
+        A single range is served as a C{206} with a C{Content-Range}.
+        """
+        request = self.render(b"hello.txt", {b"range": b"bytes=7-11"})
+        self.assertEqual(request.code, 206)
+        self.assertEqual(request.getWrittenData(), b"world")
+        self.assertEqual(
+            self.header(request, b"content-range"), b"bytes 7-11/13"
+        )
+        self.assertEqual(self.header(request, b"content-length"), b"5")
+
+    def test_multipleRanges(self) -> None:
+        """
+        Multiple ranges are served as a C{multipart/byteranges} body.
+        """
+        request = self.render(b"hello.txt", {b"range": b"bytes=0-4,-6"})
+        self.assertEqual(request.code, 206)
+        contentType = self.header(request, b"content-type")
+        assert contentType is not None
+        prefix = b"multipart/byteranges; boundary="
+        self.assertTrue(contentType.startswith(prefix))
+        boundary = contentType.split(b"=", 1)[1]
+        body = request.getWrittenData()
+        self.assertEqual(
+            body,
+            b"\r\n--%s\r\ncontent-type: text/plain\r\n"
+            b"content-range: bytes 0-4/13\r\n\r\nHello"
+            b"\r\n--%s\r\ncontent-type: text/plain\r\n"
+            b"content-range: bytes 7-12/13\r\n\r\nworld!"
+            b"\r\n--%s--\r\n" % (boundary, boundary, boundary),
+        )
+        self.assertEqual(
+            self.header(request, b"content-length"), b"%d" % (len(body),)
+        )
+
+    def test_unsatisfiableRange(self) -> None:
+        """
+        Unsatisfiable ranges get a C{416}.
+        """
+        request = self.render(b"hello.txt", {b"range": b"bytes=100-"})
+        self.assertEqual(request.code, 416)
+        self.assertEqual(self.header(request, b"content-range"), b"bytes */13")
+
+    def test_ifRange(self) -> None:
+        """
+        When C{If-Range} doesn't match the file, the whole file is sent.
+        """
+        etag = self.header(self.render(b"hello.txt"), b"etag")
+        assert etag is not None
+        request = self.render(
+            b"hello.txt", {b"range": b"bytes=0-4", b"if-range": etag}
+        )
+        self.assertEqual(request.getWrittenData(), b"Hello")
+        request = self.render(
+            b"hello.txt", {b"range": b"bytes=0-4", b"if-range": b'"other"'}
+        )
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"Hello, world!")
+
+    def test_ifRangeDate(self) -> None:
+        """
+        An C{If-Range} date matches the C{Last-Modified} date it was copied
+        from, even when the file was modified part of the way through a
+        second.
+        """
+        hello = self.root.child("hello.txt")
+        os.utime(hello.path, ns=(10**18 + 5 * 10**8, 10**18 + 5 * 10**8))
+        lastModified = self.header(self.render(b"hello.txt"), b"last-modified")
+        assert lastModified is not None
+        request = self.render(
+            b"hello.txt", {b"range": b"bytes=0-4", b"if-range": lastModified}
+        )
+        self.assertEqual(request.code, 206)
+        self.assertEqual(request.getWrittenData(), b"Hello")
+        earlier = b"Sun, 06 Nov 1994 08:49:37 GMT"
+        request = self.render(
+            b"hello.txt", {b"range": b"bytes=0-4", b"if-range": earlier}
+        )
+        self.assertEqual(request.code, 200)
+        self.assertEqual(request.getWrittenData(), b"Hello, world!")
+
+    def test_statCache(self) -> None:
+        """
+        What is known about a file is reused until C{recheck} seconds have
+        passed, after which a change of modification time is noticed.
+        """
+        hello = self.root.child("hello.txt")
+        first = self.header(self.render(b"hello.txt"), b"etag")
+        hello.setContent(b"Goodbye, world!")
+        os.utime(hello.path, ns=(10**18, 10**18))
+        self.assertEqual(self.header(self.render(b"hello.txt"), b"etag"), first)
+        self.clock.advance(1)
+        request = self.render(b"hello.txt")
+        self.assertNotEqual(self.header(request, b"etag"), first)
+        self.assertEqual(request.getWrittenData(), b"Goodbye, world!")
+
+    def test_removed(self) -> None:
+        """
+        A file removed since it was cached is not found.
+        """
+        self.render(b"hello.txt")
+        self.root.child("hello.txt").remove()
+        self.assertEqual(self.render(b"hello.txt").code, 404)
+
+    def test_maxEntries(self) -> None:
+        """
+        Only C{maxEntries} files are remembered.
+        """
+        files = StaticFiles(self.root.path, maxEntries=1)
+        for name in ["a", "b", "c"]:
+            self.root.child(name).setContent(name.encode("ascii"))
+            files._info(self.root.child(name).path)
+        self.assertEqual(list(files._entries), [self.root.child("c").path])
+
+    def test_unsupportedEncoding(self) -> None:
+        """
+        Only the C{br} and C{gzip} content codings are supported.
+        """
+        self.assertRaises(
+            ValueError, StaticFiles, self.root.path, encodings=["zstd"]
+        )
+
+
+class FileProducerTests(SynchronousTestCase):
+    """
+    Tests for L{FileProducer}.
+    """
+
+    def test_sendfile(self) -> None:
+        """
+        Once resumed after a pause, which means the transport's buffer is
+        empty, file ranges are sent with C{sendfile} until the socket is full,
+        and then written normally again.
+        """
+        threshold = _sendfileThreshold
+        size = 6 * threshold
+        path = FilePath(self.mktemp())
+        path.setContent(bytes(range(256)) * (size // 256))
+        calls: List[Tuple[int, int, int, int]] = []
+        results = [threshold, 0]
+
+        def sendfile(out: int, in_: int, offset: int, count: int) -> int:
+            calls.append((out, in_, offset, count))
+            sent = results.pop(0)
+            if not sent:
+                raise BlockingIOError()
+            return sent
+
+        request = MockRequest(b"/")
+        # Only the transport resumes producers in real life.
+        request.registerProducer = (  # type: ignore[method-assign]
+            lambda producer, streaming: None
+        )
+        file = path.open()
+        fd = file.fileno()
+        producer = FileProducer(
+            request, file, [b"<", (0, size), b">"], 99, sendfile
+        )
+        write = request.write
+
+        def writeAndPause(data: bytes) -> None:
+            write(data)
+            if len(data) > 1:
+                producer.pauseProducing()
+
+        request.write = writeAndPause  # type: ignore[method-assign]
+        producer.start()
+        self.assertEqual(calls, [])
+        self.assertEqual(len(request.getWrittenData()), 1 + 2 * threshold)
+
+        # Part of the rest fits in the socket; then a chunk is written.
+        producer.resumeProducing()
+        self.assertEqual(calls, [(99, fd, 2 * threshold, 4 * threshold)])
+        self.assertEqual(len(request.getWrittenData()), 1 + 4 * threshold)
+
+        # Nothing fits; the last chunk is written.
+        producer.resumeProducing()
+        self.assertEqual(calls[1:], [(99, fd, 5 * threshold, threshold)])
+        self.assertEqual(len(request.getWrittenData()), 1 + 5 * threshold)
+        self.assertFalse(request.finished)
+
+        producer.resumeProducing()
+        self.assertTrue(request.finished)
+        self.assertTrue(request.getWrittenData().endswith(b">"))
+        self.assertTrue(file.closed)
+
+    def test_stop(self) -> None:
+        """
+        Stopping the producer closes the file.
+        """
+        path = FilePath(self.mktemp())
+        path.setContent(b"x" * 300000)
+        request = MockRequest(b"/")
+        file = path.open()
+        producer = FileProducer(request, file, [(0, 300000)])
+        request.write = (  # type: ignore[method-assign]
+            lambda data: producer.pauseProducing()
+        )
+        producer.start()
+        producer.stopProducing()
+        self.assertTrue(file.closed)
+        producer.resumeProducing()
+        self.assertFalse(request.finished)
@@ -0,0 +1,250 @@
+"""
+Tests for L{klein._streaming}.
+"""
+
+from typing import Any, AsyncIterator, Iterator, List, Union
+from unittest.mock import Mock
+
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import Klein, KleinRenderable, Response
+from .._streaming import StreamProducer, isStream
+from .test_resource import MockRequest, _render
+
+
+class StreamingError(Exception):
+    """
+    Raised by streams under test.
+    """
+
+
+def failingChunks() -> Iterator[bytes]:
+    """
+    Raise L{StreamingError} instead of returning any chunks.
+    """
+    raise StreamingError()
+
+
+class IsStreamTests(SynchronousTestCase):
+    """
+    Tests for L{isStream}.
+    """
+
+    def test_isStream(self) -> None:
+        """
+        Iterators and asynchronous iterators are streams; strings and other
+        iterables are not.
+        """
+
+        async def agen() -> AsyncIterator[bytes]:
+            yield b"x"  # pragma: no cover
+
+        self.assertTrue(isStream(iter([b"x"])))
+        self.assertTrue(isStream(chunk for chunk in [b"x"]))
+        self.assertTrue(isStream(agen()))
+        self.assertFalse(isStream(b"x"))
+        self.assertFalse(isStream("x"))
+        self.assertFalse(isStream([b"x"]))
+
+
+class StreamProducerTests(SynchronousTestCase):
+    """
+    Tests for L{StreamProducer}.
+    """
+
+    def test_backpressure(self) -> None:
+        """
+        Iteration stops while the producer is paused, and carries on when it
+        is resumed.
+        """
+        request = MockRequest(b"/")
+        produced: List[int] = []
+
+        def numbers() -> Iterator[bytes]:
+            for i in range(4):
+                produced.append(i)
+                yield b"%d" % (i,)
+
+        producer = StreamProducer(request, numbers())
+        write = request.write
+
+        def writeAndPause(data: bytes) -> None:
+            write(data)
+            producer.pauseProducing()
+
+        request.write = writeAndPause  # type: ignore[method-assign]
+        d = producer.start()
+        self.assertEqual(produced, [0])
+        self.assertEqual(request.getWrittenData(), b"0")
+        self.assertNoResult(d)
+
+        request.write = write  # type: ignore[method-assign]
+        producer.resumeProducing()
+        self.assertEqual(produced, [0, 1, 2, 3])
+        self.assertEqual(request.getWrittenData(), b"0123")
+        self.assertIsNone(self.successResultOf(d))
+        self.assertTrue(request.finished)
+        self.assertIsNone(request.producer)
+
+    def test_resumeWhileRunning(self) -> None:
+        """
+        Resuming a producer which isn't paused does nothing.
+        """
+        request = MockRequest(b"/")
+        producer = StreamProducer(request, iter([b"a", b"b"]))
+        producer.resumeProducing()
+        self.successResultOf(producer.start())
+        producer.resumeProducing()
+        self.assertEqual(request.getWrittenData(), b"ab")
+
+    def test_disconnect(self) -> None:
+        """
+        When the client disconnects, the stream is closed, and the
+        L{Deferred} fails with L{CancelledError}.
+        """
+        request = MockRequest(b"/")
+        waiting: Deferred[bytes] = Deferred()
+        closed: List[bool] = []
+
+        async def chunks() -> AsyncIterator[bytes]:
+            try:
+                yield b"first"
+                yield await waiting
+            finally:
+                closed.append(True)
+
+        d = StreamProducer(request, chunks()).start()
+        self.assertEqual(request.getWrittenData(), b"first")
+        request.connectionLost(Failure(ConnectionDone()))
+        self.assertEqual(closed, [True])
+        self.failureResultOf(d)
+        self.assertFalse(request.finished)
+
+
+class StreamingRouteTests(SynchronousTestCase):
+    """
+    Tests for routes returning streams.
+    """
+
+    def setUp(self) -> None:
+        self.app = Klein()
+
+    def render(self) -> MockRequest:
+        request = MockRequest(b"/")
+        self.successResultOf(_render(self.app.resource(), request))
+        return request
+
+    def test_generator(self) -> None:
+        """
+        The chunks of a generator are written in order, without a
+        C{Content-Length}, and then the request is finished.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Iterator[Union[str, bytes]]:
+            yield b"a,b\n"
+            yield "\N{SNOWMAN},2\n"
+
+        request = self.render()
+        self.assertEqual(
+            request.getWrittenData(), "a,b\n\N{SNOWMAN},2\n".encode()
+        )
+        self.assertEqual(request.finishCount, 1)
+        self.assertIsNone(
+            request.responseHeaders.getRawHeaders(b"content-length")
+        )
+        self.assertIsNone(request.producer)
+
+    def test_asyncGenerator(self) -> None:
+        """
+        The chunks of an asynchronous generator are written as they are
+        produced.
+        """
+        waiting: Deferred[bytes] = Deferred()
+
+        @self.app.route("/")
+        async def root(request: IRequest) -> AsyncIterator[bytes]:
+            yield b"header\n"
+            yield await waiting
+            yield b"footer\n"
+
+        request = MockRequest(b"/")
+        d = _render(self.app.resource(), request)
+        self.assertEqual(request.getWrittenData(), b"header\n")
+        self.assertNoResult(d)
+        waiting.callback(b"row\n")
+        self.successResultOf(d)
+        self.assertEqual(request.getWrittenData(), b"header\nrow\nfooter\n")
+        self.assertEqual(request.finishCount, 1)
+
+    def test_response(self) -> None:
+        """
+        A L{Response} may have a stream as its body.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            return Response(202, {"content-type": "text/csv"}, iter([b"1,2"]))
+
+        request = self.render()
+        self.assertEqual(request.code, 202)
+        self.assertEqual(request.getWrittenData(), b"1,2")
+        self.assertIsNone(request.responseHeaders.getRawHeaders(b"etag"))
+
+    def test_errorBeforeWriting(self) -> None:
+        """
+        An exception raised before the first chunk is handled like any other
+        exception raised by the route.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Iterator[bytes]:
+            yield from failingChunks()
+
+        @self.app.handle_errors(StreamingError)
+        def handle(request: IRequest, failure: Failure) -> KleinRenderable:
+            request.setResponseCode(500)
+            return b"handled"
+
+        request = self.render()
+        self.assertEqual(request.code, 500)
+        self.assertEqual(request.getWrittenData(), b"handled")
+        self.assertIsNone(request.producer)
+
+    def test_errorWhileWriting(self) -> None:
+        """
+        An exception raised after some chunks have been written is logged,
+        and the connection is closed without finishing the response.
+        """
+        loseConnection = Mock()
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Iterator[bytes]:
+            yield b"partial"
+            raise StreamingError()
+
+        request = MockRequest(b"/")
+        request.loseConnection = loseConnection  # type: ignore[method-assign]
+        _render(self.app.resource(), request, notifyFinish=False)
+        self.assertEqual(request.getWrittenData(), b"partial")
+        self.assertEqual(request.finishCount, 0)
+        loseConnection.assert_called_once_with()
+        self.assertEqual(len(self.flushLoggedErrors(StreamingError)), 1)
+
+    def test_badChunk(self) -> None:
+        """
+        Chunks which are neither C{str} nor C{bytes} are an error.
+        """
+
+        @self.app.route("/")
+        def root(request: IRequest) -> Any:
+            chunks: List[Union[bytes, int]] = [1]
+            return iter(chunks)
+
+        request = self.render()
+        self.assertEqual(request.code, 500)
+        self.assertEqual(len(self.flushLoggedErrors(TypeError)), 1)
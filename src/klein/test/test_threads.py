@@ -0,0 +1,353 @@
+"""
+Tests for L{klein._threads}.
+"""
+
+from typing import Any, Callable, List, Tuple
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from twisted.internet.defer import CancelledError
+from twisted.internet.error import ConnectionLost
+from twisted.python.failure import Failure
+from twisted.trial.unittest import SynchronousTestCase
+from twisted.web.iweb import IRequest
+
+from .. import HandlerThreadPool, Klein, KleinRenderable, Requirer, blocking
+from .._threads import defaultPool
+from .test_resource import MockRequest, _render
+
+
+Work = Tuple[Callable[..., None], Callable[..., Any], Any, Any]
+
+
+class FakeThreadPool:
+    """
+    Enough of a L{twisted.python.threadpool.ThreadPool} to hold the calls
+    made in it until they're run with L{FakeThreadPool.runNext}.
+    """
+
+    def __init__(self) -> None:
+        self.started = False
+        self.work: List[Work] = []
+
+    def start(self) -> None:
+        self.started = True
+
+    def stop(self) -> None:
+        self.started = False
+
+    def callInThreadWithCallback(
+        self,
+        onResult: Callable[..., None],
+        f: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        self.work.append((onResult, f, args, kwargs))
+
+    def runNext(self) -> None:
+        onResult, f, args, kwargs = self.work.pop(0)
+        try:
+            result = f(*args, **kwargs)
+        except BaseException:
+            onResult(False, Failure())
+        else:
+            onResult(True, result)
+
+
+class FakeReactor:
+    """
+    Enough of a reactor for L{HandlerThreadPool}.
+    """
+
+    def __init__(self) -> None:
+        self.triggers: List[Tuple[str, str, Callable[[], None]]] = []
+
+    def callFromThread(self, f: Callable[..., Any], *args: Any) -> None:
+        f(*args)
+
+    def addSystemEventTrigger(
+        self, phase: str, event: str, f: Callable[[], None]
+    ) -> None:
+        self.triggers.append((phase, event, f))
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+def fakePool(**kwargs: Any) -> Tuple[HandlerThreadPool, FakeThreadPool]:
+    threads = FakeThreadPool()
+    pool = HandlerThreadPool(
+        reactor=FakeReactor(),
+        threadpool=threads,  # type: ignore[arg-type]
+        **kwargs,
+    )
+    return pool, threads
+
+
+class HandlerThreadPoolTests(SynchronousTestCase):
+    """
+    Tests for L{HandlerThreadPool}.
+    """
+
+    def setUp(self) -> None:
+        self.clock = Clock()
+        self.reactor = FakeReactor()
+        self.threads = FakeThreadPool()
+        self.pool = HandlerThreadPool(
+            size=1,
+            maxQueue=1,
+            reactor=self.reactor,
+            threadpool=self.threads,  # type: ignore[arg-type]
+            now=self.clock,
+        )
+
+    def test_size(self) -> None:
+        """
+        A pool needs at least one thread.
+        """
+        self.assertRaises(ValueError, HandlerThreadPool, size=0)
+
+    def test_run(self) -> None:
+        """
+        Calls are run in the pool's threads, which are started when first
+        needed and stopped when the reactor shuts down.
+        """
+        self.assertFalse(self.threads.started)
+        d = self.pool.run(lambda a, b: a + b, 1, b=2)
+        self.assertTrue(self.threads.started)
+        self.assertNoResult(d)
+        self.threads.runNext()
+        self.assertEqual(self.successResultOf(d), 3)
+        [(phase, event, stop)] = self.reactor.triggers
+        self.assertEqual((phase, event), ("during", "shutdown"))
+        stop()
+        self.assertFalse(self.threads.started)
+
+    def test_failure(self) -> None:
+        """
+        Exceptions raised in a thread fail the result.
+        """
+        d = self.pool.run(lambda: 1 // 0)
+        self.threads.runNext()
+        self.failureResultOf(d, ZeroDivisionError)
+
+    def test_queue(self) -> None:
+        """
+        Calls beyond the pool's size wait for a thread, and those beyond its
+        queue are refused.
+        """
+        first = self.pool.run(lambda: 1)
+        self.clock.time = 1.0
+        second = self.pool.run(lambda: 2)
+        third = self.pool.run(lambda: 3)
+        self.failureResultOf(third, ServiceUnavailable)
+        self.assertEqual(len(self.threads.work), 1)
+        stats = self.pool.stats()
+        self.assertEqual(
+            (stats.running, stats.queued, stats.rejected), (1, 1, 1)
+        )
+
+        self.clock.time = 3.0
+        self.threads.runNext()
+        self.assertEqual(self.successResultOf(first), 1)
+        self.threads.runNext()
+        self.assertEqual(self.successResultOf(second), 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats.running, stats.completed), (0, 2))
+        self.assertEqual((stats.totalWait, stats.maxWait), (2.0, 2.0))
+        self.assertEqual(stats.meanWait(), 1.0)
+
+    def test_retryAfter(self) -> None:
+        """
+        Refused calls tell clients when to retry, if the pool says.
+        """
+        self.pool.retryAfter = 5
+        self.pool.maxQueue = 0
+        self.pool.run(lambda: 1)
+        error = self.failureResultOf(self.pool.run(lambda: 2)).value
+        self.assertIn(("Retry-After", "5"), error.get_headers())
+
+    def test_cancelQueued(self) -> None:
+        """
+        Cancelled calls which haven't started are never run.
+        """
+        self.pool.run(lambda: 1)
+        ran: List[int] = []
+        second = self.pool.run(ran.append, 2)
+        second.cancel()
+        self.failureResultOf(second, CancelledError)
+        self.threads.runNext()
+        self.assertEqual((self.threads.work, ran), ([], []))
+        stats = self.pool.stats()
+        self.assertEqual((stats.queued, stats.cancelled), (0, 1))
+
+    def test_cancelRunning(self) -> None:
+        """
+        The results of calls cancelled while they run are discarded.
+        """
+        first = self.pool.run(lambda: 1)
+        second = self.pool.run(lambda: 2)
+        first.cancel()
+        self.failureResultOf(first, CancelledError)
+        self.threads.runNext()
+        self.threads.runNext()
+        self.assertEqual(self.successResultOf(second), 2)
+
+
+class BlockingTests(SynchronousTestCase):
+    """
+    Tests for L{blocking} and L{Klein.route}'s C{threaded} argument.
+    """
+
+    def setUp(self) -> None:
+        self.pool, self.threads = fakePool(size=1)
+        self.app = Klein(thread_pool=self.pool)
+
+    def render(self, path: bytes) -> MockRequest:
+        request = MockRequest(path)
+        _render(self.app.resource(), request)
+        return request
+
+    def test_threaded(self) -> None:
+        """
+        The handlers of threaded routes are run in the application's pool.
+        """
+
+        @self.app.route("/<name>", threaded=True)
+        def hello(request: IRequest, name: str) -> KleinRenderable:
+            return f"hello {name}"
+
+        request = self.render(b"/world")
+        self.assertEqual(request.getWrittenData(), b"")
+        self.threads.runNext()
+        self.assertEqual(request.getWrittenData(), b"hello world")
+        self.assertIdentical(self.app.thread_pool, self.pool)
+
+    def test_threadedPool(self) -> None:
+        """
+        Routes may be given a pool of their own.
+        """
+        pool, threads = fakePool()
+
+        @self.app.route("/", threaded=pool)
+        def root(request: IRequest) -> KleinRenderable:
+            return b"ok"
+
+        request = self.render(b"/")
+        self.assertEqual(self.threads.work, [])
+        threads.runNext()
+        self.assertEqual(request.getWrittenData(), b"ok")
+
+    def test_defaultPool(self) -> None:
+        """
+        Applications without a pool of their own share the default one.
+        """
+        self.assertIdentical(Klein().thread_pool, defaultPool())
+
+    def test_method(self) -> None:
+        """
+        Handlers which are methods get their instance.
+        """
+
+        class Application:
+            app = Klein(thread_pool=self.pool)
+
+            @app.route("/")
+            @blocking(pool=self.pool)
+            def root(self, request: IRequest) -> KleinRenderable:
+                return repr(self)
+
+        application = Application()
+        request = MockRequest(b"/")
+        _render(application.app.resource(), request)
+        self.threads.runNext()
+        self.assertEqual(
+            request.getWrittenData(), repr(application).encode("utf-8")
+        )
+
+    def test_requirer(self) -> None:
+        """
+        L{blocking} functions can be beneath L{Requirer.require}, which calls
+        them without the request.
+        """
+        requirer = Requirer()
+
+        @requirer.require(self.app.route("/"))
+        @blocking(pool=self.pool)
+        def root() -> KleinRenderable:
+            return b"required"
+
+        request = self.render(b"/")
+        self.threads.runNext()
+        self.assertEqual(request.getWrittenData(), b"required")
+
+    def test_coroutine(self) -> None:
+        """
+        Coroutines returned from a thread are run on the reactor.
+        """
+
+        async def later() -> bytes:
+            return b"awaited"
+
+        @self.app.route("/", threaded=True)
+        def root(request: IRequest) -> KleinRenderable:
+            return later()
+
+        request = self.render(b"/")
+        self.threads.runNext()
+        self.assertEqual(request.getWrittenData(), b"awaited")
+
+    def test_full(self) -> None:
+        """
+        Requests to threaded routes are answered with a 503 once the queue
+        is full.
+        """
+        self.pool.maxQueue = 0
+
+        @self.app.route("/", threaded=True)
+        def root(request: IRequest) -> KleinRenderable:
+            return b"ok"  # pragma: no cover
+
+        self.render(b"/")
+        request = self.render(b"/")
+        request.setResponseCode.assert_called_with(503)
+
+    def test_disconnected(self) -> None:
+        """
+        Handlers still waiting for a thread when their client disconnects
+        are never run.
+        """
+        ran: List[IRequest] = []
+
+        @self.app.route("/", threaded=True)
+        def root(request: IRequest) -> KleinRenderable:
+            ran.append(request)
+            return b"ok"
+
+        self.render(b"/")
+        waiting = MockRequest(b"/")
+        finished = _render(self.app.resource(), waiting)
+        waiting.connectionLost(Failure(ConnectionLost()))
+        self.failureResultOf(finished, ConnectionLost)
+        self.assertEqual(self.pool.stats().cancelled, 1)
+        self.threads.runNext()
+        self.assertEqual(self.threads.work, [])
+        self.assertEqual(len(ran), 1)
+
+    def test_bareDecorator(self) -> None:
+        """
+        L{blocking} may be used without arguments, to use the default pool.
+        """
+
+        def f() -> None:
+            pass  # pragma: no cover
+
+        decorated = blocking(f)
+        self.assertEqual(decorated.__name__, "blocking for f")
+        self.assertTrue(getattr(decorated, "__klein_bound__"))